@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Load test for the Oil Manager API middleware
+Drives a running api_middleware.py (normally backed by the Firestore and Auth emulators)
+with a weighted mix of the app's reads over keep-alive connections and reports
+requests/s, p50 and p99 latency per endpoint, plus bytes on the wire and the share of
+conditional GETs answered 304
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+DEFAULT_URL = 'http://127.0.0.1:8080/api'
+DEFAULT_EMAIL = 'customer@test.com'
+DEFAULT_PASSWORD = 'Test123456'
+DEFAULT_CONCURRENCY = 32
+DEFAULT_DURATION = 20.0
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+# (endpoint template, weight) of the read mix; roughly what the customer and driver apps issue
+READ_MIX = (
+    ('GET /catalog/products', 30),
+    ('GET /catalog/products/{sku}', 20),
+    ('GET /catalog/products/{sku}/pricing', 20),
+    ('GET /orders', 10),
+    ('GET /orders/{id}', 8),
+    ('GET /pickups', 6),
+    ('GET /pickups/{id}', 4),
+    ('GET /dispatch/jobs', 10),
+)
+
+
+# ============================================================
+# HTTP CLIENT
+# ============================================================
+
+class Connection:
+    """Minimal HTTP/1.1 keep-alive client; the middleware always sends Content-Length"""
+
+    def __init__(self, host, port, prefix=''):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.reader = None
+        self.writer = None
+        self.last_headers = {}
+        self.last_size = 0
+
+    async def request(self, method, path, token=None, body=None, headers=None, decode=True):
+        """(status, decoded JSON body or None); response headers and wire size land on last_headers/last_size"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        head = f'{method} {self.prefix}{path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(data)}\r\n'
+        if data:
+            head += 'Content-Type: application/json\r\n'
+        if token:
+            head += f'Authorization: Bearer {token}\r\n'
+        head += ''.join(f'{name}: {value}\r\n' for name, value in (headers or {}).items())
+        try:
+            self.writer.write(head.encode('latin-1') + b'\r\n' + data)
+            await self.writer.drain()
+            status = int((await self.reader.readline()).split()[1])
+            headers = {}
+            while True:
+                line = await self.reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            payload = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        except (IndexError, ValueError, ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            raise ConnectionError(f'{method} {path}: connection dropped')
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        self.last_headers, self.last_size = headers, len(payload)
+        if not (decode and payload):
+            return status, None
+        if headers.get('content-encoding') == 'gzip':
+            payload = gzip.decompress(payload)
+        return status, json.loads(payload)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+# ============================================================
+# SCENARIO
+# ============================================================
+
+async def login(conn, email, password):
+    status, body = await conn.request('POST', '/auth/login', body={'email': email, 'password': password,
+                                                                   'loginType': 'email'})
+    if status != 200:
+        raise SystemExit(f"❌ Login failed for {email}: {status} {body}")
+    return body['token'], body['user']
+
+
+async def discover(conn, token, user):
+    """IDs the read mix can address: SKUs, the caller's orders/pickups and the driver filter"""
+    ids = {'sku': [], 'order': [], 'pickup': []}
+    status, products = await conn.request('GET', '/catalog/products', token)
+    if status == 200:
+        ids['sku'] = [p.get('sku') or p['id'] for p in products]
+    account = user.get('customerAccountId')
+    if account:
+        for kind, collection in (('order', 'orders'), ('pickup', 'pickups')):
+            status, records = await conn.request('GET', f'/{collection}?customerId={account}', token)
+            if status == 200:
+                ids[kind] = [r['id'] for r in records]
+    return ids
+
+
+def build_mix(user, ids):
+    """(template, weight, path factory) for every endpoint this user can exercise with the data seeded"""
+    account = user.get('customerAccountId')
+    factories = {
+        'GET /catalog/products': lambda: '/catalog/products',
+        'GET /catalog/products/{sku}': ids['sku'] and (lambda: f"/catalog/products/{random.choice(ids['sku'])}"),
+        'GET /catalog/products/{sku}/pricing': ids['sku'] and account and (
+            lambda: f"/catalog/products/{random.choice(ids['sku'])}/pricing?"
+                    + urlencode({'customerId': account, 'quantity': random.randint(1, 50)})),
+        'GET /orders': account and (lambda: f'/orders?customerId={account}'),
+        'GET /orders/{id}': ids['order'] and (lambda: f"/orders/{random.choice(ids['order'])}"),
+        'GET /pickups': account and (lambda: f'/pickups?customerId={account}'),
+        'GET /pickups/{id}': ids['pickup'] and (lambda: f"/pickups/{random.choice(ids['pickup'])}"),
+        'GET /dispatch/jobs': user.get('role') == 'driver' and (lambda: f"/dispatch/jobs?driverUid={user['uid']}"),
+    }
+    return [(template, weight, factories[template]) for template, weight in READ_MIX if factories[template]]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.bytes = defaultdict(int)
+
+    def record(self, template, seconds, status, size=0):
+        self.latencies[template].append(seconds)
+        self.statuses[template][status] += 1
+        self.bytes[template] += size
+        if status is None or status >= 400:
+            self.errors[template] += 1
+
+
+async def worker(host, port, prefix, token, mix, deadline, recorder, warmup_until, conditional):
+    """One keep-alive connection issuing the mix; with conditional, it revalidates with the ETags it has seen"""
+    conn = Connection(host, port, prefix)
+    templates = [m[0] for m in mix]
+    weights = [m[1] for m in mix]
+    factories = {m[0]: m[2] for m in mix}
+    etags = {}
+    try:
+        while time.perf_counter() < deadline:
+            template = random.choices(templates, weights)[0]
+            path = factories[template]()
+            headers = {'Accept-Encoding': 'gzip, br'}
+            if conditional and path in etags:
+                headers['If-None-Match'] = etags[path]
+            started = time.perf_counter()
+            try:
+                status, _ = await conn.request('GET', path, token, headers=headers, decode=False)
+            except ConnectionError:
+                status = None
+            if started >= warmup_until:
+                recorder.record(template, time.perf_counter() - started, status, conn.last_size)
+            if status == 200 and 'etag' in conn.last_headers:
+                etags[path] = conn.last_headers['etag']
+    finally:
+        conn.close()
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def print_report(recorder, seconds):
+    print(f"\n📊 Results over {seconds:.1f}s:")
+    print(f"   {'endpoint':<38} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'B/resp':>7} {'304 %':>6} {'errors':>7}")
+    total = 0
+    for template, _ in READ_MIX:
+        values = sorted(recorder.latencies.get(template, []))
+        if not values:
+            continue
+        total += len(values)
+        print(f"   {template:<38} {len(values):>9} {len(values) / seconds:>8.1f} "
+              f"{percentile(values, 0.50) * 1000:>8.1f} {percentile(values, 0.99) * 1000:>8.1f} "
+              f"{values[-1] * 1000:>8.1f} {recorder.bytes[template] / len(values):>7.0f} "
+              f"{recorder.statuses[template][304] / len(values) * 100:>6.1f} {recorder.errors[template]:>7}")
+    every = sorted(v for values in recorder.latencies.values() for v in values)
+    not_modified = sum(s[304] for s in recorder.statuses.values())
+    print(f"   {'TOTAL':<38} {total:>9} {total / seconds:>8.1f} {percentile(every, 0.50) * 1000:>8.1f} "
+          f"{percentile(every, 0.99) * 1000:>8.1f} {(every[-1] if every else 0) * 1000:>8.1f} "
+          f"{sum(recorder.bytes.values()) / max(total, 1):>7.0f} {not_modified / max(total, 1) * 100:>6.1f} "
+          f"{sum(recorder.errors.values()):>7}")
+    failing = {t: dict(s) for t, s in recorder.statuses.items() if recorder.errors[t]}
+    for template, statuses in failing.items():
+        print(f"   ⚠️  {template}: {statuses}")
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    host, port, prefix = url.hostname, url.port or 80, url.path.rstrip('/')
+    setup = Connection(host, port, prefix)
+    token, user = await login(setup, args.email, args.password)
+    ids = await discover(setup, token, user)
+    setup.close()
+    mix = build_mix(user, ids)
+    print(f"👤 {user.get('displayName') or user['uid']} ({user.get('role')}): "
+          f"{len(ids['sku'])} SKUs, {len(ids['order'])} orders, {len(ids['pickup'])} pickups")
+    print(f"🎯 {len(mix)} endpoints, {args.concurrency} connections, "
+          f"{args.warmup:g}s warm-up + {args.duration:g}s measured")
+    recorder = Recorder()
+    started = time.perf_counter()
+    warmup_until = started + args.warmup
+    deadline = warmup_until + args.duration
+    await asyncio.gather(*(worker(host, port, prefix, token, mix, deadline, recorder, warmup_until,
+                                  args.conditional) for _ in range(args.concurrency)))
+    print_report(recorder, time.perf_counter() - warmup_until)
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=DEFAULT_URL, help=f'middleware base URL (default {DEFAULT_URL})')
+    parser.add_argument('--email', default=DEFAULT_EMAIL, help='test user to log in as (see setup_firestore.py)')
+    parser.add_argument('--password', default=DEFAULT_PASSWORD)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='parallel keep-alive connections')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds of load before measuring')
+    parser.add_argument('--conditional', action='store_true',
+                        help='revalidate with If-None-Match like a returning shop screen (catalog 304s)')
+    parser.add_argument('--seed', type=int, help='random seed for a repeatable request sequence')
+    parser.add_argument('--allow-remote', action='store_true',
+                        help='allow a non-local --url (load tests belong on the emulator)')
+    args = parser.parse_args()
+    if urlsplit(args.url).hostname not in LOCAL_HOSTS and not args.allow_remote:
+        parser.error('refusing to load-test a remote server without --allow-remote')
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    print("=" * 60)
+    print("🏋️  OIL MANAGER - API LOAD TEST")
+    print("=" * 60)
+    try:
+        asyncio.run(run(args))
+    except ConnectionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    except OSError as e:
+        print(f"❌ Cannot reach {args.url}: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1446 @@
+#!/usr/bin/env python3
+"""
+REST middleware for the Oil Manager Flutter app
+Serves the ApiConfig endpoints (auth, catalog, orders, pickups, dispatch jobs) over asyncio
+on a pool of async Firestore clients, reading and writing the collection layouts created by
+setup_firestore.py; identical concurrent reads share a single Firestore fetch
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+try:
+    import firebase_admin
+    from firebase_admin import auth, firestore
+    from google.api_core.exceptions import Aborted, Conflict, FailedPrecondition
+    from google.cloud.firestore import AsyncClient
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from audit_writer import AUDIT_COLLECTION, audit_entry
+from config_cache import ConfigCache
+from firestore_metrics import add_metrics_args, instrument_async, label_pairs
+from maintenance_runtime import MAX_BATCH_WRITES, async_client, sync_client
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_POOL_SIZE = 4
+# In-flight requests allowed to touch Firestore at once, across the whole pool
+DEFAULT_CONCURRENCY = 64
+# ApiConfig.baseUrl ends in /api; paths are accepted with or without the prefix
+API_PREFIX = '/api'
+MAX_HEADER_LINES = 100
+MAX_BODY_BYTES = 1024 * 1024
+KEEPALIVE_TIMEOUT = 30.0
+DEFAULT_LIST_LIMIT = 100
+MAX_LIST_LIMIT = 500
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+CUSTOMER_ROLES = ('customer_b2c', 'customer_b2b_user', 'customer_b2b_admin')
+STAFF_ROLES = ('dispatcher', 'admin')
+
+ORDER_STATUSES = ('Submitted', 'Confirmed', 'Scheduled', 'OutForDelivery', 'Delivered',
+                  'Invoiced', 'Completed', 'Cancelled')
+PICKUP_STATUSES = ('Submitted', 'Approved', 'Scheduled', 'DriverAssigned', 'Collected',
+                   'Settled', 'Rejected', 'Cancelled')
+# Customers may cancel only before the goods or the truck are on the move
+ORDER_CANCELLABLE = ('Submitted', 'Confirmed', 'Scheduled')
+PICKUP_CANCELLABLE = ('Submitted', 'Approved', 'Scheduled')
+
+JOB_TYPES = ('Delivery', 'Pickup')
+# JobStatus moves a driver (or dispatcher) may make; Completed is terminal
+JOB_TRANSITIONS = {
+    'Assigned': ('EnRoute', 'Failed', 'Rescheduled'),
+    'EnRoute': ('Arrived', 'Failed', 'Rescheduled'),
+    'Arrived': ('Completed', 'Failed'),
+    'Failed': ('Rescheduled',),
+    'Rescheduled': ('Assigned', 'EnRoute', 'Failed'),
+    'Completed': (),
+}
+JOB_STATUSES = tuple(JOB_TRANSITIONS)
+
+# Catalog and pricing are served from an in-memory snapshot of these, kept current by listeners
+CATALOG_COLLECTIONS = ('products_cache', 'config_products', 'config_price_lists', 'config_price_list_items')
+CUSTOMER_TYPES = ('B2C', 'B2B')
+# Clients revalidate every time; an unchanged catalog costs a 304 and no Firestore reads
+CATALOG_CACHE_CONTROL = 'private, no-cache'
+# Smaller bodies go out as-is: compression framing would eat most of the saving
+MIN_COMPRESS_BYTES = 512
+# Encoded bodies kept per snapshot (pricing adds one per sku × customer × quantity asked for)
+MAX_CACHED_BODIES = 4096
+
+# Offline replays from driver devices: events per /dispatch/jobs:batchStatus call and key length
+MAX_BATCH_EVENTS = 200
+MAX_IDEMPOTENCY_KEY = 128
+
+# Request fields sent as ISO-8601 strings and stored as Firestore timestamps
+TIMESTAMP_FIELDS = ('preferredWindowStart', 'preferredWindowEnd', 'scheduledDate', 'windowStart', 'windowEnd')
+
+SIGN_IN_URL = 'https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={key}'
+EMULATOR_SIGN_IN_URL = 'http://{host}/identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={key}'
+
+
+# ============================================================
+# HTTP
+# ============================================================
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    """One parsed HTTP/1.1 request"""
+
+    def __init__(self, method, target, headers, body):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        if self.path == API_PREFIX or self.path.startswith(API_PREFIX + '/'):
+            self.path = self.path[len(API_PREFIX):] or '/'
+        self.query = dict(parse_qsl(parts.query))
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        return self.headers.get('connection', '').lower() != 'close'
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise HttpError(400, 'Request body is not valid JSON')
+        if not isinstance(data, dict):
+            raise HttpError(400, 'Request body must be a JSON object')
+        return data
+
+
+class Response:
+    def __init__(self, status=200, body=b'', headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    def encode(self, keep_alive=True):
+        reason = HTTPStatus(self.status).phrase
+        if self.status == 304:
+            headers = dict(self.headers)
+        else:
+            headers = {'Content-Type': 'application/json', **self.headers, 'Content-Length': str(len(self.body))}
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        head = f'HTTP/1.1 {self.status} {reason}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items())
+        return head.encode('latin-1') + b'\r\n' + self.body
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+    if isinstance(value, firestore.GeoPoint):
+        return {'lat': value.latitude, 'lng': value.longitude}
+    if hasattr(value, 'path'):
+        return value.path
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def json_response(data, status=200):
+    return Response(status, json.dumps(data, default=_json_default, separators=(',', ':')).encode('utf-8'))
+
+
+def error_response(status, message):
+    return json_response({'error': HTTPStatus(status).phrase, 'message': message}, status)
+
+
+async def read_request(reader):
+    """Next request on a keep-alive connection, or None once the client has closed it"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, 'Malformed request line')
+    if not version.startswith('HTTP/1.'):
+        raise HttpError(505, 'Only HTTP/1.x is supported')
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HttpError(431, 'Too many header lines')
+    if 'chunked' in headers.get('transfer-encoding', ''):
+        raise HttpError(411, 'Send a Content-Length instead of chunked bodies')
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise HttpError(400, 'Content-Length must be a non-negative integer')
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f'Body larger than {MAX_BODY_BYTES} bytes')
+    body = await reader.readexactly(length) if length else b''
+    if version == 'HTTP/1.0' and headers.get('connection', '').lower() != 'keep-alive':
+        headers['connection'] = 'close'
+    return Request(method.upper(), target, headers, body)
+
+
+class Router:
+    """Method + path-pattern routing; {name} segments become handler keyword arguments"""
+
+    def __init__(self):
+        self.routes = []
+
+    def add(self, method, template, handler):
+        pattern = re.sub(r'\{(\w+)\}', r'(?P<\1>[^/]+)', template)
+        self.routes.append((method, re.compile(f'^{pattern}$'), template, handler))
+
+    def match(self, method, path):
+        allowed = False
+        for route_method, pattern, template, handler in self.routes:
+            found = pattern.match(path)
+            if found is None:
+                continue
+            if route_method == method:
+                return template, handler, found.groupdict()
+            allowed = True
+        raise HttpError(405 if allowed else 404, f'No route for {method} {path}')
+
+
+# ============================================================
+# FIRESTORE POOL & READ COALESCING
+# ============================================================
+
+def client_pool(size, job=None, args=None):
+    """size instrumented AsyncClients, each with its own gRPC channel, sharing one metrics registry"""
+    clients = [async_client(job=job, args=args)]
+    app = firebase_admin.get_app()
+    for _ in range(size - 1):
+        client = AsyncClient(credentials=app.credential.get_credential(), project=app.project_id)
+        clients.append(instrument_async(client, job=job, args=args))
+    return clients
+
+
+class ClientPool:
+    """Round-robin over the clients, with a global cap on requests inside Firestore"""
+
+    def __init__(self, clients, concurrency=DEFAULT_CONCURRENCY):
+        self.clients = clients
+        self._next = itertools.cycle(clients)
+        self.limit = asyncio.Semaphore(concurrency)
+
+    @property
+    def metrics(self):
+        return self.clients[0].metrics
+
+    @contextlib.asynccontextmanager
+    async def lease(self):
+        async with self.limit:
+            yield next(self._next)
+
+
+class Coalescer:
+    """Single-flight reads: callers asking for the same key while a fetch is running share its result"""
+
+    def __init__(self):
+        self.inflight = {}
+        self.fetches = 0
+        self.joined = 0
+
+    async def run(self, key, fetch):
+        task = self.inflight.get(key)
+        if task is None:
+            self.fetches += 1
+            # A task, so one caller disconnecting does not cancel the read for the others
+            task = self.inflight[key] = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.joined += 1
+        return await asyncio.shield(task)
+
+
+# ============================================================
+# CATALOG SNAPSHOT
+# ============================================================
+
+def accepted_encodings(header):
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.partition(';')
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    if '*' in accepted:
+        accepted.update(('br', 'gzip'))
+    return accepted
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison, as If-None-Match requires"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    return any(tag.strip().removeprefix('W/') == opaque for tag in if_none_match.split(','))
+
+
+def price_table(price_lists, products, items, customer_type, now):
+    """Default price list valid at now for a customer type, with its items grouped by SKU"""
+    valid = [(list_id, data) for list_id, data in sorted(price_lists.items())
+             if data.get('customerType') == customer_type and data.get('isActive') is not False
+             and (data.get('validFrom') is None or data['validFrom'] <= now)
+             and (data.get('validUntil') is None or data['validUntil'] > now)]
+    if not valid:
+        return None
+    list_id, chosen = next(((i, d) for i, d in valid if d.get('isDefault')), valid[0])
+    sku_of = {doc_id: data.get('sku') for doc_id, data in products.items() if data.get('isActive') is True}
+    by_sku = defaultdict(list)
+    for _, item in sorted(items.items()):
+        if item.get('priceListId') == list_id and sku_of.get(item.get('productId')):
+            by_sku[sku_of[item['productId']]].append(item)
+    for tiers in by_sku.values():
+        tiers.sort(key=lambda item: item.get('minQuantity') or 0)
+    return {'priceListId': list_id, 'code': chosen.get('code'), 'items': dict(by_sku)}
+
+
+def next_validity_change(price_lists, now):
+    """Earliest future validFrom/validUntil: the price tables must be rebuilt then even without a change"""
+    times = [t for data in price_lists.values() for t in (data.get('validFrom'), data.get('validUntil'))
+             if isinstance(t, datetime) and t > now]
+    return min(times, default=None)
+
+
+class EncodedBody:
+    """One JSON body with its content-hash ETag and precompressed variants"""
+
+    def __init__(self, data):
+        self.identity = json.dumps(data, default=_json_default, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        self.etag = f'W/"{hashlib.sha256(self.identity).hexdigest()[:24]}"'
+        self.variants = {}
+        if len(self.identity) >= MIN_COMPRESS_BYTES:
+            self.variants['gzip'] = gzip.compress(self.identity, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(self.identity, quality=11)
+
+    def negotiate(self, accept_encoding):
+        """(body, Content-Encoding or None) for the smallest variant the client accepts"""
+        accepted = accepted_encodings(accept_encoding)
+        for coding in ('br', 'gzip'):
+            if coding in self.variants and coding in accepted:
+                return self.variants[coding], coding
+        return self.identity, None
+
+
+class CatalogSnapshot:
+    """Immutable products and price tables, with the response bodies encoded from them so far"""
+
+    def __init__(self, generation, products, price_tables, expires_at=None):
+        self.generation = generation
+        self.products = products
+        self.by_sku = {p['id']: p for p in products}
+        self.price_tables = price_tables
+        self.expires_at = expires_at
+        content = json.dumps([products, price_tables], default=_json_default, sort_keys=True)
+        self.version = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+        self._bodies = OrderedDict()
+
+    def fresh(self, generation, now):
+        return self.generation == generation and (self.expires_at is None or now < self.expires_at)
+
+    def body(self, key, build):
+        encoded = self._bodies.get(key)
+        if encoded is None:
+            encoded = self._bodies[key] = EncodedBody(build())
+            if len(self._bodies) > MAX_CACHED_BODIES:
+                self._bodies.popitem(last=False)
+        else:
+            self._bodies.move_to_end(key)
+        return encoded
+
+
+class Catalog:
+    """Current CatalogSnapshot; config-cache listeners mark it stale and the next request rebuilds it"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.cache = None
+        self.generation = 0
+        self.snapshot = None
+        self.rebuilds = 0
+
+    def attach(self, cache):
+        self.cache = cache
+        return self
+
+    def changed(self, collection):
+        """ConfigCache on_change hook; called on listener threads"""
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._bump)
+
+    def _bump(self):
+        self.generation += 1
+
+    async def current(self, reads):
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.fresh(self.generation, datetime.now(timezone.utc)):
+            return snapshot
+        generation = self.generation
+        snapshot = await reads.run(('catalog', generation), lambda: asyncio.to_thread(self._build, generation))
+        if self.snapshot is None or snapshot.generation >= self.snapshot.generation:
+            self.snapshot = snapshot
+        return snapshot
+
+    def _build(self, generation):
+        """New snapshot from the cached collections; no Firestore reads while the listeners are live"""
+        now = datetime.now(timezone.utc)
+        products = sorted(({'id': doc_id, **data} for doc_id, data in self.cache.documents('products_cache').items()
+                           if data.get('isActive') is True), key=lambda p: (p.get('name') or '', p['id']))
+        price_lists = self.cache.documents('config_price_lists')
+        config_products = self.cache.documents('config_products')
+        items = self.cache.documents('config_price_list_items')
+        tables = {t: price_table(price_lists, config_products, items, t, now) for t in CUSTOMER_TYPES}
+        self.rebuilds += 1
+        return CatalogSnapshot(generation, products, tables, next_validity_change(price_lists, now))
+
+
+# ============================================================
+# AUTH
+# ============================================================
+
+class Principal:
+    def __init__(self, uid, profile):
+        self.uid = uid
+        self.role = profile.get('role') or ''
+        self.customer_account_id = profile.get('customerAccountId')
+        self.display_name = profile.get('displayName')
+
+    @property
+    def is_customer(self):
+        return self.role in CUSTOMER_ROLES
+
+    @property
+    def is_driver(self):
+        return self.role == 'driver'
+
+    @property
+    def is_staff(self):
+        return self.role in STAFF_ROLES
+
+    @property
+    def customer_type(self):
+        return 'B2B' if self.role.startswith('customer_b2b') else 'B2C'
+
+    def to_json(self):
+        return {'uid': self.uid, 'role': self.role, 'displayName': self.display_name,
+                'customerAccountId': self.customer_account_id}
+
+
+def sign_in_with_password(email, password):
+    """Identity Toolkit password sign-in (the Auth emulator when FIREBASE_AUTH_EMULATOR_HOST is set)"""
+    emulator = os.environ.get('FIREBASE_AUTH_EMULATOR_HOST')
+    key = os.environ.get('FIREBASE_API_KEY') or ('fake-api-key' if emulator else None)
+    if not key:
+        raise HttpError(503, 'Set FIREBASE_API_KEY to enable password login')
+    url = (EMULATOR_SIGN_IN_URL.format(host=emulator, key=key) if emulator
+           else SIGN_IN_URL.format(key=key))
+    body = json.dumps({'email': email, 'password': password, 'returnSecureToken': True}).encode()
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise HttpError(401, 'Invalid email or password') from e
+    except urllib.error.URLError as e:
+        raise HttpError(502, f'Auth service unreachable: {e.reason}') from e
+
+
+def idempotent_event_id(driver_uid, key):
+    """job_events document id for a device-generated idempotency key, scoped to the driver"""
+    return hashlib.sha256(f'{driver_uid}:{key}'.encode('utf-8')).hexdigest()[:40]
+
+
+def parse_timestamp(value, field):
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise HttpError(400, f'{field} must be an ISO-8601 timestamp')
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_day(value):
+    """[start, end) of a UTC day; DispatchApiService sends full ISO timestamps, so only the date part counts"""
+    try:
+        day = datetime.strptime(value[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HttpError(400, 'date must be YYYY-MM-DD')
+    return day, day + timedelta(days=1)
+
+
+def require(data, *fields):
+    missing = [f for f in fields if data.get(f) in (None, '')]
+    if missing:
+        raise HttpError(400, f"Missing field(s): {', '.join(missing)}")
+
+
+def positive_number(value, field):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f'{field} must be a number')
+    if number <= 0:
+        raise HttpError(400, f'{field} must be positive')
+    return value if isinstance(value, (int, float)) else number
+
+
+def list_limit(request):
+    try:
+        return max(1, min(int(request.query.get('limit', DEFAULT_LIST_LIMIT)), MAX_LIST_LIMIT))
+    except ValueError:
+        raise HttpError(400, 'limit must be an integer')
+
+
+def doc_json(snap):
+    return {'id': snap.id, **snap.to_dict()}
+
+
+# ============================================================
+# SERVER
+# ============================================================
+
+class ApiServer:
+    """Route handlers for the ApiConfig endpoints plus the connection loop"""
+
+    def __init__(self, pool, catalog, search_index=None):
+        self.pool = pool
+        self.catalog = catalog
+        self.search_index = search_index
+        self.reads = Coalescer()
+        self.router = Router()
+        self.tokens = {}
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(float)
+        self._register_routes()
+        pool.metrics.add_collector(self.collect)
+
+    def _register_routes(self):
+        routes = [
+            ('POST', '/auth/login', self.login),
+            ('POST', '/auth/login/send-otp', self.otp_unsupported),
+            ('POST', '/auth/login/verify-otp', self.otp_unsupported),
+            ('GET', '/catalog/products', self.list_products),
+            ('GET', '/catalog/products/{sku}', self.get_product),
+            ('GET', '/catalog/products/{sku}/pricing', self.get_pricing),
+            ('POST', '/orders', self.create_order),
+            ('GET', '/orders', self.list_orders),
+            ('GET', '/orders/{order_id}', self.get_order),
+            ('PUT', '/orders/{order_id}/status', self.update_order_status),
+            ('POST', '/orders/{order_id}/cancel', self.cancel_order),
+            ('POST', '/pickups', self.create_pickup),
+            ('GET', '/pickups', self.list_pickups),
+            ('GET', '/pickups/{pickup_id}', self.get_pickup),
+            ('PUT', '/pickups/{pickup_id}/status', self.update_pickup_status),
+            ('POST', '/pickups/{pickup_id}/cancel', self.cancel_pickup),
+            ('POST', '/pickups/{pickup_id}/quality', self.record_quality),
+            ('POST', '/dispatch/jobs', self.create_job),
+            ('GET', '/dispatch/jobs', self.list_jobs),
+            ('POST', '/dispatch/jobs/{job_id}/assign', self.assign_job),
+            ('POST', '/dispatch/jobs/{job_id}/status', self.update_job_status),
+            ('POST', '/dispatch/jobs/{job_id}/complete', self.complete_job),
+            ('POST', '/dispatch/jobs:batchStatus', self.batch_job_status),
+            ('GET', '/search', self.search),
+        ]
+        for method, template, handler in routes:
+            self.router.add(method, template, handler)
+
+    # ==================== CONNECTIONS ====================
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), KEEPALIVE_TIMEOUT)
+                except HttpError as e:
+                    writer.write(error_response(e.status, e.message).encode(keep_alive=False))
+                    break
+                if request is None:
+                    break
+                response = await self.dispatch(request)
+                writer.write(response.encode(request.keep_alive))
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request):
+        started = time.perf_counter()
+        template = 'unmatched'
+        try:
+            template, handler, params = self.router.match(request.method, request.path)
+            async with self.pool.lease() as db:
+                principal = None if handler == self.login else await self.authenticate(db, request)
+                response = await handler(db, request, principal, **params)
+        except HttpError as e:
+            response = error_response(e.status, e.message)
+        except Exception as e:
+            print(f"❌ {request.method} {request.path}: {type(e).__name__}: {e}")
+            response = error_response(500, 'Internal error')
+        key = (request.method, template, response.status)
+        self.requests[key] += 1
+        self.latency[key] += time.perf_counter() - started
+        return response
+
+    async def authenticate(self, db, request):
+        header = request.headers.get('authorization', '')
+        if not header.lower().startswith('bearer '):
+            raise HttpError(401, 'Missing bearer token')
+        token = header[7:].strip()
+        cached = self.tokens.get(token)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        try:
+            claims = await asyncio.to_thread(auth.verify_id_token, token)
+        except (ValueError, auth.InvalidIdTokenError, auth.ExpiredIdTokenError) as e:
+            raise HttpError(401, f'Invalid token: {e}')
+        profile = await self.reads.run(('users', claims['uid']), lambda: self._fetch_doc(db, 'users', claims['uid']))
+        if profile is None:
+            raise HttpError(403, 'No user profile for this account')
+        principal = Principal(claims['uid'], profile)
+        if len(self.tokens) > 10000:
+            now = time.time()
+            self.tokens = {t: v for t, v in self.tokens.items() if v[1] > now}
+        self.tokens[token] = (principal, claims.get('exp', time.time() + 300))
+        return principal
+
+    @staticmethod
+    async def _fetch_doc(db, collection, doc_id):
+        snap = await db.collection(collection).document(doc_id).get()
+        return doc_json(snap) if snap.exists else None
+
+    # ==================== ACCESS ====================
+
+    @staticmethod
+    def require_staff(principal):
+        if not principal.is_staff:
+            raise HttpError(403, 'Dispatcher or admin role required')
+
+    @staticmethod
+    def customer_scope(principal, customer_id):
+        """Customer account a listing may cover; customers only ever see their own"""
+        if principal.is_customer:
+            if customer_id and customer_id != principal.customer_account_id:
+                raise HttpError(403, 'Customers can only access their own account')
+            return principal.customer_account_id
+        if principal.is_driver:
+            raise HttpError(403, 'Drivers use /dispatch/jobs')
+        return customer_id
+
+    def check_owner(self, principal, record):
+        if record is None:
+            raise HttpError(404, 'Not found')
+        if principal.is_customer and record.get('customerAccountId') != principal.customer_account_id:
+            raise HttpError(404, 'Not found')
+        if principal.is_driver:
+            raise HttpError(403, 'Drivers use /dispatch/jobs')
+        return record
+
+    @staticmethod
+    def check_job_access(principal, job):
+        if job is None:
+            raise HttpError(404, 'Job not found')
+        if principal.is_driver and job.get('assignedDriverUid') != principal.uid:
+            raise HttpError(404, 'Job not found')
+        if not (principal.is_driver or principal.is_staff):
+            raise HttpError(403, 'Driver, dispatcher or admin role required')
+        return job
+
+    # ==================== AUTH ====================
+
+    async def login(self, db, request, principal):
+        body = request.json()
+        require(body, 'email', 'password')
+        result = await asyncio.to_thread(sign_in_with_password, body['email'], body['password'])
+        snap = await db.collection('users').document(result['localId']).get()
+        if not snap.exists:
+            raise HttpError(403, 'No user profile for this account')
+        return json_response({
+            'token': result['idToken'],
+            'refreshToken': result.get('refreshToken'),
+            'expiresIn': int(result.get('expiresIn', 3600)),
+            'user': Principal(snap.id, snap.to_dict()).to_json(),
+        })
+
+    async def otp_unsupported(self, db, request, principal):
+        raise HttpError(501, 'Phone OTP login runs through the Firebase client SDK')
+
+    # ==================== CATALOG ====================
+
+    @staticmethod
+    def unit_price(table, sku, quantity):
+        """(unitPrice, currency) of the first item whose quantity band covers quantity"""
+        for item in (table or {}).get('items', {}).get(sku, []):
+            if item.get('minQuantity') is not None and quantity < item['minQuantity']:
+                continue
+            if item.get('maxQuantity') is not None and quantity > item['maxQuantity']:
+                continue
+            return item.get('unitPrice'), item.get('currency') or 'USD'
+        return None, None
+
+    async def customer_type_of(self, db, principal, customer_id):
+        if principal.is_customer:
+            return principal.customer_type
+
+        async def fetch():
+            docs = await db.collection('users').where(
+                filter=FieldFilter('customerAccountId', '==', customer_id)).limit(1).get()
+            return Principal(docs[0].id, docs[0].to_dict()).customer_type if docs else None
+        customer_type = await self.reads.run(('customer_type', customer_id), fetch)
+        if customer_type is None:
+            raise HttpError(404, f'Unknown customer {customer_id}')
+        return customer_type
+
+    @staticmethod
+    def cached_response(request, snapshot, key, build):
+        """Snapshot-cached body: 304 while If-None-Match still matches, else the smallest accepted encoding"""
+        encoded = snapshot.body(key, build)
+        headers = {'ETag': encoded.etag, 'Cache-Control': CATALOG_CACHE_CONTROL, 'Vary': 'Accept-Encoding',
+                   'X-Catalog-Version': snapshot.version}
+        if etag_matches(request.headers.get('if-none-match'), encoded.etag):
+            return Response(304, headers=headers)
+        body, coding = encoded.negotiate(request.headers.get('accept-encoding', ''))
+        if coding:
+            headers['Content-Encoding'] = coding
+        return Response(200, body, headers)
+
+    def priced_products(self, snapshot, customer_type):
+        table = snapshot.price_tables.get(customer_type)
+        priced = []
+        for product in snapshot.products:
+            unit_price, currency = self.unit_price(table, product['id'], 1)
+            priced.append({**product, 'unitPrice': unit_price, 'currency': currency})
+        return priced
+
+    async def list_products(self, db, request, principal):
+        snapshot = await self.catalog.current(self.reads)
+        customer_id = request.query.get('customerId')
+        if not customer_id:
+            return self.cached_response(request, snapshot, ('products',), lambda: snapshot.products)
+        self.customer_scope(principal, customer_id)
+        customer_type = await self.customer_type_of(db, principal, customer_id)
+        return self.cached_response(request, snapshot, ('products', customer_type),
+                                    lambda: self.priced_products(snapshot, customer_type))
+
+    async def get_product(self, db, request, principal, sku):
+        snapshot = await self.catalog.current(self.reads)
+        product = snapshot.by_sku.get(sku)
+        if product is None:
+            raise HttpError(404, f'Unknown SKU {sku}')
+        return self.cached_response(request, snapshot, ('product', sku), lambda: product)
+
+    async def get_pricing(self, db, request, principal, sku):
+        customer_id = self.customer_scope(principal, request.query.get('customerId'))
+        if not customer_id:
+            raise HttpError(400, 'customerId is required')
+        quantity = positive_number(request.query.get('quantity', 1), 'quantity')
+        customer_type = await self.customer_type_of(db, principal, customer_id)
+        snapshot = await self.catalog.current(self.reads)
+        table = snapshot.price_tables.get(customer_type)
+        unit_price, currency = self.unit_price(table, sku, quantity)
+        if unit_price is None:
+            raise HttpError(404, f'No {customer_type} price for {sku} at quantity {quantity:g}')
+        return self.cached_response(request, snapshot, ('pricing', sku, customer_id, quantity), lambda: {
+            'sku': sku, 'customerId': customer_id, 'customerType': customer_type,
+            'priceListCode': table['code'], 'quantity': quantity, 'unitPrice': unit_price,
+            'currency': currency, 'lineTotal': round(unit_price * quantity, 2),
+        })
+
+    # ==================== SHARED RECORD HELPERS ====================
+
+    def new_record(self, principal, body, fields):
+        """Customer-submitted document: allowed fields only, account and type taken from the caller"""
+        record = {f: body.get(f) for f in fields}
+        for field in TIMESTAMP_FIELDS:
+            if field in record:
+                record[field] = parse_timestamp(record[field], field)
+        if principal.is_customer:
+            record['customerAccountId'] = principal.customer_account_id
+            record['customerType'] = principal.customer_type
+        else:
+            self.require_staff(principal)
+            require(body, 'customerAccountId')
+            record['customerAccountId'] = body['customerAccountId']
+            record['customerType'] = body.get('customerType') or 'B2C'
+        now = datetime.now(timezone.utc)
+        record.update({'status': 'Submitted', 'createdByUid': principal.uid, 'createdAt': now, 'lastStatusAt': now})
+        return record
+
+    async def list_records(self, db, request, principal, collection):
+        customer_id = self.customer_scope(principal, request.query.get('customerId'))
+        status = request.query.get('status')
+        limit = list_limit(request)
+        if customer_id:
+            # One account's records are few; fetched whole and shared across status filters
+            query = db.collection(collection).where(filter=FieldFilter('customerAccountId', '==', customer_id))
+            records = await self.reads.run((collection, customer_id), lambda: self._query_records(query))
+            if status:
+                records = [r for r in records if r.get('status') == status]
+            return json_response(records[:limit])
+        if not status:
+            raise HttpError(400, 'customerId or status is required')
+        # A status spans the whole collection: newest-first and the limit run server-side (status, createdAt desc)
+        query = (db.collection(collection).where(filter=FieldFilter('status', '==', status))
+                 .order_by('createdAt', direction='DESCENDING').limit(limit))
+        records = await self.reads.run((collection, status, limit), lambda: self._query_records(query))
+        return json_response(records)
+
+    @staticmethod
+    async def _query_records(query):
+        records = [doc_json(d) for d in await query.get()]
+        records.sort(key=lambda r: r.get('createdAt') or datetime.min.replace(tzinfo=timezone.utc), reverse=True)
+        return records
+
+    async def change_status(self, db, collection, entity_type, doc_id, principal, to_status,
+                            allowed_from=None, notes=None, extra=None):
+        """Status update guarded by the read's update_time, with its audit_log entry in the same batch"""
+        ref = db.collection(collection).document(doc_id)
+        snap = await ref.get()
+        record = self.check_owner(principal, doc_json(snap) if snap.exists else None)
+        from_status = record.get('status')
+        if allowed_from is not None and from_status not in allowed_from:
+            raise HttpError(409, f'Cannot move {entity_type} from {from_status} to {to_status}')
+        now = datetime.now(timezone.utc)
+        updates = {'status': to_status, 'lastStatusAt': now, **(extra or {})}
+        batch = db.batch()
+        batch.update(ref, updates, option=db.write_option(last_update_time=snap.update_time))
+        batch.set(db.collection(AUDIT_COLLECTION).document(), audit_entry(
+            None, entity_type, doc_id, 'status_changed', principal.uid,
+            from_status=from_status, to_status=to_status, notes=notes,
+            changes={k: v for k, v in updates.items() if k != 'lastStatusAt'}, performed_at=now))
+        try:
+            await batch.commit()
+        except (Aborted, FailedPrecondition):
+            raise HttpError(409, f'{entity_type} {doc_id} changed concurrently, retry')
+        return json_response({**record, **updates})
+
+    # ==================== ORDERS ====================
+
+    async def create_order(self, db, request, principal):
+        body = request.json()
+        order = self.new_record(principal, body, (
+            'branchId', 'deliveryAddress', 'preferredWindowStart', 'preferredWindowEnd', 'paymentMethod'))
+        order['paymentMethod'] = order['paymentMethod'] or 'COD'
+        lines = body.get('lines')
+        if not isinstance(lines, list) or not lines:
+            raise HttpError(400, 'lines must be a non-empty list of {sku, qty}')
+        table = (await self.catalog.current(self.reads)).price_tables.get(order['customerType'])
+        priced, currency = [], None
+        for line in lines:
+            require(line, 'sku', 'qty')
+            qty = positive_number(line['qty'], 'qty')
+            unit_price, line_currency = self.unit_price(table, line['sku'], qty)
+            if unit_price is None:
+                raise HttpError(400, f"No {order['customerType']} price for {line['sku']}")
+            if currency and line_currency != currency:
+                raise HttpError(400, 'All lines must share one currency')
+            currency = line_currency
+            priced.append({'sku': line['sku'], 'qty': qty, 'unitPrice': unit_price,
+                           'lineTotal': round(unit_price * qty, 2)})
+        ref = db.collection('sales_orders').document()
+        order.update({'orderNumber': f"SO-{order['createdAt']:%Y%m%d}-{ref.id[:6].upper()}",
+                      'totalAmount': round(sum(l['lineTotal'] for l in priced), 2), 'currency': currency})
+        batch = db.batch()
+        batch.set(ref, order)
+        for line in priced:
+            line['orderId'] = ref.id
+            batch.set(db.collection('sales_order_lines').document(), line)
+        batch.set(db.collection(AUDIT_COLLECTION).document(), audit_entry(
+            None, 'sales_order', ref.id, 'created', principal.uid, to_status='Submitted',
+            performed_at=order['createdAt']))
+        await batch.commit()
+        return json_response({'id': ref.id, **order, 'lines': priced}, 201)
+
+    async def _fetch_order(self, db, order_id):
+        order = await self._fetch_doc(db, 'sales_orders', order_id)
+        if order is not None:
+            lines = await db.collection('sales_order_lines').where(
+                filter=FieldFilter('orderId', '==', order_id)).get()
+            order['lines'] = [doc_json(l) for l in lines]
+        return order
+
+    async def get_order(self, db, request, principal, order_id):
+        order = await self.reads.run(('sales_orders', order_id), lambda: self._fetch_order(db, order_id))
+        return json_response(self.check_owner(principal, order))
+
+    async def list_orders(self, db, request, principal):
+        return await self.list_records(db, request, principal, 'sales_orders')
+
+    async def update_order_status(self, db, request, principal, order_id):
+        self.require_staff(principal)
+        body = request.json()
+        require(body, 'status')
+        if body['status'] not in ORDER_STATUSES:
+            raise HttpError(400, f"status must be one of {', '.join(ORDER_STATUSES)}")
+        return await self.change_status(db, 'sales_orders', 'sales_order', order_id, principal,
+                                        body['status'], notes=body.get('notes'))
+
+    async def cancel_order(self, db, request, principal, order_id):
+        reason = request.json().get('reason')
+        return await self.change_status(
+            db, 'sales_orders', 'sales_order', order_id, principal, 'Cancelled',
+            allowed_from=ORDER_CANCELLABLE, notes=reason,
+            extra={'cancelReason': reason, 'cancelledBy': principal.uid,
+                   'cancelledAt': datetime.now(timezone.utc)})
+
+    # ==================== PICKUPS ====================
+
+    async def create_pickup(self, db, request, principal):
+        body = request.json()
+        pickup = self.new_record(principal, body, (
+            'branchId', 'pickupAddress', 'estimatedQty', 'estimatedUom', 'containerType', 'photos',
+            'preferredWindowStart', 'preferredWindowEnd', 'incentiveType'))
+        require(body, 'pickupAddress', 'estimatedQty')
+        pickup.update({'estimatedQty': positive_number(body['estimatedQty'], 'estimatedQty'),
+                       'estimatedUom': pickup['estimatedUom'] or 'liter', 'photos': pickup['photos'] or [],
+                       'qualityFlags': None})
+        ref = db.collection('pickup_requests').document()
+        batch = db.batch()
+        batch.set(ref, pickup)
+        batch.set(db.collection(AUDIT_COLLECTION).document(), audit_entry(
+            None, 'pickup_request', ref.id, 'created', principal.uid, to_status='Submitted',
+            performed_at=pickup['createdAt']))
+        await batch.commit()
+        return json_response({'id': ref.id, **pickup}, 201)
+
+    async def get_pickup(self, db, request, principal, pickup_id):
+        pickup = await self.reads.run(('pickup_requests', pickup_id),
+                                      lambda: self._fetch_doc(db, 'pickup_requests', pickup_id))
+        return json_response(self.check_owner(principal, pickup))
+
+    async def list_pickups(self, db, request, principal):
+        return await self.list_records(db, request, principal, 'pickup_requests')
+
+    async def update_pickup_status(self, db, request, principal, pickup_id):
+        self.require_staff(principal)
+        body = request.json()
+        require(body, 'status')
+        if body['status'] not in PICKUP_STATUSES:
+            raise HttpError(400, f"status must be one of {', '.join(PICKUP_STATUSES)}")
+        return await self.change_status(db, 'pickup_requests', 'pickup_request', pickup_id, principal,
+                                        body['status'], notes=body.get('notes'))
+
+    async def cancel_pickup(self, db, request, principal, pickup_id):
+        reason = request.json().get('reason')
+        return await self.change_status(
+            db, 'pickup_requests', 'pickup_request', pickup_id, principal, 'Cancelled',
+            allowed_from=PICKUP_CANCELLABLE, notes=reason,
+            extra={'cancelReason': reason, 'cancelledBy': principal.uid,
+                   'cancelledAt': datetime.now(timezone.utc)})
+
+    async def record_quality(self, db, request, principal, pickup_id):
+        if not (principal.is_staff or principal.is_driver):
+            raise HttpError(403, 'Driver, dispatcher or admin role required')
+        body = request.json()
+        require(body, 'qualityFlags')
+        ref = db.collection('pickup_requests').document(pickup_id)
+        snap = await ref.get()
+        if not snap.exists:
+            raise HttpError(404, 'Not found')
+        updates = {'qualityFlags': body['qualityFlags'], 'inspectedBy': principal.uid,
+                   'inspectedAt': datetime.now(timezone.utc)}
+        if body.get('qualityScore') is not None:
+            try:
+                updates['qualityScore'] = float(body['qualityScore'])
+            except (TypeError, ValueError):
+                raise HttpError(400, 'qualityScore must be a number')
+        batch = db.batch()
+        batch.update(ref, updates)
+        batch.set(db.collection(AUDIT_COLLECTION).document(), audit_entry(
+            None, 'pickup_request', pickup_id, 'quality_recorded', principal.uid,
+            notes=body.get('notes'), changes=updates, performed_at=updates['inspectedAt']))
+        await batch.commit()
+        return json_response({**doc_json(snap), **updates})
+
+    # ==================== DISPATCH JOBS ====================
+
+    @staticmethod
+    def job_event(job_id, principal, event_type='StatusChange', status_from=None, status_to=None,
+                  note=None, lat=None, lng=None, **proof):
+        """job_events document in the JobEvent.toFirestore() layout"""
+        return {
+            'jobId': job_id, 'eventType': event_type, 'statusFrom': status_from, 'statusTo': status_to,
+            'note': note, 'photoUrls': proof.get('photoUrls') or [],
+            'signatureUrl': proof.get('signatureUrl'), 'actualQty': proof.get('actualQty'),
+            'actualUom': proof.get('actualUom'), 'lat': lat, 'lng': lng,
+            'createdByUid': principal.uid, 'createdAt': datetime.now(timezone.utc),
+        }
+
+    async def create_job(self, db, request, principal):
+        self.require_staff(principal)
+        body = request.json()
+        require(body, 'jobType', 'refId', 'scheduledDate')
+        if body['jobType'] not in JOB_TYPES:
+            raise HttpError(400, f"jobType must be one of {', '.join(JOB_TYPES)}")
+        source = 'pickup_requests' if body['jobType'] == 'Pickup' else 'sales_orders'
+        if not (await db.collection(source).document(body['refId']).get()).exists:
+            raise HttpError(400, f"{body['jobType']} reference {body['refId']} not found")
+        now = datetime.now(timezone.utc)
+        job = {
+            'jobType': body['jobType'], 'refId': body['refId'], 'stopSequence': int(body.get('stopSequence') or 0),
+            'assignedDriverUid': body.get('assignedDriverUid') or '',
+            'assignedVehicleId': body.get('assignedVehicleId') or '',
+            'scheduledDate': parse_timestamp(body['scheduledDate'], 'scheduledDate'),
+            'windowStart': parse_timestamp(body.get('windowStart') or body['scheduledDate'], 'windowStart'),
+            'windowEnd': parse_timestamp(body.get('windowEnd') or body['scheduledDate'], 'windowEnd'),
+            'status': 'Assigned', 'dispatcherUid': principal.uid, 'createdAt': now,
+        }
+        ref = db.collection('jobs').document()
+        batch = db.batch()
+        batch.set(ref, job)
+        batch.set(db.collection('job_events').document(), self.job_event(ref.id, principal, status_to='Assigned'))
+        await batch.commit()
+        return json_response({'id': ref.id, **job}, 201)
+
+    async def _load_job(self, db, principal, job_id):
+        """(snapshot, data) of a job the caller may act on"""
+        snap = await db.collection('jobs').document(job_id).get()
+        return snap, self.check_job_access(principal, doc_json(snap) if snap.exists else None)
+
+    async def _commit_job(self, db, snap, job, updates, event, extra_writes=()):
+        batch = db.batch()
+        batch.update(snap.reference, updates, option=db.write_option(last_update_time=snap.update_time))
+        batch.set(db.collection('job_events').document(), event)
+        for ref, data in extra_writes:
+            batch.update(ref, data)
+        try:
+            await batch.commit()
+        except (Aborted, FailedPrecondition):
+            raise HttpError(409, f'Job {snap.id} changed concurrently, retry')
+        return json_response({**job, **updates})
+
+    async def assign_job(self, db, request, principal, job_id):
+        self.require_staff(principal)
+        body = request.json()
+        require(body, 'driverUid')
+        snap, job = await self._load_job(db, principal, job_id)
+        if job.get('status') == 'Completed':
+            raise HttpError(409, 'Completed jobs cannot be reassigned')
+        updates = {'assignedDriverUid': body['driverUid'], 'assignedVehicleId': body.get('vehicleId') or '',
+                   'status': 'Assigned', 'dispatcherUid': principal.uid}
+        if body.get('scheduledDate'):
+            updates['scheduledDate'] = parse_timestamp(body['scheduledDate'], 'scheduledDate')
+        event = self.job_event(job_id, principal, status_from=job.get('status'), status_to='Assigned',
+                               note=f"Assigned to {body['driverUid']}")
+        return await self._commit_job(db, snap, job, updates, event)
+
+    async def update_job_status(self, db, request, principal, job_id):
+        body = request.json()
+        require(body, 'status')
+        snap, job = await self._load_job(db, principal, job_id)
+        from_status, to_status = job.get('status') or 'Assigned', body['status']
+        if to_status not in JOB_STATUSES:
+            raise HttpError(400, f"status must be one of {', '.join(JOB_STATUSES)}")
+        if to_status == 'Completed':
+            raise HttpError(400, 'Use /complete to close a job with proof of delivery')
+        if to_status not in JOB_TRANSITIONS[from_status]:
+            raise HttpError(409, f'Cannot move job from {from_status} to {to_status}')
+        event = self.job_event(job_id, principal, status_from=from_status, status_to=to_status,
+                               note=body.get('notes'), lat=body.get('lat'), lng=body.get('lng'))
+        return await self._commit_job(db, snap, job, {'status': to_status}, event)
+
+    async def complete_job(self, db, request, principal, job_id):
+        body = request.json()
+        snap, job = await self._load_job(db, principal, job_id)
+        from_status = job.get('status') or 'Assigned'
+        if 'Completed' not in JOB_TRANSITIONS[from_status]:
+            raise HttpError(409, f'Cannot complete a job that is {from_status}')
+        now = datetime.now(timezone.utc)
+        event_type, ref, updates = self.completion(db, job, body, now)
+        proof = {k: body.get(k) for k in ('photoUrls', 'signatureUrl', 'actualQty', 'actualUom')}
+        event = self.job_event(job_id, principal, event_type, status_from=from_status, status_to='Completed',
+                               note=body.get('notes'), **proof)
+        extra = [(ref, updates)] if (await ref.get()).exists else []
+        return await self._commit_job(db, snap, job, {'status': 'Completed', 'completedAt': now}, event, extra)
+
+    @staticmethod
+    def completion(db, job, body, now):
+        """(proof event type, order/pickup reference, its update) for closing a job with proof"""
+        if job.get('jobType') == 'Pickup':
+            return 'PickupProof', db.collection('pickup_requests').document(job.get('refId') or '-'), {
+                'status': 'Collected', 'actualQty': body.get('actualQty'), 'actualUom': body.get('actualUom'),
+                'qualityFlags': body.get('qualityFlags'), 'collectedAt': now, 'lastStatusAt': now}
+        return 'PODUploaded', db.collection('sales_orders').document(job.get('refId') or '-'), {
+            'status': 'Delivered', 'deliveredAt': now, 'lastStatusAt': now}
+
+    # ==================== BATCH STATUS ====================
+
+    @staticmethod
+    def validate_batch(body, principal):
+        """(driver uid the events belong to, event list) after shape checks"""
+        if principal.is_driver:
+            if body.get('driverUid') not in (None, principal.uid):
+                raise HttpError(403, 'Drivers can only replay their own events')
+            driver_uid = principal.uid
+        elif principal.is_staff:
+            require(body, 'driverUid')
+            driver_uid = body['driverUid']
+        else:
+            raise HttpError(403, 'Driver, dispatcher or admin role required')
+        events = body.get('events')
+        if not isinstance(events, list) or not events:
+            raise HttpError(400, 'events must be a non-empty list')
+        if len(events) > MAX_BATCH_EVENTS:
+            raise HttpError(413, f'At most {MAX_BATCH_EVENTS} events per call')
+        keys = set()
+        for i, event in enumerate(events):
+            if not isinstance(event, dict):
+                raise HttpError(400, f'events[{i}] must be an object')
+            require(event, 'idempotencyKey', 'jobId', 'status')
+            key = event['idempotencyKey']
+            if not isinstance(key, str) or len(key) > MAX_IDEMPOTENCY_KEY:
+                raise HttpError(400, f'events[{i}].idempotencyKey must be a string of at most {MAX_IDEMPOTENCY_KEY} characters')
+            if key in keys:
+                raise HttpError(400, f'events[{i}] repeats idempotencyKey {key}')
+            keys.add(key)
+            if event['status'] not in JOB_STATUSES:
+                raise HttpError(400, f"events[{i}].status must be one of {', '.join(JOB_STATUSES)}")
+            event['occurredAt'] = parse_timestamp(event.get('occurredAt'), f'events[{i}].occurredAt')
+        return driver_uid, events
+
+    async def batch_job_status(self, db, request, principal):
+        """Ordered job events from a driver's offline queue, each applied at most once per idempotencyKey
+
+        Events are replayed per job against JOB_TRANSITIONS starting from the stored status; an
+        invalid move rejects it and every later event for that job. Each job's accepted events
+        commit together (one jobs update with the final status plus one job_events document per
+        event, created under an id derived from the idempotency key), packed into shared batches.
+        """
+        driver_uid, events = self.validate_batch(request.json(), principal)
+        now = datetime.now(timezone.utc)
+        event_refs = [db.collection('job_events').document(idempotent_event_id(driver_uid, e['idempotencyKey']))
+                      for e in events]
+        job_ids = list(dict.fromkeys(e['jobId'] for e in events))
+        applied_before = {snap.id for snap in await db.get_all(event_refs) if snap.exists}
+        jobs = {snap.id: snap for snap in await db.get_all([db.collection('jobs').document(j) for j in job_ids])}
+
+        results = []
+        plans = {}
+        for event, ref in zip(events, event_refs):
+            outcome = {'idempotencyKey': event['idempotencyKey'], 'jobId': event['jobId'], 'status': event['status']}
+            results.append(outcome)
+            snap = jobs.get(event['jobId'])
+            if ref.id in applied_before:
+                outcome['result'] = 'duplicate'
+                continue
+            if snap is None or not snap.exists or snap.to_dict().get('assignedDriverUid') != driver_uid:
+                outcome.update(result='rejected', reason='Job not found for this driver')
+                continue
+            if snap.id not in plans:
+                job = snap.to_dict()
+                plans[snap.id] = {'snap': snap, 'job': job, 'status': job.get('status') or 'Assigned',
+                                  'events': [], 'outcomes': [], 'blocked_by': None}
+            plan = plans[snap.id]
+            from_status, to_status = plan['status'], event['status']
+            if plan['blocked_by'] is not None:
+                outcome.update(result='rejected', reason=f"Follows rejected event {plan['blocked_by']}")
+            elif to_status == from_status:
+                outcome.update(result='skipped', reason=f'Job already {to_status}')
+            elif to_status not in JOB_TRANSITIONS.get(from_status, ()):
+                outcome.update(result='rejected', reason=f'Cannot move job from {from_status} to {to_status}')
+                plan['blocked_by'] = event['idempotencyKey']
+            else:
+                plan['status'] = to_status
+                plan['events'].append((ref, event, from_status))
+                plan['outcomes'].append(outcome)
+
+        plans = [p for p in plans.values() if p['events']]
+        await self._stage_completions(db, plans, now)
+        staged = [(plan, self._plan_writes(db, plan, principal, now)) for plan in plans]
+        groups, group, size = [], [], 0
+        for plan, writes in staged:
+            if group and size + len(writes) > MAX_BATCH_WRITES:
+                groups.append(group)
+                group, size = [], 0
+            group.append((plan, writes))
+            size += len(writes)
+        if group:
+            groups.append(group)
+        await asyncio.gather(*(self._commit_group(db, g) for g in groups))
+
+        counts = defaultdict(int)
+        for outcome in results:
+            outcome.setdefault('result', 'applied')
+            counts[outcome['result']] += 1
+        return json_response({'driverUid': driver_uid, 'results': results, 'counts': dict(counts)})
+
+    async def _stage_completions(self, db, plans, now):
+        """Order/pickup updates for plans ending in Completed; references are read in one round trip"""
+        completing = []
+        for plan in plans:
+            ref, event, _ = plan['events'][-1]
+            plan['completion'] = None
+            if plan['status'] == 'Completed':
+                event_type, target, updates = self.completion(db, plan['job'], event, event['occurredAt'] or now)
+                plan['completion'] = (event_type, target, updates)
+                completing.append(target)
+        existing = set()
+        if completing:
+            existing = {snap.reference.path for snap in await db.get_all(completing) if snap.exists}
+        for plan in plans:
+            if plan['completion'] is not None and plan['completion'][1].path not in existing:
+                plan['completion'] = (plan['completion'][0], None, None)
+
+    def _plan_writes(self, db, plan, principal, now):
+        """Writes for one job: its final status, one job_events create per event and any completion update"""
+        snap = plan['snap']
+        updates = {'status': plan['status']}
+        writes = [('update', snap.reference, updates, db.write_option(last_update_time=snap.update_time))]
+        for ref, event, from_status in plan['events']:
+            event_type = 'StatusChange'
+            if event['status'] == 'Completed':
+                event_type = plan['completion'][0]
+                updates['completedAt'] = event['occurredAt'] or now
+            proof = {k: event.get(k) for k in ('photoUrls', 'signatureUrl', 'actualQty', 'actualUom')}
+            data = self.job_event(snap.id, principal, event_type, status_from=from_status, status_to=event['status'],
+                                  note=event.get('notes'), lat=event.get('lat'), lng=event.get('lng'), **proof)
+            data.update(idempotencyKey=event['idempotencyKey'], occurredAt=event['occurredAt'])
+            writes.append(('create', ref, data, None))
+        if plan['completion'] is not None and plan['completion'][1] is not None:
+            writes.append(('update', plan['completion'][1], plan['completion'][2], None))
+        return writes
+
+    @staticmethod
+    def _stage(batch, writes):
+        for op, ref, data, option in writes:
+            if op == 'create':
+                batch.create(ref, data)
+            elif option is not None:
+                batch.update(ref, data, option=option)
+            else:
+                batch.update(ref, data)
+
+    async def _commit_group(self, db, group):
+        """Commit several jobs' writes in one batch; on a conflict, retry job by job so one stale job fails alone"""
+        batch = db.batch()
+        for _, writes in group:
+            self._stage(batch, writes)
+        try:
+            await batch.commit()
+            return
+        except (Aborted, Conflict, FailedPrecondition):
+            if len(group) == 1:
+                self._mark_conflict(group[0][0])
+                return
+        for plan, writes in group:
+            batch = db.batch()
+            self._stage(batch, writes)
+            try:
+                await batch.commit()
+            except (Aborted, Conflict, FailedPrecondition):
+                self._mark_conflict(plan)
+
+    @staticmethod
+    def _mark_conflict(plan):
+        for outcome in plan['outcomes']:
+            outcome.update(result='conflict', reason='Job changed concurrently; resend with the same keys')
+
+    async def list_jobs(self, db, request, principal):
+        driver_uid = request.query.get('driverUid')
+        if principal.is_driver:
+            if driver_uid and driver_uid != principal.uid:
+                raise HttpError(403, 'Drivers can only list their own jobs')
+            driver_uid = principal.uid
+        elif not principal.is_staff:
+            raise HttpError(403, 'Driver, dispatcher or admin role required')
+        status, date = request.query.get('status'), request.query.get('date')
+        query = db.collection('jobs')
+        if driver_uid:
+            query = query.where(filter=FieldFilter('assignedDriverUid', '==', driver_uid))
+        elif status and not date:
+            query = query.where(filter=FieldFilter('status', '==', status))
+        elif not date:
+            raise HttpError(400, 'driverUid, status or date is required')
+        if date:
+            start, end = parse_day(date)
+            query = query.where(filter=FieldFilter('scheduledDate', '>=', start)).where(
+                filter=FieldFilter('scheduledDate', '<', end))
+
+        async def fetch():
+            jobs = [doc_json(d) for d in await query.get()]
+            jobs.sort(key=lambda j: (j.get('scheduledDate') or datetime.min.replace(tzinfo=timezone.utc),
+                                     j.get('stopSequence') or 0))
+            return jobs
+        jobs = await self.reads.run(('jobs', driver_uid, date, status), fetch)
+        if status:
+            jobs = [j for j in jobs if j.get('status') == status]
+        return json_response(jobs[:list_limit(request)])
+
+    # ==================== SEARCH ====================
+
+    async def search(self, db, request, principal):
+        """Ranked matches from the search_index.py index for the back-office screens: ?q=&kind=&limit="""
+        self.require_staff(principal)
+        if self.search_index is None:
+            raise HttpError(503, 'Search is not enabled; start the middleware with --search-index')
+        query = (request.query.get('q') or '').strip()
+        if not query:
+            raise HttpError(400, 'q is required')
+        kinds = [kind for kind in (request.query.get('kind') or '').split(',') if kind] or None
+        unknown = set(kinds or ()) - set(self.search_index.shards)
+        if unknown:
+            raise HttpError(400, f"kind must be one of {', '.join(self.search_index.shards)}")
+        try:
+            limit = max(1, min(int(request.query.get('limit', DEFAULT_SEARCH_LIMIT)), MAX_SEARCH_LIMIT))
+        except ValueError:
+            raise HttpError(400, 'limit must be an integer')
+        started = time.perf_counter()
+        hits = await asyncio.to_thread(self.search_index.search, query, kinds, limit)
+        return json_response({'query': query, 'results': hits,
+                              'tookMs': round((time.perf_counter() - started) * 1000, 2)})
+
+    # ==================== METRICS ====================
+
+    def collect(self, openmetrics=False):
+        """Exposition lines for FirestoreMetrics.add_collector()"""
+        job = self.pool.metrics.job
+        lines = []
+
+        def counter(name, help_text, samples):
+            family = name if openmetrics else f'{name}_total'
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} counter')
+            for labels, value in samples:
+                lines.append(f'{name}_total{{{label_pairs(job=job, **labels)}}} {value}')
+
+        def by_route(values):
+            return [({'method': m, 'route': r, 'status': s}, v) for (m, r, s), v in sorted(values.items())]
+
+        counter('api_requests', 'HTTP requests by route and status', by_route(self.requests))
+        counter('api_request_seconds', 'Handler seconds spent by route and status',
+                [(labels, f'{v:.6f}') for labels, v in by_route(self.latency)])
+        counter('api_coalesced_reads', 'Reads answered by joining an in-flight fetch', [({}, self.reads.joined)])
+        counter('api_catalog_rebuilds', 'Catalog snapshots built after config changes', [({}, self.catalog.rebuilds)])
+        return lines
+
+    def print_stats(self):
+        print("\n📊 Requests served:")
+        print(f"   {'route':<44} {'status':>6} {'count':>8} {'avg ms':>8}")
+        for (method, route, status), count in sorted(self.requests.items()):
+            avg = self.latency[(method, route, status)] / count * 1000
+            print(f"   {method + ' ' + route:<44} {status:>6} {count:>8} {avg:>8.1f}")
+        print(f"   Firestore reads: {self.reads.fetches} fetched, {self.reads.joined} coalesced")
+        print(f"   Catalog snapshots built: {self.catalog.rebuilds}")
+
+
+async def serve(args):
+    pool = ClientPool(client_pool(args.pool_size, job='api_middleware', args=args), args.concurrency)
+    catalog = Catalog(asyncio.get_running_loop())
+    cache = ConfigCache(sync_client(job='api_middleware', args=args), collections=CATALOG_COLLECTIONS,
+                        on_change=catalog.changed)
+    catalog.attach(await asyncio.to_thread(cache.load))
+    index = maintainer = None
+    stop_indexing = threading.Event()
+    if args.search_index:
+        from search_index import SearchIndexer, open_index
+        if not os.path.exists(args.search_index):
+            print(f"⚠️  {args.search_index} not found; indexing from scratch (search_index.py --once is faster)")
+        index = await asyncio.to_thread(open_index, args.search_index)
+        indexer = SearchIndexer(sync_client(job='api_middleware', args=args), index)
+
+        def maintain():
+            # Serves the loaded file meanwhile; the build prunes documents deleted while we were down
+            indexer.build()
+            indexer.run(args.search_index, stop=stop_indexing)
+        maintainer = threading.Thread(target=maintain, name='search-indexer', daemon=True)
+        maintainer.start()
+        print(f"🔎 Search index {args.search_index}: {len(index):,} records, reconciling then kept current")
+    server = ApiServer(pool, catalog, index)
+    snapshot = await catalog.current(server.reads)
+    print(f"🗂️  Catalog snapshot {snapshot.version}: {len(snapshot.products)} products, "
+          f"brotli {'on' if brotli is not None else 'off (pip install brotli)'}")
+    listener = await asyncio.start_server(server.handle_connection, args.host, args.port)
+    print(f"🚀 Serving Oil Manager API on http://{args.host}:{args.port}{API_PREFIX} "
+          f"({args.pool_size} Firestore clients, {args.concurrency} in flight)")
+    if os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        print(f"   Firestore emulator: {os.environ['FIRESTORE_EMULATOR_HOST']}")
+    try:
+        async with listener:
+            if args.duration:
+                await asyncio.sleep(args.duration)
+            else:
+                await listener.serve_forever()
+    finally:
+        cache.close()
+        if maintainer is not None:
+            stop_indexing.set()
+            await asyncio.to_thread(maintainer.join)
+        server.print_stats()
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE,
+                        help=f'async Firestore clients to round-robin over (default {DEFAULT_POOL_SIZE})')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'requests allowed inside Firestore at once (default {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--duration', type=float, metavar='SECONDS', help='stop after SECONDS (default: run forever)')
+    parser.add_argument('--search-index', metavar='PATH',
+                        help='serve GET /search from this search_index.py file, kept current by listeners')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    if args.pool_size < 1:
+        parser.error('--pool-size must be at least 1')
+
+    print("=" * 60)
+    print("🌐 OIL MANAGER - API MIDDLEWARE")
+    print("=" * 60)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\n👋 Stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Approval inbox fan-out worker for Oil Manager
+Listens to pending approval_requests and maintains one compact inboxes/{uid or role}
+document per approver, holding the top pending items sorted by priority and SLA,
+so an Approval Inbox screen streams one small document instead of a live query
+"""
+
+import argparse
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+try:
+    from firebase_admin import firestore
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import MAX_BATCH_WRITES, chunked, sync_client
+
+INBOX_COLLECTION = 'inboxes'
+UNASSIGNED_INBOX = 'unassigned'
+
+# Keeps an inbox document around 25 KB; pendingCount still reports the full backlog
+MAX_INBOX_ITEMS = 50
+MAX_REQUEST_DATA_KEYS = 8
+
+PRIORITY_RANK = {'urgent': 0, 'high': 1, 'medium': 2, 'low': 3}
+FAR_FUTURE = datetime.max.replace(tzinfo=timezone.utc)
+
+# Fields ApprovalRequest.fromFirestore() reads; decision fields are always empty while pending
+SUMMARY_FIELDS = (
+    'workflowInstanceId', 'workflowStepId', 'workflowType', 'entityId', 'requestType',
+    'requestedBy', 'requestedAt', 'assignedTo', 'assignedToRole', 'status', 'priority', 'slaDeadline',
+)
+
+FLUSH_INTERVAL = 0.5
+
+
+def _aware(ts):
+    if ts is None:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def inbox_ids(request):
+    """Inboxes a pending request belongs to, mirroring getPendingApprovals(userId:) and (userRole:)"""
+    ids = [value for value in (request.get('assignedTo'), request.get('assignedToRole')) if value]
+    return ids or [UNASSIGNED_INBOX]
+
+
+def summarize(request_id, request):
+    """Compact inbox entry: the ApprovalRequest fields plus scalar requestData values"""
+    item = {field: request.get(field) for field in SUMMARY_FIELDS}
+    item['id'] = request_id
+    data = request.get('requestData') or {}
+    item['requestData'] = {key: value for key, value in list(data.items())[:MAX_REQUEST_DATA_KEYS]
+                           if isinstance(value, (str, int, float, bool)) or value is None}
+    return item
+
+
+def sort_key(item):
+    """Most urgent first, then nearest SLA deadline, then newest request"""
+    requested = _aware(item.get('requestedAt'))
+    return (PRIORITY_RANK.get(item.get('priority'), len(PRIORITY_RANK)),
+            _aware(item.get('slaDeadline')) or FAR_FUTURE,
+            -(requested.timestamp() if requested else 0))
+
+
+def render_inbox(inbox_id, items, now, max_items=MAX_INBOX_ITEMS):
+    """Inbox document for a set of pending summaries; returns (doc, next SLA deadline to recheck at)"""
+    ordered = sorted(items, key=sort_key)
+    by_type = defaultdict(int)
+    overdue = 0
+    next_deadline = None
+    for item in ordered:
+        by_type[item.get('workflowType') or 'unknown'] += 1
+        deadline = _aware(item.get('slaDeadline'))
+        if deadline is not None and deadline < now:
+            overdue += 1
+        elif deadline is not None and (next_deadline is None or deadline < next_deadline):
+            next_deadline = deadline
+    top = [dict(item, isOverdue=bool(item.get('slaDeadline')) and _aware(item['slaDeadline']) < now)
+           for item in ordered[:max_items]]
+    doc = {
+        'inboxId': inbox_id,
+        'items': top,
+        'pendingCount': len(ordered),
+        'overdueCount': overdue,
+        'truncated': len(ordered) > max_items,
+        'byWorkflowType': dict(by_type),
+        'nextSlaDeadline': next_deadline,
+    }
+    return doc, next_deadline
+
+
+class InboxFanout:
+    """In-memory view of the pending set, written out as one document per inbox
+
+    Changes are applied as they arrive and only the inboxes they touch are marked
+    dirty; flush() writes dirty inboxes in batches and skips ones whose content did
+    not change, so a burst of edits to one request costs one write per inbox.
+    """
+
+    def __init__(self, db, max_items=MAX_INBOX_ITEMS):
+        self.db = db
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.members = defaultdict(dict)
+        self.dirty = set()
+        self.written = {}
+        self.deadlines = {}
+        self.counts = defaultdict(int)
+        # Set when a listener (re)opens: its first snapshot replaces the pending set instead of patching it
+        self._resync = False
+
+    def pending_query(self):
+        return self.db.collection('approval_requests').where(filter=FieldFilter('status', '==', 'pending'))
+
+    def apply(self, request_id, request):
+        """Upsert a pending request, or drop it when request is None (approved, rejected, deleted)"""
+        with self._lock:
+            self._apply(request_id, request)
+            self.counts['changes'] += 1
+
+    def _apply(self, request_id, request):
+        for inbox in self.requests.pop(request_id, ()):
+            self.members[inbox].pop(request_id, None)
+            self.dirty.add(inbox)
+        if request is not None and request.get('status', 'pending') == 'pending':
+            summary = summarize(request_id, request)
+            inboxes = inbox_ids(request)
+            self.requests[request_id] = inboxes
+            for inbox in inboxes:
+                self.members[inbox][request_id] = summary
+                self.dirty.add(inbox)
+
+    def replace(self, snapshots):
+        """Rebuild the pending set from a full snapshot; every inbox it held before is re-rendered
+
+        Requests that stopped being pending while no listener was attached are simply absent
+        here, so their inboxes come out without them (or empty) on the next flush.
+        """
+        with self._lock:
+            self.dirty.update(self.members)
+            self.requests, self.members = {}, defaultdict(dict)
+            for snap in snapshots:
+                self._apply(snap.id, snap.to_dict())
+            self.counts['resyncs'] += 1
+
+    def on_snapshot(self, snapshots, changes, read_time):
+        if self._resync:
+            self._resync = False
+            self.replace(snapshots)
+            return
+        for change in changes:
+            removed = change.type.name == 'REMOVED'
+            self.apply(change.document.id, None if removed else change.document.to_dict())
+
+    def on_change(self, event):
+        """change_bus handler; the bus carries every approval_request, apply() drops non-pending ones"""
+        self.apply(event.doc_id, event.data)
+
+    def attach(self, bus):
+        """Consume approval_requests from a ChangeBus, or from a change_bus.py socket path"""
+        from change_bus import connect
+        feed = connect(bus, 'approval_inbox_fanout', self.on_change, ['approval_requests'])
+        if isinstance(bus, str):
+            # A socket consumer joins a running bus whose log no longer holds the initial snapshot
+            self.load()
+        return feed
+
+    def load(self):
+        self.replace(self.pending_query().stream())
+
+    def reconcile(self):
+        """Mark inbox documents left over from earlier runs as dirty so they get emptied"""
+        for ref in self.db.collection(INBOX_COLLECTION).list_documents():
+            with self._lock:
+                if ref.id not in self.members:
+                    self.members[ref.id] = {}
+                    self.dirty.add(ref.id)
+
+    def flush(self, now=None):
+        """Write every dirty inbox, plus inboxes where an item just crossed its SLA deadline"""
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            expired = {inbox for inbox, deadline in self.deadlines.items() if deadline and deadline <= now}
+            targets, self.dirty = self.dirty | expired, set()
+            rendered = []
+            for inbox in sorted(targets):
+                doc, next_deadline = render_inbox(inbox, self.members[inbox].values(), now, self.max_items)
+                self.deadlines[inbox] = next_deadline
+                fingerprint = repr(doc)
+                if self.written.get(inbox) == fingerprint:
+                    continue
+                rendered.append((inbox, doc, fingerprint))
+                if not self.members[inbox]:
+                    del self.members[inbox]
+
+        chunks = list(chunked(rendered, MAX_BATCH_WRITES))
+        for n, chunk in enumerate(chunks):
+            batch = self.db.batch()
+            for inbox, doc, _ in chunk:
+                batch.set(self.db.collection(INBOX_COLLECTION).document(inbox),
+                          dict(doc, updatedAt=firestore.SERVER_TIMESTAMP))
+            try:
+                batch.commit()
+            except Exception:
+                with self._lock:
+                    # Unwritten inboxes are rendered again by the next flush
+                    self.dirty.update(inbox for unwritten in chunks[n:] for inbox, _, _ in unwritten)
+                raise
+            with self._lock:
+                for inbox, _, fingerprint in chunk:
+                    self.written[inbox] = fingerprint
+        self.counts['inbox writes'] += len(rendered)
+        return len(rendered)
+
+    def listen(self, bus=None):
+        if bus is None:
+            self._resync = True
+            return self.pending_query().on_snapshot(self.on_snapshot)
+        return self.attach(bus)
+
+    def restart(self, bus=None):
+        """Reopen the change source after an outage and rebuild the pending set, since changes were missed"""
+        feed = self.listen(bus)
+        if bus is not None and not isinstance(bus, str):
+            # attach() only reloads for socket consumers
+            self.load()
+        return feed
+
+    def run(self, duration=None, bus=None):
+        """Keep the inboxes current until interrupted (or duration seconds)
+
+        Opens its own listener on the pending set, or with bus (a ChangeBus or the path
+        of a change_bus.py socket) consumes approval_requests changes from the bus.
+        """
+        watch = self.listen(bus)
+        self.reconcile()
+        started = time.time()
+        source = 'pending approval_requests' if bus is None else 'approval_requests from the change bus'
+        print(f"👂 Listening to {source} (flush every {FLUSH_INTERVAL}s)...")
+        try:
+            while duration is None or time.time() - started < duration:
+                time.sleep(FLUSH_INTERVAL)
+                written = self.flush()
+                if written:
+                    print(f"   ✓ {written} inbox(es) updated, {len(self.requests)} pending request(s)")
+                if not watch.is_active:
+                    print("⚠️  Listener closed, restarting from a fresh snapshot")
+                    watch = self.restart(bus)
+        except KeyboardInterrupt:
+            print("\n🛑 Stopping inbox fan-out")
+        finally:
+            watch.unsubscribe()
+            self.flush()
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--once', action='store_true', help='rebuild every inbox from one query and exit')
+    parser.add_argument('--duration', type=float, metavar='SECONDS', help='stop listening after SECONDS')
+    parser.add_argument('--max-items', type=int, default=MAX_INBOX_ITEMS,
+                        help=f'items kept per inbox document (default {MAX_INBOX_ITEMS})')
+    parser.add_argument('--bus', metavar='SOCKET',
+                        help='consume approval_requests from a running change_bus.py socket instead of listening')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    print("📥 Oil Manager approval inbox fan-out")
+    fanout = InboxFanout(sync_client(args=args), max_items=args.max_items)
+
+    if args.once:
+        fanout.load()
+        fanout.reconcile()
+        written = fanout.flush()
+        print(f"✅ {written} inbox(es) written for {len(fanout.requests)} pending request(s)")
+        return
+
+    fanout.run(duration=args.duration, bus=args.bus)
+
+
+if __name__ == '__main__':
+    main()
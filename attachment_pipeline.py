@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Attachment processing pipeline for Oil Manager photos
+Watches attachments/ in the storage bucket (or a local directory stand-in) for POD,
+collection and inspection photos, renders thumbnail and web variants and a perceptual
+hash in a process pool, flags near-duplicate photos, and writes the variant URLs back
+to the owning documents in batches
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import quote
+
+try:
+    import numpy as np
+    from PIL import Image, ImageOps
+except ImportError:
+    print("❌ Pillow/numpy not installed. Run: pip install Pillow numpy")
+    sys.exit(1)
+
+try:
+    from firebase_admin import firestore
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import MAX_BATCH_WRITES, chunked, sync_client
+
+ATTACHMENT_COLLECTION = 'attachments'
+DEFAULT_SOURCE = 'gs://fleets-x9tytb.firebasestorage.app'
+# Originals live at attachments/{collection}/{docId}/{attachmentType}/{file}; variants go under variants/
+SOURCE_PREFIX = 'attachments/'
+VARIANT_PREFIX = 'variants/'
+ATTACHMENT_TYPES = {'POD_PHOTO', 'COLLECTION_PHOTO', 'INSPECTION_PHOTO', 'PHOTO', 'SIGNATURE'}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Longest edge and JPEG quality per variant
+VARIANTS = {'thumb': (256, 70), 'web': (1280, 80)}
+# Hamming distance at or below which two 64-bit perceptual hashes count as the same photo
+DUPLICATE_DISTANCE = 6
+HASH_BANDS = 8
+POLL_SECONDS = 10
+# Each image costs two writes (attachments doc, owner update)
+IMAGES_PER_BATCH = MAX_BATCH_WRITES // 2
+DEFAULT_WORKERS = os.cpu_count() or 2
+
+
+# ============================================================
+# STORES
+# ============================================================
+
+class DirectoryStore:
+    """Objects as files under a local directory, standing in for the bucket in development"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def list(self, prefix):
+        """(name, generation, size) of every object under prefix"""
+        base = os.path.join(self.root, prefix)
+        for folder, _, files in os.walk(base):
+            for file in files:
+                path = os.path.join(folder, file)
+                stat = os.stat(path)
+                yield os.path.relpath(path, self.root).replace(os.sep, '/'), str(stat.st_mtime_ns), stat.st_size
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), 'rb') as fh:
+            return fh.read()
+
+    def write(self, name, data, content_type):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        return path
+
+
+class BucketStore:
+    """Objects in a Cloud Storage bucket; variants get Firebase download-token URLs like app uploads"""
+
+    def __init__(self, bucket_name):
+        from firebase_admin import storage
+        self.bucket = storage.bucket(bucket_name)
+
+    def list(self, prefix):
+        for blob in self.bucket.list_blobs(prefix=prefix):
+            yield blob.name, str(blob.generation), blob.size
+
+    def read(self, name):
+        return self.bucket.blob(name).download_as_bytes()
+
+    def write(self, name, data, content_type):
+        token = str(uuid.uuid4())
+        blob = self.bucket.blob(name)
+        blob.metadata = {'firebaseStorageDownloadTokens': token}
+        blob.cache_control = 'public, max-age=31536000'
+        blob.upload_from_string(data, content_type=content_type)
+        return (f'https://firebasestorage.googleapis.com/v0/b/{self.bucket.name}/o/'
+                f'{quote(name, safe="")}?alt=media&token={token}')
+
+
+def open_store(spec):
+    """Store for a gs://bucket URI or a local directory path"""
+    if spec.startswith('gs://'):
+        return BucketStore(spec[len('gs://'):].split('/', 1)[0])
+    return DirectoryStore(spec)
+
+
+def parse_name(name):
+    """(collection, doc_id, attachment_type) for attachments/{collection}/{docId}/{type}/{file}, else None"""
+    parts = name.split('/')
+    if len(parts) != 5 or parts[0] != SOURCE_PREFIX.rstrip('/') or not name.lower().endswith(IMAGE_EXTENSIONS):
+        return None
+    if parts[3] not in ATTACHMENT_TYPES:
+        return None
+    return parts[1], parts[2], parts[3]
+
+
+def attachment_key(name):
+    return hashlib.sha1(name.encode('utf-8')).hexdigest()[:20]
+
+
+# ============================================================
+# IMAGE WORK (runs in the process pool)
+# ============================================================
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def perceptual_hash(image):
+    """64-bit DCT hash: low 8×8 frequencies of a 32×32 grayscale copy against their median"""
+    gray = np.asarray(image.convert('L').resize((32, 32), Image.Resampling.LANCZOS), dtype=float)
+    low = (_DCT32 @ gray @ _DCT32.T)[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+
+def render(data):
+    """Variants and hash for one original; returns a dict, or {'error': ...} for unreadable input"""
+    started = time.process_time()
+    try:
+        with Image.open(io.BytesIO(data)) as original:
+            image = ImageOps.exif_transpose(original).convert('RGB')
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+    result = {'width': image.width, 'height': image.height, 'phash': perceptual_hash(image), 'variants': {}}
+    for variant, (edge, quality) in VARIANTS.items():
+        copy = image.copy()
+        copy.thumbnail((edge, edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        out = io.BytesIO()
+        # Saved without EXIF: variants must not carry the phone's GPS tags into back-office lists
+        copy.save(out, 'JPEG', quality=quality, optimize=True, progressive=variant == 'web')
+        result['variants'][variant] = (out.getvalue(), copy.width, copy.height)
+    result['cpu_seconds'] = time.process_time() - started
+    return result
+
+
+# ============================================================
+# DUPLICATES
+# ============================================================
+
+class HashIndex:
+    """Near-duplicate lookup over 64-bit hashes
+
+    Hashes are split into HASH_BANDS bands; two hashes within DUPLICATE_DISTANCE bits
+    differ in at most that many bands, so (with more bands than the distance) they share
+    at least one band exactly and only hashes in a matching band bucket are compared.
+    """
+
+    def __init__(self, distance=DUPLICATE_DISTANCE, bands=HASH_BANDS):
+        self.distance = distance
+        self.bits = 64 // bands
+        self.bands = bands
+        self.buckets = {}
+
+    def _bands(self, value):
+        mask = (1 << self.bits) - 1
+        return [(i, (value >> (i * self.bits)) & mask) for i in range(self.bands)]
+
+    def add(self, value, key):
+        for band in self._bands(value):
+            self.buckets.setdefault(band, []).append((value, key))
+
+    def match(self, value, owner=None):
+        """Key of the closest indexed hash within distance, ignoring keys from the same owner"""
+        best = None
+        for band in self._bands(value):
+            for other, key in self.buckets.get(band, ()):
+                if owner is not None and key[1] == owner:
+                    continue
+                d = bin(value ^ other).count('1')
+                if d <= self.distance and (best is None or d < best[0]):
+                    best = (d, key[0])
+        return best
+
+
+# ============================================================
+# PIPELINE
+# ============================================================
+
+class AttachmentPipeline:
+    def __init__(self, db, store, workers=DEFAULT_WORKERS, dry_run=False):
+        self.db = db
+        self.store = store
+        self.workers = workers
+        self.dry_run = dry_run
+        self.processed = {}
+        self.hashes = HashIndex()
+        self.stats = {'images': 0, 'duplicates': 0, 'failed': 0, 'orphans': 0, 'bytes_in': 0, 'bytes_out': 0,
+                      'cpu_seconds': 0.0, 'seconds': 0.0}
+
+    def load(self):
+        """Already-processed originals and their hashes, so restarts only pick up new objects"""
+        query = self.db.collection(ATTACHMENT_COLLECTION).select(['sourceGeneration', 'phash', 'ownerPath'])
+        for snap in query.stream():
+            doc = snap.to_dict()
+            self.processed[snap.id] = doc.get('sourceGeneration')
+            if doc.get('phash'):
+                self.hashes.add(int(doc['phash'], 16), (snap.id, doc.get('ownerPath')))
+        return len(self.processed)
+
+    def pending(self):
+        """New or replaced originals under attachments/"""
+        found = []
+        for name, generation, size in self.store.list(SOURCE_PREFIX):
+            owner = parse_name(name)
+            if owner is None:
+                continue
+            key = attachment_key(name)
+            if self.processed.get(key) != generation:
+                found.append((key, name, generation, size, owner))
+        return found
+
+    def process(self, items, pool, io_pool):
+        """Render, upload and record one chunk of originals"""
+        started = time.perf_counter()
+        originals = list(io_pool.map(lambda item: self.store.read(item[1]), items))
+        results = list(pool.map(render, originals, chunksize=max(1, len(items) // (self.workers * 4))))
+        uploads = []
+        for item, data, result in zip(items, originals, results):
+            self.stats['bytes_in'] += len(data)
+            if 'error' in result:
+                # Not retried until the object changes or the pipeline restarts
+                self.processed[item[0]] = item[2]
+                self.stats['failed'] += 1
+                print(f"⚠️  {item[1]}: {result['error']}")
+                continue
+            self.stats['cpu_seconds'] += result['cpu_seconds']
+            uploads.append((item, result))
+
+        def upload(entry):
+            (key, name, generation, size, owner), result = entry
+            stem = os.path.splitext(name[len(SOURCE_PREFIX):])[0]
+            urls = {}
+            for variant, (data, width, height) in result['variants'].items():
+                target = f'{VARIANT_PREFIX}{stem}_{variant}.jpg'
+                urls[variant] = target if self.dry_run else self.store.write(target, data, 'image/jpeg')
+                self.stats['bytes_out'] += len(data)
+            return urls
+
+        urls = list(io_pool.map(upload, uploads))
+        self.record([(item, result, u) for (item, result), u in zip(uploads, urls)])
+        self.stats['seconds'] += time.perf_counter() - started
+
+    def record(self, rendered):
+        """attachments/{key} plus attachmentVariants.{key} on the owner, in batches"""
+        for chunk in chunked(rendered, IMAGES_PER_BATCH):
+            owner_refs = {owner: self.db.collection(owner[0]).document(owner[1]) for (_, _, _, _, owner), _, _ in chunk}
+            existing = {snap.reference.path for snap in self.db.get_all(list(owner_refs.values())) if snap.exists}
+            batch = self.db.batch()
+            for (key, name, generation, size, owner), result, urls in chunk:
+                owner_path = f'{owner[0]}/{owner[1]}'
+                match = self.hashes.match(result['phash'], owner_path)
+                phash = f"{result['phash']:016x}"
+                entry = {
+                    'source': name,
+                    'attachmentType': owner[2],
+                    'thumbUrl': urls['thumb'],
+                    'webUrl': urls['web'],
+                    'width': result['width'],
+                    'height': result['height'],
+                    'phash': phash,
+                    'duplicateOf': match[1] if match else None,
+                }
+                batch.set(self.db.collection(ATTACHMENT_COLLECTION).document(key), dict(
+                    entry, ownerPath=owner_path, sourceGeneration=generation, sourceBytes=size,
+                    processedAt=firestore.SERVER_TIMESTAMP))
+                if owner_refs[owner].path in existing:
+                    batch.update(owner_refs[owner], {f'attachmentVariants.{key}': entry})
+                else:
+                    self.stats['orphans'] += 1
+                if match:
+                    self.stats['duplicates'] += 1
+                    print(f"🔁 {name} looks like {match[1]} (distance {match[0]})")
+                self.hashes.add(result['phash'], (key, owner_path))
+                self.processed[key] = generation
+                self.stats['images'] += 1
+            if not self.dry_run:
+                batch.commit()
+
+    def run_once(self, pool, io_pool):
+        items = self.pending()
+        for chunk in chunked(items, IMAGES_PER_BATCH):
+            self.process(chunk, pool, io_pool)
+        return len(items)
+
+    def run(self, watch=False, duration=None):
+        started = time.time()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool, ThreadPoolExecutor(max_workers=16) as io_pool:
+            while True:
+                count = self.run_once(pool, io_pool)
+                if count:
+                    print(f"   ✓ {count} photo(s) processed, {self.stats['duplicates']} duplicate(s) so far")
+                if not watch or (duration is not None and time.time() - started >= duration):
+                    break
+                time.sleep(POLL_SECONDS)
+        return self.stats
+
+
+def synthetic_photo(rng, width=2000, height=1500):
+    """JPEG bytes of a smooth random scene plus sensor noise, roughly the weight of a phone photo"""
+    scene = Image.fromarray(rng.uniform(0, 255, (12, 16, 3)).astype(np.uint8)).resize((width, height), Image.BICUBIC)
+    pixels = np.clip(np.asarray(scene, dtype=float) + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+def benchmark(images, workers):
+    """Render synthetic photos with 1 and with workers processes; returns {workers: images/s}"""
+    rng = np.random.default_rng(3)
+    photos = [synthetic_photo(rng) for _ in range(min(images, 8))]
+    batch = [photos[i % len(photos)] for i in range(images)]
+    rates = {}
+    for count in sorted({1, workers}):
+        with ProcessPoolExecutor(max_workers=count) as pool:
+            list(pool.map(render, photos[:count]))
+            started = time.perf_counter()
+            list(pool.map(render, batch, chunksize=max(1, images // (count * 4))))
+            rates[count] = images / (time.perf_counter() - started)
+    return rates
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--source', default=DEFAULT_SOURCE,
+                        help=f'gs://bucket or a local directory holding attachments/ (default {DEFAULT_SOURCE})')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'image processes (default: one per core, {DEFAULT_WORKERS})')
+    parser.add_argument('--watch', action='store_true', help=f'keep polling for new photos every {POLL_SECONDS}s')
+    parser.add_argument('--duration', type=float, metavar='SECONDS', help='stop watching after SECONDS')
+    parser.add_argument('--dry-run', action='store_true', help='render and hash without uploading or writing')
+    parser.add_argument('--benchmark', type=int, metavar='IMAGES',
+                        help='time rendering of IMAGES synthetic 3 MP photos, then exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        rates = benchmark(args.benchmark, args.workers)
+        print(f"⏱️  Rendered {args.benchmark} synthetic 2000×1500 photos:")
+        for count, rate in rates.items():
+            print(f"   • {count} process(es): {rate:.1f} images/s ({rate / count:.1f} images/s per core)")
+        return
+
+    print("🖼️  Oil Manager attachment pipeline")
+    pipeline = AttachmentPipeline(sync_client(args=args), open_store(args.source), args.workers, args.dry_run)
+    known = pipeline.load()
+    print(f"📦 {known} attachment(s) already processed; scanning {args.source}/{SOURCE_PREFIX}...")
+    try:
+        stats = pipeline.run(watch=args.watch, duration=args.duration)
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping attachment pipeline")
+        stats = pipeline.stats
+
+    rate = stats['images'] / stats['seconds'] if stats['seconds'] else 0
+    cpu_rate = stats['images'] / stats['cpu_seconds'] if stats['cpu_seconds'] else 0
+    print(f"\n✅ Attachment pipeline finished{' (dry run)' if args.dry_run else ''}")
+    print(f"   • Photos processed: {stats['images']} ({stats['failed']} unreadable, {stats['orphans']} without owner)")
+    print(f"   • Near-duplicates flagged: {stats['duplicates']}")
+    print(f"   • {rate:.1f} images/s on {args.workers} process(es), {cpu_rate:.1f} images/s per core")
+    if stats['bytes_in']:
+        print(f"   • {stats['bytes_in'] / 1e6:.1f} MB of originals → {stats['bytes_out'] / 1e6:.1f} MB of variants")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Bootstrap a complete Oil Manager environment
+Runs every seeder (setup, sample config, advanced config, workflow data) as one
+asyncio task graph: independent collections are written concurrently, dependent
+ones (buyback rates → grades, price items → products + price lists, order lines
+→ order) wait only for what they need
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import create_advanced_config_data as advanced
+import create_sample_config_data as sample
+import create_workflow_sample_data as workflow
+import setup_firestore as setup
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import DEFAULT_CONCURRENCY, TaskGraph, async_client
+
+graph = TaskGraph()
+
+
+def by_field(field):
+    return lambda doc: doc[field]
+
+
+# ============================================================
+# SETUP (users, products cache, sample order and pickup)
+# ============================================================
+@graph.job('users')
+async def seed_users(ctx):
+    async def create(user_data):
+        # create_auth_user prints and swallows its own errors, like setup_firestore.py
+        await ctx.blocking(setup.create_auth_user, user_data)
+
+    await asyncio.gather(*(create(u) for u in setup.test_users))
+    docs = [setup.user_doc(i, u) for i, u in enumerate(setup.test_users)]
+    return await ctx.write_all('users', docs, key=by_field('uid'))
+
+
+@graph.job('products_cache')
+async def seed_products_cache(ctx):
+    return await ctx.write_all('products_cache', setup.products, key=by_field('sku'))
+
+
+@graph.job('sample_order')
+async def seed_sample_order(ctx):
+    return await ctx.write_all('sales_orders', [setup.sample_order_doc()])
+
+
+@graph.job('sample_order_lines', deps=['sample_order'])
+async def seed_sample_order_lines(ctx):
+    order_id = ctx.results['sample_order'][0][0]
+    return await ctx.write_all('sales_order_lines', setup.sample_order_line_docs(order_id))
+
+
+@graph.job('sample_pickup')
+async def seed_sample_pickup(ctx):
+    return await ctx.write_all('pickup_requests', [setup.sample_pickup_doc()])
+
+
+# ============================================================
+# SAMPLE CONFIG
+# ============================================================
+@graph.job('config_products')
+async def seed_config_products(ctx):
+    written = await ctx.write_all('config_products', sample.products)
+    return {doc['sku']: doc_id for doc_id, doc in written}
+
+
+@graph.job('config_uco_grades')
+async def seed_uco_grades(ctx):
+    written = await ctx.write_all('config_uco_grades', sample.uco_grades)
+    return {doc['gradeCode']: doc_id for doc_id, doc in written}
+
+
+@graph.job('config_uco_buyback_rates', deps=['config_uco_grades'])
+async def seed_buyback_rates(ctx):
+    docs = sample.buyback_rate_docs(ctx.results['config_uco_grades'])
+    return await ctx.write_all('config_uco_buyback_rates', docs)
+
+
+@graph.job('config_payment_methods')
+async def seed_payment_methods(ctx):
+    return await ctx.write_all('config_payment_methods', sample.payment_methods)
+
+
+@graph.job('config_order_statuses')
+async def seed_order_statuses(ctx):
+    return await ctx.write_all('config_order_statuses', sample.order_statuses)
+
+
+@graph.job('config_reasons')
+async def seed_reasons(ctx):
+    return await ctx.write_all('config_reasons', sample.reasons)
+
+
+@graph.job('config_fulfillment_settings')
+async def seed_fulfillment_settings(ctx):
+    return await ctx.write_all('config_fulfillment_settings', [sample.fulfillment_settings])
+
+
+@graph.job('config_workflow_templates')
+async def seed_workflow_templates(ctx):
+    docs = sample.workflow_templates + advanced.workflow_template_docs()
+    return await ctx.write_all('config_workflow_templates', docs)
+
+
+@graph.job('config_price_lists')
+async def seed_price_lists(ctx):
+    written = await ctx.write_all('config_price_lists', sample.price_lists)
+    return {doc['code']: doc_id for doc_id, doc in written}
+
+
+@graph.job('config_price_list_items', deps=['config_price_lists', 'config_products'])
+async def seed_price_items(ctx):
+    docs = sample.price_item_docs(ctx.results['config_price_lists'], ctx.results['config_products'])
+    return await ctx.write_all('config_price_list_items', docs)
+
+
+# ============================================================
+# ADVANCED CONFIG
+# ============================================================
+@graph.job('config_system_settings')
+async def seed_system_settings(ctx):
+    return await ctx.write_all('config_system_settings', advanced.system_setting_docs(), key=by_field('key'))
+
+
+@graph.job('config_routing_rules')
+async def seed_routing_rules(ctx):
+    return await ctx.write_all('config_routing_rules', advanced.routing_rule_docs())
+
+
+@graph.job('config_uco_incentives')
+async def seed_uco_incentives(ctx):
+    return await ctx.write_all('config_uco_incentives', advanced.uco_incentive_docs())
+
+
+@graph.job('config_delivery_slots')
+async def seed_delivery_slots(ctx):
+    return await ctx.write_all('config_delivery_slots', advanced.delivery_slot_docs())
+
+
+@graph.job('config_notification_templates')
+async def seed_notification_templates(ctx):
+    return await ctx.write_all('config_notification_templates', advanced.notification_template_docs())
+
+
+@graph.job('config_status_sequences')
+async def seed_status_sequences(ctx):
+    return await ctx.write_all('config_status_sequences', advanced.status_sequence_docs())
+
+
+# ============================================================
+# WORKFLOW DATA
+# ============================================================
+@graph.job('workflow_instances')
+async def seed_workflow_instances(ctx):
+    return await ctx.write_all('workflow_instances', workflow.workflow_instance_docs())
+
+
+@graph.job('approval_requests')
+async def seed_approval_requests(ctx):
+    return await ctx.write_all('approval_requests', workflow.approval_request_docs())
+
+
+@graph.job('exceptions')
+async def seed_exceptions(ctx):
+    return await ctx.write_all('exceptions', workflow.exception_docs())
+
+
+@graph.job('audit_log')
+async def seed_audit_log(ctx):
+    return await ctx.write_all('audit_log', workflow.audit_log_docs())
+
+
+def print_summary(results):
+    print('\n📊 Documents written:')
+    for name in sorted(results):
+        print(f'   • {name:<32} {len(results[name])}')
+
+
+async def bootstrap(args):
+    # The async client binds its channel to the running loop, so create it in here
+    db = async_client(job='bootstrap_environment', args=args)
+    if args.benchmark:
+        await benchmark(db, args.concurrency, args.only)
+        return
+    results = await graph.run(db, concurrency=args.concurrency, only=args.only)
+    graph.print_report()
+    print_summary(results)
+
+
+async def benchmark(db, concurrency, only):
+    """Seed twice, fully serialized then at the configured concurrency, and compare wall time"""
+    timings = {}
+    for level in (1, concurrency):
+        print(f'\n🏁 Benchmark run with concurrency={level}...')
+        start = time.perf_counter()
+        await graph.run(db, concurrency=level, only=only)
+        timings[level] = time.perf_counter() - start
+        graph.print_report()
+
+    print('\n📈 Benchmark:')
+    print(f'   Serialized (1 RPC in flight): {timings[1]:.3f}s')
+    print(f'   Concurrency {concurrency:<17} {timings[concurrency]:.3f}s')
+    if timings[concurrency] > 0:
+        print(f'   Speedup:                      {timings[1] / timings[concurrency]:.1f}x')
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'maximum in-flight Firestore RPCs (default {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--only', nargs='+', metavar='JOB',
+                        help='run only these jobs (plus their dependencies)')
+    parser.add_argument('--list', action='store_true', help='list jobs and dependencies, then exit')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='seed twice (serialized, then concurrent) and compare wall time; emulator only')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.list:
+        for name, job in graph.jobs.items():
+            deps = f"  ← {', '.join(job.deps)}" if job.deps else ''
+            print(f'{name}{deps}')
+        return
+
+    if args.benchmark and not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        print("❌ --benchmark writes every collection twice; set FIRESTORE_EMULATOR_HOST first")
+        sys.exit(1)
+
+    print("🚀 Bootstrapping Oil Manager environment...")
+    asyncio.run(bootstrap(args))
+    print("\n✅ Environment bootstrap complete!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,598 @@
+#!/usr/bin/env python3
+"""
+Change-data-capture bus for Oil Manager workers
+Opens one Firestore snapshot listener per watched collection and publishes ordered
+change events to a bounded in-process log. Consumers read it at their own offset, in
+the same process or over a local Unix socket, so adding a consumer costs no
+extra Firestore reads. A slow consumer applies backpressure to the listeners instead of
+letting the log grow without bound
+"""
+
+import argparse
+import itertools
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+from firestore_metrics import add_metrics_args, label_pairs
+from maintenance_runtime import from_json_value, sync_client, to_json_value
+
+WATCHED_COLLECTIONS = ['workflow_instances', 'approval_requests', 'exceptions', 'sales_orders', 'pickup_requests']
+DEFAULT_STATE_PATH = 'change_bus.state.json'
+DEFAULT_SOCKET_PATH = 'change_bus.sock'
+DEFAULT_CAPACITY = 10000
+POLL_BATCH = 500
+SAVE_INTERVAL = 1.0
+
+
+def _aware(ts):
+    if ts is None:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+class ChangeEvent:
+    """One document change; seq is the bus-wide order, update_time the per-collection order
+
+    initial marks events from the first snapshot after the listener (re)connected, i.e.
+    documents that may have been seen before. REMOVED events carry data=None and the
+    snapshot read time as update_time.
+    """
+
+    __slots__ = ('seq', 'collection', 'doc_id', 'type', 'data', 'update_time', 'initial')
+
+    def __init__(self, collection, doc_id, type, data, update_time, initial=False, seq=None):
+        self.seq = seq
+        self.collection = collection
+        self.doc_id = doc_id
+        self.type = type
+        self.data = data
+        self.update_time = _aware(update_time)
+        self.initial = initial
+
+    def to_json(self):
+        return to_json_value({slot: getattr(self, slot) for slot in self.__slots__})
+
+    @classmethod
+    def from_json(cls, record, db=None):
+        return cls(**from_json_value(record, db))
+
+    def __repr__(self):
+        return f'<ChangeEvent #{self.seq} {self.type} {self.collection}/{self.doc_id}>'
+
+
+# ============================================================
+# SUBSCRIPTIONS
+# ============================================================
+
+class Subscription:
+    """A consumer's position in the bus log
+
+    Durable subscriptions (the default for named socket consumers) keep a per-collection
+    update_time watermark in the bus state file; after a restart they skip initial events
+    at or below it, so they resume where they left off instead of replaying everything.
+    """
+
+    def __init__(self, bus, name, collections=None, durable=False, offset=0):
+        self.bus = bus
+        self.name = name
+        self.collections = set(collections) if collections else None
+        self.durable = durable
+        self.offset = offset
+        self.delivered = 0
+        self.active = True
+
+    def wants(self, event):
+        if self.collections is not None and event.collection not in self.collections:
+            return False
+        if self.durable and event.initial and event.type != 'REMOVED':
+            watermark = self.bus.watermark(self.name, event.collection)
+            if watermark is not None and event.update_time <= watermark:
+                return False
+        return True
+
+    def poll(self, max_events=POLL_BATCH, timeout=None):
+        """Next events for this consumer (possibly empty on timeout); advances the offset"""
+        return self.bus._read(self, max_events, timeout)
+
+    def commit(self, events):
+        """Record processed events; durable consumers advance their watermarks"""
+        self.delivered += len(events)
+        if self.durable:
+            self.bus._commit(self.name, events)
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    @property
+    def lag(self):
+        return self.bus.next_seq - self.offset
+
+
+class Feed:
+    """A consumer thread: polls a subscription (or a socket) and hands each event to handler
+
+    Shaped like a Firestore Watch (is_active, unsubscribe()), so a worker can swap its
+    own snapshot listener for a bus feed without changing its run loop.
+    """
+
+    def __init__(self, name, handler, events):
+        self.name = name
+        self.handler = handler
+        self._events = events
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'change-feed-{name}', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for batch, commit in self._events(self._stop):
+            for event in batch:
+                try:
+                    self.handler(event)
+                except Exception as e:
+                    print(f"⚠️  Consumer {self.name} failed on {event!r}: {e}")
+            commit(batch)
+
+    @property
+    def is_active(self):
+        return self._thread.is_alive()
+
+    def unsubscribe(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+
+# ============================================================
+# BUS
+# ============================================================
+
+class ChangeBus:
+    """One listener per collection, fanned out to any number of consumers
+
+    Events are appended under a condition variable with a global sequence number;
+    within one snapshot they are ordered by document update time. The log keeps
+    at most capacity events: once full, publishing waits until the slowest
+    subscription has read past the oldest event, which blocks the listener thread
+    and lets Firestore hold the backlog.
+    """
+
+    def __init__(self, db, collections=WATCHED_COLLECTIONS, state_path=DEFAULT_STATE_PATH,
+                 capacity=DEFAULT_CAPACITY):
+        self.db = db
+        self.collections = list(collections)
+        self.state_path = state_path
+        self.capacity = capacity
+        self._cond = threading.Condition()
+        self.log = deque()
+        self.next_seq = 0
+        self.subscriptions = []
+        self.versions = defaultdict(dict)
+        self.synced = set()
+        self.watches = {}
+        self.counts = defaultdict(int)
+        self.published = defaultdict(int)
+        self._closed = False
+        self._dirty = False
+
+        state = {}
+        if state_path and os.path.exists(state_path):
+            with open(state_path, encoding='utf-8') as fh:
+                state = from_json_value(json.load(fh))
+        self.known = {c: set(state.get('collections', {}).get(c, ())) for c in self.collections}
+        self.watermarks = defaultdict(dict, state.get('consumers', {}))
+
+        metrics = getattr(db, 'metrics', None)
+        if metrics is not None:
+            metrics.add_collector(self.collect)
+
+    # ==================== LISTENERS ====================
+
+    def start(self):
+        for collection in self.collections:
+            self._listen(collection)
+        return self
+
+    def _listen(self, collection):
+        self.synced.discard(collection)
+        callback = lambda docs, changes, read_time: self._on_snapshot(collection, docs, changes, read_time)
+        self.watches[collection] = self.db.collection(collection).on_snapshot(callback)
+
+    def _on_snapshot(self, collection, docs, changes, read_time):
+        initial = collection not in self.synced
+        versions = self.versions[collection]
+        events = []
+        for change in changes:
+            snap = change.document
+            kind = change.type.name
+            if kind == 'REMOVED':
+                versions.pop(snap.id, None)
+                events.append(ChangeEvent(collection, snap.id, kind, None, read_time, initial))
+                continue
+            # After a reconnect the listener re-sends every document; skip the ones already published
+            if initial and versions.get(snap.id) == snap.update_time:
+                continue
+            versions[snap.id] = snap.update_time
+            events.append(ChangeEvent(collection, snap.id, kind, snap.to_dict(), snap.update_time, initial))
+        if initial:
+            # Documents deleted while nothing was listening never show up as REMOVED changes
+            with self._cond:
+                missing = self.known[collection] - {doc.id for doc in docs}
+            for doc_id in missing:
+                versions.pop(doc_id, None)
+                events.append(ChangeEvent(collection, doc_id, 'REMOVED', None, read_time, initial))
+            self.synced.add(collection)
+        # save() snapshots known and _dirty from the main thread
+        with self._cond:
+            self.known[collection] = set(versions)
+            self._dirty = True
+        events.sort(key=lambda e: (e.update_time or _aware(read_time), e.doc_id))
+        self.publish(events)
+
+    def check_listeners(self):
+        """Re-open listeners that have stopped; returns the collections restarted"""
+        restarted = [c for c, watch in self.watches.items() if not watch.is_active]
+        for collection in restarted:
+            self.counts['listener restarts'] += 1
+            self._listen(collection)
+        return restarted
+
+    # ==================== LOG ====================
+
+    def publish(self, events):
+        with self._cond:
+            for event in events:
+                while len(self.log) >= self.capacity and not self._closed:
+                    self._trim()
+                    if len(self.log) < self.capacity:
+                        break
+                    self.counts['backpressure waits'] += 1
+                    self._cond.wait(0.5)
+                event.seq = self.next_seq
+                self.next_seq += 1
+                self.log.append(event)
+                self.published[event.collection] += 1
+            self._cond.notify_all()
+
+    def _trim(self):
+        floor = min((s.offset for s in self.subscriptions), default=self.next_seq)
+        while self.log and self.log[0].seq < floor:
+            self.log.popleft()
+
+    def subscribe(self, name, collections=None, durable=False, from_start=True):
+        """New subscription at the oldest retained event (or at the end with from_start=False)"""
+        with self._cond:
+            offset = self.log[0].seq if (from_start and self.log) else self.next_seq
+            sub = Subscription(self, name, collections, durable, offset)
+            self.subscriptions.append(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._cond:
+            sub.active = False
+            if sub in self.subscriptions:
+                self.subscriptions.remove(sub)
+            self._trim()
+            self._cond.notify_all()
+
+    def _read(self, sub, max_events, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while sub.active and not self._closed:
+                start = sub.offset - self.log[0].seq if self.log else 0
+                if start < len(self.log):
+                    batch = list(itertools.islice(self.log, max(start, 0), max(start, 0) + max_events))
+                    sub.offset = batch[-1].seq + 1
+                    self._trim()
+                    self._cond.notify_all()
+                    return [event for event in batch if sub.wants(event)]
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return []
+
+    def consume(self, name, handler, collections=None, durable=False):
+        """Run handler(event) for every matching event on a background thread; returns the Feed"""
+        sub = self.subscribe(name, collections, durable)
+
+        def events(stop):
+            try:
+                while not stop.is_set() and sub.active:
+                    batch = sub.poll(timeout=0.5)
+                    yield batch, sub.commit
+            finally:
+                sub.close()
+        return Feed(name, handler, events)
+
+    # ==================== STATE ====================
+
+    def watermark(self, consumer, collection):
+        value = self.watermarks.get(consumer, {}).get(collection)
+        return _aware(value) if isinstance(value, datetime) else None
+
+    def _commit(self, consumer, events):
+        with self._cond:
+            marks = self.watermarks[consumer]
+            for event in events:
+                if event.type != 'REMOVED' and (marks.get(event.collection) is None
+                                                or event.update_time > marks[event.collection]):
+                    marks[event.collection] = event.update_time
+                    self._dirty = True
+
+    def save(self):
+        """Atomically persist known document IDs and consumer watermarks, if they changed"""
+        if not self.state_path:
+            return
+        with self._cond:
+            if not self._dirty:
+                return
+            self._dirty = False
+            state = {
+                'collections': {c: sorted(ids) for c, ids in self.known.items()},
+                'consumers': {name: dict(marks) for name, marks in self.watermarks.items()},
+            }
+        tmp = f'{self.state_path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(to_json_value(state), fh, separators=(',', ':'))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.state_path)
+
+    def close(self):
+        for watch in self.watches.values():
+            watch.unsubscribe()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.save()
+        metrics = getattr(self.db, 'metrics', None)
+        if metrics is not None:
+            metrics.remove_collector(self.collect)
+
+    # ==================== REPORTING ====================
+
+    def stats(self):
+        with self._cond:
+            return {
+                'depth': len(self.log),
+                'published': dict(self.published),
+                'consumers': {s.name: {'lag': s.lag, 'delivered': s.delivered} for s in self.subscriptions},
+                'backpressure_waits': self.counts['backpressure waits'],
+                'listener_restarts': self.counts['listener restarts'],
+            }
+
+    def collect(self, openmetrics=False):
+        """Exposition lines for FirestoreMetrics.add_collector()"""
+        stats = self.stats()
+        job = getattr(getattr(self.db, 'metrics', None), 'job', 'oil_manager')
+        counter = '' if openmetrics else '_total'
+        lines = [
+            '# HELP change_bus_depth Change events retained in the bus log',
+            '# TYPE change_bus_depth gauge',
+            f"change_bus_depth{{{label_pairs(job=job)}}} {stats['depth']}",
+            f'# HELP change_bus_events{counter} Change events published per collection',
+            f'# TYPE change_bus_events{counter} counter',
+        ]
+        for collection, count in sorted(stats['published'].items()):
+            lines.append(f"change_bus_events_total{{{label_pairs(job=job, collection=collection)}}} {count}")
+        lines.append('# HELP change_bus_consumer_lag Events published but not yet read by a consumer')
+        lines.append('# TYPE change_bus_consumer_lag gauge')
+        for name, consumer in sorted(stats['consumers'].items()):
+            lines.append(f"change_bus_consumer_lag{{{label_pairs(job=job, consumer=name)}}} {consumer['lag']}")
+        for name, help_text in (('backpressure_waits', 'Times a listener waited for slow consumers'),
+                                ('listener_restarts', 'Snapshot listeners re-opened after closing')):
+            lines.append(f'# HELP change_bus_{name}{counter} {help_text}')
+            lines.append(f'# TYPE change_bus_{name}{counter} counter')
+            lines.append(f"change_bus_{name}_total{{{label_pairs(job=job)}}} {stats[name]}")
+        return lines
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"\n📊 Change bus: {sum(stats['published'].values())} events, {stats['depth']} retained, "
+              f"{stats['backpressure_waits']} backpressure waits, {stats['listener_restarts']} listener restarts")
+        for collection, count in sorted(stats['published'].items()):
+            print(f"   • {collection:<20} {count}")
+        for name, consumer in sorted(stats['consumers'].items()):
+            print(f"   → {name:<20} delivered {consumer['delivered']}, lag {consumer['lag']}")
+
+
+# ============================================================
+# LOCAL SOCKET
+# ============================================================
+
+class _SocketHandler(socketserver.StreamRequestHandler):
+    """One socket consumer: a JSON hello line in, JSON event lines out, {"ack": seq} lines in
+
+    Events are committed (durable watermarks advance) only when the consumer acknowledges
+    them, so a consumer that dies mid-batch gets the unacknowledged events again after a restart.
+    """
+
+    def handle(self):
+        hello = json.loads(self.rfile.readline() or b'{}')
+        bus = self.server.bus
+        sub = bus.subscribe(hello.get('consumer', 'socket'), hello.get('collections'),
+                            durable=hello.get('durable', True), from_start=hello.get('from_start', True))
+        unacked = deque()
+        lock = threading.Lock()
+        reader = threading.Thread(target=self._read_acks, args=(sub, unacked, lock),
+                                  name=f'change-bus-acks-{sub.name}', daemon=True)
+        reader.start()
+        try:
+            while sub.active:
+                events = sub.poll(timeout=1.0)
+                if events:
+                    with lock:
+                        unacked.extend(events)
+                    # sendall blocks while the reader is behind, which holds back this subscription's offset
+                    self.wfile.write(b''.join(json.dumps(e.to_json(), separators=(',', ':')).encode() + b'\n'
+                                              for e in events))
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            sub.close()
+
+    def _read_acks(self, sub, unacked, lock):
+        """Commit sent events up to each acknowledged seq; closes the subscription when the consumer hangs up"""
+        try:
+            for line in self.rfile:
+                try:
+                    seq = json.loads(line).get('ack')
+                except (json.JSONDecodeError, AttributeError):
+                    continue
+                if not isinstance(seq, int):
+                    continue
+                with lock:
+                    done = []
+                    while unacked and unacked[0].seq <= seq:
+                        done.append(unacked.popleft())
+                if done:
+                    sub.commit(done)
+        except (OSError, ValueError):
+            pass
+        finally:
+            sub.close()
+
+
+class _SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_socket(bus, path=DEFAULT_SOCKET_PATH):
+    """Serve bus events on a Unix socket in a background thread; returns the server"""
+    if os.path.exists(path):
+        os.unlink(path)
+    server = _SocketServer(path, _SocketHandler)
+    server.bus = bus
+    threading.Thread(target=server.serve_forever, name='change-bus-socket', daemon=True).start()
+    return server
+
+
+class BusClient:
+    """Consumer end of a bus daemon's socket: events in, acknowledgements out"""
+
+    def __init__(self, path, consumer, collections=None, durable=True):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.sock.settimeout(1.0)
+        hello = {'consumer': consumer, 'collections': collections, 'durable': durable}
+        self.sock.sendall(json.dumps(hello).encode() + b'\n')
+
+    def events(self, stop=None):
+        """Yield ChangeEvents until the daemon hangs up or stop is set"""
+        buffer = b''
+        while stop is None or not stop.is_set():
+            try:
+                chunk = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            if not chunk:
+                return
+            buffer += chunk
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                yield ChangeEvent.from_json(json.loads(line))
+
+    def ack(self, events):
+        """Acknowledge events as processed; the daemon commits everything up to the last one"""
+        if events:
+            self.sock.sendall(json.dumps({'ack': events[-1].seq}).encode() + b'\n')
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def tail(path, consumer, collections=None, durable=True, stop=None):
+    """Yield ChangeEvents from a running bus daemon's socket, acknowledging each once the caller asks for the next"""
+    with BusClient(path, consumer, collections, durable) as client:
+        for event in client.events(stop):
+            yield event
+            client.ack([event])
+
+
+def connect(bus, name, handler, collections=None, durable=False):
+    """Feed events to handler from an in-process ChangeBus or from a bus socket path"""
+    if isinstance(bus, ChangeBus):
+        return bus.consume(name, handler, collections, durable)
+
+    def events(stop):
+        with BusClient(bus, name, collections, durable) as client:
+            for event in client.events(stop):
+                yield [event], client.ack
+    return Feed(name, handler, events)
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--collections', nargs='+', default=WATCHED_COLLECTIONS, metavar='COLLECTION',
+                        help='collections to listen to (default: workflow, approval, exception, order, pickup)')
+    parser.add_argument('--state', default=DEFAULT_STATE_PATH, help=f'state file (default {DEFAULT_STATE_PATH})')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help=f'Unix socket to serve (default {DEFAULT_SOCKET_PATH})')
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY,
+                        help=f'events retained before listeners are held back (default {DEFAULT_CAPACITY})')
+    parser.add_argument('--inbox', action='store_true', help='run the approval inbox fan-out as an in-process consumer')
+    parser.add_argument('--duration', type=float, metavar='SECONDS', help='stop after SECONDS')
+    parser.add_argument('--tail', metavar='CONSUMER', help='print events from a running daemon as CONSUMER, then exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.tail:
+        try:
+            for event in tail(args.socket, args.tail, None if args.collections == WATCHED_COLLECTIONS else args.collections):
+                print(f"#{event.seq:<8} {event.type:<8} {event.collection}/{event.doc_id}"
+                      f"{' (initial)' if event.initial else ''}")
+        except KeyboardInterrupt:
+            pass
+        return
+
+    print("🚌 Oil Manager change-data-capture bus")
+    db = sync_client(args=args)
+    bus = ChangeBus(db, args.collections, args.state, args.capacity)
+    fanout = feed = None
+    if args.inbox:
+        from approval_inbox_fanout import InboxFanout
+        # Subscribed before the listeners start, so the feed sees the full initial snapshot
+        fanout = InboxFanout(db)
+        feed = fanout.attach(bus)
+        fanout.reconcile()
+    bus.start()
+    server = serve_socket(bus, args.socket)
+    print(f"👂 Listening to {', '.join(args.collections)}; consumers connect on {args.socket}")
+
+    started = time.time()
+    try:
+        while args.duration is None or time.time() - started < args.duration:
+            time.sleep(SAVE_INTERVAL)
+            for collection in bus.check_listeners():
+                print(f"⚠️  Listener on {collection} closed, re-opened")
+            if fanout is not None:
+                fanout.flush()
+            bus.save()
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping change bus")
+    finally:
+        server.shutdown()
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        bus.close()
+        if fanout is not None:
+            feed.unsubscribe()
+            fanout.flush()
+        bus.print_stats()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Shared in-process config cache for Oil Manager Python workers
+Loads the config_* collections once at startup, keeps them fresh with snapshot
+listeners (falling back to TTL re-reads when a listener is down) and serves
+typed lookups such as get_setting('SLA_DEFAULT_HOURS') and incentive_for(zone, customerType)
+"""
+
+import argparse
+import bisect
+import threading
+import time
+
+from firestore_metrics import add_metrics_args, label_pairs
+
+DEFAULT_TTL = 300
+INITIAL_SNAPSHOT_TIMEOUT = 10.0
+
+CONFIG_COLLECTIONS = (
+    'config_system_settings',
+    'config_uco_grades',
+    'config_uco_buyback_rates',
+    'config_uco_incentives',
+    'config_delivery_slots',
+    'config_order_statuses',
+    'config_reasons',
+    'config_routing_rules',
+    'config_notification_templates',
+    'config_payment_methods',
+    'config_price_lists',
+    'config_price_list_items',
+    'config_products',
+    'config_fulfillment_settings',
+    'config_workflow_templates',
+    'config_status_sequences',
+)
+
+# System settings store their value in one of three typed fields (see create_system_settings())
+SETTING_VALUE_FIELDS = ('valueNumber', 'valueString', 'valueBool')
+
+
+def setting_value(data):
+    """Typed value of a config_system_settings document, or None if no value field is set"""
+    for field in SETTING_VALUE_FIELDS:
+        if data.get(field) is not None:
+            return data[field]
+    return None
+
+
+# ============================================================
+# DERIVED INDEXES
+# Rebuilt whenever a collection changes so lookups stay O(1) / O(log n)
+# ============================================================
+
+def _index_settings(docs):
+    return {data.get('key') or doc_id: data for doc_id, data in docs.items()}
+
+
+def _index_incentives(docs):
+    index = {}
+    for data in docs.values():
+        if data.get('isActive', True):
+            index.setdefault((data.get('zone'), data.get('customerType')), []).append(data)
+    for tiers in index.values():
+        # Highest minQty first, so the first tier the quantity reaches is the best one
+        tiers.sort(key=lambda d: d.get('minQty') or 0, reverse=True)
+    return index
+
+
+def _index_grades(docs):
+    grades = [dict(data, id=doc_id) for doc_id, data in docs.items() if data.get('isActive', True)]
+    return sorted(grades, key=lambda d: d.get('minQualityScore') or 0)
+
+
+INDEXERS = {
+    'config_system_settings': _index_settings,
+    'config_uco_incentives': _index_incentives,
+    'config_uco_grades': _index_grades,
+}
+
+
+class CachedCollection:
+    """Documents of one config collection plus freshness bookkeeping"""
+
+    def __init__(self, name):
+        self.name = name
+        self.docs = None
+        self.index = None
+        self.synced_at = None
+        self.watch = None
+        self.first_snapshot = threading.Event()
+        self.lookups = {'hit': 0, 'miss': 0, 'stale': 0}
+        self.refreshes = {'load': 0, 'listener': 0, 'ttl': 0}
+
+    @property
+    def listening(self):
+        return self.watch is not None and self.watch.is_active
+
+    def staleness(self, now=None):
+        """Seconds the cached data may lag Firestore: 0 while a listener is live"""
+        if self.synced_at is None:
+            return float('inf')
+        if self.listening:
+            return 0.0
+        return (now or time.time()) - self.synced_at
+
+
+class ConfigCache:
+    """Read-through cache over the config_* collections
+
+    Pass a synchronous client (snapshot listeners are not available on the AsyncClient);
+    lookups never touch Firestore while a collection's listener is live, so async workers
+    can call them directly from the event loop. Returned documents are shared, not copied:
+    treat them as read-only. on_change(collection) is called after every reload, from the
+    listener thread when a snapshot arrives, so consumers can drop anything derived from it.
+    """
+
+    def __init__(self, db, collections=CONFIG_COLLECTIONS, ttl=DEFAULT_TTL, listen=True, on_change=None):
+        self.db = db
+        self.ttl = ttl
+        self.listen = listen
+        self.on_change = on_change
+        self._lock = threading.RLock()
+        self._entries = {name: CachedCollection(name) for name in collections}
+        metrics = getattr(db, 'metrics', None)
+        if metrics is not None:
+            metrics.add_collector(self.collect)
+
+    # ==================== LOADING ====================
+
+    def load(self):
+        """Populate every collection in bulk
+
+        With listeners on, the initial snapshot of each listener is the bulk load (all
+        collections in parallel, each document billed once); collections whose snapshot
+        does not arrive in time, or all of them with listen=False, are read with one query each.
+        """
+        if self.listen:
+            for entry in self._entries.values():
+                self._start_listener(entry)
+            deadline = time.time() + INITIAL_SNAPSHOT_TIMEOUT
+            for entry in self._entries.values():
+                entry.first_snapshot.wait(max(0.0, deadline - time.time()))
+        for entry in self._entries.values():
+            if entry.docs is None:
+                self._query(entry, 'load')
+        return self
+
+    def close(self):
+        for entry in self._entries.values():
+            if entry.watch is not None:
+                entry.watch.unsubscribe()
+                entry.watch = None
+        metrics = getattr(self.db, 'metrics', None)
+        if metrics is not None:
+            metrics.remove_collector(self.collect)
+
+    def refresh(self, name=None):
+        """Force a re-read of one collection (or all of them)"""
+        for entry in ([self._entries[name]] if name else self._entries.values()):
+            self._query(entry, 'load')
+
+    def _start_listener(self, entry):
+        def on_snapshot(snapshots, changes, read_time):
+            self._apply(entry, {doc.id: doc.to_dict() for doc in snapshots}, 'listener')
+            entry.first_snapshot.set()
+
+        try:
+            entry.watch = self.db.collection(entry.name).on_snapshot(on_snapshot)
+        except Exception as e:
+            print(f"⚠️  Config listener for {entry.name} not started, using {self.ttl}s TTL: {e}")
+            entry.watch = None
+
+    def _query(self, entry, source):
+        docs = {doc.id: doc.to_dict() for doc in self.db.collection(entry.name).stream()}
+        self._apply(entry, docs, source)
+
+    def _apply(self, entry, docs, source):
+        index = INDEXERS[entry.name](docs) if entry.name in INDEXERS else None
+        with self._lock:
+            entry.docs = docs
+            entry.index = index
+            entry.synced_at = time.time()
+            entry.refreshes[source] += 1
+        if self.on_change is not None:
+            self.on_change(entry.name)
+
+    def _entry(self, name):
+        """Fresh cache entry for a collection, re-reading it first if it is cold or past its TTL"""
+        entry = self._entries.get(name)
+        if entry is None:
+            raise KeyError(f'{name} is not a cached config collection')
+        if entry.docs is None:
+            entry.lookups['miss'] += 1
+            self._query(entry, 'load')
+        elif entry.staleness() > self.ttl:
+            entry.lookups['miss'] += 1
+            try:
+                self._query(entry, 'ttl')
+                if self.listen and not entry.listening:
+                    self._start_listener(entry)
+            except Exception as e:
+                # Serve what we have rather than fail the worker; staleness keeps growing
+                entry.lookups['stale'] += 1
+                print(f"⚠️  Config refresh failed for {name}, serving cached copy: {e}")
+        else:
+            entry.lookups['hit'] += 1
+        return entry
+
+    # ==================== LOOKUPS ====================
+
+    def documents(self, name):
+        """All documents of a config collection as {doc_id: data}"""
+        return self._entry(name).docs
+
+    def get(self, name, doc_id, default=None):
+        return self._entry(name).docs.get(doc_id, default)
+
+    def get_setting(self, key, default=None):
+        """Value of a system setting from whichever of valueNumber/valueString/valueBool is set"""
+        data = self._entry('config_system_settings').index.get(key)
+        if data is None:
+            return default
+        value = setting_value(data)
+        return default if value is None else value
+
+    def settings(self, category=None):
+        """All system settings as {key: value}, optionally for one category"""
+        index = self._entry('config_system_settings').index
+        return {key: setting_value(data) for key, data in index.items()
+                if category is None or data.get('category') == category}
+
+    def incentive_for(self, zone, customer_type, quantity=None):
+        """Active UCO incentive for a zone and customer type
+
+        With a quantity, returns the highest tier whose minQty it reaches (None below the
+        lowest tier), matching AdvancedConfigService.getIncentiveForZone in the app;
+        without one, the entry-level (lowest minQty) tier.
+        """
+        tiers = self._entry('config_uco_incentives').index.get((zone, customer_type), [])
+        if quantity is None:
+            return tiers[-1] if tiers else None
+        for tier in tiers:
+            if quantity >= (tier.get('minQty') or 0):
+                return tier
+        return None
+
+    def grades(self):
+        """Active UCO grades ordered by minQualityScore"""
+        return self._entry('config_uco_grades').index
+
+    def grade_for_score(self, score):
+        """Grade with the highest minQualityScore the score reaches; None below the lowest grade
+
+        Seeded ranges are whole numbers (60-79, 80-100), so a score like 79.5 falls in the
+        gap between maxQualityScore and the next minQualityScore and belongs to the lower grade.
+        """
+        grades = self.grades()
+        i = bisect.bisect_right([g.get('minQualityScore') or 0 for g in grades], score)
+        return grades[i - 1] if i else None
+
+    # ==================== METRICS ====================
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                name: {
+                    'documents': len(entry.docs or {}),
+                    'listening': entry.listening,
+                    'staleness': entry.staleness(now),
+                    'lookups': dict(entry.lookups),
+                    'refreshes': dict(entry.refreshes),
+                }
+                for name, entry in self._entries.items()
+            }
+
+    def collect(self, openmetrics=False):
+        """Exposition lines for FirestoreMetrics.add_collector()"""
+        stats = self.stats()
+        job = getattr(getattr(self.db, 'metrics', None), 'job', 'oil_manager')
+        lines = []
+
+        def counter(name, help_text, key, label):
+            family = name if openmetrics else f'{name}_total'
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} counter')
+            for collection, s in sorted(stats.items()):
+                for value, count in s[key].items():
+                    labels = label_pairs(job=job, collection=collection, **{label: value})
+                    lines.append(f'{name}_total{{{labels}}} {count}')
+
+        def gauge(name, help_text, value_of):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for collection, s in sorted(stats.items()):
+                lines.append(f'{name}{{{label_pairs(job=job, collection=collection)}}} {value_of(s)}')
+
+        counter('config_cache_lookups', 'Config cache lookups by result (hit, miss, stale)', 'lookups', 'result')
+        counter('config_cache_refreshes', 'Config collection reloads by source (load, listener, ttl)',
+                'refreshes', 'source')
+        gauge('config_cache_documents', 'Documents held for the collection', lambda s: s['documents'])
+        gauge('config_cache_staleness_seconds', 'Seconds the cached copy may lag Firestore (0 while listening)',
+              lambda s: s['staleness'] if s['staleness'] != float('inf') else '+Inf')
+        gauge('config_cache_listening', '1 while the snapshot listener is live', lambda s: int(s['listening']))
+        return lines
+
+    def print_stats(self):
+        print(f"\n🗄️  Config cache ({self.ttl}s TTL fallback):")
+        print(f"   {'collection':<32} {'docs':>5} {'live':>5} {'stale s':>8} {'hits':>7} {'misses':>7}")
+        for name, s in self.stats().items():
+            print(f"   {name:<32} {s['documents']:>5} {'yes' if s['listening'] else 'no':>5} "
+                  f"{s['staleness']:>8.1f} {s['lookups']['hit']:>7} {s['lookups']['miss']:>7}")
+
+
+# ============================================================
+# PROCESS-WIDE CACHE
+# ============================================================
+
+_cache = None
+
+
+def init_cache(db, **kwargs):
+    """Create and bulk-load the process-wide cache used by the module-level accessors"""
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = ConfigCache(db, **kwargs).load()
+    return _cache
+
+
+def default_cache():
+    if _cache is None:
+        raise RuntimeError('config cache not initialized: call init_cache(db) at worker startup')
+    return _cache
+
+
+def get_setting(key, default=None):
+    return default_cache().get_setting(key, default)
+
+
+def incentive_for(zone, customer_type, quantity=None):
+    return default_cache().incentive_for(zone, customer_type, quantity)
+
+
+def main():
+    """Load the cache and print what a worker would see"""
+    from maintenance_runtime import sync_client
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL, help=f'TTL fallback in seconds (default {DEFAULT_TTL})')
+    parser.add_argument('--no-listen', action='store_true', help='skip snapshot listeners and rely on the TTL alone')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help='keep listening for SECONDS and print the settings whenever they change')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    db = sync_client(args=args)
+    started = time.perf_counter()
+    cache = init_cache(db, ttl=args.ttl, listen=not args.no_listen)
+    print(f"✅ Config cache loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    print("\n⚙️  System settings:")
+    for key, value in sorted(cache.settings().items()):
+        print(f"   {key:<28} {value!r}")
+
+    print("\n♻️  UCO incentives:")
+    for (zone, customer_type), tiers in sorted(cache._entry('config_uco_incentives').index.items()):
+        for tier in tiers:
+            print(f"   {zone:<20} {customer_type:<4} ≥{tier.get('minQty', 0):>6} kg  "
+                  f"cash {tier.get('cashRatePerKg')}/kg  credit {tier.get('creditRatePerKg')}/kg")
+
+    if args.watch:
+        last = cache.settings()
+        deadline = time.time() + args.watch
+        while time.time() < deadline:
+            time.sleep(1)
+            current = cache.settings()
+            for key in sorted(set(current) | set(last)):
+                if current.get(key) != last.get(key):
+                    print(f"🔄 {key}: {last.get(key)!r} → {current.get(key)!r}")
+            last = current
+
+    cache.print_stats()
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
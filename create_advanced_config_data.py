@@ -4,26 +4,28 @@ Populate advanced configuration collections for Phase 5: Config-Driven System
 Creates 7 collections with comprehensive sample data
 """
 
-import firebase_admin
-from firebase_admin import credentials, firestore
 from datetime import datetime
 
-# Initialize Firebase
-try:
-    cred = credentials.Certificate('/opt/flutter/firebase-admin-sdk.json')
-    firebase_admin.initialize_app(cred)
-    print("✅ Firebase Admin SDK initialized")
-except Exception as e:
-    print(f"❌ Error: {e}")
-    exit(1)
+from firestore_metrics import parse_metrics_args
+from maintenance_runtime import initialize_firebase, sync_client
 
-db = firestore.client()
+db = None
 
-def create_system_settings():
-    """1. System Settings - Global configuration parameters"""
-    print("\n⚙️  Creating system settings...")
-    
-    settings = [
+def init_db():
+    """Initialize Firebase and the client used by the create_* functions"""
+    global db
+    args = parse_metrics_args(__doc__)
+    try:
+        initialize_firebase()
+        print("✅ Firebase Admin SDK initialized")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        exit(1)
+    db = sync_client(args=args)
+
+def system_setting_docs():
+    """System setting documents"""
+    return [
         {
             'key': 'MIN_PICKUP_QTY',
             'valueNumber': 20.0,
@@ -105,6 +107,12 @@ def create_system_settings():
             'updatedBy': 'admin_001'
         },
     ]
+
+def create_system_settings():
+    """1. System Settings - Global configuration parameters"""
+    print("\n⚙️  Creating system settings...")
+    
+    settings = system_setting_docs()
     
     for setting in settings:
         db.collection('config_system_settings').document(setting['key']).set(setting)
@@ -112,11 +120,9 @@ def create_system_settings():
     
     print(f"✅ Created {len(settings)} system settings")
 
-def create_workflow_templates():
-    """2. Workflow Templates - Versioned workflow definitions"""
-    print("\n📋 Creating workflow templates...")
-    
-    templates = [
+def workflow_template_docs():
+    """Versioned workflow template documents"""
+    return [
         # Sales Order Approval Workflow
         {
             'templateId': 'sales_order_std',
@@ -194,6 +200,12 @@ def create_workflow_templates():
             'updatedAt': datetime.now()
         },
     ]
+
+def create_workflow_templates():
+    """2. Workflow Templates - Versioned workflow definitions"""
+    print("\n📋 Creating workflow templates...")
+    
+    templates = workflow_template_docs()
     
     for template in templates:
         db.collection('config_workflow_templates').add(template)
@@ -201,11 +213,9 @@ def create_workflow_templates():
     
     print(f"✅ Created {len(templates)} workflow templates")
 
-def create_routing_rules():
-    """3. Routing Rules - Conditional routing"""
-    print("\n🔀 Creating routing rules...")
-    
-    rules = [
+def routing_rule_docs():
+    """Routing rule documents"""
+    return [
         {
             'ruleId': 'high_value_order',
             'domain': 'sales',
@@ -257,6 +267,12 @@ def create_routing_rules():
             'updatedAt': datetime.now()
         },
     ]
+
+def create_routing_rules():
+    """3. Routing Rules - Conditional routing"""
+    print("\n🔀 Creating routing rules...")
+    
+    rules = routing_rule_docs()
     
     for rule in rules:
         db.collection('config_routing_rules').add(rule)
@@ -264,11 +280,9 @@ def create_routing_rules():
     
     print(f"✅ Created {len(rules)} routing rules")
 
-def create_uco_incentives():
-    """4. UCO Incentives - Zone-based pricing"""
-    print("\n💰 Creating UCO incentives...")
-    
-    incentives = [
+def uco_incentive_docs():
+    """UCO incentive documents"""
+    return [
         {
             'zone': 'Bangkok Central',
             'customerType': 'B2B',
@@ -360,6 +374,12 @@ def create_uco_incentives():
             'updatedAt': datetime.now()
         },
     ]
+
+def create_uco_incentives():
+    """4. UCO Incentives - Zone-based pricing"""
+    print("\n💰 Creating UCO incentives...")
+    
+    incentives = uco_incentive_docs()
     
     for incentive in incentives:
         db.collection('config_uco_incentives').add(incentive)
@@ -367,11 +387,9 @@ def create_uco_incentives():
     
     print(f"✅ Created {len(incentives)} UCO incentives")
 
-def create_delivery_slots():
-    """5. Delivery Slots - Zone-based capacity"""
-    print("\n🚚 Creating delivery slots...")
-    
-    slots = [
+def delivery_slot_docs():
+    """Delivery slot documents"""
+    return [
         # Bangkok Central
         {'zone': 'Bangkok Central', 'maxCapacity': 20, 'timeWindowStart': '08:00', 'timeWindowEnd': '12:00', 'isActive': True, 'bufferMinutes': 30, 'updatedAt': datetime.now()},
         {'zone': 'Bangkok Central', 'maxCapacity': 25, 'timeWindowStart': '13:00', 'timeWindowEnd': '17:00', 'isActive': True, 'bufferMinutes': 30, 'updatedAt': datetime.now()},
@@ -385,6 +403,12 @@ def create_delivery_slots():
         {'zone': 'Provinces', 'maxCapacity': 10, 'timeWindowStart': '09:00', 'timeWindowEnd': '13:00', 'isActive': True, 'bufferMinutes': 60, 'updatedAt': datetime.now()},
         {'zone': 'Provinces', 'maxCapacity': 12, 'timeWindowStart': '14:00', 'timeWindowEnd': '18:00', 'isActive': True, 'bufferMinutes': 60, 'updatedAt': datetime.now()},
     ]
+
+def create_delivery_slots():
+    """5. Delivery Slots - Zone-based capacity"""
+    print("\n🚚 Creating delivery slots...")
+    
+    slots = delivery_slot_docs()
     
     for slot in slots:
         db.collection('config_delivery_slots').add(slot)
@@ -392,11 +416,9 @@ def create_delivery_slots():
     
     print(f"✅ Created {len(slots)} delivery slots")
 
-def create_notification_templates():
-    """6. Notification Templates - Multi-channel templates"""
-    print("\n📧 Creating notification templates...")
-    
-    templates = [
+def notification_template_docs():
+    """Notification template documents"""
+    return [
         {
             'templateKey': 'approval_pending',
             'channel': 'email',
@@ -438,6 +460,12 @@ def create_notification_templates():
             'updatedAt': datetime.now()
         },
     ]
+
+def create_notification_templates():
+    """6. Notification Templates - Multi-channel templates"""
+    print("\n📧 Creating notification templates...")
+    
+    templates = notification_template_docs()
     
     for template in templates:
         db.collection('config_notification_templates').add(template)
@@ -445,11 +473,9 @@ def create_notification_templates():
     
     print(f"✅ Created {len(templates)} notification templates")
 
-def create_status_sequences():
-    """7. Status Sequences - Domain-specific status flows"""
-    print("\n📊 Creating status sequences...")
-    
-    sequences = [
+def status_sequence_docs():
+    """Status sequence documents"""
+    return [
         {
             'domain': 'sales_order',
             'statuses': ['pending', 'confirmed', 'preparing', 'in_transit', 'delivered', 'completed'],
@@ -472,6 +498,12 @@ def create_status_sequences():
             'updatedAt': datetime.now()
         },
     ]
+
+def create_status_sequences():
+    """7. Status Sequences - Domain-specific status flows"""
+    print("\n📊 Creating status sequences...")
+    
+    sequences = status_sequence_docs()
     
     for sequence in sequences:
         db.collection('config_status_sequences').add(sequence)
@@ -481,6 +513,7 @@ def create_status_sequences():
 
 def main():
     """Main execution"""
+    init_db()
     print("=" * 70)
     print("🚀 PHASE 5: Advanced Configuration System - Data Population")
     print("=" * 70)
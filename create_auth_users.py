@@ -14,12 +14,16 @@ except ImportError as e:
     print(f"❌ Failed to import firebase-admin: {e}")
     sys.exit(1)
 
+from firestore_metrics import instrument, parse_metrics_args
+
+args = parse_metrics_args(__doc__)
+
 # Initialize Firebase
 if not firebase_admin._apps:
     cred = credentials.Certificate("/opt/flutter/firebase-admin-sdk.json")
     firebase_admin.initialize_app(cred)
 
-db = firestore.client()
+db = instrument(firestore.client(), args=args)
 
 # Test users to create
 test_users = [
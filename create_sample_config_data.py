@@ -9,27 +9,20 @@ import os
 
 try:
     import firebase_admin
-    from firebase_admin import credentials, firestore
+    from firebase_admin import firestore
     print("✅ firebase-admin imported successfully\n")
 except ImportError as e:
     print(f"❌ Failed to import firebase-admin: {e}")
     sys.exit(1)
 
-# Initialize Firebase
-if not firebase_admin._apps:
-    cred = credentials.Certificate("/opt/flutter/firebase-admin-sdk.json")
-    firebase_admin.initialize_app(cred)
+from firestore_metrics import parse_metrics_args
+from maintenance_runtime import initialize_firebase, sync_client
 
-db = firestore.client()
-
-print("🔧 Creating Sample Configuration Data")
-print("=" * 60)
+db = None
 
 # ============================================================
 # PRODUCTS
 # ============================================================
-print("\n📦 Creating Products...")
-
 products = [
     {
         "sku": "OIL-PREM-5L",
@@ -84,15 +77,19 @@ products = [
     },
 ]
 
-for product in products:
-    db.collection("config_products").add(product)
-    print(f"  ✓ Created: {product['name']} ({product['sku']})")
+def create_products():
+    """Create config products and return a sku → document ID map"""
+    print("\n📦 Creating Products...")
+    product_map = {}
+    for product in products:
+        doc_ref = db.collection("config_products").add(product)
+        product_map[product['sku']] = doc_ref[1].id
+        print(f"  ✓ Created: {product['name']} ({product['sku']})")
+    return product_map
 
 # ============================================================
 # UCO GRADES
 # ============================================================
-print("\n♻️  Creating UCO Grades...")
-
 uco_grades = [
     {
         "gradeCode": "A",
@@ -126,55 +123,60 @@ uco_grades = [
     },
 ]
 
-for grade in uco_grades:
-    db.collection("config_uco_grades").add(grade)
-    print(f"  ✓ Created: {grade['gradeName']} ({grade['gradeCode']})")
+def create_uco_grades():
+    """Create UCO grades and return a gradeCode → document ID map"""
+    print("\n♻️  Creating UCO Grades...")
+    grade_map = {}
+    for grade in uco_grades:
+        doc_ref = db.collection("config_uco_grades").add(grade)
+        grade_map[grade['gradeCode']] = doc_ref[1].id
+        print(f"  ✓ Created: {grade['gradeName']} ({grade['gradeCode']})")
+    return grade_map
 
 # ============================================================
 # UCO BUYBACK RATES
 # ============================================================
-print("\n💰 Creating UCO Buyback Rates...")
-
-# Get grade IDs first
-grades_snapshot = db.collection("config_uco_grades").get()
-grade_map = {doc.to_dict()['gradeCode']: doc.id for doc in grades_snapshot}
-
-buyback_rates = [
-    {
-        "gradeId": grade_map.get("A", ""),
-        "ratePerKg": 2.50,
-        "currency": "USD",
-        "validFrom": firestore.SERVER_TIMESTAMP,
-        "isActive": True,
-        "createdAt": firestore.SERVER_TIMESTAMP,
-    },
-    {
-        "gradeId": grade_map.get("B", ""),
-        "ratePerKg": 2.00,
-        "currency": "USD",
-        "validFrom": firestore.SERVER_TIMESTAMP,
-        "isActive": True,
-        "createdAt": firestore.SERVER_TIMESTAMP,
-    },
-    {
-        "gradeId": grade_map.get("C", ""),
-        "ratePerKg": 1.50,
-        "currency": "USD",
-        "validFrom": firestore.SERVER_TIMESTAMP,
-        "isActive": True,
-        "createdAt": firestore.SERVER_TIMESTAMP,
-    },
-]
+def buyback_rate_docs(grade_map):
+    """Buyback rates per grade; gradeId comes from the grades created first"""
+    return [
+        {
+            "gradeId": grade_map.get("A", ""),
+            "ratePerKg": 2.50,
+            "currency": "USD",
+            "validFrom": firestore.SERVER_TIMESTAMP,
+            "isActive": True,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+        },
+        {
+            "gradeId": grade_map.get("B", ""),
+            "ratePerKg": 2.00,
+            "currency": "USD",
+            "validFrom": firestore.SERVER_TIMESTAMP,
+            "isActive": True,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+        },
+        {
+            "gradeId": grade_map.get("C", ""),
+            "ratePerKg": 1.50,
+            "currency": "USD",
+            "validFrom": firestore.SERVER_TIMESTAMP,
+            "isActive": True,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+        },
+    ]
 
-for rate in buyback_rates:
-    db.collection("config_uco_buyback_rates").add(rate)
-    print(f"  ✓ Created: ${rate['ratePerKg']}/kg for grade {rate['gradeId'][:8]}...")
+def create_buyback_rates(grade_map):
+    """Create UCO buyback rates"""
+    print("\n💰 Creating UCO Buyback Rates...")
+    buyback_rates = buyback_rate_docs(grade_map)
+    for rate in buyback_rates:
+        db.collection("config_uco_buyback_rates").add(rate)
+        print(f"  ✓ Created: ${rate['ratePerKg']}/kg for grade {rate['gradeId'][:8]}...")
+    return buyback_rates
 
 # ============================================================
 # PAYMENT METHODS
 # ============================================================
-print("\n💳 Creating Payment Methods...")
-
 payment_methods = [
     {
         "code": "COD",
@@ -208,15 +210,17 @@ payment_methods = [
     },
 ]
 
-for method in payment_methods:
-    db.collection("config_payment_methods").add(method)
-    print(f"  ✓ Created: {method['name']} ({method['code']})")
+def create_payment_methods():
+    """Create payment methods"""
+    print("\n💳 Creating Payment Methods...")
+    for method in payment_methods:
+        db.collection("config_payment_methods").add(method)
+        print(f"  ✓ Created: {method['name']} ({method['code']})")
+    return payment_methods
 
 # ============================================================
 # ORDER STATUSES
 # ============================================================
-print("\n📊 Creating Order Statuses...")
-
 order_statuses = [
     # Sales Order Statuses
     {"type": "sales", "code": "PENDING", "name": "Pending", "description": "Order received, awaiting confirmation", "sequence": 1, "isTerminal": False, "color": "#FFA500", "isActive": True, "createdAt": firestore.SERVER_TIMESTAMP},
@@ -240,21 +244,26 @@ order_statuses = [
     {"type": "return", "code": "REFUNDED", "name": "Refunded", "description": "Refund processed", "sequence": 4, "isTerminal": True, "color": "#4CAF50", "isActive": True, "createdAt": firestore.SERVER_TIMESTAMP},
 ]
 
-for status in order_statuses:
-    db.collection("config_order_statuses").add(status)
-    print(f"  ✓ Created: {status['type'].upper()} - {status['name']}")
+def create_order_statuses():
+    """Create order statuses"""
+    print("\n📊 Creating Order Statuses...")
+    for status in order_statuses:
+        db.collection("config_order_statuses").add(status)
+        print(f"  ✓ Created: {status['type'].upper()} - {status['name']}")
+    return order_statuses
 
 # ============================================================
 # REASONS
 # ============================================================
-print("\n📝 Creating Reason Codes...")
-
 reasons = [
     # Cancel Reasons
     {"type": "cancel", "code": "CHANGE_MIND", "name": "Changed My Mind", "description": "Customer changed mind about order", "requiresEvidence": False, "requiresComment": False, "displayOrder": 1, "isActive": True, "createdAt": firestore.SERVER_TIMESTAMP},
     {"type": "cancel", "code": "WRONG_PRODUCT", "name": "Ordered Wrong Product", "description": "Customer ordered wrong product", "requiresEvidence": False, "requiresComment": False, "displayOrder": 2, "isActive": True, "createdAt": firestore.SERVER_TIMESTAMP},
     {"type": "cancel", "code": "FOUND_CHEAPER", "name": "Found Cheaper Alternative", "description": "Customer found cheaper option", "requiresEvidence": False, "requiresComment": False, "displayOrder": 3, "isActive": True, "createdAt": firestore.SERVER_TIMESTAMP},
     
+    # System Cancel Reasons (not offered to customers)
+    {"type": "auto_cancel", "code": "PAYMENT_TIMEOUT", "name": "Payment Not Received", "description": "Order not paid within ORDER_AUTO_CANCEL_HOURS (set by the auto-cancel scheduler)", "requiresEvidence": False, "requiresComment": False, "displayOrder": 1, "isActive": True, "createdAt": firestore.SERVER_TIMESTAMP},
+    
     # Return Reasons
     {"type": "return", "code": "DAMAGED", "name": "Damaged Product", "description": "Product arrived damaged", "requiresEvidence": True, "requiresComment": True, "displayOrder": 1, "isActive": True, "createdAt": firestore.SERVER_TIMESTAMP},
     {"type": "return", "code": "WRONG_ITEM", "name": "Wrong Item Delivered", "description": "Received wrong product", "requiresEvidence": True, "requiresComment": True, "displayOrder": 2, "isActive": True, "createdAt": firestore.SERVER_TIMESTAMP},
@@ -266,15 +275,17 @@ reasons = [
     {"type": "reject_uco", "code": "INSUFFICIENT_QTY", "name": "Insufficient Quantity", "description": "Quantity too low for collection", "requiresEvidence": False, "requiresComment": True, "displayOrder": 3, "isActive": True, "createdAt": firestore.SERVER_TIMESTAMP},
 ]
 
-for reason in reasons:
-    db.collection("config_reasons").add(reason)
-    print(f"  ✓ Created: {reason['type'].upper()} - {reason['name']}")
+def create_reasons():
+    """Create reason codes"""
+    print("\n📝 Creating Reason Codes...")
+    for reason in reasons:
+        db.collection("config_reasons").add(reason)
+        print(f"  ✓ Created: {reason['type'].upper()} - {reason['name']}")
+    return reasons
 
 # ============================================================
 # FULFILLMENT SETTINGS
 # ============================================================
-print("\n🚚 Creating Fulfillment Settings...")
-
 fulfillment_settings = {
     "deliverySlots": [
         {"slotName": "Morning", "startTime": "08:00", "endTime": "12:00", "maxCapacity": 20},
@@ -298,14 +309,16 @@ fulfillment_settings = {
     "createdAt": firestore.SERVER_TIMESTAMP,
 }
 
-db.collection("config_fulfillment_settings").add(fulfillment_settings)
-print(f"  ✓ Created fulfillment settings with {len(fulfillment_settings['deliverySlots'])} delivery slots")
+def create_fulfillment_settings():
+    """Create fulfillment settings"""
+    print("\n🚚 Creating Fulfillment Settings...")
+    db.collection("config_fulfillment_settings").add(fulfillment_settings)
+    print(f"  ✓ Created fulfillment settings with {len(fulfillment_settings['deliverySlots'])} delivery slots")
+    return fulfillment_settings
 
 # ============================================================
 # WORKFLOW TEMPLATES
 # ============================================================
-print("\n⚙️  Creating Workflow Templates...")
-
 # Sales Order Workflow
 sales_workflow = {
     "domain": "sales",
@@ -325,9 +338,6 @@ sales_workflow = {
     "createdAt": firestore.SERVER_TIMESTAMP,
 }
 
-db.collection("config_workflow_templates").add(sales_workflow)
-print(f"  ✓ Created: Sales Order Workflow ({len(sales_workflow['steps'])} steps)")
-
 # UCO Workflow
 uco_workflow = {
     "domain": "uco",
@@ -348,9 +358,6 @@ uco_workflow = {
     "createdAt": firestore.SERVER_TIMESTAMP,
 }
 
-db.collection("config_workflow_templates").add(uco_workflow)
-print(f"  ✓ Created: UCO Collection Workflow ({len(uco_workflow['steps'])} steps)")
-
 # Return Workflow
 return_workflow = {
     "domain": "return",
@@ -369,14 +376,22 @@ return_workflow = {
     "createdAt": firestore.SERVER_TIMESTAMP,
 }
 
-db.collection("config_workflow_templates").add(return_workflow)
-print(f"  ✓ Created: Return/Refund Workflow ({len(return_workflow['steps'])} steps)")
+workflow_templates = [sales_workflow, uco_workflow, return_workflow]
+
+def create_workflow_templates():
+    """Create default workflow templates"""
+    print("\n⚙️  Creating Workflow Templates...")
+    db.collection("config_workflow_templates").add(sales_workflow)
+    print(f"  ✓ Created: Sales Order Workflow ({len(sales_workflow['steps'])} steps)")
+    db.collection("config_workflow_templates").add(uco_workflow)
+    print(f"  ✓ Created: UCO Collection Workflow ({len(uco_workflow['steps'])} steps)")
+    db.collection("config_workflow_templates").add(return_workflow)
+    print(f"  ✓ Created: Return/Refund Workflow ({len(return_workflow['steps'])} steps)")
+    return workflow_templates
 
 # ============================================================
 # PRICE LISTS
 # ============================================================
-print("\n💵 Creating Price Lists...")
-
 price_lists = [
     {
         "code": "B2C_STANDARD",
@@ -400,53 +415,81 @@ price_lists = [
     },
 ]
 
-price_list_map = {}
-for price_list in price_lists:
-    doc_ref = db.collection("config_price_lists").add(price_list)
-    price_list_map[price_list['code']] = doc_ref[1].id
-    print(f"  ✓ Created: {price_list['name']}")
+def create_price_lists():
+    """Create price lists and return a code → document ID map"""
+    print("\n💵 Creating Price Lists...")
+    price_list_map = {}
+    for price_list in price_lists:
+        doc_ref = db.collection("config_price_lists").add(price_list)
+        price_list_map[price_list['code']] = doc_ref[1].id
+        print(f"  ✓ Created: {price_list['name']}")
+    return price_list_map
 
 # ============================================================
 # PRICE LIST ITEMS
 # ============================================================
-print("\n💲 Creating Price List Items...")
-
-# Get product IDs
-products_snapshot = db.collection("config_products").get()
-product_map = {doc.to_dict()['sku']: doc.id for doc in products_snapshot}
-
-price_items = [
-    # B2C Pricing
-    {"priceListId": price_list_map.get("B2C_STANDARD", ""), "productId": product_map.get("OIL-PREM-5L", ""), "unitPrice": 45.00, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
-    {"priceListId": price_list_map.get("B2C_STANDARD", ""), "productId": product_map.get("OIL-STD-10L", ""), "unitPrice": 80.00, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
-    {"priceListId": price_list_map.get("B2C_STANDARD", ""), "productId": product_map.get("OIL-BULK-20L", ""), "unitPrice": 150.00, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
-    
-    # B2B Pricing (10% discount)
-    {"priceListId": price_list_map.get("B2B_WHOLESALE", ""), "productId": product_map.get("OIL-PREM-5L", ""), "unitPrice": 40.50, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
-    {"priceListId": price_list_map.get("B2B_WHOLESALE", ""), "productId": product_map.get("OIL-STD-10L", ""), "unitPrice": 72.00, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
-    {"priceListId": price_list_map.get("B2B_WHOLESALE", ""), "productId": product_map.get("OIL-BULK-20L", ""), "unitPrice": 135.00, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
-]
-
-for item in price_items:
-    db.collection("config_price_list_items").add(item)
-
-print(f"  ✓ Created {len(price_items)} price list items")
-
-# ============================================================
-# SUMMARY
-# ============================================================
-print("\n" + "=" * 60)
-print("✅ SAMPLE DATA CREATION COMPLETE!")
-print("=" * 60)
-print(f"\n📊 Summary:")
-print(f"   • Products: {len(products)}")
-print(f"   • UCO Grades: {len(uco_grades)}")
-print(f"   • Buyback Rates: {len(buyback_rates)}")
-print(f"   • Payment Methods: {len(payment_methods)}")
-print(f"   • Order Statuses: {len(order_statuses)}")
-print(f"   • Reason Codes: {len(reasons)}")
-print(f"   • Fulfillment Settings: 1 document")
-print(f"   • Workflow Templates: 3 (Sales, UCO, Return)")
-print(f"   • Price Lists: {len(price_lists)}")
-print(f"   • Price List Items: {len(price_items)}")
-print(f"\n🎉 All configuration data is ready for use!")
+def price_item_docs(price_list_map, product_map):
+    """Price list items; IDs come from the price lists and products created first"""
+    return [
+        # B2C Pricing
+        {"priceListId": price_list_map.get("B2C_STANDARD", ""), "productId": product_map.get("OIL-PREM-5L", ""), "unitPrice": 45.00, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
+        {"priceListId": price_list_map.get("B2C_STANDARD", ""), "productId": product_map.get("OIL-STD-10L", ""), "unitPrice": 80.00, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
+        {"priceListId": price_list_map.get("B2C_STANDARD", ""), "productId": product_map.get("OIL-BULK-20L", ""), "unitPrice": 150.00, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
+        
+        # B2B Pricing (10% discount)
+        {"priceListId": price_list_map.get("B2B_WHOLESALE", ""), "productId": product_map.get("OIL-PREM-5L", ""), "unitPrice": 40.50, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
+        {"priceListId": price_list_map.get("B2B_WHOLESALE", ""), "productId": product_map.get("OIL-STD-10L", ""), "unitPrice": 72.00, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
+        {"priceListId": price_list_map.get("B2B_WHOLESALE", ""), "productId": product_map.get("OIL-BULK-20L", ""), "unitPrice": 135.00, "currency": "USD", "createdAt": firestore.SERVER_TIMESTAMP},
+    ]
+
+def create_price_items(price_list_map, product_map):
+    """Create price list items"""
+    print("\n💲 Creating Price List Items...")
+    price_items = price_item_docs(price_list_map, product_map)
+    for item in price_items:
+        db.collection("config_price_list_items").add(item)
+
+    print(f"  ✓ Created {len(price_items)} price list items")
+    return price_items
+
+def main():
+    """Main execution"""
+    global db
+    args = parse_metrics_args(__doc__)
+
+    # Initialize Firebase
+    initialize_firebase()
+    db = sync_client(args=args)
+
+    print("🔧 Creating Sample Configuration Data")
+    print("=" * 60)
+
+    product_map = create_products()
+    grade_map = create_uco_grades()
+    buyback_rates = create_buyback_rates(grade_map)
+    create_payment_methods()
+    create_order_statuses()
+    create_reasons()
+    create_fulfillment_settings()
+    create_workflow_templates()
+    price_list_map = create_price_lists()
+    price_items = create_price_items(price_list_map, product_map)
+
+    print("\n" + "=" * 60)
+    print("✅ SAMPLE DATA CREATION COMPLETE!")
+    print("=" * 60)
+    print(f"\n📊 Summary:")
+    print(f"   • Products: {len(products)}")
+    print(f"   • UCO Grades: {len(uco_grades)}")
+    print(f"   • Buyback Rates: {len(buyback_rates)}")
+    print(f"   • Payment Methods: {len(payment_methods)}")
+    print(f"   • Order Statuses: {len(order_statuses)}")
+    print(f"   • Reason Codes: {len(reasons)}")
+    print(f"   • Fulfillment Settings: 1 document")
+    print(f"   • Workflow Templates: 3 (Sales, UCO, Return)")
+    print(f"   • Price Lists: {len(price_lists)}")
+    print(f"   • Price List Items: {len(price_items)}")
+    print(f"\n🎉 All configuration data is ready for use!")
+
+if __name__ == '__main__':
+    main()
@@ -4,27 +4,29 @@ Populate sample workflow data for Phase 4: Workflow Engine
 Creates workflow instances, approval requests, exceptions, and audit logs
 """
 
-import firebase_admin
-from firebase_admin import credentials, firestore
 from datetime import datetime, timedelta
 import random
 
-# Initialize Firebase Admin SDK
-try:
-    cred = credentials.Certificate('/opt/flutter/firebase-admin-sdk.json')
-    firebase_admin.initialize_app(cred)
-    print("✅ Firebase Admin SDK initialized successfully")
-except Exception as e:
-    print(f"❌ Error initializing Firebase: {e}")
-    exit(1)
+from firestore_metrics import parse_metrics_args
+from maintenance_runtime import initialize_firebase, sync_client
 
-db = firestore.client()
+db = None
 
-def create_workflow_instances():
-    """Create sample workflow instances"""
-    print("\n📦 Creating workflow instances...")
-    
-    instances = [
+def init_db():
+    """Initialize Firebase and the client used by the create_* functions"""
+    global db
+    args = parse_metrics_args(__doc__)
+    try:
+        initialize_firebase()
+        print("✅ Firebase Admin SDK initialized successfully")
+    except Exception as e:
+        print(f"❌ Error initializing Firebase: {e}")
+        exit(1)
+    db = sync_client(args=args)
+
+def workflow_instance_docs():
+    """Sample workflow instance documents"""
+    return [
         # Sales Order Workflows
         {
             'workflowType': 'sales_order',
@@ -156,6 +158,12 @@ def create_workflow_instances():
             'isOverdue': False,
         },
     ]
+
+def create_workflow_instances():
+    """Create sample workflow instances"""
+    print("\n📦 Creating workflow instances...")
+    
+    instances = workflow_instance_docs()
     
     for instance in instances:
         doc_ref = db.collection('workflow_instances').add(instance)
@@ -164,11 +172,9 @@ def create_workflow_instances():
     print(f"✅ Created {len(instances)} workflow instances")
     return instances
 
-def create_approval_requests():
-    """Create sample approval requests"""
-    print("\n🔔 Creating approval requests...")
-    
-    requests = [
+def approval_request_docs():
+    """Sample approval request documents"""
+    return [
         # Sales order approval - Urgent
         {
             'workflowInstanceId': 'wf_001',
@@ -301,6 +307,12 @@ def create_approval_requests():
             'slaDeadline': datetime.now() + timedelta(hours=21),
         },
     ]
+
+def create_approval_requests():
+    """Create sample approval requests"""
+    print("\n🔔 Creating approval requests...")
+    
+    requests = approval_request_docs()
     
     for request in requests:
         doc_ref = db.collection('approval_requests').add(request)
@@ -309,11 +321,9 @@ def create_approval_requests():
     print(f"✅ Created {len(requests)} approval requests")
     return requests
 
-def create_exceptions():
-    """Create sample exception records"""
-    print("\n⚠️  Creating exception records...")
-    
-    exceptions = [
+def exception_docs():
+    """Sample exception documents"""
+    return [
         # Critical: Payment failed
         {
             'workflowInstanceId': 'wf_009',
@@ -425,6 +435,12 @@ def create_exceptions():
             }
         },
     ]
+
+def create_exceptions():
+    """Create sample exception records"""
+    print("\n⚠️  Creating exception records...")
+    
+    exceptions = exception_docs()
     
     for exception in exceptions:
         doc_ref = db.collection('exceptions').add(exception)
@@ -433,11 +449,9 @@ def create_exceptions():
     print(f"✅ Created {len(exceptions)} exception records")
     return exceptions
 
-def create_audit_logs():
-    """Create sample audit log entries"""
-    print("\n📋 Creating audit log entries...")
-    
-    logs = [
+def audit_log_docs():
+    """Sample audit log documents"""
+    return [
         # Workflow created
         {
             'workflowInstanceId': 'wf_001',
@@ -553,6 +567,12 @@ def create_audit_logs():
             }
         },
     ]
+
+def create_audit_logs():
+    """Create sample audit log entries"""
+    print("\n📋 Creating audit log entries...")
+    
+    logs = audit_log_docs()
     
     for log in logs:
         doc_ref = db.collection('audit_log').add(log)
@@ -563,6 +583,7 @@ def create_audit_logs():
 
 def main():
     """Main execution function"""
+    init_db()
     print("=" * 60)
     print("🚀 PHASE 4: Workflow Engine Data Population")
     print("=" * 60)
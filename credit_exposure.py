@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+B2B credit exposure ledger for Oil Manager
+Keeps one credit_exposure/{customerAccountId} document with running totals of open
+credit orders, delivered-not-paid orders and unsettled UCO credit notes, maintained
+from sales_orders and pickup_requests changes, so "would this order exceed the
+limit?" is one document read. --reconcile recomputes every account from the source
+collections in parallel partitions and flags (or with --fix, repairs) drift
+"""
+
+import argparse
+import asyncio
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+try:
+    from firebase_admin import firestore
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from config_cache import ConfigCache
+from daily_rollups import fact_delta, pickup_grade, pickup_kg, pickup_payout
+from daily_rollups import ledger_entry as rollup_ledger_entry, ledger_facts as rollup_ledger_facts
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import DEFAULT_CONCURRENCY, MAX_BATCH_WRITES, async_client, chunked, sync_client
+
+EXPOSURE_COLLECTION = 'credit_exposure'
+LEDGER_COLLECTION = 'credit_exposure_ledger'
+SOURCES = ('sales_orders', 'pickup_requests')
+
+# An order is exposure from submission until it is paid (Completed) or Cancelled; COD orders
+# are paid on delivery and never run on credit
+OPEN_ORDER_STATUSES = ('Submitted', 'Confirmed', 'Scheduled', 'OutForDelivery')
+RECEIVABLE_STATUSES = ('Delivered', 'Invoiced')
+CASH_PAYMENT_METHODS = {'COD'}
+# A CreditNote pickup offsets exposure once the oil is collected; at settlement the note is
+# applied to the account's invoices and drops out
+CREDIT_NOTE_STATUSES = ('Collected',)
+
+# Running totals on an exposure document; exposure = openOrders + receivable - creditNotes
+AMOUNT_FIELDS = ('openOrders', 'receivable', 'creditNotes')
+COUNT_FIELDS = ('openOrderCount', 'receivableCount', 'creditNoteCount')
+TOTAL_FIELDS = AMOUNT_FIELDS + COUNT_FIELDS + ('exposure',)
+DRIFT_TOLERANCE = 0.01
+
+# Source documents per batch: one ledger write plus at most two exposure writes each
+CHUNK_SIZE = 150
+FLUSH_INTERVAL = 1.0
+
+
+# ============================================================
+# FACTS
+# A document's facts are what it adds to its account's totals, e.g.
+# {'receivable': 6500.0, 'receivableCount': 1, 'exposure': 6500.0}
+# ============================================================
+
+def order_facts(order):
+    """(customerAccountId, facts) for a sales order; no facts unless it is B2B credit still unpaid"""
+    account = order.get('customerAccountId')
+    if order.get('customerType') != 'B2B' or not account:
+        return None, {}
+    if (order.get('paymentMethod') or 'COD') in CASH_PAYMENT_METHODS:
+        return None, {}
+    amount = float(order.get('totalAmount') or 0)
+    if order.get('status') in OPEN_ORDER_STATUSES:
+        return account, {'openOrders': amount, 'openOrderCount': 1, 'exposure': amount}
+    if order.get('status') in RECEIVABLE_STATUSES:
+        return account, {'receivable': amount, 'receivableCount': 1, 'exposure': amount}
+    return None, {}
+
+
+def pickup_facts(pickup, cache):
+    """(customerAccountId, facts) for a UCO pickup; only B2B CreditNote pickups awaiting settlement count"""
+    account = pickup.get('customerAccountId')
+    if (pickup.get('customerType') != 'B2B' or not account or pickup.get('incentiveType') != 'CreditNote'
+            or pickup.get('status') not in CREDIT_NOTE_STATUSES):
+        return None, {}
+    kg = pickup_kg(pickup)
+    credit, _ = pickup_payout(pickup, kg, pickup_grade(pickup, cache), cache)
+    return account, {'creditNotes': round(credit, 2), 'creditNoteCount': 1, 'exposure': -round(credit, 2)}
+
+
+def ledger_entry(source, doc_id, account, facts):
+    return rollup_ledger_entry(source, doc_id, account, facts, key_field='customerAccountId')
+
+
+def ledger_facts(data):
+    if data and isinstance(data.get('facts'), dict):
+        # Written before the ledgers shared the {path, value} encoding
+        return data.get('customerAccountId'), data['facts']
+    return rollup_ledger_facts(data, key_field='customerAccountId')
+
+
+def credit_check(exposure, order_amount):
+    """Whether an order of order_amount fits under the account's limit, from its exposure document
+
+    An account without a recorded creditLimit has no credit: any credit order exceeds it
+    and needs a credit_limit approval.
+    """
+    exposure = exposure or {}
+    limit = float(exposure.get('creditLimit') or 0)
+    current = float(exposure.get('exposure') or 0)
+    return {
+        'customerAccountId': exposure.get('customerAccountId'),
+        'creditLimit': limit,
+        'exposure': current,
+        'available': round(limit - current, 2),
+        'orderAmount': order_amount,
+        'exceeds': current + order_amount > limit + DRIFT_TOLERANCE,
+    }
+
+
+def check_order(db, customer_account_id, order_amount):
+    """credit_check() for an account with one document read"""
+    snap = db.collection(EXPOSURE_COLLECTION).document(customer_account_id).get()
+    exposure = snap.to_dict() if snap.exists else {'customerAccountId': customer_account_id}
+    return credit_check(exposure, order_amount)
+
+
+def approved_limit(request):
+    """New creditLimit granted by an approved credit_limit approval request, else None"""
+    if request.get('requestType') != 'credit_limit' or request.get('status') != 'approved':
+        return None
+    data = request.get('requestData') or {}
+    value = data.get('approvedCreditLimit', data.get('requestedCreditLimit'))
+    return float(value) if value is not None else None
+
+
+# ============================================================
+# LEDGER
+# ============================================================
+
+class CreditLedger:
+    """Folds order and pickup changes into per-account exposure documents
+
+    Changes are collected as they arrive and flushed in batches; for each document the
+    ledger entry (its last contribution) and the exposure increments that replace it
+    commit in the same batch, so replaying a change (listener reconnect, change bus
+    initial snapshot) is a no-op. Run a single instance: two writers could both read
+    the same old ledger entry and retract it twice.
+    """
+
+    def __init__(self, db, cache):
+        self.db = db
+        self.cache = cache
+        self._lock = threading.Lock()
+        self.pending = {}
+        self.limits = {}
+        self.counts = defaultdict(int)
+
+    def facts(self, source, data):
+        if data is None:
+            return None, {}
+        if source == 'pickup_requests':
+            return pickup_facts(data, self.cache)
+        return order_facts(data)
+
+    def apply(self, source, doc_id, data):
+        """Queue a document's latest state (None when deleted); the next flush folds it in"""
+        with self._lock:
+            self.pending[(source, doc_id)] = data
+
+    def apply_approval(self, request_id, request):
+        """Queue the creditLimit granted by an approved credit_limit request"""
+        limit = approved_limit(request or {})
+        if limit is not None:
+            with self._lock:
+                self.limits[request_id] = (request, limit)
+
+    def on_change(self, event):
+        """change_bus handler for sales_orders, pickup_requests and approval_requests"""
+        data = None if event.type == 'REMOVED' else event.data
+        if event.collection == 'approval_requests':
+            self.apply_approval(event.doc_id, data)
+        else:
+            self.apply(event.collection, event.doc_id, data)
+
+    def on_snapshot(self, source):
+        def callback(docs, changes, read_time):
+            for change in changes:
+                removed = change.type.name == 'REMOVED'
+                self.apply(source, change.document.id, None if removed else change.document.to_dict())
+        return callback
+
+    def on_approvals(self, docs, changes, read_time):
+        for change in changes:
+            if change.type.name != 'REMOVED':
+                self.apply_approval(change.document.id, change.document.to_dict())
+
+    def flush(self):
+        """Fold every queued change into the exposure documents; returns the number of documents changed"""
+        with self._lock:
+            changes, self.pending = list(self.pending.items()), {}
+            limits, self.limits = list(self.limits.items()), {}
+        changed = 0
+        for chunk in chunked(changes, CHUNK_SIZE):
+            changed += self._fold(chunk)
+        for request_id, (request, limit) in limits:
+            self._set_limit_from(request_id, request, limit)
+        return changed
+
+    def _fold(self, chunk):
+        refs = [self.db.collection(LEDGER_COLLECTION).document(f'{source}_{doc_id}') for (source, doc_id), _ in chunk]
+        old = {snap.id: ledger_facts(snap.to_dict() if snap.exists else None) for snap in self.db.get_all(refs)}
+
+        batch = self.db.batch()
+        per_account = defaultdict(dict)
+        changed = 0
+        for ((source, doc_id), data), ref in zip(chunk, refs):
+            old_account, old_facts = old.get(ref.id, (None, {}))
+            new_account, new_facts = self.facts(source, data)
+            if (old_account, old_facts) == (new_account, new_facts):
+                continue
+            for account, delta in fact_delta(old_account, old_facts, new_account, new_facts).items():
+                for field, change in delta.items():
+                    per_account[account][field] = per_account[account].get(field, 0) + change
+            if new_facts:
+                batch.set(ref, ledger_entry(source, doc_id, new_account, new_facts))
+            else:
+                batch.delete(ref)
+            changed += 1
+            self.counts[f'{source} changed'] += 1
+
+        for account, delta in per_account.items():
+            update = {field: firestore.Increment(value) for field, value in delta.items()}
+            update.update({'customerAccountId': account, 'updatedAt': firestore.SERVER_TIMESTAMP})
+            batch.set(self.db.collection(EXPOSURE_COLLECTION).document(account), update, merge=True)
+        if len(batch):
+            batch.commit()
+        self.counts['exposure writes'] += len(per_account)
+        return changed
+
+    def _set_limit_from(self, request_id, request, limit):
+        """Record an approved limit on the account of the request (requestData or its sales order)"""
+        account = (request.get('requestData') or {}).get('customerAccountId')
+        if not account and request.get('entityId'):
+            order = self.db.collection('sales_orders').document(request['entityId']).get()
+            account = (order.to_dict() or {}).get('customerAccountId') if order.exists else None
+        if not account:
+            print(f"⚠️  Approved credit_limit {request_id}: no customer account to apply it to")
+            return
+        ref = self.db.collection(EXPOSURE_COLLECTION).document(account)
+        snap = ref.get()
+        if snap.exists and (snap.to_dict() or {}).get('creditLimitSource') == request_id:
+            return
+        set_limit(self.db, account, limit, source=request_id)
+        self.counts['limits set'] += 1
+        print(f"   💳 {account}: creditLimit {limit:,.2f} from approval {request_id}")
+
+    def load(self):
+        """Fold in the current state of every B2B order and pickup (first run or after a gap)"""
+        for source in SOURCES:
+            query = self.db.collection(source).where(filter=FieldFilter('customerType', '==', 'B2B'))
+            for doc in query.stream():
+                self.apply(source, doc.id, doc.to_dict())
+        for doc in self.approvals_query().stream():
+            self.apply_approval(doc.id, doc.to_dict())
+        return self.flush()
+
+    def approvals_query(self):
+        return (self.db.collection('approval_requests')
+                .where(filter=FieldFilter('requestType', '==', 'credit_limit'))
+                .where(filter=FieldFilter('status', '==', 'approved')))
+
+    def listen(self, bus=None):
+        """Watches feeding apply(): a listener per source, or one change bus feed"""
+        if bus is not None:
+            from change_bus import connect
+            feed = connect(bus, 'credit_exposure', self.on_change, list(SOURCES) + ['approval_requests'])
+            if isinstance(bus, str):
+                # A socket consumer joins a running bus whose log no longer holds the initial snapshot
+                self.load()
+            return [feed]
+        # A listener's initial snapshot replays every B2B document, which the ledger absorbs as no-ops
+        watches = [self.db.collection(source).where(filter=FieldFilter('customerType', '==', 'B2B'))
+                   .on_snapshot(self.on_snapshot(source)) for source in SOURCES]
+        return watches + [self.approvals_query().on_snapshot(self.on_approvals)]
+
+    def run(self, duration=None, bus=None):
+        """Keep exposure current until interrupted (or duration seconds)"""
+        watches = self.listen(bus)
+        started = time.time()
+        source = 'B2B orders and pickups' if bus is None else 'orders and pickups from the change bus'
+        print(f"👂 Listening to {source} (flush every {FLUSH_INTERVAL}s)...")
+        try:
+            while duration is None or time.time() - started < duration:
+                time.sleep(FLUSH_INTERVAL)
+                changed = self.flush()
+                if changed:
+                    print(f"   ✓ {changed} document(s) folded into exposure")
+                if not all(w.is_active for w in watches):
+                    print("⚠️  Listener closed, restarting from a fresh snapshot")
+                    for watch in watches:
+                        watch.unsubscribe()
+                    watches = self.listen(bus)
+        except KeyboardInterrupt:
+            print("\n🛑 Stopping credit exposure ledger")
+        finally:
+            for watch in watches:
+                watch.unsubscribe()
+            self.flush()
+
+
+def set_limit(db, account, limit, source='manual'):
+    db.collection(EXPOSURE_COLLECTION).document(account).set({
+        'customerAccountId': account,
+        'creditLimit': limit,
+        'creditLimitSource': source,
+        'creditLimitUpdatedAt': firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+
+# ============================================================
+# RECONCILIATION
+# ============================================================
+
+class Reconciler:
+    """Recomputes every account's totals from the source collections and compares them to the ledger
+
+    Each (collection, status) pair that can carry exposure is one partition, read
+    concurrently. Accounts whose exposure document changed after the run started are
+    skipped rather than reported, since the live ledger moved under the comparison.
+    """
+
+    def __init__(self, db, cache, concurrency=DEFAULT_CONCURRENCY):
+        self.db = db
+        self.cache = cache
+        self.limiter = asyncio.Semaphore(concurrency)
+        self.totals = defaultdict(lambda: defaultdict(int))
+        self.entries = {}
+        self.counts = defaultdict(int)
+
+    def partitions(self):
+        statuses = {'sales_orders': OPEN_ORDER_STATUSES + RECEIVABLE_STATUSES, 'pickup_requests': CREDIT_NOTE_STATUSES}
+        return [(source, status) for source in SOURCES for status in statuses[source]]
+
+    async def read_partition(self, source, status):
+        query = (self.db.collection(source)
+                 .where(filter=FieldFilter('customerType', '==', 'B2B'))
+                 .where(filter=FieldFilter('status', '==', status)))
+        async with self.limiter:
+            docs = [doc async for doc in query.stream()]
+        for doc in docs:
+            data = doc.to_dict()
+            account, facts = pickup_facts(data, self.cache) if source == 'pickup_requests' else order_facts(data)
+            if not facts:
+                continue
+            self.entries[f'{source}_{doc.id}'] = ledger_entry(source, doc.id, account, facts)
+            for field, value in facts.items():
+                self.totals[account][field] += value
+        self.counts[f'{source} read'] += len(docs)
+
+    async def stored(self):
+        async with self.limiter:
+            return {doc.id: doc async for doc in self.db.collection(EXPOSURE_COLLECTION).stream()}
+
+    async def run(self, fix=False):
+        started = datetime.now(timezone.utc)
+        partitions = self.partitions()
+        print(f"\n🧮 Recomputing exposure from {len(partitions)} partition(s)...")
+        results = await asyncio.gather(self.stored(), *(self.read_partition(s, st) for s, st in partitions))
+        stored = results[0]
+
+        drifted = {}
+        for account in sorted(set(stored) | set(self.totals)):
+            snap = stored.get(account)
+            if snap is not None and snap.update_time and snap.update_time > started:
+                self.counts['changed during run'] += 1
+                continue
+            have = snap.to_dict() if snap is not None else {}
+            want = self.totals.get(account, {})
+            drift = {field: round(want.get(field, 0) - (have.get(field) or 0), 2) for field in TOTAL_FIELDS
+                     if abs(want.get(field, 0) - (have.get(field) or 0)) > DRIFT_TOLERANCE}
+            if drift:
+                drifted[account] = drift
+            elif have.get('drift'):
+                drifted[account] = {}
+        self.counts['accounts'] = len(set(stored) | set(self.totals))
+        self.counts['accounts drifted'] = sum(1 for d in drifted.values() if d)
+
+        for account, drift in sorted(drifted.items()):
+            if drift:
+                print(f"   ⚠️  {account}: " + ', '.join(f"{f} {v:+,.2f}" for f, v in drift.items()))
+        await self.flag(drifted, started, fix)
+        if fix:
+            await self.rewrite_ledger()
+
+    async def flag(self, drifted, started, fix):
+        """Record drift on the exposure documents; with fix, also set the recomputed totals"""
+        writes = []
+        for account, drift in drifted.items():
+            update = {'customerAccountId': account, 'drift': drift or None, 'reconciledAt': started}
+            if fix and drift:
+                want = self.totals.get(account, {})
+                update.update({field: round(want.get(field, 0), 6) for field in TOTAL_FIELDS})
+                update['drift'] = None
+                update['driftFixedAt'] = started
+            writes.append((self.db.collection(EXPOSURE_COLLECTION).document(account), update))
+        await self.commit_all(writes, merge=True)
+
+    async def rewrite_ledger(self):
+        """Replace the ledger with the recomputed entries so later increments start from the fixed totals"""
+        async with self.limiter:
+            existing = [ref async for ref in self.db.collection(LEDGER_COLLECTION).list_documents()]
+        writes = [(ref, None) for ref in existing if ref.id not in self.entries]
+        writes += [(self.db.collection(LEDGER_COLLECTION).document(key), entry) for key, entry in self.entries.items()]
+        await self.commit_all(writes)
+        self.counts['ledger entries'] = len(self.entries)
+
+    async def commit_all(self, writes, merge=False):
+        async def commit(chunk):
+            batch = self.db.batch()
+            for ref, data in chunk:
+                if data is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, data, merge=merge)
+            async with self.limiter:
+                await batch.commit()
+
+        await asyncio.gather(*(commit(c) for c in chunked(writes, MAX_BATCH_WRITES)))
+
+
+async def reconcile(args, cache):
+    reconciler = Reconciler(async_client(job='credit_exposure', args=args), cache, concurrency=args.concurrency)
+    started = time.perf_counter()
+    await reconciler.run(fix=args.fix)
+    drifted = reconciler.counts['accounts drifted']
+    verb = 'fixed' if args.fix else 'flagged'
+    print(f"\n{'⚠️ ' if drifted else '✅'} {drifted} of {reconciler.counts['accounts']} account(s) drifted "
+          f"({verb}) in {time.perf_counter() - started:.2f}s")
+    for name, count in sorted(reconciler.counts.items()):
+        print(f"   • {name}: {count}")
+    return drifted
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--once', action='store_true', help='fold in every B2B order and pickup once and exit')
+    parser.add_argument('--duration', type=float, metavar='SECONDS', help='stop listening after SECONDS')
+    parser.add_argument('--bus', metavar='SOCKET',
+                        help='consume changes from a running change_bus.py socket instead of listening')
+    parser.add_argument('--reconcile', action='store_true', help='recompute all accounts and flag drift (nightly)')
+    parser.add_argument('--fix', action='store_true', help='with --reconcile, overwrite drifted totals and the ledger')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'maximum in-flight Firestore RPCs for --reconcile (default {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--check', nargs=2, metavar=('ACCOUNT', 'AMOUNT'),
+                        help='report whether an order of AMOUNT would exceed ACCOUNT\'s credit limit')
+    parser.add_argument('--set-limit', nargs=2, metavar=('ACCOUNT', 'AMOUNT'), help='record a credit limit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    if args.fix and not args.reconcile:
+        parser.error('--fix requires --reconcile')
+
+    print("💳 Oil Manager credit exposure ledger")
+    db = sync_client(job='credit_exposure', args=args)
+    if args.check:
+        result = check_order(db, args.check[0], float(args.check[1]))
+        icon = '❌' if result['exceeds'] else '✅'
+        print(f"{icon} {args.check[0]}: exposure {result['exposure']:,.2f} + order {result['orderAmount']:,.2f} "
+              f"vs limit {result['creditLimit']:,.2f} (available {result['available']:,.2f})")
+        sys.exit(1 if result['exceeds'] else 0)
+    if args.set_limit:
+        set_limit(db, args.set_limit[0], float(args.set_limit[1]))
+        print(f"✅ {args.set_limit[0]}: creditLimit {float(args.set_limit[1]):,.2f}")
+        return
+
+    # Grades and incentives price credit notes for pickups that carry no payoutAmount
+    cache = ConfigCache(db, collections=('config_uco_grades', 'config_uco_incentives'),
+                        listen=not (args.once or args.reconcile)).load()
+    try:
+        if args.reconcile:
+            drifted = asyncio.run(reconcile(args, cache))
+            sys.exit(1 if drifted and not args.fix else 0)
+        ledger = CreditLedger(db, cache)
+        if args.once:
+            changed = ledger.load()
+            print(f"✅ {changed} document(s) folded into exposure, {ledger.counts['exposure writes']} account write(s)")
+            return
+        ledger.run(duration=args.duration, bus=args.bus)
+    finally:
+        cache.close()
+
+
+if __name__ == '__main__':
+    main()
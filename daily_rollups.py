@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Incremental daily sales and UCO rollups for Oil Manager reporting
+Maintains one compact rollups/{yyyy-mm-dd} document per day with totals and
+per-zone, per-SKU and per-grade revenue, litres sold, kg collected and payouts.
+Incremental runs only read orders and pickups whose lastStatusAt passed the stored
+watermark; --backfill rebuilds a date range in parallel partitions
+"""
+
+import argparse
+import asyncio
+import math
+import re
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+try:
+    from firebase_admin import firestore
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from config_cache import ConfigCache
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import DEFAULT_CONCURRENCY, MAX_BATCH_WRITES, async_client, chunked, sync_client
+from uco_grading import GRADE_LABELS, grade_code
+
+ROLLUP_COLLECTION = 'rollups'
+LEDGER_COLLECTION = 'rollup_ledger'
+STATE_COLLECTION = 'rollup_state'
+STATE_DOC = 'daily'
+
+# Orders count once delivered; pickups once the oil is collected
+SOLD_STATUSES = {'Delivered', 'Invoiced', 'Completed'}
+COLLECTED_STATUSES = {'Collected', 'Settled'}
+
+DEFAULT_TIMEZONE = 'Asia/Bangkok'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+UCO_KG_PER_LITRE = 0.92
+UNASSIGNED = 'Unassigned'
+UNGRADED = 'Ungraded'
+
+# AddressModel carries only lat/lng, so zones are rings of (name, centre lat, centre lng, radius km),
+# innermost first; beyond the last ring an address is in OUTER_ZONE. The names are the ones
+# config_delivery_slots and config_uco_incentives are keyed by
+DELIVERY_ZONES = (
+    ('Bangkok Central', 13.7563, 100.5018, 12.0),
+    ('Bangkok Suburbs', 13.7563, 100.5018, 40.0),
+)
+OUTER_ZONE = 'Provinces'
+EARTH_RADIUS_KM = 6371.0
+
+PAYOUT_RATE_FIELDS = {'Cash': 'cashRatePerKg', 'CreditNote': 'creditRatePerKg'}
+
+# Firestore 'in' filters accept at most 30 values
+IN_QUERY_LIMIT = 30
+# Source documents per batch: each needs a ledger write, plus one write per touched day
+CHUNK_SIZE = 200
+
+PACK_LITRES = re.compile(r'(\d+(?:\.\d+)?)\s*L\b', re.IGNORECASE)
+
+
+# ============================================================
+# FACTS
+# A fact is (path, value), e.g. (('byZone', 'Bangkok Central', 'revenue'), 235.0);
+# a document's facts are what it contributes to the rollup of its day
+# ============================================================
+
+def day_key(ts, tz):
+    return ts.astimezone(tz).strftime('%Y-%m-%d')
+
+
+def zone_for_location(lat, lng, zones=DELIVERY_ZONES):
+    """Delivery zone of a coordinate, or None when it is missing (AddressModel defaults it to 0, 0)"""
+    if lat is None or lng is None or (lat == 0 and lng == 0):
+        return None
+    for name, centre_lat, centre_lng, radius_km in zones:
+        d_lat = math.radians(lat - centre_lat)
+        d_lng = math.radians(lng - centre_lng)
+        a = (math.sin(d_lat / 2) ** 2
+             + math.cos(math.radians(lat)) * math.cos(math.radians(centre_lat)) * math.sin(d_lng / 2) ** 2)
+        if 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))) <= radius_km:
+            return name
+    return OUTER_ZONE
+
+
+def zone_of(doc, address_field):
+    """An explicit zone on the document or its address, else the zone of the address coordinates"""
+    address = doc.get(address_field)
+    # Older seed documents store the address as plain text
+    if not isinstance(address, dict):
+        address = {}
+    return (doc.get('zone') or address.get('zone')
+            or zone_for_location(address.get('lat'), address.get('lng')) or UNASSIGNED)
+
+
+def pack_litres(product):
+    """Litres per unit from the SKU, pack size or name ('OIL-PREM-5L', '5L Bottle')"""
+    for field in ('sku', 'packSize', 'name'):
+        match = PACK_LITRES.search(str(product.get(field) or ''))
+        if match:
+            return float(match.group(1))
+    return 0.0
+
+
+def _add(facts, path, value):
+    if value:
+        facts[path] = facts.get(path, 0) + value
+
+
+def order_facts(order, lines, litres_by_sku, tz):
+    """(day, facts) for a sales order; no facts unless it has been delivered"""
+    if order.get('status') not in SOLD_STATUSES or not order.get('createdAt'):
+        return None, {}
+    facts = {}
+    zone = zone_of(order, 'deliveryAddress')
+    revenue = order.get('totalAmount') or sum(line.get('lineTotal') or 0 for line in lines)
+    litres = 0.0
+    for line in lines:
+        sku = line.get('sku') or 'UNKNOWN'
+        line_litres = (line.get('qty') or 0) * litres_by_sku.get(sku, 0.0)
+        litres += line_litres
+        _add(facts, ('bySku', sku, 'qty'), line.get('qty') or 0)
+        _add(facts, ('bySku', sku, 'litresSold'), line_litres)
+        _add(facts, ('bySku', sku, 'revenue'), line.get('lineTotal') or 0)
+    for scope in (('totals',), ('byZone', zone)):
+        _add(facts, scope + ('orders',), 1)
+        _add(facts, scope + ('revenue',), revenue)
+        _add(facts, scope + ('litresSold',), litres)
+    return day_key(order['createdAt'], tz), facts
+
+
+def pickup_kg(pickup):
+    qty = pickup.get('actualQty')
+    uom = pickup.get('actualUom') if qty is not None else pickup.get('estimatedUom')
+    if qty is None:
+        qty = pickup.get('estimatedQty') or 0
+    return qty * UCO_KG_PER_LITRE if (uom or '').lower() in ('liter', 'litre', 'l') else qty
+
+
+def pickup_grade(pickup, cache):
+    if grade_code(pickup.get('gradeCode')):
+        return grade_code(pickup['gradeCode'])
+    score = pickup.get('qualityScore')
+    grade = cache.grade_for_score(score) if score is not None else None
+    return grade['gradeCode'] if grade else UNGRADED
+
+
+def pickup_payout(pickup, kg, grade, cache):
+    """(payout, points): the recorded payoutAmount, else the zone incentive rate times the grade multiplier
+
+    Pickups uco_grading.py rejected or found below threshold (payoutWithheld) earn nothing.
+    """
+    if pickup.get('payoutWithheld'):
+        return 0.0, 0.0
+    zone = zone_of(pickup, 'pickupAddress')
+    incentive = cache.incentive_for(zone, pickup.get('customerType'), kg)
+    # qualityMultipliers is keyed by grade label ('Premium A'), grades by gradeCode
+    multiplier = ((incentive or {}).get('qualityMultipliers') or {}).get(GRADE_LABELS.get(grade), 1.0)
+    if pickup.get('incentiveType') == 'Points':
+        return 0.0, kg * (incentive or {}).get('pointsPerKg', 0) * multiplier
+    if pickup.get('payoutAmount') is not None:
+        return pickup['payoutAmount'], 0.0
+    rate = (incentive or {}).get(PAYOUT_RATE_FIELDS.get(pickup.get('incentiveType'), 'cashRatePerKg'), 0)
+    return kg * rate * multiplier, 0.0
+
+
+def pickup_facts(pickup, cache, tz):
+    """(day, facts) for a UCO pickup; no facts until it has been collected"""
+    if pickup.get('status') not in COLLECTED_STATUSES or not pickup.get('createdAt'):
+        return None, {}
+    facts = {}
+    kg = pickup_kg(pickup)
+    grade = pickup_grade(pickup, cache)
+    payout, points = pickup_payout(pickup, kg, grade, cache)
+    for scope in (('totals',), ('byZone', zone_of(pickup, 'pickupAddress')), ('byGrade', grade)):
+        _add(facts, scope + ('pickups',), 1)
+        _add(facts, scope + ('kgCollected',), kg)
+        _add(facts, scope + ('payouts',), payout)
+        _add(facts, scope + ('points',), points)
+    return day_key(pickup['createdAt'], tz), facts
+
+
+def fact_delta(old_key, old_facts, new_key, new_facts):
+    """{key: {path: change}} that turns the old contribution into the new one
+
+    key is what the facts roll up into: a day here, a customerAccountId in credit_exposure.py.
+    """
+    delta = defaultdict(dict)
+    for path, value in old_facts.items():
+        delta[old_key][path] = -value
+    for path, value in new_facts.items():
+        delta[new_key][path] = delta[new_key].get(path, 0) + value
+    rounded = {key: {p: round(v, 6) for p, v in changes.items() if round(v, 6)}
+               for key, changes in delta.items() if key}
+    return {key: changes for key, changes in rounded.items() if changes}
+
+
+def nest(facts, leaf=lambda v: v):
+    """{('byZone', 'North', 'revenue'): 5} -> {'byZone': {'North': {'revenue': 5}}}"""
+    doc = {}
+    for path, value in facts.items():
+        node = doc
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = leaf(value)
+    return doc
+
+
+def ledger_entry(source, doc_id, key, facts, key_field='day'):
+    """Ledger document recording what one source document contributed to key
+
+    A path is a tuple of nested field names; a plain field name is stored as a one-part path.
+    """
+    return {
+        'source': source,
+        'refId': doc_id,
+        key_field: key,
+        'facts': [{'path': list(path) if isinstance(path, tuple) else [path], 'value': value}
+                  for path, value in facts.items()],
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }
+
+
+def ledger_facts(data, key_field='day'):
+    """(key, facts) back from a ledger document; one-part paths come back as plain field names"""
+    if not data:
+        return None, {}
+    facts = {}
+    for fact in data.get('facts', []):
+        path = fact['path']
+        facts[tuple(path) if len(path) > 1 else path[0]] = fact['value']
+    return data.get(key_field), facts
+
+
+class RollupJob:
+    """Shared state for one run: clients, config cache, SKU litres and the report timezone"""
+
+    def __init__(self, db, cache, tz, concurrency=DEFAULT_CONCURRENCY):
+        self.db = db
+        self.cache = cache
+        self.tz = tz
+        self.limiter = asyncio.Semaphore(concurrency)
+        self.litres_by_sku = {}
+        self.counts = defaultdict(int)
+
+    async def load_products(self):
+        for collection in ('products_cache', 'config_products'):
+            async for doc in self.db.collection(collection).stream():
+                product = doc.to_dict()
+                litres = pack_litres(product)
+                if product.get('sku') and litres:
+                    self.litres_by_sku.setdefault(product['sku'], litres)
+
+    async def order_lines(self, order_ids):
+        """Lines of the given orders, grouped by orderId, fetched in concurrent 'in' queries"""
+        lines = defaultdict(list)
+
+        async def fetch(ids):
+            async with self.limiter:
+                query = self.db.collection('sales_order_lines').where(filter=FieldFilter('orderId', 'in', ids))
+                async for doc in query.stream():
+                    line = doc.to_dict()
+                    lines[line.get('orderId')].append(line)
+
+        await asyncio.gather(*(fetch(ids) for ids in chunked(list(order_ids), IN_QUERY_LIMIT)))
+        return lines
+
+    async def facts_for(self, source, docs):
+        """{doc_id: (day, facts)} for sales_orders or pickup_requests snapshots"""
+        if source == 'pickup_requests':
+            return {doc.id: pickup_facts(doc.to_dict(), self.cache, self.tz) for doc in docs}
+        orders = {doc.id: doc.to_dict() for doc in docs}
+        lines = await self.order_lines([i for i, o in orders.items() if o.get('status') in SOLD_STATUSES])
+        return {i: order_facts(o, lines.get(i, []), self.litres_by_sku, self.tz) for i, o in orders.items()}
+
+    # ==================== INCREMENTAL ====================
+
+    async def apply_changes(self, source, docs):
+        """Fold changed documents into the rollups: retract each one's ledgered contribution, add the new one
+
+        A document's ledger entry and the rollup increments it causes commit in the same batch,
+        so re-processing a document (overlapping watermark, retried run) changes nothing.
+        """
+        new = await self.facts_for(source, docs)
+        refs = [self.db.collection(LEDGER_COLLECTION).document(f'{source}_{doc.id}') for doc in docs]
+        async with self.limiter:
+            snapshots = await self.db.get_all(refs)
+        old = {snap.id: ledger_facts(snap.to_dict() if snap.exists else None) for snap in snapshots}
+
+        batch = self.db.batch()
+        per_day = defaultdict(dict)
+        for doc, ref in zip(docs, refs):
+            old_day, old_facts = old.get(ref.id, (None, {}))
+            new_day, new_facts = new[doc.id]
+            if (old_day, old_facts) == (new_day, new_facts):
+                continue
+            for day, changes in fact_delta(old_day, old_facts, new_day, new_facts).items():
+                for path, change in changes.items():
+                    per_day[day][path] = per_day[day].get(path, 0) + change
+            if new_facts:
+                batch.set(ref, ledger_entry(source, doc.id, new_day, new_facts))
+            else:
+                batch.delete(ref)
+            self.counts[f'{source} changed'] += 1
+
+        for day, changes in per_day.items():
+            update = nest(changes, leaf=firestore.Increment)
+            update.update({'date': day, 'updatedAt': firestore.SERVER_TIMESTAMP})
+            batch.set(self.db.collection(ROLLUP_COLLECTION).document(day), update, merge=True)
+        if len(batch):
+            async with self.limiter:
+                await batch.commit()
+        self.counts['rollup day writes'] += len(per_day)
+
+    async def incremental(self):
+        state_ref = self.db.collection(STATE_COLLECTION).document(STATE_DOC)
+        state = (await state_ref.get()).to_dict() or {}
+        watermarks = {}
+        for source in ('sales_orders', 'pickup_requests'):
+            since = state.get(source) or EPOCH
+            print(f"\n🔎 {source}: changes since {since.isoformat()}")
+            # >= rather than >: documents sharing the watermark timestamp are re-read, and are no-ops
+            query = (self.db.collection(source)
+                     .where(filter=FieldFilter('lastStatusAt', '>=', since))
+                     .order_by('lastStatusAt'))
+            docs = [doc async for doc in query.stream()]
+            self.counts[f'{source} read'] += len(docs)
+            await asyncio.gather(*(self.apply_changes(source, chunk) for chunk in chunked(docs, CHUNK_SIZE)))
+            watermarks[source] = max((d.get('lastStatusAt') for d in docs if d.get('lastStatusAt')), default=since)
+            print(f"   ✓ {len(docs)} read, {self.counts[f'{source} changed']} changed")
+        watermarks['updatedAt'] = firestore.SERVER_TIMESTAMP
+        await state_ref.set(watermarks, merge=True)
+
+    # ==================== BACKFILL ====================
+
+    def _bounds(self, first, last):
+        start = datetime.combine(first, datetime.min.time(), self.tz)
+        end = datetime.combine(last + timedelta(days=1), datetime.min.time(), self.tz)
+        return start, end
+
+    async def backfill_partition(self, first, last):
+        """Recompute rollups for the days first..last from scratch and reset the ledger for their documents"""
+        start, end = self._bounds(first, last)
+        per_day = defaultdict(dict)
+        writes = []
+        for source in ('sales_orders', 'pickup_requests'):
+            query = (self.db.collection(source)
+                     .where(filter=FieldFilter('createdAt', '>=', start))
+                     .where(filter=FieldFilter('createdAt', '<', end)))
+            async with self.limiter:
+                docs = [doc async for doc in query.stream()]
+            self.counts[f'{source} read'] += len(docs)
+            for doc_id, (day, facts) in (await self.facts_for(source, docs)).items():
+                ref = self.db.collection(LEDGER_COLLECTION).document(f'{source}_{doc_id}')
+                # Deleting also clears entries for documents that stopped counting
+                writes.append((ref, ledger_entry(source, doc_id, day, facts) if facts else None))
+                for path, value in facts.items():
+                    per_day[day][path] = per_day[day].get(path, 0) + value
+
+        day = first
+        while day <= last:
+            key = day.isoformat()
+            rollup = nest({p: round(v, 6) for p, v in per_day.get(key, {}).items()})
+            rollup.update({'date': key, 'updatedAt': firestore.SERVER_TIMESTAMP})
+            writes.append((self.db.collection(ROLLUP_COLLECTION).document(key), rollup))
+            day += timedelta(days=1)
+
+        async def commit(chunk):
+            batch = self.db.batch()
+            for ref, data in chunk:
+                if data is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, data)
+            async with self.limiter:
+                await batch.commit()
+
+        await asyncio.gather(*(commit(c) for c in chunked(writes, MAX_BATCH_WRITES)))
+        self.counts['rollup day writes'] += (last - first).days + 1
+        print(f"   ✓ {first} → {last}: {sum(1 for _, d in writes if d is not None)} documents written")
+
+    async def backfill(self, first, last, partitions):
+        # Taken before reading so anything changed during the backfill is picked up incrementally
+        started = datetime.now(timezone.utc)
+        days = (last - first).days + 1
+        size = max(1, -(-days // partitions))
+        ranges = []
+        day = first
+        while day <= last:
+            ranges.append((day, min(last, day + timedelta(days=size - 1))))
+            day += timedelta(days=size)
+        print(f"\n🧮 Backfilling {days} day(s) in {len(ranges)} partition(s)...")
+        await asyncio.gather(*(self.backfill_partition(a, b) for a, b in ranges))
+        await self.db.collection(STATE_COLLECTION).document(STATE_DOC).set({
+            'sales_orders': started,
+            'pickup_requests': started,
+            'updatedAt': firestore.SERVER_TIMESTAMP,
+        }, merge=True)
+
+
+async def show(db, day):
+    snap = await db.collection(ROLLUP_COLLECTION).document(day).get()
+    if not snap.exists:
+        print(f"⚠️  No rollup for {day}")
+        return
+    data = snap.to_dict()
+    print(f"\n📊 Rollup {day}")
+    for section in ('totals', 'byZone', 'bySku', 'byGrade'):
+        values = data.get(section) or {}
+        if section == 'totals':
+            print(f"   totals: {values}")
+            continue
+        print(f"   {section}:")
+        for key in sorted(values):
+            print(f"      {key:<24} {values[key]}")
+
+
+def parse_day(text):
+    return date.fromisoformat(text)
+
+
+async def run(args):
+    tz = ZoneInfo(args.tz)
+    db = async_client(job='daily_rollups', args=args)
+    if args.show:
+        await show(db, args.show)
+        return
+
+    # Grades and incentives price pickups that carry no payoutAmount; read once per run
+    cache = ConfigCache(sync_client(job='daily_rollups', args=args),
+                        collections=('config_uco_grades', 'config_uco_incentives'), listen=False).load()
+    job = RollupJob(db, cache, tz, concurrency=args.concurrency)
+    await job.load_products()
+
+    started = time.perf_counter()
+    if args.backfill:
+        last = args.to or datetime.now(tz).date()
+        await job.backfill(args.from_day, last, args.partitions)
+    else:
+        await job.incremental()
+
+    print(f"\n✅ Rollups updated in {time.perf_counter() - started:.2f}s")
+    for name, count in sorted(job.counts.items()):
+        print(f"   • {name}: {count}")
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--backfill', action='store_true', help='rebuild a date range instead of running incrementally')
+    parser.add_argument('--from', dest='from_day', type=parse_day, metavar='YYYY-MM-DD',
+                        help='first day to backfill (required with --backfill)')
+    parser.add_argument('--to', type=parse_day, metavar='YYYY-MM-DD', help='last day to backfill (default today)')
+    parser.add_argument('--partitions', type=int, default=8, help='parallel date partitions for --backfill (default 8)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'maximum in-flight Firestore RPCs (default {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--tz', default=DEFAULT_TIMEZONE, help=f'timezone for day boundaries (default {DEFAULT_TIMEZONE})')
+    parser.add_argument('--show', metavar='YYYY-MM-DD', help='print one rollup document and exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.backfill and not args.from_day:
+        parser.error('--backfill requires --from')
+
+    print("📈 Oil Manager daily rollups")
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Batch driver assignment for approved Oil Manager pickups
+Scores every (driver, pending pickup) pair on distance from driver_locations, remaining
+vehicle capacity against estimatedQty, overlap with the driver's booked windows and current
+job load, solves the whole assignment as one min-cost bipartite matching, and writes the
+resulting jobs with the pickups moved to DriverAssigned
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+except ImportError:
+    print("❌ numpy/scipy not installed. Run: pip install numpy scipy")
+    sys.exit(1)
+
+try:
+    from firebase_admin import firestore
+    from google.api_core.exceptions import FailedPrecondition, NotFound
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from config_cache import ConfigCache
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import MAX_BATCH_WRITES, chunked, sync_client
+
+EARTH_RADIUS_KM = 6371.0
+OPEN_JOB_STATUSES = ['Assigned', 'EnRoute', 'Arrived']
+PENDING_PICKUP_STATUS = 'Approved'
+ASSIGNED_PICKUP_STATUS = 'DriverAssigned'
+
+# Defaults for drivers without metadata.vehicleCapacity and for the per-driver job cap;
+# config_system_settings can override them with VEHICLE_CAPACITY_LITERS / DISPATCH_MAX_JOBS_PER_DRIVER
+DEFAULT_VEHICLE_CAPACITY = 500.0
+DEFAULT_MAX_JOBS = 12
+
+# Cost is in kilometres of driving: each job already on the route costs like LOAD_KM of detour,
+# and a pickup window fully covered by the driver's booked windows like BUSY_KM
+LOAD_KM = 2.0
+BUSY_KM = 8.0
+DEFAULT_MAX_DISTANCE_KM = 40.0
+# Candidate drivers kept per pickup (nearest first); the rest never make the matching
+CANDIDATE_DRIVERS = 12
+# Leaving a pickup unassigned costs more than any real edge, so it only happens when forced
+UNASSIGNED_COST = 1e6
+# Re-solve rounds for pickups bumped because a driver's picks overflowed the vehicle
+REPAIR_ROUNDS = 3
+
+
+# ============================================================
+# SCORING
+# ============================================================
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between broadcastable coordinate arrays"""
+    lat1, lng1, lat2, lng2 = (np.radians(v) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def window_overlap(starts, ends, busy_starts, busy_ends):
+    """(busy × windows) share of each window covered by each busy interval, epoch seconds"""
+    covered = np.minimum(ends[None, :], busy_ends[:, None]) - np.maximum(starts[None, :], busy_starts[:, None])
+    return np.clip(covered, 0, None) / np.maximum(ends - starts, 1.0)[None, :]
+
+
+class Fleet:
+    """Column arrays for the drivers taking part in one solve"""
+
+    def __init__(self, uids, vehicle_ids, lat, lng, capacity, load, max_jobs):
+        self.uids = list(uids)
+        self.vehicle_ids = list(vehicle_ids)
+        self.lat = np.asarray(lat, dtype=float)
+        self.lng = np.asarray(lng, dtype=float)
+        self.capacity = np.asarray(capacity, dtype=float)
+        self.load = np.asarray(load, dtype=int)
+        self.slots = np.clip(max_jobs - self.load, 0, None)
+
+    def __len__(self):
+        return len(self.uids)
+
+
+class Pickups:
+    """Column arrays for the pending pickups taking part in one solve"""
+
+    def __init__(self, ids, lat, lng, qty, window_start, window_end):
+        self.ids = list(ids)
+        self.lat = np.asarray(lat, dtype=float)
+        self.lng = np.asarray(lng, dtype=float)
+        self.qty = np.asarray(qty, dtype=float)
+        self.window_start = np.asarray(window_start, dtype=float)
+        self.window_end = np.asarray(window_end, dtype=float)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class AssignmentSolver:
+    """Min-cost assignment of pickups to driver job slots
+
+    Driver d is expanded into one column per free job slot; slot k costs k * LOAD_KM more than
+    slot 0, so spreading work is preferred to stacking it. Each pickup only gets edges to its
+    nearest CANDIDATE_DRIVERS drivers within max_km that can carry it, plus a private
+    "unassigned" column, which keeps the graph sparse and a full matching always possible.
+    Vehicle capacity is checked per pair during the solve and cumulatively afterwards;
+    pickups that overflow a vehicle are re-solved against what is left.
+    """
+
+    def __init__(self, fleet, pickups, busy=None, max_km=DEFAULT_MAX_DISTANCE_KM, candidates=CANDIDATE_DRIVERS):
+        self.fleet = fleet
+        self.pickups = pickups
+        self.busy = busy
+        self.max_km = max_km
+        self.candidates = candidates
+        self.distance = haversine_km(pickups.lat[:, None], pickups.lng[:, None], fleet.lat[None, :], fleet.lng[None, :])
+        self.stats = {'edges': 0, 'rounds': 0, 'bumped': 0}
+
+    def costs(self, rows, capacity, slots):
+        """(pickup rows × drivers) cost, inf where the pair is not allowed"""
+        cost = self.distance[rows] + LOAD_KM * self.fleet.load[None, :]
+        if self.busy is not None:
+            cost = cost + BUSY_KM * self.busy[:, rows].T
+        blocked = ((self.distance[rows] > self.max_km)
+                   | (self.pickups.qty[rows][:, None] > capacity[None, :])
+                   | (slots[None, :] == 0))
+        cost[blocked] = np.inf
+        return cost
+
+    def match(self, rows, capacity, slots):
+        """{pickup row: driver} for one matching round over the given pickups"""
+        cost = self.costs(rows, capacity, slots)
+        n, drivers = cost.shape
+        keep = min(self.candidates, drivers)
+        nearest = np.argpartition(cost, keep - 1, axis=1)[:, :keep] if keep < drivers else \
+            np.broadcast_to(np.arange(drivers), (n, drivers))
+        depth = int(slots.max()) if len(slots) else 0
+
+        edge_rows = np.repeat(np.arange(n), keep * depth)
+        edge_drivers = np.repeat(nearest, depth, axis=1).ravel()
+        edge_slots = np.tile(np.arange(depth), n * keep)
+        edge_cost = cost[edge_rows, edge_drivers] + LOAD_KM * edge_slots
+        usable = np.isfinite(edge_cost) & (edge_slots < slots[edge_drivers])
+        edge_rows, edge_cost = edge_rows[usable], edge_cost[usable]
+        edge_cols = edge_drivers[usable] * depth + edge_slots[usable]
+        self.stats['edges'] += len(edge_rows)
+
+        # Private "unassigned" column per pickup; +1 keeps zero-distance edges from reading as absent
+        unassigned = drivers * depth + np.arange(n)
+        graph = csr_matrix((np.concatenate([edge_cost + 1.0, np.full(n, UNASSIGNED_COST)]),
+                            (np.concatenate([edge_rows, np.arange(n)]), np.concatenate([edge_cols, unassigned]))),
+                           shape=(n, drivers * depth + n))
+        matched_rows, matched_cols = min_weight_full_bipartite_matching(graph)
+        return {rows[r]: c // depth for r, c in zip(matched_rows, matched_cols) if c < drivers * depth}
+
+    def solve(self):
+        """{pickup index: (driver index, cost)} for every pickup that could be placed"""
+        capacity = self.fleet.capacity.copy()
+        slots = self.fleet.slots.copy()
+        rows = np.arange(len(self.pickups))
+        assigned = {}
+        for _ in range(REPAIR_ROUNDS):
+            if not len(rows) or not slots.any():
+                break
+            self.stats['rounds'] += 1
+            picks = self.match(rows, capacity, slots)
+            by_driver = {}
+            for row, driver in picks.items():
+                by_driver.setdefault(driver, []).append(row)
+            bumped = []
+            for driver, driver_rows in by_driver.items():
+                # Cheapest picks keep their place in the vehicle; the rest try again next round
+                driver_rows.sort(key=lambda r: self.distance[r, driver])
+                for row in driver_rows:
+                    if self.pickups.qty[row] <= capacity[driver] and slots[driver] > 0:
+                        capacity[driver] -= self.pickups.qty[row]
+                        slots[driver] -= 1
+                        assigned[row] = driver
+                    else:
+                        bumped.append(row)
+            self.stats['bumped'] += len(bumped)
+            rows = np.array(sorted(bumped), dtype=int)
+        base = self.costs(np.arange(len(self.pickups)), self.fleet.capacity, self.fleet.slots)
+        return {row: (driver, float(base[row, driver])) for row, driver in assigned.items()}
+
+
+# ============================================================
+# JOB
+# ============================================================
+
+def _epoch(value, default):
+    return value.timestamp() if isinstance(value, datetime) else default
+
+
+class AssignmentJob:
+    def __init__(self, db, cache, max_km=DEFAULT_MAX_DISTANCE_KM, dispatcher_uid='system'):
+        self.db = db
+        self.max_km = max_km
+        self.dispatcher_uid = dispatcher_uid
+        self.default_capacity = float(cache.get_setting('VEHICLE_CAPACITY_LITERS', DEFAULT_VEHICLE_CAPACITY))
+        self.max_jobs = int(cache.get_setting('DISPATCH_MAX_JOBS_PER_DRIVER', DEFAULT_MAX_JOBS))
+        self.counts = {'drivers': 0, 'pickups': 0, 'drivers without location': 0, 'pickups without coordinates': 0}
+
+    def open_jobs(self):
+        query = self.db.collection('jobs').where(filter=FieldFilter('status', 'in', OPEN_JOB_STATUSES))
+        return [s.to_dict() for s in query.stream()]
+
+    def committed_qty(self, jobs):
+        """{pickupId: estimatedQty} for pickups already on a driver's route"""
+        ids = [j['refId'] for j in jobs if j.get('jobType') == 'Pickup' and j.get('refId')]
+        qty = {}
+        for chunk in chunked(ids, MAX_BATCH_WRITES):
+            refs = [self.db.collection('pickup_requests').document(i) for i in chunk]
+            for snap in self.db.get_all(refs, field_paths=['estimatedQty']):
+                if snap.exists:
+                    qty[snap.id] = float(snap.get('estimatedQty') or 0)
+        return qty
+
+    def load_fleet(self, jobs):
+        locations = {s.id: s.to_dict() for s in self.db.collection('driver_locations').stream()}
+        query = self.db.collection('users').where(filter=FieldFilter('role', '==', 'driver'))
+        committed = self.committed_qty(jobs)
+        load, used = {}, {}
+        for job in jobs:
+            uid = job.get('assignedDriverUid')
+            load[uid] = load.get(uid, 0) + 1
+            used[uid] = used.get(uid, 0.0) + committed.get(job.get('refId'), 0.0)
+
+        rows = []
+        for snap in query.stream():
+            user = snap.to_dict()
+            if not user.get('isActive', True):
+                continue
+            location = locations.get(snap.id)
+            if not location or location.get('lat') is None:
+                self.counts['drivers without location'] += 1
+                continue
+            meta = user.get('metadata') or {}
+            capacity = float(meta.get('vehicleCapacity') or self.default_capacity)
+            rows.append((snap.id, meta.get('vehicleId', ''), location['lat'], location['lng'],
+                         max(0.0, capacity - used.get(snap.id, 0.0)), load.get(snap.id, 0)))
+        self.counts['drivers'] = len(rows)
+        return Fleet(*zip(*rows), max_jobs=self.max_jobs) if rows else None
+
+    def load_pickups(self, jobs):
+        """Approved pickups that are not already on a job, with their snapshots for preconditions"""
+        scheduled = {j.get('refId') for j in jobs if j.get('jobType') == 'Pickup'}
+        query = self.db.collection('pickup_requests').where(filter=FieldFilter('status', '==', PENDING_PICKUP_STATUS))
+        now = datetime.now(timezone.utc).timestamp()
+        rows, snaps = [], []
+        for snap in query.stream():
+            if snap.id in scheduled:
+                continue
+            pickup = snap.to_dict()
+            address = pickup.get('pickupAddress') or {}
+            if not isinstance(address, dict) or not address.get('lat') or not address.get('lng'):
+                self.counts['pickups without coordinates'] += 1
+                continue
+            start = _epoch(pickup.get('preferredWindowStart'), now)
+            end = _epoch(pickup.get('preferredWindowEnd'), start + 3600)
+            rows.append((snap.id, address['lat'], address['lng'], float(pickup.get('estimatedQty') or 0), start, end))
+            snaps.append(snap)
+        self.counts['pickups'] = len(rows)
+        return (Pickups(*zip(*rows)) if rows else None), snaps
+
+    def busy_matrix(self, fleet, pickups, jobs):
+        """(drivers × pickups) how much of each pickup window the driver's open jobs already cover"""
+        index = {uid: i for i, uid in enumerate(fleet.uids)}
+        booked = [(index[j['assignedDriverUid']], j['windowStart'].timestamp(), j['windowEnd'].timestamp())
+                  for j in jobs if j.get('assignedDriverUid') in index
+                  and isinstance(j.get('windowStart'), datetime) and isinstance(j.get('windowEnd'), datetime)]
+        busy = np.zeros((len(fleet), len(pickups)))
+        for chunk in chunked(booked, 1000):
+            drivers, starts, ends = (np.array(col) for col in zip(*chunk))
+            np.add.at(busy, drivers, window_overlap(pickups.window_start, pickups.window_end, starts, ends))
+        return busy
+
+    def run(self):
+        print("\n📦 Loading drivers, open jobs and approved pickups...")
+        started = time.perf_counter()
+        jobs = self.open_jobs()
+        fleet = self.load_fleet(jobs)
+        pickups, snaps = self.load_pickups(jobs)
+        print(f"   ✓ {self.counts['drivers']} driver(s), {len(jobs)} open job(s), {self.counts['pickups']} "
+              f"pickup(s) in {time.perf_counter() - started:.1f}s")
+        if fleet is None or pickups is None:
+            return None, None, {}, []
+
+        started = time.perf_counter()
+        solver = AssignmentSolver(fleet, pickups, self.busy_matrix(fleet, pickups, jobs), self.max_km)
+        assigned = solver.solve()
+        print(f"   ✓ Solved {len(pickups)} × {len(fleet)} in {time.perf_counter() - started:.2f}s "
+              f"({solver.stats['edges']:,} candidate edges, {solver.stats['rounds']} round(s))")
+        return fleet, pickups, assigned, snaps
+
+    def documents(self, fleet, pickups, assigned):
+        """(pickup index, job document) pairs, numbered per driver in window order"""
+        by_driver = {}
+        for row, (driver, cost) in assigned.items():
+            by_driver.setdefault(driver, []).append(row)
+        docs = []
+        for driver, rows in by_driver.items():
+            rows.sort(key=lambda r: pickups.window_start[r])
+            for sequence, row in enumerate(rows, start=int(fleet.load[driver]) + 1):
+                window_start = datetime.fromtimestamp(pickups.window_start[row], timezone.utc)
+                docs.append((row, {
+                    'jobType': 'Pickup',
+                    'refId': pickups.ids[row],
+                    'stopSequence': sequence,
+                    'assignedDriverUid': fleet.uids[driver],
+                    'assignedVehicleId': fleet.vehicle_ids[driver],
+                    'scheduledDate': window_start,
+                    'windowStart': window_start,
+                    'windowEnd': datetime.fromtimestamp(pickups.window_end[row], timezone.utc),
+                    'status': 'Assigned',
+                    'dispatcherUid': self.dispatcher_uid,
+                    'distanceKm': round(float(haversine_km(pickups.lat[row], pickups.lng[row],
+                                                           fleet.lat[driver], fleet.lng[driver])), 2),
+                    'assignmentCost': round(assigned[row][1], 2),
+                    'createdAt': firestore.SERVER_TIMESTAMP,
+                }))
+        return docs
+
+    def _stage(self, batch, snap, job):
+        job_ref = self.db.collection('jobs').document()
+        batch.set(job_ref, job)
+        # Precondition: a pickup edited or assigned by hand since it was read is left alone
+        batch.update(snap.reference, {
+            'status': ASSIGNED_PICKUP_STATUS,
+            'assignedJobId': job_ref.id,
+            'lastStatusAt': firestore.SERVER_TIMESTAMP,
+        }, option=self.db.write_option(last_update_time=snap.update_time))
+
+    def write(self, docs, snaps):
+        """Commit jobs and pickup updates together; returns (written, conflicts)"""
+        written = conflicts = 0
+        for chunk in chunked(docs, MAX_BATCH_WRITES // 2):
+            batch = self.db.batch()
+            for row, job in chunk:
+                self._stage(batch, snaps[row], job)
+            try:
+                batch.commit()
+                written += len(chunk)
+                continue
+            except (FailedPrecondition, NotFound):
+                pass
+            # Some pickup in the chunk changed or was deleted underneath us: retry pair by pair, skipping those
+            for row, job in chunk:
+                batch = self.db.batch()
+                self._stage(batch, snaps[row], job)
+                try:
+                    batch.commit()
+                    written += 1
+                except (FailedPrecondition, NotFound):
+                    conflicts += 1
+        return written, conflicts
+
+
+def benchmark(drivers, pickups):
+    """Solve a synthetic Bangkok-sized instance; returns (seconds, assigned, solver)"""
+    rng = np.random.default_rng(11)
+    now = datetime.now(timezone.utc).timestamp()
+    fleet = Fleet([f'driver_{i}' for i in range(drivers)], [f'VH{i:04d}' for i in range(drivers)],
+                  rng.uniform(13.55, 13.95, drivers), rng.uniform(100.35, 100.85, drivers),
+                  rng.uniform(200, 800, drivers), rng.integers(0, 4, drivers), max_jobs=DEFAULT_MAX_JOBS)
+    starts = now + 3600 * rng.integers(8, 18, pickups)
+    work = Pickups([f'pickup_{i}' for i in range(pickups)], rng.uniform(13.55, 13.95, pickups),
+                   rng.uniform(100.35, 100.85, pickups), rng.gamma(2.0, 25.0, pickups), starts, starts + 7200)
+    started = time.perf_counter()
+    solver = AssignmentSolver(fleet, work)
+    assigned = solver.solve()
+    return time.perf_counter() - started, assigned, solver
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--max-km', type=float, default=DEFAULT_MAX_DISTANCE_KM,
+                        help=f'never assign a pickup further than this from the driver (default {DEFAULT_MAX_DISTANCE_KM:g})')
+    parser.add_argument('--dispatcher', default='system', help='dispatcherUid recorded on the jobs (default system)')
+    parser.add_argument('--dry-run', action='store_true', help='solve and print the plan without writing')
+    parser.add_argument('--benchmark', type=int, nargs=2, metavar=('DRIVERS', 'PICKUPS'),
+                        help='time the solver on a synthetic instance, then exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        seconds, assigned, solver = benchmark(*args.benchmark)
+        print(f"⏱️  Assigned {len(assigned)}/{args.benchmark[1]} pickups to {args.benchmark[0]} drivers "
+              f"in {seconds:.2f}s ({solver.stats['edges']:,} edges, {solver.stats['bumped']} bumped for capacity)")
+        return
+
+    print("🚚 Oil Manager driver assignment")
+    db = sync_client(args=args)
+    cache = ConfigCache(db, collections=('config_system_settings',), listen=False).load()
+    job = AssignmentJob(db, cache, args.max_km, args.dispatcher)
+    fleet, pickups, assigned, snaps = job.run()
+    docs = job.documents(fleet, pickups, assigned) if assigned else []
+
+    for row, doc in docs[:20]:
+        print(f"   {doc['refId']:<22} → {doc['assignedDriverUid']:<18} stop {doc['stopSequence']:<3} "
+              f"{doc['distanceKm']:>6.1f} km")
+    if len(docs) > 20:
+        print(f"   … {len(docs) - 20} more")
+
+    unassigned = (len(pickups) if pickups is not None else 0) - len(docs)
+    written = conflicts = 0
+    if docs and not args.dry_run:
+        written, conflicts = job.write(docs, snaps)
+    print(f"\n✅ Assignment finished{' (dry run)' if args.dry_run else ''}")
+    print(f"   • jobs planned: {len(docs)}")
+    if not args.dry_run:
+        print(f"   • jobs written: {written} ({conflicts} pickup(s) changed meanwhile, skipped)")
+    print(f"   • left unassigned: {unassigned}")
+    for name, count in job.counts.items():
+        print(f"   • {name}: {count}")
+
+
+if __name__ == '__main__':
+    main()
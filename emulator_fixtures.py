@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Emulator fixtures for Oil Manager integration tests
+pytest plugin that boots the local Firestore and Auth emulators once per session,
+seeds a named dataset from the bootstrap task graph, snapshots it, and puts it back
+before every test with an emulator-side clear and batched rewrite instead of re-seeding.
+Load it with `pytest -p emulator_fixtures`; per-test restore timing is reported at the end
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pytest
+except ImportError:
+    print("❌ pytest not installed. Run: pip install pytest")
+    sys.exit(1)
+
+try:
+    from firebase_admin import auth
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from maintenance_runtime import DEFAULT_CONCURRENCY, MAX_BATCH_WRITES, async_client, chunked, sync_client
+
+EMULATOR_PROJECT_ID = 'demo-oil-manager'
+FIRESTORE_EMULATOR_HOST = '127.0.0.1:8080'
+AUTH_EMULATOR_HOST = '127.0.0.1:9099'
+STARTUP_TIMEOUT = 60
+
+WORKFLOW_JOBS = ['workflow_instances', 'approval_requests', 'exceptions', 'audit_log']
+
+# Dataset name → bootstrap_environment job patterns to seed it from
+DATASETS = {
+    'full': ['*'],
+    'config': ['config_*'],
+    'workflow': WORKFLOW_JOBS,
+    'users': ['users'],
+    'empty': [],
+}
+
+
+def dataset_jobs(name):
+    """bootstrap_environment job names for a dataset (dependencies are added by the graph)"""
+    from bootstrap_environment import graph
+    if name not in DATASETS:
+        raise KeyError(f"unknown dataset '{name}' (choose from {', '.join(DATASETS)})")
+    return [job for job in graph.jobs if any(fnmatch.fnmatch(job, p) for p in DATASETS[name])]
+
+
+def _port_open(host):
+    address, _, port = host.rpartition(':')
+    try:
+        with socket.create_connection((address, int(port)), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+def _emulator_request(host, path, method='GET'):
+    request = urllib.request.Request(f'http://{host}{path}', method=method,
+                                     headers={'Authorization': 'Bearer owner'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.read()
+
+
+def snapshot_documents(db):
+    """Every document keyed by path, subcollections included"""
+    documents = {}
+    for collection in db.collections():
+        for snap in collection.recursive().stream():
+            documents[snap.reference.path] = snap.to_dict()
+    return documents
+
+
+# ============================================================
+# EMULATOR SESSION
+# ============================================================
+
+class EmulatorSession:
+    """One emulator pair for the whole run, plus a snapshot per dataset
+
+    restore() clears the Firestore emulator with its DELETE documents endpoint and
+    rewrites the snapshot in concurrent 500-write batches. It runs before every test:
+    writes from the app, the REST API or another process never show up in this
+    process's metrics, so there is no cheap way to prove the emulator is unchanged.
+    """
+
+    def __init__(self, project=None):
+        self.project = project or os.environ.get('GCLOUD_PROJECT', EMULATOR_PROJECT_ID)
+        self.firestore_host = os.environ.get('FIRESTORE_EMULATOR_HOST', FIRESTORE_EMULATOR_HOST)
+        self.auth_host = os.environ.get('FIREBASE_AUTH_EMULATOR_HOST', AUTH_EMULATOR_HOST)
+        self.process = None
+        self.workdir = None
+        self.snapshots = {}
+        self.db = None
+        self._async_db = None
+        self._loop = None
+
+    # ==================== LIFECYCLE ====================
+
+    def start(self):
+        """Attach to running emulators, or boot them with the firebase CLI"""
+        if not (_port_open(self.firestore_host) and _port_open(self.auth_host)):
+            self._boot()
+        os.environ['FIRESTORE_EMULATOR_HOST'] = self.firestore_host
+        os.environ['FIREBASE_AUTH_EMULATOR_HOST'] = self.auth_host
+        os.environ['GCLOUD_PROJECT'] = self.project
+        self.db = sync_client(job='emulator_fixtures')
+
+        # One loop for the whole session: the async client is bound to the loop it was created on
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='emulator-seeder', daemon=True).start()
+        return self
+
+    def _boot(self):
+        if shutil.which('firebase') is None:
+            raise RuntimeError('Firestore/Auth emulators are not running and the firebase CLI is not installed '
+                               '(npm install -g firebase-tools)')
+        self.workdir = tempfile.mkdtemp(prefix='oil-manager-emulator-')
+        config = {'emulators': {
+            'firestore': {'host': self.firestore_host.rpartition(':')[0], 'port': int(self.firestore_host.rpartition(':')[2])},
+            'auth': {'host': self.auth_host.rpartition(':')[0], 'port': int(self.auth_host.rpartition(':')[2])},
+            'ui': {'enabled': False},
+            'singleProjectMode': True,
+        }}
+        with open(os.path.join(self.workdir, 'firebase.json'), 'w') as fh:
+            json.dump(config, fh)
+        self.process = subprocess.Popen(
+            ['firebase', 'emulators:start', '--only', 'firestore,auth', '--project', self.project],
+            cwd=self.workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        deadline = time.time() + STARTUP_TIMEOUT
+        while not (_port_open(self.firestore_host) and _port_open(self.auth_host)):
+            if self.process.poll() is not None:
+                raise RuntimeError(f'firebase emulators:start exited with code {self.process.returncode}')
+            if time.time() > deadline:
+                self.stop()
+                raise RuntimeError(f'emulators did not start within {STARTUP_TIMEOUT}s')
+            time.sleep(0.25)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+        if self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+    # ==================== DATASETS ====================
+
+    def clear(self):
+        _emulator_request(self.firestore_host, f'/emulator/v1/projects/{self.project}/databases/(default)/documents',
+                          method='DELETE')
+        _emulator_request(self.auth_host, f'/emulator/v1/projects/{self.project}/accounts', method='DELETE')
+
+    def load(self, name):
+        """Seed a dataset from the bootstrap graph once and keep its documents in memory"""
+        if name in self.snapshots:
+            return self.snapshots[name]
+        from bootstrap_environment import graph
+        from setup_firestore import test_users
+
+        jobs = dataset_jobs(name)
+        self.clear()
+        started = time.perf_counter()
+        if jobs:
+            async def seed():
+                # Creating the client here binds it to the session loop
+                if self._async_db is None:
+                    self._async_db = async_client(job='emulator_fixtures')
+                await graph.run(self._async_db, only=jobs)
+            asyncio.run_coroutine_threadsafe(seed(), self._loop).result()
+
+        documents = snapshot_documents(self.db)
+        uids = {user.uid for user in auth.list_users().iterate_all()}
+        self.snapshots[name] = {
+            'documents': documents,
+            'users': [user for user in test_users if user['uid'] in uids],
+            'seconds': time.perf_counter() - started,
+        }
+        return self.snapshots[name]
+
+    def restore(self, name):
+        """Put the emulator back to the dataset's snapshot; returns the number of documents written"""
+        snapshot = self.load(name)
+        self.clear()
+        items = list(snapshot['documents'].items())
+
+        def commit(chunk):
+            batch = self.db.batch()
+            for path, data in chunk:
+                batch.set(self.db.document(path), data)
+            batch.commit()
+
+        with ThreadPoolExecutor(max_workers=DEFAULT_CONCURRENCY) as pool:
+            list(pool.map(commit, chunked(items, MAX_BATCH_WRITES)))
+            list(pool.map(lambda u: auth.create_user(uid=u['uid'], email=u['email'], password=u['password'],
+                                                     display_name=u['displayName']), snapshot['users']))
+        return len(items)
+
+
+# ============================================================
+# TIMING REPORT
+# ============================================================
+
+class EmulatorReport:
+    """Collects restore and test-phase timings and prints them after the run"""
+
+    def __init__(self, config):
+        self.config = config
+        self.seeded = {}
+        self.restores = {}
+        self.phases = {}
+
+    def pytest_runtest_logreport(self, report):
+        self.phases.setdefault(report.nodeid, {})[report.when] = report.duration
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.restores:
+            return
+        write = terminalreporter.write_line
+        timings = [seconds for seconds, _ in self.restores.values()]
+        slowest = self.config.getoption('emulator_slowest')
+        terminalreporter.section('emulator fixtures')
+        write(f"{len(self.restores)} test(s) on the emulator, "
+              f"{sum(written for _, written in self.restores.values())} document(s) restored")
+        write('seeded once: ' + ', '.join(f'{name} {seconds:.2f}s' for name, seconds in sorted(self.seeded.items())))
+        p95 = sorted(timings)[int(0.95 * (len(timings) - 1))]
+        write(f"restore: mean {statistics.mean(timings) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, "
+              f"total {sum(timings):.2f}s")
+        ranked = sorted(self.restores, key=lambda n: sum(self.phases.get(n, {}).values()), reverse=True)
+        write(f"slowest {min(slowest, len(ranked))} (restore / setup / call / teardown, ms):")
+        for nodeid in ranked[:slowest]:
+            phases = self.phases.get(nodeid, {})
+            write(f"  {self.restores[nodeid][0] * 1000:8.1f} {phases.get('setup', 0) * 1000:8.1f} "
+                  f"{phases.get('call', 0) * 1000:8.1f} {phases.get('teardown', 0) * 1000:8.1f}  {nodeid}")
+
+        path = self.config.getoption('emulator_timings')
+        if path:
+            with open(path, 'w') as fh:
+                json.dump({nodeid: dict(self.phases.get(nodeid, {}), restore=seconds, documents=written)
+                           for nodeid, (seconds, written) in self.restores.items()}, fh, indent=2)
+            write(f"timings written to {path}")
+
+
+# ============================================================
+# PYTEST HOOKS AND FIXTURES
+# ============================================================
+
+def pytest_addoption(parser):
+    group = parser.getgroup('emulator', 'Oil Manager emulator fixtures')
+    group.addoption('--emulator-dataset', default='full', choices=sorted(DATASETS),
+                    help='dataset loaded for tests without an emulator_dataset marker (default full)')
+    group.addoption('--emulator-timings', metavar='PATH', help='write per-test restore/phase timings as JSON')
+    group.addoption('--emulator-slowest', type=int, default=10, metavar='N',
+                    help='list the N slowest emulator tests in the summary (default 10)')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'emulator_dataset(name): seed dataset the test starts from')
+    config.pluginmanager.register(EmulatorReport(config), 'emulator_report')
+
+
+@pytest.fixture(scope='session')
+def emulator(request):
+    """The running emulator session; skips the test when no emulator can be started"""
+    session = EmulatorSession()
+    try:
+        session.start()
+    except RuntimeError as e:
+        pytest.skip(str(e))
+    yield session
+    session.stop()
+
+
+@pytest.fixture
+def firestore_db(emulator, request):
+    """Instrumented Firestore client on the emulator, reset to the test's dataset"""
+    marker = request.node.get_closest_marker('emulator_dataset')
+    name = marker.args[0] if marker else request.config.getoption('emulator_dataset')
+    report = request.config.pluginmanager.get_plugin('emulator_report')
+    report.seeded[name] = emulator.load(name)['seconds']
+    started = time.perf_counter()
+    written = emulator.restore(name)
+    report.restores[request.node.nodeid] = (time.perf_counter() - started, written)
+    return emulator.db
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dataset', default='full', choices=sorted(DATASETS), help='dataset to load (default full)')
+    parser.add_argument('--rounds', type=int, default=20, help='restores to time (default 20)')
+    args = parser.parse_args()
+
+    print(f"🧪 Loading '{args.dataset}' into the Firestore/Auth emulators...")
+    session = EmulatorSession()
+    try:
+        session.start()
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    try:
+        snapshot = session.load(args.dataset)
+        print(f"✅ Seeded {len(snapshot['documents'])} documents and {len(snapshot['users'])} auth users "
+              f"in {snapshot['seconds']:.2f}s")
+        timings = []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            session.restore(args.dataset)
+            timings.append(time.perf_counter() - started)
+        print(f"⏱️  Restore over {args.rounds} rounds: mean {statistics.mean(timings) * 1000:.1f} ms, "
+              f"min {min(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms")
+    finally:
+        session.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+"""
+Merkle-hash environment diff for Oil Manager configuration
+Keeps a local cache of per-document content hashes for each environment, refreshed
+incrementally by updateTime, rolls them up into per-collection Merkle trees and
+compares two environments by walking only the subtrees that differ. The result is a
+patch that the batched writer applies to the target environment
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import string
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+try:
+    from firebase_admin import firestore
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from firestore_metrics import add_metrics_args
+from integrity_checker import ID, REFERENCES, UNIQUE_KEYS
+from maintenance_runtime import (DEFAULT_CONCURRENCY, TaskGraph, async_client, chunked, from_json_value,
+                                 to_json_value)
+
+DEFAULT_CACHE_DIR = '.envdiff'
+DEFAULT_PREFIX = 'config_'
+# Set by the server or the seeder in each environment, so they never match across environments
+IGNORED_FIELDS = ('createdAt', 'updatedAt')
+# Documents per Merkle leaf bucket before the tree grows another level; 16 children per node
+LEAF_SIZE = 16
+FANOUT = '0123456789abcdef'
+GET_ALL_CHUNK = 300
+MAX_PRINTED = 10
+
+# Most config documents have auto IDs that differ per environment, so documents are matched on
+# their unique key and ID references are compared by the key of the document they point to.
+# An empty key matches a singleton collection's only document.
+NATURAL_KEYS = dict(UNIQUE_KEYS, **{
+    'config_uco_buyback_rates': ('gradeId',),
+    'config_payment_methods': ('code',),
+    'config_order_statuses': ('type', 'code'),
+    'config_reasons': ('type', 'code'),
+    'config_uco_incentives': ('zone', 'customerType'),
+    'config_delivery_slots': ('zone', 'timeWindowStart'),
+    'config_notification_templates': ('templateKey', 'channel'),
+    'config_status_sequences': ('domain',),
+    'config_fulfillment_settings': (),
+})
+ID_REFERENCES = defaultdict(dict)
+for _ref in REFERENCES:
+    if _ref.target_field == ID and not _ref.when:
+        ID_REFERENCES[_ref.collection][_ref.field] = _ref.target_collection
+
+
+def _hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+def content_hash(data, collection, ignored):
+    """Hash of a document's JSON form without ignored fields and ID references (those are hashed by key)"""
+    skip = set(ignored) | set(ID_REFERENCES.get(collection, ()))
+    return _hash(json.dumps({k: v for k, v in data.items() if k not in skip}, sort_keys=True, ensure_ascii=False))
+
+
+def auto_id():
+    """A 20-character document ID like the ones collection().document() generates"""
+    alphabet = string.ascii_letters + string.digits
+    return ''.join(random.SystemRandom().choice(alphabet) for _ in range(20))
+
+
+# ============================================================
+# SNAPSHOT CACHE
+# ============================================================
+
+class Snapshot:
+    """Local cache of one environment: per collection, {doc_id: {t: updateTime, h: hash, data: JSON}}"""
+
+    def __init__(self, label, cache_dir=DEFAULT_CACHE_DIR):
+        self.label = label
+        self.path = os.path.join(cache_dir, f'{label}.json.gz')
+        self.collections = {}
+        self.ignored = list(IGNORED_FIELDS)
+        self.synced_at = None
+
+    def load(self):
+        if os.path.exists(self.path):
+            with gzip.open(self.path, 'rt', encoding='utf-8') as fh:
+                state = json.load(fh)
+            self.collections = state['collections']
+            self.ignored = state.get('ignored', self.ignored)
+            self.synced_at = state.get('syncedAt')
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8') as fh:
+            json.dump({'label': self.label, 'syncedAt': self.synced_at, 'ignored': self.ignored,
+                       'collections': self.collections}, fh)
+        os.replace(tmp, self.path)
+
+    def rehash(self, ignored):
+        """Recompute every hash from the cached data when the ignored fields change"""
+        if sorted(ignored) == sorted(self.ignored):
+            return
+        self.ignored = list(ignored)
+        for name, docs in self.collections.items():
+            for entry in docs.values():
+                entry['h'] = content_hash(entry['data'], name, self.ignored)
+
+
+async def refresh(db, snapshot, collections, limiter, counts):
+    """Bring the cache up to date: list IDs and updateTimes, then read only documents that changed"""
+
+    async def one(name):
+        docs = snapshot.collections.setdefault(name, {})
+        async with limiter:
+            listing = {snap.id: snap.update_time.isoformat()
+                       async for snap in db.collection(name).select([ID]).stream()}
+        changed = [doc_id for doc_id, t in listing.items() if docs.get(doc_id, {}).get('t') != t]
+        for doc_id in set(docs) - set(listing):
+            del docs[doc_id]
+            counts['removed'] += 1
+        for chunk in chunked(changed, GET_ALL_CHUNK):
+            async with limiter:
+                snaps = await db.get_all([db.collection(name).document(doc_id) for doc_id in chunk])
+            for snap in snaps:
+                if not snap.exists:
+                    docs.pop(snap.id, None)
+                    continue
+                data = to_json_value(snap.to_dict())
+                docs[snap.id] = {'t': snap.update_time.isoformat(), 'h': content_hash(data, name, snapshot.ignored),
+                                 'data': data}
+        counts['read'] += len(changed)
+        counts['unchanged'] += len(listing) - len(changed)
+        if not docs:
+            del snapshot.collections[name]
+
+    await asyncio.gather(*(one(name) for name in collections))
+    snapshot.synced_at = datetime.now(timezone.utc).isoformat()
+
+
+# ============================================================
+# MERKLE TREES
+# ============================================================
+
+class EnvIndex:
+    """Keys and leaf hashes of a snapshot
+
+    A document's key is its unique key (with ID references inside it resolved to the
+    referenced document's key) or 'id:<docId>' for collections without one and for
+    documents whose unique key is missing or duplicated. Its leaf hash covers the
+    content hash plus the keys its ID references resolve to.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._keys = {}
+        self.duplicates = defaultdict(list)
+
+    def keys(self, collection):
+        """{doc_id: key} for a collection"""
+        if collection in self._keys:
+            return self._keys[collection]
+        self._keys[collection] = {}
+        docs = self.snapshot.collections.get(collection, {})
+        fields = NATURAL_KEYS.get(collection)
+        keys = {}
+        for doc_id, entry in docs.items():
+            values = [self.resolve(collection, field, entry['data'].get(field)) for field in fields or ()]
+            usable = fields is not None and all(v not in (None, '') and not v.startswith('missing:') for v in values)
+            keys[doc_id] = json.dumps(values, ensure_ascii=False) if usable else f'id:{doc_id}'
+        taken = defaultdict(list)
+        for doc_id, key in keys.items():
+            taken[key].append(doc_id)
+        for key, doc_ids in taken.items():
+            if len(doc_ids) > 1:
+                self.duplicates[collection].append(key)
+                for doc_id in doc_ids:
+                    keys[doc_id] = f'id:{doc_id}'
+        self._keys[collection] = keys
+        return keys
+
+    def resolve(self, collection, field, value):
+        """Value of a field as compared across environments: ID references become the target's key"""
+        target = ID_REFERENCES.get(collection, {}).get(field)
+        if target is None or not value or not isinstance(value, str):
+            return value if isinstance(value, str) or value is None else json.dumps(value, sort_keys=True)
+        if target not in self.snapshot.collections:
+            return f'id:{value}'
+        return self.keys(target).get(value) or f'missing:{value}'
+
+    def leaves(self, collection):
+        """{key: (leaf hash, doc_id)}"""
+        docs = self.snapshot.collections.get(collection, {})
+        refs = ID_REFERENCES.get(collection, {})
+        out = {}
+        for doc_id, key in self.keys(collection).items():
+            entry = docs[doc_id]
+            resolved = {field: self.resolve(collection, field, entry['data'].get(field)) for field in sorted(refs)}
+            out[key] = (_hash(entry['h'] + json.dumps(resolved, sort_keys=True)), doc_id)
+        return out
+
+
+def tree_depth(size):
+    return 0 if size <= LEAF_SIZE else math.ceil(math.log(size / LEAF_SIZE, len(FANOUT)))
+
+
+def merkle(leaves, depth):
+    """Levels of a Merkle tree over the key-digest space; levels[d] maps d-character prefixes to node hashes
+
+    Keys are bucketed by the first depth hex digits of their SHA-1, which splits the ID
+    range the same way in both environments regardless of how many documents each has.
+    """
+    buckets = defaultdict(list)
+    for key, (leaf, _) in leaves.items():
+        buckets[hashlib.sha1(key.encode('utf-8')).hexdigest()[:depth]].append((key, leaf))
+    level = {prefix: _hash(''.join(f'{k}\0{h}\0' for k, h in sorted(items))) for prefix, items in buckets.items()}
+    levels = [level]
+    for d in range(depth - 1, -1, -1):
+        parents = defaultdict(list)
+        for prefix, node in level.items():
+            parents[prefix[:d]].append((prefix, node))
+        level = {prefix: _hash(''.join(c + h for c, h in sorted(children))) for prefix, children in parents.items()}
+        levels.append(level)
+    levels.reverse()
+    return levels, buckets
+
+
+def diff_collection(source, target):
+    """(created, updated, deleted keys, nodes visited, nodes total) between two leaf maps"""
+    depth = tree_depth(max(len(source), len(target)))
+    (a, a_buckets), (b, b_buckets) = merkle(source, depth), merkle(target, depth)
+    visited = 0
+    prefixes = ['']
+    for d in range(depth + 1):
+        differing = []
+        for prefix in prefixes:
+            visited += 1
+            if a[d].get(prefix) != b[d].get(prefix):
+                differing.append(prefix)
+        if d == depth:
+            prefixes = differing
+            break
+        prefixes = [p + c for p in differing for c in FANOUT if p + c in a[d + 1] or p + c in b[d + 1]]
+    created, updated, deleted = [], [], []
+    for prefix in prefixes:
+        have = dict(a_buckets.get(prefix, ()))
+        want = dict(b_buckets.get(prefix, ()))
+        created += [k for k in have if k not in want]
+        updated += [k for k in have if k in want and have[k] != want[k]]
+        deleted += [k for k in want if k not in have]
+    total = sum(len(level) for level in a) + sum(len(level) for level in b)
+    return sorted(created), sorted(updated), sorted(deleted), visited, total
+
+
+# ============================================================
+# PATCHES
+# ============================================================
+
+def dependency_order(collections):
+    """Collections with referenced collections first, so new targets exist before their referrers"""
+    ordered, seen = [], set()
+
+    def visit(name):
+        if name in seen:
+            return
+        seen.add(name)
+        for target in ID_REFERENCES.get(name, {}).values():
+            if target in collections:
+                visit(target)
+        ordered.append(name)
+
+    for name in sorted(collections):
+        visit(name)
+    return ordered
+
+
+def build_patch(source, target, diffs, prune=False):
+    """Patch document turning target into source for the differing keys; returns (patch, warnings)"""
+    src, dst = EnvIndex(source), EnvIndex(target)
+    inverse = {}
+
+    def dst_ids(name):
+        if name not in inverse:
+            inverse[name] = {key: doc_id for doc_id, key in dst.keys(name).items()}
+        return inverse[name]
+
+    new_ids = {}
+    for name, (created, _, _) in diffs.items():
+        for key in created:
+            new_ids[(name, key)] = key[3:] if key.startswith('id:') else auto_id()
+    warnings = []
+
+    def translate(name, data):
+        data = dict(data)
+        for field, ref_target in ID_REFERENCES.get(name, {}).items():
+            value = data.get(field)
+            if not value or not isinstance(value, str):
+                continue
+            key = src.keys(ref_target).get(value) if ref_target in source.collections else None
+            if key is None:
+                continue
+            doc_id = dst_ids(ref_target).get(key) or new_ids.get((ref_target, key))
+            if doc_id is None:
+                warnings.append(f'{name}.{field}: {key} has no counterpart in {target.label}; kept {value}')
+            else:
+                data[field] = doc_id
+        return data
+
+    ops = []
+    for name in dependency_order(diffs):
+        created, updated, deleted = diffs[name]
+        src_ids = {key: doc_id for doc_id, key in src.keys(name).items()}
+        for key in created:
+            data = translate(name, source.collections[name][src_ids[key]]['data'])
+            ops.append({'op': 'create', 'collection': name, 'id': new_ids[(name, key)], 'key': key, 'data': data})
+        for key in updated:
+            current = target.collections[name][dst_ids(name)[key]]
+            data = {k: v for k, v in translate(name, source.collections[name][src_ids[key]]['data']).items()
+                    if k not in target.ignored}
+            data.update({k: v for k, v in current['data'].items() if k in target.ignored})
+            ops.append({'op': 'update', 'collection': name, 'id': dst_ids(name)[key], 'key': key, 'data': data,
+                        'remove': sorted(set(current['data']) - set(data)), 'updateTime': current['t']})
+    if prune:
+        for name in reversed(dependency_order(diffs)):
+            for key in diffs[name][2]:
+                doc_id = dst_ids(name)[key]
+                ops.append({'op': 'delete', 'collection': name, 'id': doc_id, 'key': key,
+                            'updateTime': target.collections[name][doc_id]['t']})
+    patch = {'source': source.label, 'target': target.label, 'createdAt': datetime.now(timezone.utc).isoformat(),
+             'sourceSyncedAt': source.synced_at, 'targetSyncedAt': target.synced_at, 'ops': ops}
+    return patch, warnings
+
+
+def patch_writes(db, ops):
+    """(op, ref, data, option) writes for maintenance_runtime's JobContext.apply_writes()"""
+    writes = []
+    for op in ops:
+        ref = db.collection(op['collection']).document(op['id'])
+        option = db.write_option(last_update_time=datetime.fromisoformat(op['updateTime'])) if op.get('updateTime') else None
+        if op['op'] == 'create':
+            writes.append(('create', ref, from_json_value(op['data'], db), None))
+        elif op['op'] == 'update':
+            data = from_json_value(op['data'], db)
+            data.update({field: firestore.DELETE_FIELD for field in op.get('remove', ())})
+            writes.append(('update', ref, data, option))
+        else:
+            writes.append(('delete', ref, None, option))
+    return writes
+
+
+async def apply_patch(db, patch, concurrency):
+    """Apply a patch as a task graph: one job per collection after the collections it references,
+    deletes last; returns (graph, rejected writes)"""
+    by_collection = defaultdict(list)
+    deletes = []
+    for op in patch['ops']:
+        (deletes if op['op'] == 'delete' else by_collection[op['collection']]).append(op)
+    graph = TaskGraph()
+    rejected = []
+
+    def job(ops):
+        async def run(ctx):
+            failed = await ctx.apply_writes(patch_writes(ctx.db, ops))
+            rejected.extend(failed)
+            return len(ops) - len(failed)
+        return run
+
+    for name in dependency_order(by_collection):
+        deps = [t for t in ID_REFERENCES.get(name, {}).values() if t in by_collection and t != name]
+        graph.add(name, job(by_collection[name]), deps=deps)
+    if deletes:
+        graph.add('deletes', job(deletes), deps=list(by_collection))
+    await graph.run(db, concurrency=concurrency)
+    return graph, rejected
+
+
+# ============================================================
+# COMMANDS
+# ============================================================
+
+async def snapshot_command(args):
+    db = async_client(job='env_diff', args=args)
+    snapshot = Snapshot(args.snapshot, args.cache_dir).load()
+    snapshot.rehash(args.ignore)
+    collections = args.collections
+    if not collections:
+        collections = sorted({c.id async for c in db.collections() if c.id.startswith(DEFAULT_PREFIX)}
+                             | set(snapshot.collections))
+    counts = defaultdict(int)
+    started = time.perf_counter()
+    await refresh(db, snapshot, collections, asyncio.Semaphore(args.concurrency), counts)
+    snapshot.save()
+    docs = sum(len(d) for d in snapshot.collections.values())
+    print(f"✅ {args.snapshot}: {docs:,} documents in {len(snapshot.collections)} collections "
+          f"({counts['read']:,} read, {counts['unchanged']:,} unchanged, {counts['removed']:,} removed) "
+          f"in {time.perf_counter() - started:.2f}s → {snapshot.path}")
+
+
+def diff_command(args):
+    source = Snapshot(args.diff[0], args.cache_dir).load()
+    target = Snapshot(args.diff[1], args.cache_dir).load()
+    for snapshot in (source, target):
+        if snapshot.synced_at is None:
+            print(f"❌ No snapshot for {snapshot.label}; run --snapshot {snapshot.label} against it first")
+            sys.exit(2)
+        snapshot.rehash(args.ignore)
+    src, dst = EnvIndex(source), EnvIndex(target)
+    names = sorted(set(args.collections or []) or set(source.collections) | set(target.collections))
+    print(f"🔀 {source.label} (synced {source.synced_at[:19]}) → {target.label} (synced {target.synced_at[:19]})")
+    diffs = {}
+    visited = total = 0
+    for name in names:
+        a, b = src.leaves(name), dst.leaves(name)
+        created, updated, deleted, seen, nodes = diff_collection(a, b)
+        visited += seen
+        total += nodes
+        if not (created or updated or deleted):
+            print(f"   = {name} ({len(a)} docs)")
+            continue
+        diffs[name] = (created, updated, deleted)
+        print(f"   ≠ {name}: +{len(created)} ~{len(updated)} -{len(deleted)}")
+        changes = [('+', k) for k in created] + [('~', k) for k in updated] + [('-', k) for k in deleted]
+        for sign, key in changes[:MAX_PRINTED]:
+            print(f"       {sign} {key}")
+        if len(changes) > MAX_PRINTED:
+            print(f"       … {len(changes) - MAX_PRINTED} more")
+    for index in (src, dst):
+        for name, keys in index.duplicates.items():
+            print(f"   ⚠️  {index.snapshot.label}/{name}: duplicate key(s) {', '.join(keys[:3])} matched by document ID")
+    print(f"\n{'⚠️ ' if diffs else '✅'} {len(diffs)} of {len(names)} collection(s) differ; "
+          f"compared {visited:,} of {total:,} tree nodes")
+    if args.patch:
+        patch, warnings = build_patch(source, target, diffs, prune=args.prune)
+        for warning in warnings:
+            print(f"   ⚠️  {warning}")
+        with open(args.patch, 'w', encoding='utf-8') as fh:
+            json.dump(patch, fh, indent=2, ensure_ascii=False)
+        kinds = defaultdict(int)
+        for op in patch['ops']:
+            kinds[op['op']] += 1
+        print(f"   • patch with {len(patch['ops'])} write(s) ({dict(kinds)}) written to {args.patch}")
+    return diffs
+
+
+async def apply_command(args):
+    with open(args.apply, encoding='utf-8') as fh:
+        patch = json.load(fh)
+    if args.confirm != patch['target']:
+        print(f"❌ Patch targets '{patch['target']}'; pass --confirm {patch['target']} to apply it here")
+        sys.exit(2)
+    db = async_client(job='env_diff', args=args)
+    print(f"📝 Applying {len(patch['ops'])} write(s) from {patch['source']} to {patch['target']}...")
+    started = time.perf_counter()
+    graph, rejected = await apply_patch(db, patch, args.concurrency)
+    print(f"{'⚠️ ' if rejected else '✅'} {len(patch['ops']) - len(rejected)} applied, {len(rejected)} rejected "
+          f"in {time.perf_counter() - started:.2f}s")
+    for op, ref, _, _ in rejected[:MAX_PRINTED]:
+        print(f"   • {op} {ref.path}: changed since the snapshot (or already exists); re-run --snapshot and --diff")
+    return rejected
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    command = parser.add_mutually_exclusive_group(required=True)
+    command.add_argument('--snapshot', metavar='LABEL', help='refresh the local cache of the current environment')
+    command.add_argument('--diff', nargs=2, metavar=('SOURCE', 'TARGET'), help='compare two cached environments')
+    command.add_argument('--apply', metavar='PATCH', help='apply a patch to the current environment')
+    parser.add_argument('--collections', nargs='+', help=f'collections to cover (default: all {DEFAULT_PREFIX}*)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f'snapshot cache directory (default {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--ignore', nargs='*', default=list(IGNORED_FIELDS),
+                        help=f"fields left out of comparisons (default {' '.join(IGNORED_FIELDS)})")
+    parser.add_argument('--patch', metavar='PATH', help='with --diff, write a patch turning TARGET into SOURCE')
+    parser.add_argument('--prune', action='store_true', help='with --patch, also delete documents missing in SOURCE')
+    parser.add_argument('--confirm', metavar='LABEL', help='with --apply, the patch target label (safety check)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'maximum in-flight Firestore RPCs (default {DEFAULT_CONCURRENCY})')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.snapshot:
+        asyncio.run(snapshot_command(args))
+    elif args.diff:
+        if diff_command(args) and not args.patch:
+            sys.exit(1)
+    elif asyncio.run(apply_command(args)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,881 @@
+#!/usr/bin/env python3
+"""
+Composite index planner for Oil Manager
+Extracts Firestore query shapes from the Dart service layer and the Python jobs,
+plans a minimal composite index set and writes firestore.indexes.json
+"""
+
+import argparse
+import ast
+import glob
+import itertools
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+DART_SOURCES = ['lib/services/*.dart', 'lib/screens/**/*.dart', 'lib/providers/*.dart']
+
+# Dart where() named arguments and Python where() operators, by index role
+EQUALITY_OPS = {'isEqualTo', '==', 'whereIn', 'in', 'arrayContains', 'array_contains',
+                'arrayContainsAny', 'array_contains_any'}
+RANGE_OPS = {'isLessThan', 'isLessThanOrEqualTo', 'isGreaterThan', 'isGreaterThanOrEqualTo',
+             'isNotEqualTo', 'whereNotIn', '<', '<=', '>', '>=', '!=', 'not-in'}
+ARRAY_OPS = {'arrayContains', 'array_contains', 'arrayContainsAny', 'array_contains_any'}
+
+
+@dataclass
+class QueryShape:
+    """One concrete query: collection, equality fields, range field and sort order"""
+    collection: str
+    source: str
+    equality: tuple = ()
+    ranges: tuple = ()
+    order: tuple = ()
+    arrays: tuple = ()
+    samples: dict = field(default_factory=dict)
+
+    def sort_suffix(self):
+        """Ordered (field, direction) fields that follow the equality prefix in an index"""
+        suffix = []
+        if self.order:
+            for name, direction in self.order:
+                if name not in self.equality:
+                    suffix.append((name, direction))
+        # Firestore implicitly orders by the range field when no orderBy names it
+        for name in self.ranges:
+            if name not in [n for n, _ in suffix]:
+                suffix.insert(0, (name, 'ASCENDING'))
+        return tuple(suffix)
+
+    def distinct_fields(self):
+        return set(self.equality) | set(self.ranges) | {n for n, _ in self.order} | set(self.arrays)
+
+    def needs_composite(self):
+        """Equality-only queries are served by merging single-field indexes"""
+        if len(self.distinct_fields()) <= 1:
+            return False
+        return bool(self.sort_suffix()) or bool(self.arrays and self.equality)
+
+    def problems(self):
+        issues = []
+        if len(set(self.ranges)) > 1:
+            issues.append(f'range filters on several fields: {", ".join(sorted(set(self.ranges)))}')
+        if self.ranges and self.order and self.order[0][0] not in self.ranges:
+            issues.append(f'first orderBy must be the range field {self.ranges[0]}')
+        return issues
+
+    def describe(self):
+        parts = [f'{f}==' for f in self.equality]
+        parts += [f'{f} array-contains' for f in self.arrays]
+        parts += [f'{f} <>' for f in dict.fromkeys(self.ranges)]
+        parts += [f"orderBy {f} {'desc' if d == 'DESCENDING' else 'asc'}" for f, d in self.order]
+        return f"{self.collection} where {', '.join(parts) if parts else '(all)'}"
+
+
+@dataclass(frozen=True)
+class CompositeIndex:
+    """Ordered index fields; each entry is (fieldPath, ASCENDING | DESCENDING | CONTAINS)"""
+    collection: str
+    fields: tuple
+
+    @classmethod
+    def for_shape(cls, shape):
+        fields = [(f, 'ASCENDING') for f in shape.equality]
+        fields += [(f, 'CONTAINS') for f in shape.arrays]
+        fields += list(shape.sort_suffix())
+        return cls(shape.collection, tuple(fields))
+
+    def split(self, suffix):
+        """Return the equality prefix if this index ends with the given sort suffix"""
+        if len(self.fields) < len(suffix):
+            return None
+        if suffix and self.fields[-len(suffix):] != tuple(suffix):
+            return None
+        head = self.fields[:len(self.fields) - len(suffix)]
+        if any(order == 'DESCENDING' for _, order in head):
+            return None
+        return head
+
+    def to_json(self):
+        fields = []
+        for name, order in self.fields:
+            if order == 'CONTAINS':
+                fields.append({'fieldPath': name, 'arrayConfig': 'CONTAINS'})
+            else:
+                fields.append({'fieldPath': name, 'order': order})
+        return {'collectionGroup': self.collection, 'queryScope': 'COLLECTION', 'fields': fields}
+
+    @classmethod
+    def from_json(cls, entry):
+        fields = tuple((f['fieldPath'], f.get('order') or f.get('arrayConfig', 'ASCENDING'))
+                       for f in entry.get('fields', []))
+        return cls(entry['collectionGroup'], fields)
+
+    def describe(self):
+        labels = {'ASCENDING': 'asc', 'DESCENDING': 'desc', 'CONTAINS': 'contains'}
+        return f"{self.collection} ({', '.join(f'{n} {labels[o]}' for n, o in self.fields)})"
+
+
+# ============================================================
+# DART EXTRACTION
+# ============================================================
+
+COLLECTION_RE = re.compile(r"\.collection\('([\w-]+)'\)")
+GETTER_RE = re.compile(r"(?:CollectionReference|Query)\s+get\s+(\w+)\s*=>\s*_?\w+\.collection\('([\w-]+)'\)")
+WHERE_RE = re.compile(r"\.where\(\s*'([\w.]+)'\s*,\s*(\w+)\s*:\s*([^,)]+)")
+ORDER_RE = re.compile(r"\.orderBy\(\s*'([\w.]+)'(\s*,\s*descending\s*:\s*true)?")
+QUERY_DECL_RE = re.compile(r'\bQuery(?:<[^>]*>)?\s+(\w+)\s*=\s*')
+
+
+def _dart_literal(expr):
+    expr = expr.strip()
+    if expr in ('true', 'false'):
+        return expr == 'true'
+    if re.fullmatch(r"'[^']*'", expr):
+        return expr[1:-1]
+    if re.fullmatch(r'-?\d+(\.\d+)?', expr):
+        return float(expr) if '.' in expr else int(expr)
+    if 'Timestamp' in expr or 'DateTime' in expr:
+        return 'timestamp'
+    return None
+
+
+def _clauses(text):
+    """Return ordered (kind, field, op, sample) clauses found in a chain of Dart calls"""
+    found = []
+    for m in WHERE_RE.finditer(text):
+        found.append((m.start(), 'where', m.group(1), m.group(2), _dart_literal(m.group(3))))
+    for m in ORDER_RE.finditer(text):
+        found.append((m.start(), 'order', m.group(1), 'DESCENDING' if m.group(2) else 'ASCENDING', None))
+    return [c[1:] for c in sorted(found)]
+
+
+def _statements(body):
+    """Split a Dart function body into (statement, depth, guard) triples"""
+    result, depth, start, guards = [], 0, 0, []
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch == "'":
+            end = body.find("'", i + 1)
+            i = end if end != -1 else len(body)
+        elif ch == '{':
+            header = body[start:i].strip()
+            if '.collection(' in header:
+                # Chains passed as arguments, e.g. StreamBuilder(stream: ...snapshots(), builder: ...)
+                result.append((header, depth, ' && '.join(g for g in guards if g)))
+            guards.append(header if header.startswith(('if', 'else')) else '')
+            depth += 1
+            start = i + 1
+        elif ch == '}':
+            depth -= 1
+            guards.pop() if guards else None
+            start = i + 1
+        elif ch == ';':
+            stmt = body[start:i].strip()
+            guard = ' && '.join(g for g in guards if g)
+            if stmt.startswith('if') and '(' in stmt:
+                # Brace-less `if (x) query = query.where(...);`
+                close = _matching_paren(stmt, stmt.index('('))
+                guard = ' && '.join(filter(None, [guard, stmt[:close + 1]]))
+                stmt = stmt[close + 1:].strip()
+            result.append((stmt, depth, guard))
+            start = i + 1
+        i += 1
+    return result
+
+
+def _matching_paren(text, open_idx):
+    depth = 0
+    for i in range(open_idx, len(text)):
+        if text[i] == '(':
+            depth += 1
+        elif text[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+    return len(text) - 1
+
+
+def _guard_terms(guard):
+    """Translate `if (a != null && b == null)` into required/forbidden variable names"""
+    required = set(re.findall(r'(\w+)\s*!=\s*null', guard))
+    forbidden = set(re.findall(r'(\w+)\s*==\s*null', guard))
+    bools = set(re.findall(r'if\s*\(\s*(\w+)\s*\)', guard))
+    return required | bools, forbidden
+
+
+DART_KEYWORDS = {'if', 'for', 'while', 'switch', 'catch', 'return', 'super', 'assert'}
+
+
+def _dart_functions(source):
+    """Yield (name, body) for each top-level brace-delimited method in a Dart file"""
+    consumed_until = 0
+    for m in re.finditer(r'(\w+)\s*(?:<[^()]*>)?\s*\(', source):
+        if m.start() < consumed_until or m.group(1) in DART_KEYWORDS:
+            continue
+        close = _matching_paren(source, m.end() - 1)
+        after = re.match(r'\s*(?:async\*?\s*)?\{', source[close + 1:])
+        if not after:
+            continue
+        start = close + 1 + after.end()
+        depth = 1
+        for i in range(start, len(source)):
+            if source[i] == '{':
+                depth += 1
+            elif source[i] == '}':
+                depth -= 1
+                if depth == 0:
+                    consumed_until = i
+                    yield m.group(1), source[start:i]
+                    break
+
+
+def _shape_from_clauses(collection, source, clauses):
+    equality, ranges, order, arrays, samples = [], [], [], [], {}
+    for kind, name, op, sample in clauses:
+        if kind == 'order':
+            order.append((name, op))
+        elif op in ARRAY_OPS:
+            arrays.append(name)
+        elif op in EQUALITY_OPS:
+            equality.append(name)
+            samples[name] = sample
+        elif op in RANGE_OPS:
+            ranges.append(name)
+            samples.setdefault(name, sample)
+    return QueryShape(collection, source, tuple(sorted(set(equality))), tuple(ranges),
+                      tuple(order), tuple(sorted(set(arrays))), samples)
+
+
+def extract_dart_shapes(paths):
+    shapes = []
+    getters = {}
+    sources = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as fh:
+            sources[path] = fh.read()
+        getters.update(dict(GETTER_RE.findall(sources[path])))
+
+    for path, source in sources.items():
+        rel = os.path.relpath(path, REPO_ROOT)
+        for func, body in _dart_functions(source):
+            site = f'{rel}:{func}'
+            builders = {}
+            for stmt, depth, guard in _statements(body):
+                decl = QUERY_DECL_RE.search(stmt)
+                base = COLLECTION_RE.search(stmt)
+                getter = re.match(r'(?:\w+\s+)?(\w+)\s*=\s*(\w+)\.where', stmt)
+                if decl and (base or getter):
+                    collection = base.group(1) if base else getters.get(getter.group(2))
+                    if collection:
+                        builders[decl.group(1)] = {'collection': collection, 'base': _clauses(stmt),
+                                                   'optional': [], 'depth': depth}
+                    continue
+                assign = re.match(r'(\w+)\s*=\s*\1((?:\s*\.\s*(?:where|orderBy)\([^;]*)+)$', stmt, re.S)
+                if assign and assign.group(1) in builders:
+                    b = builders[assign.group(1)]
+                    clauses = _clauses(assign.group(2))
+                    if guard and depth > b['depth']:
+                        b['optional'].append((_guard_terms(guard), clauses))
+                    else:
+                        b['base'].extend(clauses)
+                    continue
+                used = [v for v in builders if re.search(rf'\b{v}\s*\.\s*(?:orderBy|where|limit|get|snapshots)\(', stmt)]
+                if used:
+                    b = builders[used[0]]
+                    tail = stmt[stmt.index(used[0]):]
+                    shapes.extend(_expand_builder(b, _clauses(tail), site))
+                    continue
+                # Straight chains: _firestore.collection('x').where(...).orderBy(...)
+                for m in COLLECTION_RE.finditer(stmt):
+                    clauses = _clauses(stmt[m.end():])
+                    if clauses and '.doc(' not in stmt[m.end():m.end() + 40].split('.where')[0]:
+                        shapes.append(_shape_from_clauses(m.group(1), site, clauses))
+                chained = re.match(r'(?:final\s+\w+\s*=\s*)?(?:await\s+)?(\w+)\s*\.\s*where', stmt)
+                if chained and chained.group(1) in getters and not COLLECTION_RE.search(stmt):
+                    shapes.append(_shape_from_clauses(getters[chained.group(1)], site, _clauses(stmt)))
+    return shapes
+
+
+def _expand_builder(builder, tail, site):
+    """Enumerate every reachable combination of conditional where() clauses"""
+    variables = sorted({v for (req, forb), _ in builder['optional'] for v in req | forb})
+    seen, shapes = set(), []
+    for values in itertools.product([True, False], repeat=len(variables)):
+        present = {v for v, on in zip(variables, values) if on}
+        clauses = list(builder['base'])
+        for (req, forb), extra in builder['optional']:
+            if req <= present and not (forb & present):
+                clauses.extend(extra)
+        clauses.extend(tail)
+        shape = _shape_from_clauses(builder['collection'], site, clauses)
+        key = (shape.equality, shape.ranges, shape.order, shape.arrays)
+        if key not in seen:
+            seen.add(key)
+            shapes.append(shape)
+    return shapes
+
+
+# ============================================================
+# PYTHON EXTRACTION
+# ============================================================
+
+PY_DIRECTIONS = {'DESCENDING': 'DESCENDING', 'ASCENDING': 'ASCENDING'}
+# Each statement is walked once per combination of collection names and branch facts; beyond this, stop splitting
+MAX_WORLDS = 64
+
+
+def _py_const(node):
+    return node.value if isinstance(node, ast.Constant) else None
+
+
+def _py_chain(node):
+    """Unwind `db.collection(x).where(...).order_by(...)` into (root, clauses)
+
+    root is ('collection', arg) for a chain that starts at collection() and ('var', name)
+    for one that continues a query held in a variable, e.g. `query.where(...).stream()`.
+    """
+    clauses = []
+    while isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        method = node.func.attr
+        if method == 'collection':
+            return ('collection', node.args[0] if node.args else None), list(reversed(clauses))
+        if method == 'where':
+            args = list(node.args)
+            filt = next((k.value for k in node.keywords if k.arg == 'filter'), None)
+            if filt is not None and isinstance(filt, ast.Call):
+                args = list(filt.args)
+                args += [k.value for k in filt.keywords if k.arg in ('field_path', 'op_string', 'value')]
+            if len(args) >= 2 and isinstance(_py_const(args[0]), str):
+                sample = _py_const(args[2]) if len(args) > 2 else None
+                clauses.append(('where', _py_const(args[0]), _py_const(args[1]), sample))
+        elif method == 'order_by':
+            name = _py_const(node.args[0]) if node.args else None
+            direction = 'ASCENDING'
+            for k in node.keywords:
+                if k.arg == 'direction':
+                    text = ast.unparse(k.value)
+                    direction = next((v for key, v in PY_DIRECTIONS.items() if key in text), direction)
+            if isinstance(name, str):
+                clauses.append(('order', name, direction, None))
+        node = node.func.value
+    if isinstance(node, ast.Name):
+        return ('var', node.id), list(reversed(clauses))
+    return None, []
+
+
+def _module_constants(tree):
+    """Module-level NAME = <literal> assignments, e.g. SOURCES = ('sales_orders', 'pickup_requests')"""
+    consts = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                consts[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                continue
+    return consts
+
+
+def _call_arguments(tree, consts):
+    """{function name: {parameter: {string values}}} from the calls in a module
+
+    `self.list_records(db, request, principal, 'sales_orders')` gives list_records' collection
+    parameter the value 'sales_orders', so a query on db.collection(collection) resolves.
+    """
+    params = {}
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            params[node.name] = [a.arg for a in node.args.args]
+    values = {}
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        name = node.func.attr if isinstance(node.func, ast.Attribute) else getattr(node.func, 'id', None)
+        names = params.get(name)
+        if not names:
+            continue
+        offset = 1 if isinstance(node.func, ast.Attribute) and names[0] in ('self', 'cls') else 0
+        passed = list(zip(names[offset:], node.args)) + [(k.arg, k.value) for k in node.keywords]
+        for param, arg in passed:
+            value = _py_const(arg) if isinstance(arg, ast.Constant) else consts.get(getattr(arg, 'id', None))
+            if isinstance(value, str):
+                values.setdefault(name, {}).setdefault(param, set()).add(value)
+    return values
+
+
+def _py_iterable(node, consts):
+    """The items a for loop walks, when they are literals or module constants"""
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and not node.args:
+        mapping = consts.get(getattr(node.func.value, 'id', None))
+        if isinstance(mapping, dict) and node.func.attr in ('items', 'keys', 'values'):
+            return list(getattr(mapping, node.func.attr)())
+        return None
+    if isinstance(node, ast.Name):
+        value = consts.get(node.id)
+    else:
+        try:
+            value = ast.literal_eval(node)
+        except ValueError:
+            return None
+    return list(value) if isinstance(value, (tuple, list, set, dict)) else None
+
+
+def _bind(target, value, names):
+    """Assign a loop item to the loop target, keeping the string values"""
+    if isinstance(target, ast.Name) and isinstance(value, str):
+        names[target.id] = value
+    elif isinstance(target, (ast.Tuple, ast.List)) and isinstance(value, (tuple, list)) \
+            and len(target.elts) == len(value):
+        for elt, item in zip(target.elts, value):
+            _bind(elt, item, names)
+
+
+def _test_facts(test):
+    """Variables a branch test pins to truthy/falsy: `a and not b` -> {(a, True), (b, False)}"""
+    if isinstance(test, ast.Name):
+        return {(test.id, True)}
+    if isinstance(test, ast.UnaryOp) and isinstance(test.op, ast.Not) and isinstance(test.operand, ast.Name):
+        return {(test.operand.id, False)}
+    if isinstance(test, ast.Compare) and len(test.ops) == 1 and isinstance(test.left, ast.Name) \
+            and isinstance(test.comparators[0], ast.Constant) and test.comparators[0].value is None:
+        if isinstance(test.ops[0], ast.Is):
+            return {(test.left.id, False)}
+        if isinstance(test.ops[0], ast.IsNot):
+            return {(test.left.id, True)}
+    if isinstance(test, ast.BoolOp) and isinstance(test.op, ast.And):
+        return set().union(*(_test_facts(v) for v in test.values))
+    return set()
+
+
+def _else_facts(test):
+    """Facts for the else branch; only a single-variable test can be negated"""
+    facts = _test_facts(test)
+    if len(facts) == 1 and not isinstance(test, ast.BoolOp):
+        return {(name, not truth) for name, truth in facts}
+    return set()
+
+
+class World:
+    """One path through a function: bound collection names, query variables and branch facts"""
+
+    def __init__(self, names=None, builders=None, facts=frozenset()):
+        self.names = dict(names or {})
+        self.builders = dict(builders or {})
+        self.facts = frozenset(facts)
+
+    def copy(self):
+        return World(self.names, self.builders, self.facts)
+
+    def assume(self, facts):
+        """This world under extra branch facts, or None when they contradict what it already knows"""
+        if any((name, not truth) in self.facts for name, truth in facts):
+            return None
+        world = self.copy()
+        world.facts = self.facts | frozenset(facts)
+        return world
+
+    def forget(self, name):
+        self.names.pop(name, None)
+        self.builders.pop(name, None)
+        self.facts = frozenset(f for f in self.facts if f[0] != name)
+
+    def key(self):
+        return (tuple(sorted(self.names.items())), tuple(sorted(self.builders.items())), self.facts)
+
+
+def _dedupe(worlds):
+    unique = {}
+    for world in worlds:
+        unique.setdefault(world.key(), world)
+    return list(unique.values())[:MAX_WORLDS]
+
+
+class PythonQueryWalker:
+    """Follows query variables through a module's functions, branch by branch
+
+    Handles queries built up in steps (`query = query.where(...)` under if/elif), collection
+    names held in variables (loop items, module constants, arguments at the call sites)
+    and queries used later by name (`query.stream()`, `lambda: fetch(query)`).
+    """
+
+    def __init__(self, tree, rel):
+        self.rel = rel
+        self.consts = _module_constants(tree)
+        self.arguments = _call_arguments(tree, self.consts)
+        self.shapes = {}
+
+    def run(self, tree):
+        self.block(tree.body, [World()])
+        return list(self.shapes.values())
+
+    # ---------------------------------------------------------- resolution
+
+    def collection_name(self, arg, world):
+        if isinstance(arg, ast.Constant):
+            return arg.value if isinstance(arg.value, str) else None
+        if isinstance(arg, ast.Name):
+            value = world.names.get(arg.id, self.consts.get(arg.id))
+            return value if isinstance(value, str) else None
+        return None
+
+    def resolve(self, root, clauses, world):
+        """(collection, clauses, line) for a chain in this world, or None"""
+        kind, value = root
+        if kind == 'collection':
+            collection = self.collection_name(value, world)
+            return (collection, tuple(clauses), value.lineno) if collection and value is not None else None
+        if kind == 'var' and value in world.builders:
+            collection, base, line = world.builders[value]
+            return collection, base + tuple(clauses), line
+        return None
+
+    def emit(self, collection, clauses, line):
+        if not any(c[0] in ('where', 'order') for c in clauses):
+            return
+        shape = _shape_from_clauses(collection, f'{self.rel}:{line}', clauses)
+        key = (shape.source, shape.collection, shape.equality, shape.ranges, shape.order, shape.arrays)
+        self.shapes.setdefault(key, shape)
+
+    # ---------------------------------------------------------- expressions
+
+    def uses(self, nodes, worlds, assign_to=None):
+        """Emit every query an expression runs; returns the new builder when it is assigned to a name"""
+        chains, consumed, names = [], set(), set()
+        for expr in nodes:
+            for node in ast.walk(expr):
+                if isinstance(node, ast.Call) and id(node) not in consumed:
+                    root, clauses = _py_chain(node)
+                    inner = node.func.value if isinstance(node.func, ast.Attribute) else None
+                    while isinstance(inner, ast.Call):
+                        consumed.add(id(inner))
+                        inner = inner.func.value if isinstance(inner.func, ast.Attribute) else None
+                    if isinstance(inner, ast.Name):
+                        consumed.add(id(inner))
+                    if root is not None:
+                        chains.append((node, root, clauses))
+                elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and id(node) not in consumed:
+                    names.add(node.id)
+        assigned = {}
+        for world in worlds:
+            for node, root, clauses in chains:
+                found = self.resolve(root, clauses, world)
+                if not found:
+                    continue
+                if assign_to is not None and len(nodes) == 1 and node is nodes[0]:
+                    assigned[id(world)] = found
+                else:
+                    self.emit(*found)
+            for name in names & set(world.builders):
+                self.emit(*world.builders[name])
+        return assigned
+
+    # ---------------------------------------------------------- statements
+
+    def enter(self, func, worlds):
+        """Split the worlds over the collection names the call sites pass in"""
+        passed = self.arguments.get(func.name, {})
+        used = {n.args[0].id for n in ast.walk(func)
+                if isinstance(n, ast.Call) and isinstance(n.func, ast.Attribute) and n.func.attr == 'collection'
+                and n.args and isinstance(n.args[0], ast.Name)}
+        result = [w.copy() for w in worlds]
+        for param in (a.arg for a in func.args.args):
+            if param in used and param in passed:
+                split = []
+                for world in result:
+                    for value in sorted(passed[param]):
+                        world = world.copy()
+                        world.names[param] = value
+                        split.append(world)
+                result = _dedupe(split)
+            elif param in used:
+                for world in result:
+                    world.forget(param)
+        return result
+
+    def block(self, body, worlds):
+        for stmt in body:
+            if not worlds:
+                break
+            worlds = _dedupe(self.statement(stmt, worlds))
+        return worlds
+
+    def statement(self, stmt, worlds):
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            # Nested functions see the enclosing queries; their own assignments stay local
+            self.block(stmt.body, self.enter(stmt, worlds))
+            return worlds
+        if isinstance(stmt, ast.ClassDef):
+            self.block(stmt.body, [World()])
+            return worlds
+        if isinstance(stmt, (ast.Raise, ast.Return, ast.Continue, ast.Break)):
+            self.uses([stmt], worlds)
+            return []
+        if isinstance(stmt, ast.If):
+            self.uses([stmt.test], worlds)
+            then = [w for w in (w.assume(_test_facts(stmt.test)) for w in worlds) if w]
+            other = [w for w in (w.assume(_else_facts(stmt.test)) for w in worlds) if w]
+            return self.block(stmt.body, then) + (self.block(stmt.orelse, other) if stmt.orelse else other)
+        if isinstance(stmt, (ast.For, ast.AsyncFor)):
+            self.uses([stmt.iter], worlds)
+            items = _py_iterable(stmt.iter, self.consts)
+            bound = []
+            for world in worlds:
+                world = world.copy()
+                for name in (n.id for n in ast.walk(stmt.target) if isinstance(n, ast.Name)):
+                    world.forget(name)
+                for item in items or [None]:
+                    split = world.copy()
+                    _bind(stmt.target, item, split.names)
+                    bound.append(split)
+            after = self.block(stmt.body, _dedupe(bound))
+            return (after or worlds) + (self.block(stmt.orelse, worlds) if stmt.orelse else [])
+        if isinstance(stmt, ast.While):
+            self.uses([stmt.test], worlds)
+            return self.block(stmt.body, worlds) or worlds
+        if isinstance(stmt, (ast.With, ast.AsyncWith)):
+            self.uses([item.context_expr for item in stmt.items], worlds)
+            return self.block(stmt.body, worlds)
+        if isinstance(stmt, ast.Try):
+            after = self.block(stmt.body, worlds)
+            for handler in stmt.handlers:
+                after += self.block(handler.body, worlds)
+            after = self.block(stmt.orelse, after) if stmt.orelse else after
+            return self.block(stmt.finalbody, after) if stmt.finalbody else after
+        if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+            name = stmt.targets[0].id
+            assigned = self.uses([stmt.value], worlds, assign_to=name)
+            result = []
+            for world in worlds:
+                found = assigned.get(id(world))
+                world = world.copy()
+                world.forget(name)
+                if found:
+                    world.builders[name] = found
+                result.append(world)
+            return result
+        self.uses([stmt], worlds)
+        targets = getattr(stmt, 'targets', None) or [getattr(stmt, 'target', None)]
+        for world in worlds:
+            for name in (n.id for t in targets if t is not None for n in ast.walk(t) if isinstance(n, ast.Name)):
+                world.forget(name)
+        return worlds
+
+
+def extract_python_shapes(paths):
+    shapes = []
+    for path in paths:
+        with open(path, encoding='utf-8') as fh:
+            try:
+                tree = ast.parse(fh.read(), filename=path)
+            except SyntaxError:
+                continue
+        shapes.extend(PythonQueryWalker(tree, os.path.relpath(path, REPO_ROOT)).run(tree))
+    return shapes
+
+
+def extract_all_shapes(root=REPO_ROOT):
+    dart_paths = sorted({p for pattern in DART_SOURCES
+                         for p in glob.glob(os.path.join(root, pattern), recursive=True)})
+    py_paths = sorted(glob.glob(os.path.join(root, '*.py')))
+    return extract_dart_shapes(dart_paths) + extract_python_shapes(py_paths)
+
+
+# ============================================================
+# PLANNING
+# ============================================================
+
+def serves(indexes, shape):
+    """Return the indexes that serve a shape exactly or by index merging, or None"""
+    suffix = shape.sort_suffix()
+    wanted_eq = set(shape.equality)
+    wanted_arrays = set(shape.arrays)
+    usable = []
+    for ix in indexes:
+        if ix.collection != shape.collection:
+            continue
+        head = ix.split(suffix)
+        if head is None:
+            continue
+        eq = {n for n, o in head if o != 'CONTAINS'}
+        arrays = {n for n, o in head if o == 'CONTAINS'}
+        if eq <= wanted_eq and arrays == wanted_arrays:
+            usable.append((ix, eq))
+    exact = [ix for ix, eq in usable if eq == wanted_eq]
+    if exact:
+        return exact[:1]
+    covered = set().union(*(eq for _, eq in usable)) if usable else set()
+    if usable and covered == wanted_eq:
+        return [ix for ix, _ in usable]
+    return None
+
+
+def plan_indexes(shapes, allow_merge=True):
+    """Minimal composite index set: dedupe, then drop indexes that merging already covers"""
+    composite = [s for s in shapes if s.needs_composite() and not s.problems()]
+    candidates = sorted({CompositeIndex.for_shape(s) for s in composite},
+                        key=lambda ix: (ix.collection, len(ix.fields), ix.fields))
+    if not allow_merge:
+        return candidates
+
+    kept = list(candidates)
+    # Try removing the most specific indexes first; merges of narrower ones can rebuild them
+    for ix in sorted(candidates, key=lambda ix: -len(ix.fields)):
+        trial = [k for k in kept if k != ix]
+        if all(serves(trial, s) for s in composite):
+            kept = trial
+    return kept
+
+
+def coverage_report(shapes, indexes):
+    """Classify every shape as automatic, composite, merged or missing"""
+    report = []
+    for shape in shapes:
+        issues = shape.problems()
+        if issues:
+            report.append((shape, 'invalid', issues))
+        elif not shape.needs_composite():
+            mode = 'single-field' if len(shape.distinct_fields()) <= 1 else 'index-merge'
+            report.append((shape, mode, []))
+        else:
+            used = serves(indexes, shape)
+            if used is None:
+                report.append((shape, 'missing', []))
+            elif len(used) == 1 and len(used[0].fields) == len(CompositeIndex.for_shape(shape).fields):
+                report.append((shape, 'composite', used))
+            else:
+                report.append((shape, 'composite-merge', used))
+    return report
+
+
+def load_index_file(path):
+    with open(path, encoding='utf-8') as fh:
+        data = json.load(fh)
+    return [CompositeIndex.from_json(entry) for entry in data.get('indexes', [])]
+
+
+def write_index_file(path, indexes):
+    data = {
+        'indexes': [ix.to_json() for ix in indexes],
+        'fieldOverrides': [],
+    }
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(data, fh, indent=2)
+        fh.write('\n')
+
+
+# ============================================================
+# EMULATOR VALIDATION
+# ============================================================
+
+def _placeholder(name, sample):
+    if sample is not None and sample != 'timestamp':
+        return sample
+    from datetime import datetime
+    if sample == 'timestamp' or re.search(r'(At|Date|Deadline|Start|End)$', name):
+        return datetime.now()
+    if re.match(r'(is|has)[A-Z]', name):
+        return True
+    return 'placeholder'
+
+
+def validate_against_emulator(shapes):
+    """Run each shape against the emulator so malformed shapes surface before deploy"""
+    if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        print('❌ FIRESTORE_EMULATOR_HOST is not set; start the emulator first')
+        return False
+
+    import firebase_admin
+    from firebase_admin import firestore
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(options={'projectId': os.environ.get('GCLOUD_PROJECT', 'oil-manager-dev')})
+    db = firestore.client()
+
+    ok = True
+    for shape in shapes:
+        query = db.collection(shape.collection)
+        for name in shape.equality:
+            query = query.where(filter=FieldFilter(name, '==', _placeholder(name, shape.samples.get(name))))
+        for name in shape.arrays:
+            query = query.where(filter=FieldFilter(name, 'array_contains', 'placeholder'))
+        for name in dict.fromkeys(shape.ranges):
+            query = query.where(filter=FieldFilter(name, '<', _placeholder(name, shape.samples.get(name))))
+        for name, direction in shape.order:
+            query = query.order_by(name, direction=direction)
+        started = time.perf_counter()
+        try:
+            list(query.limit(1).stream())
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f'   ✓ {shape.describe()} ({elapsed:.1f} ms)')
+        except Exception as e:
+            ok = False
+            print(f'   ❌ {shape.describe()}: {e}')
+    return ok
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description='Plan Firestore composite indexes from query shapes')
+    parser.add_argument('--out', default=os.path.join(REPO_ROOT, 'firestore.indexes.json'),
+                        help='index file to write (default: firestore.indexes.json)')
+    parser.add_argument('--check', metavar='FILE',
+                        help='report coverage of an existing index file instead of writing one')
+    parser.add_argument('--no-merge', action='store_true',
+                        help='keep one exact index per query shape instead of relying on index merging')
+    parser.add_argument('--validate', action='store_true',
+                        help='execute every query shape against the Firestore emulator')
+    args = parser.parse_args()
+
+    print('=' * 60)
+    print('🗂️  Firestore Composite Index Planner')
+    print('=' * 60)
+
+    shapes = extract_all_shapes()
+    print(f'\n🔍 Extracted {len(shapes)} query shapes from {len({s.source for s in shapes})} call sites')
+
+    if args.check:
+        indexes = load_index_file(args.check)
+        print(f'📄 Checking {len(indexes)} indexes from {args.check}')
+    else:
+        indexes = plan_indexes(shapes, allow_merge=not args.no_merge)
+        exact = plan_indexes(shapes, allow_merge=False)
+        write_index_file(args.out, indexes)
+        print(f'✅ Wrote {len(indexes)} composite indexes to {os.path.relpath(args.out)}'
+              f' ({len(exact) - len(indexes)} redundant removed)')
+
+    print('\n📋 Composite indexes:')
+    for ix in indexes:
+        print(f'   • {ix.describe()}')
+
+    report = coverage_report(shapes, indexes)
+    print('\n📊 Query coverage:')
+    for shape, mode, detail in report:
+        icon = {'missing': '❌', 'invalid': '⚠️ '}.get(mode, '✓')
+        print(f'   {icon} [{mode}] {shape.describe()}  ← {shape.source}')
+        if mode == 'invalid':
+            for issue in detail:
+                print(f'        {issue}')
+
+    missing = [s for s, mode, _ in report if mode in ('missing', 'invalid')]
+    if missing:
+        print(f'\n❌ {len(missing)} queries have no usable index: production rejects them with'
+              ' FAILED_PRECONDITION and the emulator silently falls back to a full collection scan')
+
+    if args.validate:
+        print('\n🧪 Validating query shapes against the emulator...')
+        if not validate_against_emulator(shapes):
+            sys.exit(1)
+
+    if missing:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
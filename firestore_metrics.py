@@ -0,0 +1,742 @@
+#!/usr/bin/env python3
+"""
+Firestore operation metrics for Oil Manager Python jobs
+Wraps firestore.client() to count documents read/written, bytes, latency and retries
+per collection and operation, and exports them as Prometheus text or OpenMetrics
+"""
+
+import argparse
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus client default buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Firestore list prices per operation (USD), used only to rank call sites
+COST_PER_READ = 0.06 / 100000
+COST_PER_WRITE = 0.18 / 100000
+COST_PER_DELETE = 0.02 / 100000
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.2
+
+# Field transforms that apply twice when a write that timed out but landed is retried
+NON_IDEMPOTENT_TRANSFORMS = ('Increment',)
+
+_THIS_FILE = os.path.abspath(__file__)
+
+
+def _transient_errors():
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return ()
+    return (exceptions.ServiceUnavailable, exceptions.DeadlineExceeded,
+            exceptions.InternalServerError, exceptions.ResourceExhausted, exceptions.Aborted)
+
+
+def estimate_size(value):
+    """Approximate Firestore storage size of a value, following the documented rules"""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime, date)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k).encode('utf-8')) + 1 + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    if hasattr(value, 'latitude') and hasattr(value, 'longitude'):
+        return 16
+    if hasattr(value, 'path'):
+        return len(value.path) + 1
+    # Sentinels such as SERVER_TIMESTAMP resolve to a timestamp
+    return 8
+
+
+def is_idempotent(data=None, option=None):
+    """Whether a write can be retried after a transient error without applying it twice
+
+    A write_option precondition fails on the retry once the first attempt has landed,
+    and an Increment adds again.
+    """
+    if option is not None:
+        return False
+    if isinstance(data, dict):
+        return all(is_idempotent(value) for value in data.values())
+    return type(data).__name__ not in NON_IDEMPOTENT_TRANSFORMS
+
+
+def _write_option(args, kwargs):
+    """The option= precondition of an update()/delete() call, passed by keyword or position"""
+    return kwargs.get('option', args[0] if args else None)
+
+
+def document_size(path, data):
+    """Document name size plus field sizes plus the fixed 32-byte overhead"""
+    return len(path.encode('utf-8')) + 16 + estimate_size(data or {}) + 32
+
+
+def label_pairs(**labels):
+    """Render labels as name="value" pairs with exposition-format escaping"""
+    def esc(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{esc(value)}"' for name, value in labels.items())
+
+
+def _call_site():
+    """First stack frame outside this module and the Google client libraries"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (os.path.abspath(filename) != _THIS_FILE and 'site-packages' not in filename
+                and not filename.startswith('<frozen')):
+            return f'{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+class OperationStats:
+    """Counters and latency histogram for one (collection, operation) pair"""
+
+    __slots__ = ('calls', 'reads', 'writes', 'deletes', 'bytes_read', 'bytes_written',
+                 'retries', 'errors', 'seconds', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.reads = 0
+        self.writes = 0
+        self.deletes = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.retries = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def cost(self):
+        return self.reads * COST_PER_READ + self.writes * COST_PER_WRITE + self.deletes * COST_PER_DELETE
+
+
+class FirestoreMetrics:
+    """Process-wide registry of Firestore operation metrics"""
+
+    def __init__(self, job='oil_manager'):
+        self.job = job
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._ops = defaultdict(OperationStats)
+        self._sites = defaultdict(OperationStats)
+        self._collectors = []
+
+    def add_collector(self, collector):
+        """Register collector(openmetrics) -> list of exposition lines, appended to every render"""
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def record(self, collection, op, seconds, reads=0, writes=0, deletes=0,
+               bytes_read=0, bytes_written=0, retries=0, error=False, site=None):
+        with self._lock:
+            for stats in (self._ops[(collection, op)], self._sites[(site or _call_site(), collection, op)]):
+                stats.observe(seconds)
+                stats.reads += reads
+                stats.writes += writes
+                stats.deletes += deletes
+                stats.bytes_read += bytes_read
+                stats.bytes_written += bytes_written
+                stats.retries += retries
+                stats.errors += 1 if error else 0
+
+    def timed(self, collection, op, fn, idempotent=True):
+        """Run one RPC with retries on transient errors and record its latency"""
+        site = _call_site()
+        retries = 0
+        started = time.perf_counter()
+        transient = _transient_errors()
+        while True:
+            try:
+                result = fn()
+                break
+            except transient:
+                if not idempotent or retries + 1 >= MAX_ATTEMPTS:
+                    self.record(collection, op, time.perf_counter() - started,
+                                retries=retries, error=True, site=site)
+                    raise
+                retries += 1
+                time.sleep(RETRY_BASE_DELAY * (2 ** (retries - 1)) * (0.5 + random.random()))
+            except Exception:
+                self.record(collection, op, time.perf_counter() - started,
+                            retries=retries, error=True, site=site)
+                raise
+        return result, time.perf_counter() - started, retries, site
+
+    async def timed_async(self, collection, op, coro_fn, idempotent=True):
+        """Async variant of timed() for the AsyncClient wrappers"""
+        import asyncio
+        site = _call_site()
+        retries = 0
+        started = time.perf_counter()
+        transient = _transient_errors()
+        while True:
+            try:
+                result = await coro_fn()
+                break
+            except transient:
+                if not idempotent or retries + 1 >= MAX_ATTEMPTS:
+                    self.record(collection, op, time.perf_counter() - started,
+                                retries=retries, error=True, site=site)
+                    raise
+                retries += 1
+                await asyncio.sleep(RETRY_BASE_DELAY * (2 ** (retries - 1)) * (0.5 + random.random()))
+            except Exception:
+                self.record(collection, op, time.perf_counter() - started,
+                            retries=retries, error=True, site=site)
+                raise
+        return result, time.perf_counter() - started, retries, site
+
+    def totals(self):
+        with self._lock:
+            total = OperationStats()
+            for stats in self._ops.values():
+                total.calls += stats.calls
+                total.reads += stats.reads
+                total.writes += stats.writes
+                total.deletes += stats.deletes
+                total.bytes_read += stats.bytes_read
+                total.bytes_written += stats.bytes_written
+                total.retries += stats.retries
+                total.seconds += stats.seconds
+            return total
+
+    def top_call_sites(self, n=10):
+        with self._lock:
+            ranked = sorted(self._sites.items(), key=lambda kv: (kv[1].cost(), kv[1].seconds), reverse=True)
+        return ranked[:n]
+
+    # ==================== EXPORT ====================
+
+    def render(self, openmetrics=False):
+        """Render all metrics in Prometheus text format 0.0.4 or OpenMetrics 1.0"""
+        counters = [
+            ('firestore_operations', 'Firestore RPCs issued', 'calls'),
+            ('firestore_documents_read', 'Documents read (billed reads)', 'reads'),
+            ('firestore_documents_written', 'Documents written', 'writes'),
+            ('firestore_documents_deleted', 'Documents deleted', 'deletes'),
+            ('firestore_read_bytes', 'Estimated document bytes read', 'bytes_read'),
+            ('firestore_written_bytes', 'Estimated document bytes written', 'bytes_written'),
+            ('firestore_retries', 'Retries after transient errors', 'retries'),
+            ('firestore_errors', 'Operations that failed after retries', 'errors'),
+        ]
+        with self._lock:
+            ops = sorted(self._ops.items())
+        lines = []
+        for name, help_text, attr in counters:
+            family = name if openmetrics else f'{name}_total'
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} counter')
+            for (collection, op), stats in ops:
+                lines.append(f'{name}_total{{{self._labels(collection, op)}}} {getattr(stats, attr)}')
+
+        name = 'firestore_operation_duration_seconds'
+        lines.append(f'# HELP {name} Firestore RPC latency including retries')
+        lines.append(f'# TYPE {name} histogram')
+        for (collection, op), stats in ops:
+            labels = self._labels(collection, op)
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {stats.calls}')
+            lines.append(f'{name}_sum{{{labels}}} {stats.seconds:.6f}')
+            lines.append(f'{name}_count{{{labels}}} {stats.calls}')
+        for collector in list(self._collectors):
+            lines.extend(collector(openmetrics))
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def _labels(self, collection, op):
+        return label_pairs(job=self.job, collection=collection, op=op)
+
+    def write(self, path, openmetrics=False):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            fh.write(self.render(openmetrics))
+        os.replace(tmp, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Expose /metrics on a background thread for Prometheus to scrape"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+                body = metrics.render(openmetrics).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+                                 if openmetrics else 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def print_profile(self, n=10):
+        total = self.totals()
+        print('\n' + '=' * 70)
+        print(f'📈 Firestore profile: {self.job}')
+        print('=' * 70)
+        print(f'   Calls: {total.calls}  Reads: {total.reads}  Writes: {total.writes}  '
+              f'Deletes: {total.deletes}  Retries: {total.retries}')
+        print(f'   Bytes read: {total.bytes_read:,}  Bytes written: {total.bytes_written:,}  '
+              f'Time in Firestore: {total.seconds * 1000:.0f} ms')
+        print(f'\n   Top {n} call sites by estimated cost:')
+        print(f"   {'call site':<44} {'collection':<26} {'op':<8} {'reads':>7} {'writes':>7} {'ms':>8}")
+        for (site, collection, op), stats in self.top_call_sites(n):
+            print(f'   {site[:44]:<44} {collection[:26]:<26} {op:<8} {stats.reads:>7} '
+                  f'{stats.writes + stats.deletes:>7} {stats.seconds * 1000:>8.1f}')
+
+
+# ============================================================
+# INSTRUMENTED WRAPPERS
+# ============================================================
+
+def _unwrap(obj):
+    return getattr(obj, '_wrapped', obj)
+
+
+class _Wrapper:
+    def __init__(self, wrapped, metrics, collection):
+        self._wrapped = wrapped
+        self._metrics = metrics
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+
+class InstrumentedQuery(_Wrapper):
+    """Query wrapper; builder methods keep the wrapper, get/stream are measured"""
+
+    _BUILDERS = ('where', 'order_by', 'limit', 'limit_to_last', 'offset', 'select',
+                 'start_at', 'start_after', 'end_at', 'end_before')
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+        if name in self._BUILDERS:
+            def builder(*args, **kwargs):
+                return InstrumentedQuery(attr(*args, **kwargs), self._metrics, self._collection)
+            return builder
+        return attr
+
+    def get(self, *args, **kwargs):
+        docs, seconds, retries, site = self._metrics.timed(
+            self._collection, 'query', lambda: list(self._wrapped.stream(*args, **kwargs)))
+        self._record_read(docs, 'query', seconds, retries, site)
+        return docs
+
+    def stream(self, *args, **kwargs):
+        site = _call_site()
+        started = time.perf_counter()
+        count, size = 0, 0
+        try:
+            for doc in self._wrapped.stream(*args, **kwargs):
+                count += 1
+                size += document_size(doc.reference.path, doc.to_dict())
+                yield doc
+        finally:
+            # Queries are billed at least one read even when nothing matches
+            self._metrics.record(self._collection, 'stream', time.perf_counter() - started,
+                                 reads=max(count, 1), bytes_read=size, site=site)
+
+    def count(self, *args, **kwargs):
+        aggregation = self._wrapped.count(*args, **kwargs)
+        metrics, collection = self._metrics, self._collection
+
+        class _Count:
+            def get(self_inner, *a, **kw):
+                result, seconds, retries, site = metrics.timed(collection, 'count', lambda: aggregation.get(*a, **kw))
+                value = result[0][0].value if result and result[0] else 0
+                # Aggregations bill one read per batch of up to 1000 index entries
+                metrics.record(collection, 'count', seconds, reads=max(1, -(-int(value) // 1000)),
+                               retries=retries, site=site)
+                return result
+        return _Count()
+
+    def on_snapshot(self, callback):
+        metrics, collection = self._metrics, self._collection
+
+        def counting(snapshots, changes, read_time):
+            metrics.record(collection, 'listen', 0.0, reads=max(len(changes), 1),
+                           bytes_read=sum(document_size(c.document.reference.path, c.document.to_dict())
+                                          for c in changes), site='listener')
+            return callback(snapshots, changes, read_time)
+        return self._wrapped.on_snapshot(counting)
+
+    def _record_read(self, docs, op, seconds, retries, site):
+        size = sum(document_size(d.reference.path, d.to_dict()) for d in docs)
+        self._metrics.record(self._collection, op, seconds, reads=max(len(docs), 1),
+                             bytes_read=size, retries=retries, site=site)
+
+
+class InstrumentedCollection(InstrumentedQuery):
+    def document(self, *path):
+        return InstrumentedDocument(self._wrapped.document(*path), self._metrics, self._collection)
+
+    def add(self, document_data, document_id=None):
+        result, seconds, retries, site = self._metrics.timed(
+            self._collection, 'add', lambda: self._wrapped.add(document_data, document_id=document_id),
+            idempotent=False)
+        self._metrics.record(self._collection, 'add', seconds, writes=1, retries=retries, site=site,
+                             bytes_written=document_size(result[1].path, document_data))
+        return result
+
+    def list_documents(self, *args, **kwargs):
+        for ref in self._wrapped.list_documents(*args, **kwargs):
+            yield InstrumentedDocument(ref, self._metrics, self._collection)
+
+
+class InstrumentedDocument(_Wrapper):
+    def get(self, *args, **kwargs):
+        snap, seconds, retries, site = self._metrics.timed(
+            self._collection, 'get', lambda: self._wrapped.get(*args, **kwargs))
+        self._metrics.record(self._collection, 'get', seconds, reads=1, retries=retries, site=site,
+                             bytes_read=document_size(self._wrapped.path, snap.to_dict()) if snap.exists else 0)
+        return snap
+
+    def _write(self, op, fn, data=None, idempotent=True):
+        result, seconds, retries, site = self._metrics.timed(self._collection, op, fn, idempotent=idempotent)
+        if op == 'delete':
+            self._metrics.record(self._collection, op, seconds, deletes=1, retries=retries, site=site)
+        else:
+            self._metrics.record(self._collection, op, seconds, writes=1, retries=retries, site=site,
+                                 bytes_written=document_size(self._wrapped.path, data))
+        return result
+
+    def set(self, document_data, merge=False):
+        return self._write('set', lambda: self._wrapped.set(document_data, merge=merge), document_data,
+                           idempotent=is_idempotent(document_data))
+
+    def update(self, field_updates, *args, **kwargs):
+        return self._write('update', lambda: self._wrapped.update(field_updates, *args, **kwargs), field_updates,
+                           idempotent=is_idempotent(field_updates, _write_option(args, kwargs)))
+
+    def create(self, document_data):
+        return self._write('create', lambda: self._wrapped.create(document_data), document_data, idempotent=False)
+
+    def delete(self, *args, **kwargs):
+        return self._write('delete', lambda: self._wrapped.delete(*args, **kwargs),
+                           idempotent=is_idempotent(option=_write_option(args, kwargs)))
+
+    def collection(self, collection_id):
+        return InstrumentedCollection(self._wrapped.collection(collection_id), self._metrics,
+                                      f'{self._collection}/{collection_id}')
+
+    def on_snapshot(self, callback):
+        metrics, collection = self._metrics, self._collection
+
+        def counting(snapshots, changes, read_time):
+            metrics.record(collection, 'listen', 0.0, reads=max(len(snapshots), 1), site='listener')
+            return callback(snapshots, changes, read_time)
+        return self._wrapped.on_snapshot(counting)
+
+
+class InstrumentedBatch(_Wrapper):
+    """WriteBatch wrapper; writes are attributed to collections when the batch commits"""
+
+    def __init__(self, wrapped, metrics):
+        super().__init__(wrapped, metrics, None)
+        self._pending = []
+        self._idempotent = True
+
+    def _track(self, op, reference, data=None, idempotent=True):
+        collection = getattr(reference, '_collection', None) or _unwrap(reference).parent.id
+        self._pending.append((collection, op, document_size(_unwrap(reference).path, data) if data else 0))
+        # One create, Increment or precondition makes the whole commit unsafe to retry
+        self._idempotent = self._idempotent and idempotent
+
+    def _take_pending(self):
+        pending, idempotent = self._pending, self._idempotent
+        self._pending, self._idempotent = [], True
+        return pending, idempotent
+
+    def set(self, reference, document_data, merge=False):
+        self._track('set', reference, document_data, is_idempotent(document_data))
+        return self._wrapped.set(_unwrap(reference), document_data, merge=merge)
+
+    def update(self, reference, field_updates, *args, **kwargs):
+        self._track('update', reference, field_updates, is_idempotent(field_updates, _write_option(args, kwargs)))
+        return self._wrapped.update(_unwrap(reference), field_updates, *args, **kwargs)
+
+    def create(self, reference, document_data):
+        self._track('create', reference, document_data, idempotent=False)
+        return self._wrapped.create(_unwrap(reference), document_data)
+
+    def delete(self, reference, *args, **kwargs):
+        self._track('delete', reference, idempotent=is_idempotent(option=_write_option(args, kwargs)))
+        return self._wrapped.delete(_unwrap(reference), *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        pending, idempotent = self._take_pending()
+        result, seconds, retries, site = self._metrics.timed(
+            'batch', 'commit', lambda: self._wrapped.commit(*args, **kwargs), idempotent=idempotent)
+        per_collection = defaultdict(lambda: [0, 0, 0])
+        for collection, op, size in pending:
+            entry = per_collection[collection]
+            entry[1 if op == 'delete' else 0] += 1
+            entry[2] += size
+        share = seconds / max(len(per_collection), 1)
+        for collection, (writes, deletes, size) in per_collection.items():
+            self._metrics.record(collection, 'batch', share, writes=writes, deletes=deletes,
+                                 bytes_written=size, retries=retries, site=site)
+        return result
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+
+
+class InstrumentedClient(_Wrapper):
+    """Drop-in replacement for the client returned by firestore.client()"""
+
+    def __init__(self, client, metrics):
+        super().__init__(client, metrics, None)
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def collection(self, *path):
+        name = '/'.join(path)
+        return InstrumentedCollection(self._wrapped.collection(*path), self._metrics, name.split('/')[-1])
+
+    def document(self, *path):
+        ref = self._wrapped.document(*path)
+        return InstrumentedDocument(ref, self._metrics, ref.parent.id)
+
+    def batch(self):
+        return InstrumentedBatch(self._wrapped.batch(), self._metrics)
+
+    def get_all(self, references, *args, **kwargs):
+        refs = [_unwrap(r) for r in references]
+        site = _call_site()
+        started = time.perf_counter()
+        docs = list(self._wrapped.get_all(refs, *args, **kwargs))
+        seconds = time.perf_counter() - started
+        per_collection = defaultdict(list)
+        for doc in docs:
+            per_collection[doc.reference.parent.id].append(doc)
+        for collection, group in per_collection.items():
+            self._metrics.record(collection, 'get_all', seconds * len(group) / max(len(docs), 1),
+                                 reads=len(group), site=site,
+                                 bytes_read=sum(document_size(d.reference.path, d.to_dict())
+                                                for d in group if d.exists))
+        return docs
+
+
+class AsyncInstrumentedQuery(InstrumentedQuery):
+    """AsyncQuery wrapper; get() and stream() are coroutines/async generators"""
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+        if name in self._BUILDERS:
+            def builder(*args, **kwargs):
+                return AsyncInstrumentedQuery(attr(*args, **kwargs), self._metrics, self._collection)
+            return builder
+        return attr
+
+    async def get(self, *args, **kwargs):
+        async def fetch():
+            return [doc async for doc in self._wrapped.stream(*args, **kwargs)]
+        docs, seconds, retries, site = await self._metrics.timed_async(self._collection, 'query', fetch)
+        self._record_read(docs, 'query', seconds, retries, site)
+        return docs
+
+    async def stream(self, *args, **kwargs):
+        site = _call_site()
+        started = time.perf_counter()
+        count, size = 0, 0
+        try:
+            async for doc in self._wrapped.stream(*args, **kwargs):
+                count += 1
+                size += document_size(doc.reference.path, doc.to_dict())
+                yield doc
+        finally:
+            self._metrics.record(self._collection, 'stream', time.perf_counter() - started,
+                                 reads=max(count, 1), bytes_read=size, site=site)
+
+
+class AsyncInstrumentedCollection(AsyncInstrumentedQuery):
+    def document(self, *path):
+        return AsyncInstrumentedDocument(self._wrapped.document(*path), self._metrics, self._collection)
+
+    async def add(self, document_data, document_id=None):
+        result, seconds, retries, site = await self._metrics.timed_async(
+            self._collection, 'add', lambda: self._wrapped.add(document_data, document_id=document_id),
+            idempotent=False)
+        self._metrics.record(self._collection, 'add', seconds, writes=1, retries=retries, site=site,
+                             bytes_written=document_size(result[1].path, document_data))
+        return result
+
+
+class AsyncInstrumentedDocument(InstrumentedDocument):
+    async def get(self, *args, **kwargs):
+        snap, seconds, retries, site = await self._metrics.timed_async(
+            self._collection, 'get', lambda: self._wrapped.get(*args, **kwargs))
+        self._metrics.record(self._collection, 'get', seconds, reads=1, retries=retries, site=site,
+                             bytes_read=document_size(self._wrapped.path, snap.to_dict()) if snap.exists else 0)
+        return snap
+
+    async def _write(self, op, fn, data=None, idempotent=True):
+        result, seconds, retries, site = await self._metrics.timed_async(self._collection, op, fn,
+                                                                         idempotent=idempotent)
+        if op == 'delete':
+            self._metrics.record(self._collection, op, seconds, deletes=1, retries=retries, site=site)
+        else:
+            self._metrics.record(self._collection, op, seconds, writes=1, retries=retries, site=site,
+                                 bytes_written=document_size(self._wrapped.path, data))
+        return result
+
+    def collection(self, collection_id):
+        return AsyncInstrumentedCollection(self._wrapped.collection(collection_id), self._metrics,
+                                           f'{self._collection}/{collection_id}')
+
+
+class AsyncInstrumentedBatch(InstrumentedBatch):
+    async def commit(self, *args, **kwargs):
+        pending, idempotent = self._take_pending()
+        result, seconds, retries, site = await self._metrics.timed_async(
+            'batch', 'commit', lambda: self._wrapped.commit(*args, **kwargs), idempotent=idempotent)
+        per_collection = defaultdict(lambda: [0, 0, 0])
+        for collection, op, size in pending:
+            entry = per_collection[collection]
+            entry[1 if op == 'delete' else 0] += 1
+            entry[2] += size
+        share = seconds / max(len(per_collection), 1)
+        for collection, (writes, deletes, size) in per_collection.items():
+            self._metrics.record(collection, 'batch', share, writes=writes, deletes=deletes,
+                                 bytes_written=size, retries=retries, site=site)
+        return result
+
+
+class AsyncInstrumentedClient(InstrumentedClient):
+    """Drop-in replacement for firestore.AsyncClient / firestore_async.client()"""
+
+    def collection(self, *path):
+        name = '/'.join(path)
+        return AsyncInstrumentedCollection(self._wrapped.collection(*path), self._metrics, name.split('/')[-1])
+
+    def document(self, *path):
+        ref = self._wrapped.document(*path)
+        return AsyncInstrumentedDocument(ref, self._metrics, ref.parent.id)
+
+    def batch(self):
+        return AsyncInstrumentedBatch(self._wrapped.batch(), self._metrics)
+
+    async def get_all(self, references, *args, **kwargs):
+        refs = [_unwrap(r) for r in references]
+        site = _call_site()
+        started = time.perf_counter()
+        docs = [doc async for doc in self._wrapped.get_all(refs, *args, **kwargs)]
+        seconds = time.perf_counter() - started
+        per_collection = defaultdict(list)
+        for doc in docs:
+            per_collection[doc.reference.parent.id].append(doc)
+        for collection, group in per_collection.items():
+            self._metrics.record(collection, 'get_all', seconds * len(group) / max(len(docs), 1),
+                                 reads=len(group), site=site,
+                                 bytes_read=sum(document_size(d.reference.path, d.to_dict())
+                                                for d in group if d.exists))
+        return docs
+
+
+# ============================================================
+# COMMAND-LINE INTEGRATION
+# ============================================================
+
+def add_metrics_args(parser):
+    """Add the shared --profile/--metrics-* flags to a job's argument parser"""
+    group = parser.add_argument_group('Firestore metrics')
+    group.add_argument('--profile', nargs='?', type=int, const=10, metavar='N',
+                       help='print the N costliest Firestore call sites on exit (default 10)')
+    group.add_argument('--metrics-file', metavar='PATH',
+                       help='write Firestore metrics to PATH on exit (Prometheus textfile format)')
+    group.add_argument('--metrics-port', type=int, metavar='PORT',
+                       help='serve Firestore metrics at http://127.0.0.1:PORT/metrics while running')
+    group.add_argument('--openmetrics', action='store_true',
+                       help='write --metrics-file in OpenMetrics format instead of Prometheus text')
+    return parser
+
+
+def parse_metrics_args(description=None, argv=None):
+    """Argument parser for scripts whose only options are the metrics flags"""
+    summary = (description or '').strip().splitlines()
+    parser = argparse.ArgumentParser(description=summary[0] if summary else None)
+    add_metrics_args(parser)
+    return parser.parse_args(argv)
+
+
+_registries = {}
+
+
+def _metrics_for(job, args):
+    job = job or os.path.splitext(os.path.basename(sys.argv[0] or 'oil_manager'))[0]
+    # Jobs that open both a sync and an async client share one registry and one export
+    if job in _registries:
+        return _registries[job]
+    metrics = _registries[job] = FirestoreMetrics(job)
+    if args is not None:
+        if getattr(args, 'metrics_port', None):
+            metrics.serve(args.metrics_port)
+            print(f'📡 Serving Firestore metrics on http://127.0.0.1:{args.metrics_port}/metrics')
+
+        def finish():
+            if getattr(args, 'metrics_file', None):
+                metrics.write(args.metrics_file, openmetrics=args.openmetrics)
+                print(f'📝 Firestore metrics written to {args.metrics_file}')
+            if getattr(args, 'profile', None):
+                metrics.print_profile(args.profile)
+        atexit.register(finish)
+    return metrics
+
+
+def instrument(client, job=None, args=None):
+    """Wrap a Firestore client and wire up the --profile/--metrics-* flags from args"""
+    return InstrumentedClient(client, _metrics_for(job, args))
+
+
+def instrument_async(client, job=None, args=None):
+    """Wrap a Firestore AsyncClient and wire up the --profile/--metrics-* flags from args"""
+    return AsyncInstrumentedClient(client, _metrics_for(job, args))
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+"""
+Geofence arrival detection for Oil Manager dispatch jobs
+Places a fence around every active job's stop (the order's deliveryAddress or the
+pickup's pickupAddress) in a spatial grid, tests each driver_locations update against
+the fences in the neighbouring cells only, and after a dwell time moves the job to
+Arrived with a job_events entry; leaving the stop again is recorded as a departure note
+"""
+
+import argparse
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+try:
+    from google.api_core.exceptions import FailedPrecondition, NotFound
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from config_cache import ConfigCache
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import MAX_BATCH_WRITES, chunked, sync_client
+
+ACTIVE_JOB_STATUSES = ['Assigned', 'EnRoute', 'Arrived']
+# Assigned jobs pass through EnRoute (JobStatus has no Assigned -> Arrived move), so the log stays valid
+ARRIVAL_PATH = {'Assigned': ('EnRoute', 'Arrived'), 'EnRoute': ('Arrived',)}
+SYSTEM_ACTOR = 'system_geofence'
+# Where a job's stop comes from, and the statuses that document has while its job is active;
+# listening to those keeps fences in step with address edits
+STOP_SOURCES = {'Pickup': ('pickup_requests', ['Approved', 'Scheduled', 'DriverAssigned']),
+                'Delivery': ('sales_orders', ['Confirmed', 'Scheduled', 'OutForDelivery'])}
+
+# config_system_settings can override these with GEOFENCE_RADIUS_METERS / GEOFENCE_DWELL_SECONDS /
+# GEOFENCE_DEPART_SECONDS
+DEFAULT_RADIUS_M = 150.0
+DEFAULT_DWELL_SECONDS = 60.0
+DEFAULT_DEPART_SECONDS = 120.0
+# A driver counts as gone only beyond radius x EXIT_FACTOR, so GPS jitter at the edge does not flap
+EXIT_FACTOR = 1.5
+
+METERS_PER_DEGREE = 111_320.0
+# Projection origin (Bangkok): x is measured from here, so a north-south move barely shifts x
+ORIGIN_LNG = 100.5018
+FLUSH_INTERVAL = 1.0
+# Arrival is up to three writes (job, two events); departure one
+TRANSITIONS_PER_BATCH = MAX_BATCH_WRITES // 3
+
+OUTSIDE, ENTERING, INSIDE, LEAVING = 'outside', 'entering', 'inside', 'leaving'
+
+
+def _aware(ts):
+    if ts is None:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def project(lat, lng):
+    """Local metres (x east of ORIGIN_LNG, y north); equirectangular, exact enough at fence scale"""
+    return (lng - ORIGIN_LNG) * METERS_PER_DEGREE * math.cos(math.radians(lat)), lat * METERS_PER_DEGREE
+
+
+def stop_key(job):
+    """(jobType, refId) a job's stop is cached under"""
+    return job.get('jobType'), job.get('refId')
+
+
+def stop_of(job, ref):
+    """(lat, lng) of a job's stop from its referenced order or pickup document, else None"""
+    address = (ref or {}).get('pickupAddress' if job.get('jobType') == 'Pickup' else 'deliveryAddress') or {}
+    lat, lng = address.get('lat'), address.get('lng')
+    if lat is None or lng is None:
+        return None
+    return float(lat), float(lng)
+
+
+# ============================================================
+# ENGINE
+# ============================================================
+
+class Fence:
+    __slots__ = ('job_id', 'driver_uid', 'lat', 'lng', 'x', 'y', 'cell', 'state', 'since', 'arrived_at', 'job')
+
+    def __init__(self, job_id, driver_uid, lat, lng, state=OUTSIDE, job=None):
+        self.job_id = job_id
+        self.driver_uid = driver_uid
+        self.lat = lat
+        self.lng = lng
+        self.x, self.y = project(lat, lng)
+        self.cell = None
+        self.state = state
+        self.since = None
+        self.arrived_at = None
+        self.job = job
+
+
+class Transition:
+    """An 'arrived' or 'departed' decision for one fence; dwell is seconds inside before it"""
+
+    __slots__ = ('kind', 'fence', 'lat', 'lng', 'at', 'dwell')
+
+    def __init__(self, kind, fence, lat, lng, at, dwell):
+        self.kind = kind
+        self.fence = fence
+        self.lat = lat
+        self.lng = lng
+        self.at = at
+        self.dwell = dwell
+
+
+class GeofenceEngine:
+    """Fences in a uniform grid of cells at least as wide as the exit radius
+
+    A position only has to be compared with the fences in its own and the eight
+    neighbouring cells (and only those of the same driver), so an update costs a few
+    dict lookups however many jobs are active.
+
+    Per fence: outside -> entering when the driver comes within radius; entering ->
+    inside ("arrived") after dwell seconds without leaving the exit radius; inside ->
+    leaving beyond the exit radius; leaving -> outside ("departed") after depart seconds
+    without coming back. Times are epoch seconds taken from the positions, so delayed or
+    replayed updates debounce the same way as live ones.
+    """
+
+    def __init__(self, radius=DEFAULT_RADIUS_M, dwell=DEFAULT_DWELL_SECONDS, depart=DEFAULT_DEPART_SECONDS):
+        self.radius = radius
+        self.exit_radius = radius * EXIT_FACTOR
+        self.dwell = dwell
+        self.depart = depart
+        self.cell_size = self.exit_radius
+        self.grid = defaultdict(dict)
+        self.fences = {}
+        self.by_driver = defaultdict(dict)
+        self.positions = {}
+        self.updates = 0
+        self.checks = 0
+
+    def __len__(self):
+        return len(self.fences)
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def add(self, fence):
+        """Place or move a fence; a fence already on site keeps its state"""
+        old = self.fences.get(fence.job_id)
+        if old is not None:
+            if (old.lat, old.lng, old.driver_uid) == (fence.lat, fence.lng, fence.driver_uid):
+                old.job = fence.job
+                return old
+            self.remove(fence.job_id)
+        fence.cell = self._cell(fence.x, fence.y)
+        self.grid[fence.cell][fence.job_id] = fence
+        self.fences[fence.job_id] = fence
+        self.by_driver[fence.driver_uid][fence.job_id] = fence
+        return fence
+
+    def remove(self, job_id):
+        fence = self.fences.pop(job_id, None)
+        if fence is not None:
+            cell = self.grid[fence.cell]
+            cell.pop(job_id, None)
+            if not cell:
+                del self.grid[fence.cell]
+            own = self.by_driver[fence.driver_uid]
+            own.pop(job_id, None)
+            if not own:
+                del self.by_driver[fence.driver_uid]
+        return fence
+
+    def update(self, driver_uid, lat, lng, at):
+        """Feed one driver position; returns the transitions it completes"""
+        self.updates += 1
+        self.positions[driver_uid] = (lat, lng, at)
+        x, y = project(lat, lng)
+        cx, cy = self._cell(x, y)
+        seen = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                cell = self.grid.get((cx + dx, cy + dy))
+                if cell:
+                    seen.extend(f for f in cell.values() if f.driver_uid == driver_uid)
+        transitions = []
+        for fence in seen:
+            self.checks += 1
+            distance = math.hypot(x - fence.x, y - fence.y)
+            transition = self._step(fence, distance, lat, lng, at)
+            if transition is not None:
+                transitions.append(transition)
+        # Fences the driver is no longer near at all (it jumped cells) count as far away
+        for fence in self._away_from(driver_uid, seen):
+            transition = self._step(fence, math.inf, lat, lng, at)
+            if transition is not None:
+                transitions.append(transition)
+        return transitions
+
+    def _away_from(self, driver_uid, seen):
+        own = self.by_driver.get(driver_uid)
+        pending = [f for f in own.values() if f.state in (ENTERING, INSIDE)] if own else []
+        if not pending:
+            return []
+        seen = {f.job_id for f in seen}
+        return [f for f in pending if f.job_id not in seen]
+
+    def _step(self, fence, distance, lat, lng, at):
+        if distance <= self.radius or (distance <= self.exit_radius and fence.state in (INSIDE, LEAVING)):
+            if fence.state == OUTSIDE:
+                fence.state, fence.since = ENTERING, at
+            elif fence.state == LEAVING:
+                fence.state, fence.since = INSIDE, None
+            if fence.state == ENTERING and at - fence.since >= self.dwell:
+                fence.state, fence.arrived_at = INSIDE, fence.since
+                fence.since = None
+                return Transition('arrived', fence, lat, lng, at, at - fence.arrived_at)
+        elif distance > self.exit_radius or fence.state == ENTERING:
+            if fence.state == ENTERING:
+                fence.state, fence.since = OUTSIDE, None
+            elif fence.state == INSIDE:
+                fence.state, fence.since = LEAVING, at
+            if fence.state == LEAVING and at - fence.since >= self.depart:
+                fence.state = OUTSIDE
+                dwell = fence.since - fence.arrived_at if fence.arrived_at is not None else None
+                fence.since = None
+                return Transition('departed', fence, lat, lng, at, dwell)
+        return None
+
+    def tick(self, now):
+        """Transitions that came due with no new position (a parked driver stops reporting)"""
+        transitions = []
+        for fence in list(self.fences.values()):
+            if fence.state == ENTERING and now - fence.since >= self.dwell:
+                lat, lng, _ = self.positions.get(fence.driver_uid, (fence.lat, fence.lng, now))
+                fence.state, fence.arrived_at, fence.since = INSIDE, fence.since, None
+                transitions.append(Transition('arrived', fence, lat, lng, now, now - fence.arrived_at))
+            elif fence.state == LEAVING and now - fence.since >= self.depart:
+                lat, lng, _ = self.positions.get(fence.driver_uid, (fence.lat, fence.lng, now))
+                dwell = fence.since - fence.arrived_at if fence.arrived_at is not None else None
+                fence.state, fence.since = OUTSIDE, None
+                transitions.append(Transition('departed', fence, lat, lng, now, dwell))
+        return transitions
+
+
+# ============================================================
+# SERVICE
+# ============================================================
+
+def geofence_event(job_id, event_type, at, lat, lng, status_from=None, status_to=None, note=None):
+    """job_events document in the JobEvent.toFirestore() layout"""
+    return {
+        'jobId': job_id, 'eventType': event_type, 'statusFrom': status_from, 'statusTo': status_to,
+        'note': note, 'photoUrls': [], 'signatureUrl': None, 'actualQty': None, 'actualUom': None,
+        'lat': lat, 'lng': lng, 'createdByUid': SYSTEM_ACTOR,
+        'createdAt': datetime.fromtimestamp(at, timezone.utc),
+    }
+
+
+class GeofenceService:
+    """Keeps the engine's fences in step with active jobs and writes its transitions
+
+    Job and driver_locations listeners feed the engine under one lock; flush() writes
+    the transitions collected since the last call. An arrival updates the job with a
+    last_update_time precondition, so a status the driver set by hand in between wins.
+    Stops are cached per reference document while an active job uses them; listeners on
+    the orders and pickups re-place the fences when an address is edited.
+    """
+
+    def __init__(self, db, engine, dry_run=False):
+        self.db = db
+        self.engine = engine
+        self.dry_run = dry_run
+        self._lock = threading.Lock()
+        self.pending = []
+        self.stops = {}
+        self.jobs = {}
+        self.by_stop = defaultdict(set)
+        self.counts = defaultdict(int)
+
+    def jobs_query(self):
+        return self.db.collection('jobs').where(filter=FieldFilter('status', 'in', ACTIVE_JOB_STATUSES))
+
+    def stop(self, job):
+        """Stop coordinates for a job; reference documents are read once per refId"""
+        key = stop_key(job)
+        if key not in self.stops:
+            collection = 'pickup_requests' if job.get('jobType') == 'Pickup' else 'sales_orders'
+            snap = self.db.collection(collection).document(job.get('refId') or '-').get()
+            self.stops[key] = stop_of(job, snap.to_dict() if snap.exists else None)
+        return self.stops[key]
+
+    def prefetch(self, jobs):
+        """Read every uncached reference document of jobs in one get_all per collection"""
+        missing = defaultdict(set)
+        for job in jobs:
+            key = stop_key(job)
+            if key not in self.stops and job.get('refId'):
+                missing['pickup_requests' if key[0] == 'Pickup' else 'sales_orders'].add(key)
+        for collection, keys in missing.items():
+            for chunk in chunked(sorted(keys), MAX_BATCH_WRITES):
+                refs = [self.db.collection(collection).document(ref_id) for _, ref_id in chunk]
+                by_id = {snap.id: snap.to_dict() if snap.exists else None for snap in self.db.get_all(refs)}
+                for job_type, ref_id in chunk:
+                    self.stops[(job_type, ref_id)] = stop_of({'jobType': job_type}, by_id.get(ref_id))
+
+    def _track(self, job_id, snap, key):
+        """Remember which stop an active job uses (key None: not active); stops nothing uses are forgotten"""
+        old = self.jobs.pop(job_id, (None, None))[1]
+        if old is not None and old != key:
+            users = self.by_stop[old]
+            users.discard(job_id)
+            if not users:
+                del self.by_stop[old]
+                self.stops.pop(old, None)
+        if key is not None:
+            self.jobs[job_id] = (snap, key)
+            self.by_stop[key].add(job_id)
+
+    def apply_job(self, job_id, snap):
+        """Add, move or drop the fence of one job from its latest snapshot (None when deleted)"""
+        job = snap.to_dict() if snap is not None else None
+        if not job or job.get('status') not in ACTIVE_JOB_STATUSES or not job.get('assignedDriverUid'):
+            self._track(job_id, None, None)
+            with self._lock:
+                self.engine.remove(job_id)
+            return
+        self._track(job_id, snap, stop_key(job))
+        where = self.stop(job)
+        if where is None:
+            self.counts['jobs without coordinates'] += 1
+            with self._lock:
+                self.engine.remove(job_id)
+            return
+        state = INSIDE if job.get('status') == 'Arrived' else OUTSIDE
+        with self._lock:
+            fence = self.engine.add(Fence(job_id, job['assignedDriverUid'], *where, state=state,
+                                          job=(job, snap.update_time)))
+            if job.get('status') != 'Arrived' and fence.state == INSIDE:
+                # Moved back (e.g. Rescheduled -> EnRoute) while the driver is still on site
+                fence.state = OUTSIDE
+
+    def on_jobs(self, docs, changes, read_time):
+        if any(change.type.name != 'REMOVED' for change in changes):
+            self.prefetch([change.document.to_dict() for change in changes if change.type.name != 'REMOVED'])
+        for change in changes:
+            removed = change.type.name == 'REMOVED'
+            self.apply_job(change.document.id, None if removed else change.document)
+
+    def apply_stop(self, job_type, ref_id, ref):
+        """An order or pickup changed: re-place the fences of its jobs if its coordinates moved"""
+        key = (job_type, ref_id)
+        if key not in self.stops:
+            return
+        where = stop_of({'jobType': job_type}, ref)
+        if where == self.stops[key]:
+            return
+        self.stops[key] = where
+        self.counts['stops moved'] += 1
+        for job_id in list(self.by_stop.get(key, ())):
+            snap = self.jobs.get(job_id, (None, None))[0]
+            if snap is not None:
+                self.apply_job(job_id, snap)
+
+    def on_stops(self, job_type):
+        def callback(docs, changes, read_time):
+            for change in changes:
+                if change.type.name != 'REMOVED':
+                    self.apply_stop(job_type, change.document.id, change.document.to_dict())
+        return callback
+
+    def apply_position(self, driver_uid, location):
+        lat, lng = location.get('lat'), location.get('lng')
+        if lat is None or lng is None:
+            return
+        at = _aware(location.get('updatedAt'))
+        at = at.timestamp() if at is not None else time.time()
+        with self._lock:
+            self.pending.extend(self.engine.update(driver_uid, float(lat), float(lng), at))
+
+    def on_locations(self, docs, changes, read_time):
+        for change in changes:
+            if change.type.name != 'REMOVED':
+                self.apply_position(change.document.id, change.document.to_dict())
+
+    def load(self):
+        snaps = list(self.jobs_query().stream())
+        self.prefetch([snap.to_dict() for snap in snaps])
+        for snap in snaps:
+            self.apply_job(snap.id, snap)
+
+    def listen(self):
+        watches = [self.jobs_query().on_snapshot(self.on_jobs),
+                   self.db.collection('driver_locations').on_snapshot(self.on_locations)]
+        for job_type, (collection, statuses) in STOP_SOURCES.items():
+            query = self.db.collection(collection).where(filter=FieldFilter('status', 'in', statuses))
+            watches.append(query.on_snapshot(self.on_stops(job_type)))
+        return watches
+
+    def flush(self, now=None):
+        """Write the transitions collected so far; returns how many were written"""
+        with self._lock:
+            transitions = self.pending + self.engine.tick(now or time.time())
+            self.pending = []
+        written = 0
+        for chunk in chunked(transitions, TRANSITIONS_PER_BATCH):
+            batch = self.db.batch()
+            staged = [t for t in chunk if self._stage(batch, t)]
+            if not staged or self.dry_run:
+                written += len(staged)
+                continue
+            try:
+                batch.commit()
+                written += len(staged)
+                continue
+            except (FailedPrecondition, NotFound):
+                pass
+            # A job in the chunk changed since its snapshot: retry one by one, dropping those
+            for transition in staged:
+                batch = self.db.batch()
+                self._stage(batch, transition)
+                try:
+                    batch.commit()
+                    written += 1
+                except (FailedPrecondition, NotFound):
+                    self.counts['conflicts'] += 1
+        return written
+
+    def _stage(self, batch, transition):
+        fence = transition.fence
+        job, update_time = fence.job
+        events = self.db.collection('job_events')
+        if transition.kind == 'departed':
+            minutes = f' after {transition.dwell / 60:.0f} min on site' if transition.dwell is not None else ''
+            batch.set(events.document(), geofence_event(
+                fence.job_id, 'Note', transition.at, transition.lat, transition.lng,
+                note=f'Geofence: departed stop{minutes}'))
+            self.counts['departures'] += 1
+            return True
+        path = ARRIVAL_PATH.get(job.get('status'))
+        if path is None:
+            self.counts['arrivals ignored'] += 1
+            return False
+        at = datetime.fromtimestamp(transition.at, timezone.utc)
+        batch.update(self.db.collection('jobs').document(fence.job_id),
+                     {'status': 'Arrived', 'arrivedAt': at, 'arrivalSource': 'geofence'},
+                     option=self.db.write_option(last_update_time=update_time))
+        status = job.get('status')
+        for step in path:
+            note = (f'Geofence: within {self.engine.radius:g} m for {transition.dwell:.0f}s'
+                    if step == 'Arrived' else 'Geofence: implied by arrival')
+            batch.set(events.document(), geofence_event(fence.job_id, 'StatusChange', transition.at, transition.lat,
+                                                        transition.lng, status_from=status, status_to=step, note=note))
+            status = step
+        self.counts['arrivals'] += 1
+        return True
+
+    def run(self, duration=None):
+        """Detect arrivals until interrupted (or duration seconds)"""
+        self.load()
+        watches = self.listen()
+        started = time.time()
+        print(f"👂 {len(self.engine)} active job fence(s); listening to jobs, driver_locations and stop addresses "
+              f"(radius {self.engine.radius:g} m, dwell {self.engine.dwell:g}s)")
+        try:
+            while duration is None or time.time() - started < duration:
+                time.sleep(FLUSH_INTERVAL)
+                written = self.flush()
+                if written:
+                    print(f"   ✓ {written} geofence transition(s) {'found' if self.dry_run else 'written'}")
+                if not all(w.is_active for w in watches):
+                    print("⚠️  Listener closed, restarting from a fresh snapshot")
+                    for watch in watches:
+                        watch.unsubscribe()
+                    watches = self.listen()
+        except KeyboardInterrupt:
+            print("\n🛑 Stopping geofence detection")
+        finally:
+            for watch in watches:
+                watch.unsubscribe()
+            self.flush()
+
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+
+def benchmark(updates, fences=5000, drivers=500, seed=11):
+    """Drive the engine with drivers random-walking around Bangkok between their stops; returns a stats dict"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    engine = GeofenceEngine()
+    stops = rng.normal((13.75, 100.55), 0.08, (fences, 2))
+    owner = rng.integers(0, drivers, fences)
+    for i in range(fences):
+        engine.add(Fence(f'job{i}', f'drv{owner[i]}', float(stops[i, 0]), float(stops[i, 1])))
+    by_driver = defaultdict(list)
+    for i in range(fences):
+        by_driver[owner[i]].append(i)
+    # Each driver heads for one of its stops, parks there a while, then moves on
+    targets = {d: by_driver[d][0] for d in by_driver}
+    position = {d: stops[targets[d]] + rng.normal(0, 0.01, 2) for d in by_driver}
+    active = list(by_driver)
+    picks = rng.integers(0, len(active), updates).tolist()
+    noise = rng.normal(0, 0.00015, (updates, 2)).tolist()
+    events = []
+    for n in range(updates):
+        d = active[picks[n]]
+        goal = stops[targets[d]]
+        step = goal - position[d]
+        distance = float(np.hypot(*step))
+        if distance > 0.0006:
+            position[d] = position[d] + step * min(1.0, 0.004 / distance)
+        elif rng.random() < 0.02:
+            targets[d] = by_driver[d][rng.integers(len(by_driver[d]))]
+        events.append((f'drv{d}', float(position[d][0]) + noise[n][0], float(position[d][1]) + noise[n][1]))
+    clock = 0.0
+    transitions = defaultdict(int)
+    started = time.perf_counter()
+    for uid, lat, lng in events:
+        clock += 0.05
+        for transition in engine.update(uid, lat, lng, clock):
+            transitions[transition.kind] += 1
+    seconds = time.perf_counter() - started
+    return {'updates': updates, 'seconds': seconds, 'checks': engine.checks, 'fences': len(engine),
+            'cells': len(engine.grid), 'arrived': transitions['arrived'], 'departed': transitions['departed']}
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--duration', type=float, metavar='SECONDS', help='stop listening after SECONDS')
+    parser.add_argument('--radius', type=float, help=f'fence radius in metres (default {DEFAULT_RADIUS_M:g})')
+    parser.add_argument('--dwell', type=float, help=f'seconds inside before arrival (default {DEFAULT_DWELL_SECONDS:g})')
+    parser.add_argument('--dry-run', action='store_true', help='report transitions without writing')
+    parser.add_argument('--benchmark', type=int, metavar='UPDATES',
+                        help='push UPDATES simulated positions through the engine, then exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(f"⏱️  Simulating {args.benchmark:,} driver position updates...")
+        stats = benchmark(args.benchmark)
+        print(f"   • {stats['fences']:,} fences in {stats['cells']:,} grid cells")
+        print(f"   • {stats['updates'] / stats['seconds']:,.0f} updates/s on one core "
+              f"({stats['checks'] / stats['updates']:.2f} fence checks per update)")
+        print(f"   • {stats['arrived']:,} arrivals, {stats['departed']:,} departures")
+        return
+
+    print("📍 Oil Manager geofence arrival detection")
+    db = sync_client(job='geofence', args=args)
+    cache = ConfigCache(db, collections=('config_system_settings',), listen=False).load()
+    engine = GeofenceEngine(
+        radius=args.radius or cache.get_setting('GEOFENCE_RADIUS_METERS', DEFAULT_RADIUS_M),
+        dwell=args.dwell or cache.get_setting('GEOFENCE_DWELL_SECONDS', DEFAULT_DWELL_SECONDS),
+        depart=cache.get_setting('GEOFENCE_DEPART_SECONDS', DEFAULT_DEPART_SECONDS))
+    service = GeofenceService(db, engine, dry_run=args.dry_run)
+    service.run(duration=args.duration)
+    for name, count in sorted(service.counts.items()):
+        print(f"   • {name}: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Referential-integrity checker for Oil Manager collections
+Streams every collection involved in a reference once, in parallel cursor partitions,
+reduces document IDs and key fields to sorted 64-bit hash arrays and reports dangling
+references, orphaned child documents and duplicate keys; optionally repairs or
+quarantines the offending documents in batches
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+try:
+    from google.api_core.exceptions import FailedPrecondition, GoogleAPICallError, NotFound
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ numpy not installed. Run: pip install numpy")
+    sys.exit(1)
+
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import DEFAULT_CONCURRENCY, MAX_BATCH_WRITES, async_client, chunked, to_json_value
+
+SYSTEM_ACTOR = 'system_integrity_checker'
+QUARANTINE_COLLECTION = 'integrity_quarantine'
+DEFAULT_PARTITIONS = 8
+# Findings listed per rule in the console report; the --report file has all of them
+MAX_PRINTED = 10
+ID = '__name__'
+
+
+class Reference:
+    """A field of one collection that must name a document (or a key field value) of another
+
+    target is a collection for document IDs or 'collection.field' for a key field. owned
+    marks composition: a child whose parent is gone is an orphan and is deleted on repair,
+    while a dangling plain reference is cleared when nullable; a nullable reference holding
+    None or '' is unset and not checked. when restricts the rule to documents whose field
+    holds one of the given values (None meaning the field is unset).
+    """
+
+    def __init__(self, collection, field, target, owned=False, nullable=True, when=None):
+        self.collection = collection
+        self.field = field
+        self.target_collection, _, target_field = target.partition('.')
+        self.target_field = target_field or ID
+        self.owned = owned
+        self.nullable = nullable
+        self.when = when
+
+    @property
+    def name(self):
+        suffix = f" [{', '.join(f'{k}={v}' for k, v in self.when.items())}]" if self.when else ''
+        target = self.target_collection + ('' if self.target_field == ID else f'.{self.target_field}')
+        return f'{self.collection}.{self.field} → {target}{suffix}'
+
+    def applies(self, doc):
+        return not self.when or all(doc.get(field) in values for field, values in self.when.items())
+
+
+REFERENCES = (
+    Reference('config_uco_buyback_rates', 'gradeId', 'config_uco_grades', nullable=False),
+    Reference('config_price_list_items', 'priceListId', 'config_price_lists', owned=True),
+    Reference('config_price_list_items', 'productId', 'config_products', nullable=False),
+    Reference('sales_order_lines', 'orderId', 'sales_orders', owned=True),
+    Reference('sales_order_lines', 'sku', 'config_products.sku', nullable=False),
+    Reference('sales_orders', 'branchId', 'customer_branches'),
+    Reference('sales_orders', 'createdByUid', 'users', nullable=False),
+    Reference('pickup_requests', 'branchId', 'customer_branches'),
+    Reference('pickup_requests', 'createdByUid', 'users', nullable=False),
+    # JobModel.fromFirestore() treats a missing jobType as Delivery
+    Reference('jobs', 'refId', 'sales_orders', owned=True, when={'jobType': ('Delivery', None)}),
+    Reference('jobs', 'refId', 'pickup_requests', owned=True, when={'jobType': ('Pickup',)}),
+    Reference('jobs', 'assignedDriverUid', 'users'),
+    Reference('job_events', 'jobId', 'jobs', owned=True),
+    Reference('approval_requests', 'workflowInstanceId', 'workflow_instances'),
+    Reference('exceptions', 'workflowInstanceId', 'workflow_instances'),
+)
+
+# Fields (or field combinations) that identify a document within its collection
+UNIQUE_KEYS = (
+    ('config_products', ('sku',)),
+    ('config_uco_grades', ('gradeCode',)),
+    ('config_price_lists', ('code',)),
+    ('config_price_list_items', ('priceListId', 'productId')),
+    ('config_system_settings', ('key',)),
+    ('config_workflow_templates', ('templateId',)),
+    ('config_routing_rules', ('ruleId',)),
+    ('sales_orders', ('orderNumber',)),
+)
+
+
+def key_hash(value):
+    """64-bit key for a reference value; within one run equal values always hash equal"""
+    return hash(value if isinstance(value, (str, tuple)) else str(value))
+
+
+def plan(references=REFERENCES, unique_keys=UNIQUE_KEYS):
+    """Fields to read from each collection: {collection: set of field paths}"""
+    fields = defaultdict(set)
+    for ref in references:
+        fields[ref.collection].add(ref.field)
+        fields[ref.collection].update(ref.when or ())
+        fields[ref.target_collection].update(() if ref.target_field == ID else (ref.target_field,))
+    for collection, key in unique_keys:
+        fields[collection].update(key)
+    return fields
+
+
+def present(keys, hashes):
+    """Boolean mask of which hashes occur in the sorted array keys"""
+    if not len(keys):
+        return np.zeros(len(hashes), dtype=bool)
+    pos = np.minimum(np.searchsorted(keys, hashes), len(keys) - 1)
+    return keys[pos] == hashes
+
+
+# ============================================================
+# SCAN
+# ============================================================
+
+class CollectionScan:
+    """What one pass over a collection keeps: document IDs and the values of the fields the rules read"""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = sorted(fields)
+        self.ids = []
+        self.values = {field: [] for field in self.fields}
+
+    def add(self, doc_id, data):
+        self.ids.append(doc_id)
+        for field in self.fields:
+            self.values[field].append(_get(data, field))
+
+    def keys(self, field):
+        """Sorted unique hash array of a field (or of the document IDs)"""
+        values = self.ids if field == ID else [v for v in self.values[field] if v not in (None, '')]
+        return np.unique(np.fromiter((key_hash(v) for v in values), dtype=np.int64, count=len(values)))
+
+
+def _get(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+class IntegrityChecker:
+    """One partitioned, concurrent read of every collection a rule touches, then array checks
+
+    Collections are split with Firestore partition cursors (PartitionQuery) and each
+    partition streams only the fields the rules need. Reference checks are vectorised
+    searchsorted lookups against each target's sorted hash array; duplicate keys are
+    adjacent equal hashes after a sort.
+    """
+
+    def __init__(self, db, concurrency=DEFAULT_CONCURRENCY, partitions=DEFAULT_PARTITIONS,
+                 references=REFERENCES, unique_keys=UNIQUE_KEYS):
+        self.db = db
+        self.limiter = asyncio.Semaphore(concurrency)
+        self.partitions = partitions
+        self.references = references
+        self.unique_keys = unique_keys
+        self.scans = {}
+        self.findings = []
+        self.counts = defaultdict(int)
+
+    async def cursors(self, collection):
+        """Split points for a collection; one unbounded partition when PartitionQuery is unavailable"""
+        if self.partitions <= 1:
+            return [None]
+        try:
+            async with self.limiter:
+                parts = [p async for p in self.db.collection_group(collection).get_partitions(self.partitions)]
+        except GoogleAPICallError:
+            return [None]
+        # Collection-group cursors can land in same-named subcollections; only top-level ones bound this scan
+        return [None] + [p.end_at for p in parts if p.end_at is not None and p.end_at.parent.id == collection
+                         and p.end_at.parent.parent is None]
+
+    async def read_partition(self, scan, start, end):
+        query = self.db.collection(scan.name).select(scan.fields or [ID]).order_by(ID)
+        if start is not None:
+            query = query.start_at({ID: start})
+        if end is not None:
+            query = query.end_before({ID: end})
+        async with self.limiter:
+            async for doc in query.stream():
+                scan.add(doc.id, doc.to_dict() or {})
+
+    async def scan(self):
+        fields = plan(self.references, self.unique_keys)
+        self.scans = {name: CollectionScan(name, f) for name, f in fields.items()}
+        splits = await asyncio.gather(*(self.cursors(name) for name in self.scans))
+        reads = []
+        for name, cuts in zip(self.scans, splits):
+            bounds = cuts + [None]
+            reads += [self.read_partition(self.scans[name], bounds[i], bounds[i + 1]) for i in range(len(cuts))]
+            self.counts['partitions'] += len(cuts)
+        await asyncio.gather(*reads)
+
+    def check(self):
+        """Fill self.findings from the scans; returns them"""
+        keysets = {}
+        for ref in self.references:
+            target = (ref.target_collection, ref.target_field)
+            if target not in keysets:
+                keysets[target] = self.scans[ref.target_collection].keys(ref.target_field)
+            self._check_reference(ref, keysets[target])
+        for collection, key in self.unique_keys:
+            self._check_unique(collection, key)
+        return self.findings
+
+    def _check_reference(self, ref, keys):
+        scan = self.scans[ref.collection]
+        values = scan.values[ref.field]
+        when = [dict(zip(ref.when, row)) for row in zip(*(scan.values[f] for f in ref.when))] if ref.when else None
+        # A nullable reference may be unset either way: JobModel writes assignedDriverUid '' for unassigned jobs
+        rows = [i for i, value in enumerate(values)
+                if (value not in (None, '') or not ref.nullable) and (when is None or ref.applies(when[i]))]
+        hashes = np.fromiter((key_hash(values[i]) for i in rows), dtype=np.int64, count=len(rows))
+        missing = ~present(keys, hashes)
+        for i in np.flatnonzero(missing):
+            row = rows[i]
+            value = values[row]
+            kind = 'orphan' if ref.owned and value not in (None, '') else 'dangling'
+            self.findings.append({'kind': kind, 'rule': ref.name, 'collection': ref.collection,
+                                  'docId': scan.ids[row], 'field': ref.field, 'value': value,
+                                  'target': ref.target_collection, 'owned': ref.owned, 'nullable': ref.nullable})
+        self.counts['references checked'] += len(rows)
+
+    def _check_unique(self, collection, key):
+        scan = self.scans[collection]
+        columns = [scan.values[field] for field in key]
+        rows = [i for i, row in enumerate(zip(*columns)) if all(v not in (None, '') for v in row)]
+        if not rows:
+            return
+        values = [tuple(column[i] for column in columns) if len(key) > 1 else columns[0][i] for i in rows]
+        hashes = np.fromiter((key_hash(v) for v in values), dtype=np.int64, count=len(values))
+        order = np.argsort(hashes, kind='stable')
+        ordered = hashes[order]
+        # Runs of equal hashes: each boundary where the value changes starts a new run
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        ends = np.r_[starts[1:], len(ordered)]
+        for start, end in zip(starts, ends):
+            if end - start > 1:
+                group = [rows[i] for i in order[start:end]]
+                self.findings.append({'kind': 'duplicate', 'rule': f"{collection}.{'+'.join(key)} unique",
+                                      'collection': collection, 'docIds': [scan.ids[i] for i in group],
+                                      'field': '+'.join(key), 'value': values[order[start]]})
+
+    # ==================== REPAIR ====================
+
+    async def repair(self, mode):
+        """Act on orphans and dangling references in batches; duplicates are reported only
+
+        mode 'repair' deletes orphans and clears nullable dangling references (other dangling
+        references need a human); 'quarantine' moves every affected document into
+        integrity_quarantine with its findings. Each document is re-read first and skipped if
+        the reference changed since the scan, and written with a last_update_time precondition.
+        """
+        by_doc = defaultdict(list)
+        for finding in self.findings:
+            if finding['kind'] != 'duplicate':
+                by_doc[(finding['collection'], finding['docId'])].append(finding)
+        if not by_doc:
+            return
+        refs = [self.db.collection(c).document(d) for c, d in by_doc]
+        snaps = []
+        for chunk in chunked(refs, MAX_BATCH_WRITES):
+            async with self.limiter:
+                snaps += await self.db.get_all(chunk)
+        now = datetime.now(timezone.utc)
+        writes = []
+        for snap in snaps:
+            key = (snap.reference.parent.id, snap.id)
+            if not snap.exists:
+                continue
+            data = snap.to_dict()
+            findings = [f for f in by_doc[key] if _get(data, f['field']) == f['value']]
+            if not findings:
+                self.counts['changed since scan'] += 1
+                continue
+            option = self.db.write_option(last_update_time=snap.update_time)
+            if mode == 'quarantine':
+                writes.append([('set', self.db.collection(QUARANTINE_COLLECTION).document(f'{key[0]}__{key[1]}'), {
+                    'collection': key[0], 'docId': key[1], 'data': data,
+                    'findings': [{k: f[k] for k in ('kind', 'rule', 'field', 'value')} for f in findings],
+                    'quarantinedAt': now, 'quarantinedBy': SYSTEM_ACTOR,
+                }, None), ('delete', snap.reference, None, option)])
+                self.counts['quarantined'] += 1
+            elif any(f['kind'] == 'orphan' for f in findings):
+                writes.append([('delete', snap.reference, None, option)])
+                self.counts['orphans deleted'] += 1
+            else:
+                clear = {f['field']: None for f in findings if f['nullable']}
+                if len(clear) < len(findings):
+                    self.counts['need manual fix'] += 1
+                if clear:
+                    writes.append([('update', snap.reference, clear, option)])
+                    self.counts['references cleared'] += 1
+        await self.commit_all(writes)
+
+    async def commit_all(self, groups):
+        """Commit groups of writes (each group atomic) in batches; a failed batch is retried group by group"""
+        per_batch = MAX_BATCH_WRITES // max((len(g) for g in groups), default=1)
+
+        async def commit(chunk):
+            batch = self.db.batch()
+            for group in chunk:
+                for op, ref, data, option in group:
+                    if op == 'set':
+                        batch.set(ref, data)
+                    elif op == 'update':
+                        batch.update(ref, data, option=option)
+                    else:
+                        batch.delete(ref, option=option)
+            async with self.limiter:
+                await batch.commit()
+
+        async def commit_chunk(chunk):
+            try:
+                await commit(chunk)
+                return
+            except (FailedPrecondition, NotFound):
+                pass
+            for group in chunk:
+                try:
+                    await commit([group])
+                except (FailedPrecondition, NotFound):
+                    self.counts['conflicts'] += 1
+
+        await asyncio.gather(*(commit_chunk(c) for c in chunked(groups, per_batch)))
+
+
+def print_report(checker):
+    by_rule = defaultdict(list)
+    for finding in checker.findings:
+        by_rule[(finding['kind'], finding['rule'])].append(finding)
+    for (kind, rule), findings in sorted(by_rule.items()):
+        icon = {'dangling': '🔗', 'orphan': '🧩', 'duplicate': '👯'}[kind]
+        print(f"\n{icon} {kind}: {rule} — {len(findings)}")
+        for finding in findings[:MAX_PRINTED]:
+            docs = ', '.join(finding['docIds']) if kind == 'duplicate' else finding['docId']
+            print(f"   • {docs}: {finding['field']}={finding['value']!r}")
+        if len(findings) > MAX_PRINTED:
+            print(f"   … {len(findings) - MAX_PRINTED} more")
+
+
+async def run(args):
+    checker = IntegrityChecker(async_client(job='integrity_checker', args=args),
+                               concurrency=args.concurrency, partitions=args.partitions)
+    started = time.perf_counter()
+    await checker.scan()
+    scanned = time.perf_counter() - started
+    checker.check()
+    print_report(checker)
+    kinds = defaultdict(int)
+    for finding in checker.findings:
+        kinds[finding['kind']] += 1
+    docs = sum(len(scan.ids) for scan in checker.scans.values())
+    print(f"\n{'⚠️ ' if checker.findings else '✅'} {len(checker.findings)} finding(s) "
+          f"({', '.join(f'{n} {k}' for k, n in sorted(kinds.items())) or 'none'}) across {docs:,} documents "
+          f"in {len(checker.scans)} collections; read in {scanned:.2f}s")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as fh:
+            json.dump(to_json_value(checker.findings), fh, indent=2, default=str)
+        print(f"   • report written to {args.report}")
+    if args.repair or args.quarantine:
+        await checker.repair('quarantine' if args.quarantine else 'repair')
+    for name, count in sorted(checker.counts.items()):
+        print(f"   • {name}: {count}")
+    return len(checker.findings)
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--partitions', type=int, default=DEFAULT_PARTITIONS,
+                        help=f'cursor partitions per collection (default {DEFAULT_PARTITIONS})')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'maximum in-flight Firestore RPCs (default {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--report', metavar='PATH', help='write every finding to a JSON file')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--repair', action='store_true',
+                      help='delete orphans and clear nullable dangling references')
+    mode.add_argument('--quarantine', action='store_true',
+                      help=f'move documents with orphaned or dangling references to {QUARANTINE_COLLECTION}')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    print("🔍 Oil Manager referential-integrity check")
+    findings = asyncio.run(run(args))
+    if findings and not (args.repair or args.quarantine):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -78,6 +78,21 @@ class DispatchApiService {
     return response as Map<String, dynamic>;
   }
 
+  /// Replay queued status events; each event needs a device-generated idempotencyKey
+  Future<Map<String, dynamic>> batchUpdateJobStatus({
+    required List<Map<String, dynamic>> events,
+    String? driverUid,
+  }) async {
+    final response = await _apiService.post(
+      '${ApiConfig.dispatchJobs}:batchStatus',
+      body: {
+        if (driverUid != null) 'driverUid': driverUid,
+        'events': events,
+      },
+    );
+    return response as Map<String, dynamic>;
+  }
+
   /// Get jobs for a driver
   Future<List<dynamic>> getDriverJobs({
     required String driverUid,
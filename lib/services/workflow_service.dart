@@ -1,5 +1,6 @@
 import 'package:cloud_firestore/cloud_firestore.dart';
 import 'package:flutter/foundation.dart';
+import 'dart:async';
 import '../models/workflow_models.dart';
 
 /// Workflow Service - Manages workflow instances, approvals, and exceptions
@@ -39,7 +40,11 @@ class WorkflowService {
   }
 
   /// Get a single workflow instance by ID
-  Future<WorkflowInstance?> getWorkflowInstance(String instanceId) async {
+  ///
+  /// With [includeArchived], falls back to the read-only summary left in
+  /// `workflow_archive` when the workflow has been moved to cold storage.
+  Future<WorkflowInstance?> getWorkflowInstance(String instanceId,
+      {bool includeArchived = false}) async {
     try {
       final doc = await _firestore
           .collection('workflow_instances')
@@ -49,6 +54,16 @@ class WorkflowService {
         return WorkflowInstance.fromFirestore(
             doc.data() as Map<String, dynamic>, doc.id);
       }
+      if (includeArchived) {
+        final archived = await _firestore
+            .collection('workflow_archive')
+            .doc(instanceId)
+            .get();
+        if (archived.exists) {
+          return WorkflowInstance.fromFirestore(
+              archived.data() as Map<String, dynamic>, archived.id);
+        }
+      }
       return null;
     } catch (e) {
       if (kDebugMode) {
@@ -174,6 +189,56 @@ class WorkflowService {
         );
   }
 
+  /// Get pending approvals from the materialized inbox document
+  /// (`inboxes/{userId or userRole}`, maintained by approval_inbox_fanout.py).
+  /// Streams one small document instead of a query over approval_requests;
+  /// items are sorted by priority and SLA and capped at the top 50.
+  /// Falls back to [getPendingApprovals] when the inbox cannot answer on its
+  /// own: no approver given, a workflowType filter (matches may lie beyond the
+  /// top 50), or an inbox that is missing or `truncated`.
+  Stream<List<ApprovalRequest>> getInboxApprovals({
+    String? userId,
+    String? userRole,
+    String? workflowType,
+  }) {
+    final inboxId = userId ?? userRole;
+    if (inboxId == null || workflowType != null) {
+      return getPendingApprovals(
+          userId: userId, userRole: userRole, workflowType: workflowType);
+    }
+
+    final inbox = _firestore.collection('inboxes').doc(inboxId).snapshots();
+    late final StreamController<List<ApprovalRequest>> controller;
+    StreamSubscription? inboxSubscription;
+    StreamSubscription<List<ApprovalRequest>>? querySubscription;
+
+    controller = StreamController<List<ApprovalRequest>>(
+      onListen: () {
+        inboxSubscription = inbox.listen((doc) {
+          final data = doc.data();
+          if (data == null || data['truncated'] == true) {
+            querySubscription ??=
+                getPendingApprovals(userId: userId, userRole: userRole)
+                    .listen(controller.add, onError: controller.addError);
+            return;
+          }
+          querySubscription?.cancel();
+          querySubscription = null;
+          final items = (data['items'] as List?) ?? [];
+          controller.add(items
+              .map((item) => Map<String, dynamic>.from(item as Map))
+              .map((item) => ApprovalRequest.fromFirestore(item, item['id'] ?? ''))
+              .toList());
+        }, onError: controller.addError);
+      },
+      onCancel: () async {
+        await querySubscription?.cancel();
+        await inboxSubscription?.cancel();
+      },
+    );
+    return controller.stream;
+  }
+
   /// Create a new approval request
   Future<String> createApprovalRequest({
     required String workflowInstanceId,
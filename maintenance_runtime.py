@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Async runtime for Oil Manager seeding and maintenance jobs
+Runs collection jobs as an asyncio task graph on the async Firestore client,
+with explicit dependencies and a global limit on in-flight Firestore RPCs
+"""
+
+import asyncio
+import base64
+import os
+import time
+from datetime import datetime, timezone
+
+import firebase_admin
+from firebase_admin import credentials, firestore, firestore_async
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+
+from firestore_metrics import instrument, instrument_async
+
+SERVICE_ACCOUNT_PATH = '/opt/flutter/firebase-admin-sdk.json'
+DEFAULT_PROJECT_ID = 'fleets-x9tytb'
+
+# Firestore accepts at most 500 writes per batch commit
+MAX_BATCH_WRITES = 500
+DEFAULT_CONCURRENCY = 16
+
+
+def initialize_firebase():
+    """Initialize the default app against the emulator when configured, else the service account"""
+    if firebase_admin._apps:
+        return firebase_admin.get_app()
+    if os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        project_id = os.environ.get('GCLOUD_PROJECT', DEFAULT_PROJECT_ID)
+        return firebase_admin.initialize_app(options={'projectId': project_id})
+    return firebase_admin.initialize_app(credentials.Certificate(SERVICE_ACCOUNT_PATH))
+
+
+def sync_client(job=None, args=None):
+    initialize_firebase()
+    return instrument(firestore.client(), job=job, args=args)
+
+
+def async_client(job=None, args=None):
+    initialize_firebase()
+    return instrument_async(firestore_async.client(), job=job, args=args)
+
+
+def to_json_value(value):
+    """Firestore document data → JSON-safe value; timestamps, bytes, geopoints and references are tagged"""
+    if isinstance(value, datetime):
+        return {'$ts': (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()}
+    if isinstance(value, bytes):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, firestore.GeoPoint):
+        return {'$geo': [value.latitude, value.longitude]}
+    if hasattr(value, 'path') and hasattr(value, 'parent'):
+        return {'$ref': value.path}
+    if isinstance(value, dict):
+        return {k: to_json_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(v) for v in value]
+    return value
+
+
+def from_json_value(value, db=None):
+    """Inverse of to_json_value(); references are rebuilt against db when one is given"""
+    if isinstance(value, dict):
+        if len(value) == 1:
+            tag, inner = next(iter(value.items()))
+            if tag == '$ts':
+                return datetime.fromisoformat(inner)
+            if tag == '$bytes':
+                return base64.b64decode(inner)
+            if tag == '$geo':
+                return firestore.GeoPoint(*inner)
+            if tag == '$ref':
+                return db.document(inner) if db is not None else inner
+        return {k: from_json_value(v, db) for k, v in value.items()}
+    if isinstance(value, list):
+        return [from_json_value(v, db) for v in value]
+    return value
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class GraphError(Exception):
+    pass
+
+
+class Job:
+    """One node of the task graph: an async callable plus the jobs it depends on"""
+
+    def __init__(self, name, fn, deps=()):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.started = None
+        self.finished = None
+        self.result = None
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+class JobContext:
+    """What a job sees: the client, its dependencies' results and the shared RPC limiter"""
+
+    def __init__(self, db, limiter, results):
+        self.db = db
+        self.limiter = limiter
+        self.results = results
+
+    async def rpc(self, coro_fn):
+        """Run one Firestore RPC under the global concurrency limit"""
+        async with self.limiter:
+            return await coro_fn()
+
+    async def write_all(self, collection, docs, key=None):
+        """Write docs in concurrent batch commits; returns (doc_id, doc) pairs in input order
+
+        key(doc) picks a deterministic document ID; otherwise IDs are auto-generated,
+        the same as collection().add() would.
+        """
+        refs = []
+        for doc in docs:
+            ref = self.db.collection(collection).document(key(doc)) if key else self.db.collection(collection).document()
+            refs.append((ref, doc))
+
+        async def commit(chunk):
+            batch = self.db.batch()
+            for ref, doc in chunk:
+                batch.set(ref, doc)
+            await self.rpc(batch.commit)
+
+        await asyncio.gather(*(commit(chunk) for chunk in chunked(refs, MAX_BATCH_WRITES)))
+        return [(ref.id, doc) for ref, doc in refs]
+
+    async def apply_writes(self, writes):
+        """Commit (op, ref, data, option) writes in concurrent batches; returns the rejected ones
+
+        op is 'set', 'create', 'update' or 'delete' and option a write_option() precondition
+        (or None). A batch that fails a precondition is retried write by write, so one
+        stale document does not hold back the rest.
+        """
+        rejected = []
+
+        def stage(batch, op, ref, data, option):
+            if op == 'set':
+                batch.set(ref, data)
+            elif op == 'create':
+                batch.create(ref, data)
+            elif op == 'update':
+                batch.update(ref, data, option=option)
+            else:
+                batch.delete(ref, option=option)
+
+        async def commit(chunk):
+            batch = self.db.batch()
+            for write in chunk:
+                stage(batch, *write)
+            await self.rpc(batch.commit)
+
+        async def commit_chunk(chunk):
+            try:
+                await commit(chunk)
+                return
+            except (AlreadyExists, FailedPrecondition, NotFound):
+                if len(chunk) == 1:
+                    rejected.extend(chunk)
+                    return
+            for write in chunk:
+                try:
+                    await commit([write])
+                except (AlreadyExists, FailedPrecondition, NotFound):
+                    rejected.append(write)
+
+        await asyncio.gather(*(commit_chunk(chunk) for chunk in chunked(writes, MAX_BATCH_WRITES)))
+        return rejected
+
+    async def blocking(self, fn, *args):
+        """Run a blocking SDK call (e.g. firebase_admin.auth) off the event loop"""
+        async with self.limiter:
+            return await asyncio.to_thread(fn, *args)
+
+
+class TaskGraph:
+    """Dependency-ordered asyncio job runner; independent jobs run concurrently"""
+
+    def __init__(self):
+        self.jobs = {}
+
+    def job(self, name, deps=()):
+        def register(fn):
+            self.add(name, fn, deps)
+            return fn
+        return register
+
+    def add(self, name, fn, deps=()):
+        if name in self.jobs:
+            raise GraphError(f'duplicate job: {name}')
+        self.jobs[name] = Job(name, fn, deps)
+
+    def validate(self):
+        for job in self.jobs.values():
+            missing = [d for d in job.deps if d not in self.jobs]
+            if missing:
+                raise GraphError(f'{job.name} depends on unknown job(s): {", ".join(missing)}')
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise GraphError(f'dependency cycle: {" → ".join(path + [name])}')
+            state[name] = 'visiting'
+            for dep in self.jobs[name].deps:
+                visit(dep, path + [name])
+            state[name] = 'done'
+
+        for name in self.jobs:
+            visit(name, [])
+
+    async def run(self, db, concurrency=DEFAULT_CONCURRENCY, only=None):
+        """Run the graph (or the `only` jobs plus their dependencies) and return per-job results"""
+        self.validate()
+        selected = self._closure(only) if only else set(self.jobs)
+        limiter = asyncio.Semaphore(concurrency)
+        results = {}
+        tasks = {}
+        origin = time.perf_counter()
+
+        async def run_job(job):
+            await asyncio.gather(*(tasks[d] for d in job.deps))
+            ctx = JobContext(db, limiter, {d: results[d] for d in job.deps})
+            job.started = time.perf_counter() - origin
+            job.result = await job.fn(ctx)
+            job.finished = time.perf_counter() - origin
+            results[job.name] = job.result
+            return job.result
+
+        for name in self._topological(selected):
+            tasks[name] = asyncio.ensure_future(run_job(self.jobs[name]))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        self.wall_time = time.perf_counter() - origin
+        self.selected = selected
+        return results
+
+    def _closure(self, names):
+        wanted, stack = set(), list(names)
+        while stack:
+            name = stack.pop()
+            if name not in self.jobs:
+                raise GraphError(f'unknown job: {name}')
+            if name not in wanted:
+                wanted.add(name)
+                stack.extend(self.jobs[name].deps)
+        return wanted
+
+    def _topological(self, selected):
+        order, seen = [], set()
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for dep in self.jobs[name].deps:
+                visit(dep)
+            order.append(name)
+
+        for name in sorted(selected):
+            visit(name)
+        return order
+
+    def critical_path(self):
+        """Longest chain of dependent job durations: the floor for wall time"""
+        memo = {}
+
+        def longest(name):
+            if name not in memo:
+                job = self.jobs[name]
+                memo[name] = job.duration + max((longest(d) for d in job.deps), default=0.0)
+            return memo[name]
+        return max((longest(n) for n in self.selected), default=0.0)
+
+    def print_report(self):
+        jobs = sorted((self.jobs[n] for n in self.selected), key=lambda j: j.started or 0)
+        serial = sum(j.duration for j in jobs)
+        print('\n⏱️  Job timeline (seconds from start):')
+        for job in jobs:
+            deps = f"  ← {', '.join(job.deps)}" if job.deps else ''
+            print(f'   {job.name:<32} {job.started:7.3f} → {job.finished:7.3f}  ({job.duration * 1000:7.1f} ms){deps}')
+        print(f'\n   Wall time:        {self.wall_time:.3f}s')
+        print(f'   Sum of job times: {serial:.3f}s (sequential estimate)')
+        print(f'   Critical path:    {self.critical_path():.3f}s')
+        if self.wall_time > 0:
+            print(f'   Overlap factor:   {serial / self.wall_time:.1f}x')
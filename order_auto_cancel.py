@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Auto-cancel scheduler for unpaid Oil Manager sales orders
+Keeps pending prepaid (bank transfer) sales_orders in hourly expiry buckets of a hierarchical timing wheel, fed
+by change events, and at each hour cancels only the orders whose ORDER_AUTO_CANCEL_HOURS
+ran out, with the configured CANCELLED status, a reason code and an audit_log entry
+"""
+
+import argparse
+import math
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    from firebase_admin import firestore
+    from google.api_core.exceptions import FailedPrecondition, NotFound
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from audit_writer import AUDIT_COLLECTION, audit_entry
+from config_cache import ConfigCache
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import MAX_BATCH_WRITES, chunked, sync_client
+
+HOUR = 3600
+DEFAULT_CANCEL_HOURS = 72
+# Slots per level: 24 hourly slots, 32 daily slots, 16 slots of 32 days; later expiries wait in an overflow map
+WHEEL_SIZES = (24, 32, 16)
+# The app writes Submitted; config_order_statuses calls the same state PENDING
+PENDING_ORDER_STATUSES = ['Submitted', 'Pending']
+# Only orders paid up front can time out waiting for payment: COD is paid on delivery and Credit
+# against the invoice. SalesOrder.fromFirestore() reads a missing paymentMethod as COD
+PREPAID_PAYMENT_METHODS = ('Transfer',)
+DEFAULT_PAYMENT_METHOD = 'COD'
+CANCELLED_STATUS_CODE = 'CANCELLED'
+CANCEL_REASON_CODE = 'PAYMENT_TIMEOUT'
+SYSTEM_ACTOR = 'system_auto_cancel'
+# Each cancellation is two writes (order, audit entry)
+ORDERS_PER_BATCH = MAX_BATCH_WRITES // 2
+TICK_SECONDS = 60
+
+
+def hour_of(when):
+    """Whole hours since the epoch for a datetime or epoch seconds"""
+    seconds = when.timestamp() if isinstance(when, datetime) else when
+    return int(seconds // HOUR)
+
+
+# ============================================================
+# TIMING WHEEL
+# ============================================================
+
+class TimingWheel:
+    """Hierarchical timing wheel with one-hour ticks
+
+    A key scheduled for hour H sits in the lowest level whose window still holds H: the
+    hourly level for the next day, then daily and 32-day slots. When the wheel reaches
+    the start of a coarser slot, that slot cascades its keys down a level, so every tick
+    touches only keys that are due or about to be. Removal is lazy: index holds the live
+    hour of every key, and slot entries that disagree with it are dropped when reached.
+    """
+
+    def __init__(self, now_hour, sizes=WHEEL_SIZES):
+        self.sizes = sizes
+        self.spans = [math.prod(sizes[:i]) for i in range(len(sizes))]
+        self.levels = [[{} for _ in range(size)] for size in sizes]
+        self.overflow = {}
+        self.due = {}
+        self.index = {}
+        self.current = now_hour
+        self.cascaded = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def schedule(self, key, hour):
+        """(Re)schedule key to fire at hour; hours already passed fire on the next advance()"""
+        self.index[key] = hour
+        self._place(key, hour)
+
+    def remove(self, key):
+        return self.index.pop(key, None) is not None
+
+    def _place(self, key, hour):
+        if hour <= self.current:
+            self.due[key] = hour
+            return
+        for level, (size, span) in enumerate(zip(self.sizes, self.spans)):
+            if hour // span - self.current // span < size:
+                self.levels[level][(hour // span) % size][key] = hour
+                return
+        self.overflow[key] = hour
+
+    def _live(self, entries):
+        return [(key, hour) for key, hour in entries.items() if self.index.get(key) == hour]
+
+    def advance(self, to_hour):
+        """Move the wheel to to_hour and return the keys that came due, oldest hour first"""
+        fired = self._pop_due()
+        while self.current < to_hour:
+            self.current += 1
+            top = len(self.sizes) - 1
+            if self.current % self.spans[top] == 0 and self.overflow:
+                waiting, self.overflow = self.overflow, {}
+                for key, hour in self._live(waiting):
+                    self._place(key, hour)
+            for level in range(top, 0, -1):
+                if self.current % self.spans[level] == 0:
+                    slots = self.levels[level]
+                    slot = (self.current // self.spans[level]) % self.sizes[level]
+                    entries, slots[slot] = slots[slot], {}
+                    for key, hour in self._live(entries):
+                        self.cascaded += 1
+                        self._place(key, hour)
+            slots = self.levels[0]
+            slot = self.current % self.sizes[0]
+            entries, slots[slot] = slots[slot], {}
+            for key, hour in self._live(entries):
+                del self.index[key]
+                fired.append(key)
+            fired.extend(self._pop_due())
+        return fired
+
+    def _pop_due(self):
+        entries, self.due = self.due, {}
+        live = self._live(entries)
+        for key, _ in live:
+            del self.index[key]
+        return [key for key, _ in sorted(live, key=lambda kv: kv[1])]
+
+
+# ============================================================
+# SCHEDULER
+# ============================================================
+
+def cancelled_status(cache):
+    """Order status name for the sales CANCELLED entry in config_order_statuses"""
+    for status in cache.documents('config_order_statuses').values():
+        if status.get('type') == 'sales' and status.get('code') == CANCELLED_STATUS_CODE:
+            return status.get('name') or 'Cancelled'
+    return 'Cancelled'
+
+
+def cancel_reason(cache):
+    """(code, name) of the payment-timeout cancel reason in config_reasons"""
+    for reason in cache.documents('config_reasons').values():
+        if reason.get('type') == 'auto_cancel' and reason.get('code') == CANCEL_REASON_CODE:
+            return CANCEL_REASON_CODE, reason.get('name')
+    return CANCEL_REASON_CODE, 'Payment Not Received'
+
+
+class AutoCancelScheduler:
+    def __init__(self, db, cache, dry_run=False, now=None):
+        self.db = db
+        self.dry_run = dry_run
+        self.hours = float(cache.get_setting('ORDER_AUTO_CANCEL_HOURS', DEFAULT_CANCEL_HOURS))
+        self.status = cancelled_status(cache)
+        self.reason_code, self.reason_name = cancel_reason(cache)
+        self.wheel = TimingWheel(hour_of(now or datetime.now(timezone.utc)))
+        # on_change runs on the listener/feed thread, tick() on the main thread
+        self._lock = threading.Lock()
+        self.counts = {'cancelled': 0, 'no longer pending': 0, 'conflicts': 0}
+
+    def is_pending(self, order):
+        """Still submitted, payable up front and not yet marked paid"""
+        return (order is not None and order.get('status') in PENDING_ORDER_STATUSES
+                and (order.get('paymentMethod') or DEFAULT_PAYMENT_METHOD) in PREPAID_PAYMENT_METHODS
+                and not order.get('paidAt') and isinstance(order.get('createdAt'), datetime))
+
+    def expires_at(self, order):
+        return order['createdAt'].timestamp() + self.hours * HOUR
+
+    def apply(self, order_id, order):
+        """Track an order's current state: schedule it while pending, drop it otherwise"""
+        with self._lock:
+            if self.is_pending(order):
+                self.wheel.schedule(order_id, math.ceil(self.expires_at(order) / HOUR))
+            else:
+                self.wheel.remove(order_id)
+
+    def on_change(self, event):
+        """change_bus handler for sales_orders"""
+        self.apply(event.doc_id, None if event.type == 'REMOVED' else event.data)
+
+    def on_snapshot(self, docs, changes, read_time):
+        for change in changes:
+            removed = change.type.name == 'REMOVED'
+            self.apply(change.document.id, None if removed else change.document.to_dict())
+
+    def pending_query(self):
+        return (self.db.collection('sales_orders')
+                .where(filter=FieldFilter('status', 'in', PENDING_ORDER_STATUSES))
+                .select(['status', 'createdAt', 'paidAt', 'paymentMethod']))
+
+    def load(self):
+        for snap in self.pending_query().stream():
+            self.apply(snap.id, snap.to_dict())
+
+    def attach(self, bus):
+        """Consume sales_orders from a ChangeBus, or from a change_bus.py socket path"""
+        from change_bus import connect
+        feed = connect(bus, 'order_auto_cancel', self.on_change, ['sales_orders'])
+        if isinstance(bus, str):
+            # A socket consumer joins a running bus whose log no longer holds the initial snapshot
+            self.load()
+        return feed
+
+    def listen(self, bus=None):
+        if bus is None:
+            return self.pending_query().on_snapshot(self.on_snapshot)
+        return self.attach(bus)
+
+    def tick(self, now=None):
+        """Cancel every order whose bucket came due by now; returns how many were cancelled"""
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            due = self.wheel.advance(hour_of(now))
+        return self.cancel(due, now) if due else 0
+
+    def _stage(self, batch, snap):
+        order = snap.to_dict()
+        batch.update(snap.reference, {
+            'status': self.status,
+            'cancelReasonCode': self.reason_code,
+            'cancelReason': self.reason_name,
+            'cancelledBy': SYSTEM_ACTOR,
+            'cancelledAt': firestore.SERVER_TIMESTAMP,
+            'lastStatusAt': firestore.SERVER_TIMESTAMP,
+        }, option=self.db.write_option(last_update_time=snap.update_time))
+        batch.set(self.db.collection(AUDIT_COLLECTION).document(), audit_entry(
+            None, 'sales_order', snap.id, 'status_changed', SYSTEM_ACTOR,
+            from_status=order.get('status'), to_status=self.status,
+            notes=f'{self.reason_name}: not paid within {self.hours:g} hours',
+            changes={'status': self.status, 'cancelReasonCode': self.reason_code}))
+
+    def cancel(self, order_ids, now):
+        """Re-read due orders and cancel the ones still pending and past their deadline"""
+        cancelled = 0
+        for chunk in chunked(order_ids, ORDERS_PER_BATCH):
+            refs = [self.db.collection('sales_orders').document(i) for i in chunk]
+            expired = []
+            for snap in self.db.get_all(refs):
+                order = snap.to_dict() if snap.exists else None
+                if not self.is_pending(order):
+                    self.counts['no longer pending'] += 1
+                elif self.expires_at(order) > now.timestamp():
+                    # createdAt moved since the event we bucketed it by
+                    self.apply(snap.id, order)
+                else:
+                    expired.append(snap)
+            if not expired or self.dry_run:
+                cancelled += len(expired)
+                continue
+            batch = self.db.batch()
+            for snap in expired:
+                self._stage(batch, snap)
+            try:
+                batch.commit()
+                cancelled += len(expired)
+                continue
+            except (FailedPrecondition, NotFound):
+                pass
+            # An order in the chunk was paid or edited since the read: retry one by one, skipping those
+            for snap in expired:
+                batch = self.db.batch()
+                self._stage(batch, snap)
+                try:
+                    batch.commit()
+                    cancelled += 1
+                except (FailedPrecondition, NotFound):
+                    self.counts['conflicts'] += 1
+        self.counts['cancelled'] += cancelled
+        return cancelled
+
+    def run(self, duration=None, bus=None):
+        """Cancel orders as their hour comes due until interrupted (or duration seconds)
+
+        Opens its own listener on pending sales_orders, or with bus (a ChangeBus or the
+        path of a change_bus.py socket) consumes sales_orders changes from the bus.
+        """
+        watch = self.listen(bus)
+        started = time.time()
+        source = 'pending sales_orders' if bus is None else 'sales_orders from the change bus'
+        print(f"👂 Listening to {source}; orders cancel {self.hours:g}h after creation")
+        try:
+            while duration is None or time.time() - started < duration:
+                cancelled = self.tick()
+                if cancelled:
+                    print(f"   ✓ {cancelled} order(s) auto-cancelled, {len(self.wheel)} pending")
+                if not watch.is_active:
+                    print("⚠️  Listener closed, restarting from a fresh snapshot")
+                    watch = self.listen(bus)
+                time.sleep(TICK_SECONDS)
+        except KeyboardInterrupt:
+            print("\n🛑 Stopping auto-cancel scheduler")
+        finally:
+            watch.unsubscribe()
+
+
+def benchmark(orders, days=30, paid_share=0.8, hours=DEFAULT_CANCEL_HOURS):
+    """Drive the wheel with a simulated order stream; returns a stats dict"""
+    import numpy as np
+    rng = np.random.default_rng(5)
+    created = rng.uniform(0, days * 24 * HOUR, orders)
+    expiry = np.ceil((created + hours * HOUR) / HOUR).astype(np.int64)
+    paid = rng.random(orders) < paid_share
+    paid_hour = ((created + rng.uniform(0, hours * HOUR, orders)) // HOUR).astype(np.int64)
+    ticks = days * 24 + int(hours) + 2
+    # Keys per hour for the two event kinds, as offsets into one hour-sorted key array each
+    created_keys = np.argsort(created // HOUR, kind='stable')
+    created_at = np.searchsorted((created // HOUR)[created_keys], np.arange(ticks + 1))
+    paid_keys = np.flatnonzero(paid)
+    paid_keys = paid_keys[np.argsort(paid_hour[paid_keys], kind='stable')]
+    paid_at = np.searchsorted(paid_hour[paid_keys], np.arange(ticks + 1))
+    expiry = expiry.tolist()
+
+    wheel = TimingWheel(0)
+    fired = peak = naive_reads = 0
+    started = time.perf_counter()
+    for hour in range(ticks):
+        for key in created_keys[created_at[hour]:created_at[hour + 1]].tolist():
+            wheel.schedule(key, expiry[key])
+        for key in paid_keys[paid_at[hour]:paid_at[hour + 1]].tolist():
+            wheel.remove(key)
+        fired += len(wheel.advance(hour))
+        peak = max(peak, len(wheel))
+        naive_reads += int(created_at[hour + 1])
+    return {'seconds': time.perf_counter() - started, 'ticks': ticks, 'fired': fired,
+            'peak': peak, 'cascaded': wheel.cascaded, 'naive_reads': naive_reads}
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--once', action='store_true', help='cancel every order already past its deadline and exit')
+    parser.add_argument('--duration', type=float, metavar='SECONDS', help='stop after SECONDS')
+    parser.add_argument('--bus', metavar='SOCKET',
+                        help='consume sales_orders from a running change_bus.py socket instead of listening')
+    parser.add_argument('--dry-run', action='store_true', help='report what would be cancelled without writing')
+    parser.add_argument('--benchmark', type=int, metavar='ORDERS',
+                        help='simulate ORDERS orders over 30 days through the wheel, then exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(f"⏱️  Simulating {args.benchmark:,} orders over 30 days...")
+        stats = benchmark(args.benchmark)
+        print(f"   • {stats['ticks']} hourly ticks in {stats['seconds']:.1f}s "
+              f"({args.benchmark / stats['seconds']:,.0f} orders/s)")
+        print(f"   • auto-cancelled: {stats['fired']:,}; peak pending in the wheel: {stats['peak']:,}")
+        print(f"   • keys cascaded between levels: {stats['cascaded']:,}")
+        print(f"   • documents read: {stats['fired']:,} vs {stats['naive_reads']:,} for an hourly full scan")
+        return
+
+    print("⏰ Oil Manager order auto-cancel")
+    db = sync_client(args=args)
+    cache = ConfigCache(db, collections=('config_system_settings', 'config_order_statuses', 'config_reasons'),
+                        listen=False).load()
+    scheduler = AutoCancelScheduler(db, cache, dry_run=args.dry_run)
+
+    if args.once:
+        scheduler.load()
+        cancelled = scheduler.tick()
+        print(f"✅ {cancelled} order(s) {'would be ' if args.dry_run else ''}auto-cancelled, "
+              f"{len(scheduler.wheel)} still pending")
+        for name, count in scheduler.counts.items():
+            print(f"   • {name}: {count}")
+        return
+
+    scheduler.run(duration=args.duration, bus=args.bus)
+    for name, count in scheduler.counts.items():
+        print(f"   • {name}: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+"""
+Trigram search index for Oil Manager back-office screens
+Builds prefix and trigram inverted indexes over config_products (name, SKU, tags),
+customer names in workflow_instances metadata, exception descriptions and audit_log
+entries, one shard per record kind, saved to a local index file. Listeners keep it
+current from there on; api_middleware.py serves ranked search from it (GET /search)
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ numpy not installed. Run: pip install numpy")
+    sys.exit(1)
+
+try:
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import from_json_value, sync_client, to_json_value
+
+DEFAULT_INDEX_PATH = 'search_index.npz'
+DEFAULT_LIMIT = 20
+# Word-start marker: every word is indexed as '^' + word, so '^ho' is "a word starting with ho"
+WORD_START = '^'
+# Candidates verified and ranked per shard, newest first; broader matches are cut to these
+MAX_VERIFY = 1000
+# A shard is rewritten without replaced/deleted records once they pass this share
+COMPACT_RATIO = 0.2
+SAVE_INTERVAL = 30.0
+# Listeners never see deletions made while they were down; a full build every hour prunes those
+RECONCILE_INTERVAL = 3600.0
+
+_WORD = re.compile(r'\w+')
+
+
+class SearchSource:
+    """How one collection becomes search records: weighted text fields plus a title and subtitle
+
+    since_field marks an append-only collection: listeners and rebuilds only read documents
+    at or after the stored watermark instead of the whole collection.
+    """
+
+    def __init__(self, kind, collection, fields, title, subtitle, since_field=None):
+        self.kind = kind
+        self.collection = collection
+        self.fields = fields
+        self.title = title
+        self.subtitle = subtitle
+        self.since_field = since_field
+
+    def record(self, data):
+        """(title, subtitle, [(weight, normalized text)]) or None if the document has no searchable text"""
+        fields = []
+        for path, weight in self.fields:
+            text = normalize(field_value(data, path))
+            if text:
+                fields.append((weight, text))
+        if not fields:
+            return None
+        return str(field_value(data, self.title) or ''), str(field_value(data, self.subtitle) or ''), fields
+
+
+SOURCES = (
+    SearchSource('product', 'config_products', (('name', 3), ('sku', 3), ('tags', 2), ('category', 1)),
+                 title='name', subtitle='sku'),
+    SearchSource('customer', 'workflow_instances',
+                 (('metadata.customerName', 3), ('entityId', 2), ('metadata.deliveryAddress', 1)),
+                 title='metadata.customerName', subtitle='entityId'),
+    SearchSource('exception', 'exceptions',
+                 (('entityId', 2), ('metadata.orderId', 2), ('metadata.transactionId', 2), ('description', 1)),
+                 title='exceptionType', subtitle='description'),
+    SearchSource('audit', 'audit_log', (('entityId', 2), ('action', 1), ('notes', 1)),
+                 title='action', subtitle='entityId', since_field='performedAt'),
+)
+KINDS = tuple(source.kind for source in SOURCES)
+
+
+# ============================================================
+# TEXT
+# ============================================================
+
+def field_value(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    if isinstance(data, (list, tuple)):
+        return ' '.join(str(v) for v in data if v is not None)
+    return data
+
+
+def normalize(value):
+    """Lowercase words without accents, joined by single spaces ('Café  Ltd.' -> 'cafe ltd')"""
+    if value is None:
+        return ''
+    text = unicodedata.normalize('NFKD', str(value))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(_WORD.findall(text.casefold()))
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def index_grams(fields):
+    """Grams a record is posted under: '^' plus each word's first letter, and the trigrams of '^' + word"""
+    grams = set()
+    for _, text in fields:
+        for word in text.split(' '):
+            grams.add(WORD_START + word[0])
+            grams |= trigrams(WORD_START + word)
+    return grams
+
+
+def query_grams(token):
+    """Grams a record must have to match a query word: its trigrams (substring), or a word-start prefix if shorter"""
+    if len(token) >= 3:
+        return trigrams(token)
+    return {WORD_START + token}
+
+
+def match_score(tokens, fields):
+    """Sum over query words of the best field weight x match quality (3 whole word, 2 word prefix, 1 substring)
+
+    0 when any word does not really occur; short words must start a word, as their grams require.
+    """
+    total = 0
+    for token in tokens:
+        best = 0
+        for weight, text in fields:
+            padded = f' {text} '
+            if f' {token} ' in padded:
+                quality = 3
+            elif f' {token}' in padded:
+                quality = 2
+            elif len(token) >= 3 and token in text:
+                quality = 1
+            else:
+                continue
+            best = max(best, weight * quality)
+        if not best:
+            return 0
+        total += best
+    return total
+
+
+# ============================================================
+# INDEX
+# ============================================================
+
+class IndexShard:
+    """Inverted index for one record kind
+
+    Records get increasing internal ids, so every posting list is sorted by construction.
+    Postings loaded from the index file stay as slices of one uint32 array; records added
+    since sit in per-gram array('I') tails. Changing a record's text retires its id and
+    posts it again under a new one, which also makes the newest records the highest ids.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.docs = []
+        self.by_doc = {}
+        self.base = {}
+        self.added = {}
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.by_doc)
+
+    def put(self, doc_id, record):
+        title, subtitle, fields = record
+        current = self.by_doc.get(doc_id)
+        if current is not None and self.docs[current][3] == fields:
+            self.docs[current] = (doc_id, title, subtitle, fields)
+            return False
+        self.remove(doc_id)
+        internal = len(self.docs)
+        self.docs.append((doc_id, title, subtitle, fields))
+        self.by_doc[doc_id] = internal
+        for gram in index_grams(fields):
+            tail = self.added.get(gram)
+            if tail is None:
+                tail = self.added[gram] = array('I')
+            tail.append(internal)
+        return True
+
+    def remove(self, doc_id):
+        internal = self.by_doc.pop(doc_id, None)
+        if internal is None:
+            return False
+        self.docs[internal] = None
+        self.dead += 1
+        return True
+
+    def postings(self, gram):
+        base = self.base.get(gram)
+        tail = self.added.get(gram)
+        if tail is None:
+            return base if base is not None else np.empty(0, dtype=np.uint32)
+        tail = np.frombuffer(tail, dtype=np.uint32)
+        return tail if base is None else np.concatenate((base, tail))
+
+    def search(self, tokens, limit):
+        """[(score, internal id, doc)] best first among the newest MAX_VERIFY records having every word's grams
+
+        The shortest posting list drives: it is walked from the newest end in chunks, and each
+        chunk is narrowed by binary search in the longer lists, so a query costs about
+        MAX_VERIFY lookups however common its words are.
+        """
+        lists = [self.postings(gram) for gram in set().union(*(query_grams(t) for t in tokens))]
+        lists.sort(key=len)
+        if not lists or not len(lists[0]):
+            return []
+        driver, others = lists[0], lists[1:]
+        hits = []
+        verified = 0
+        end = len(driver)
+        while end > 0 and verified < MAX_VERIFY:
+            start = max(0, end - 4 * MAX_VERIFY)
+            candidates = driver[start:end]
+            end = start
+            for postings in others:
+                found = np.minimum(np.searchsorted(postings, candidates), len(postings) - 1)
+                candidates = candidates[postings[found] == candidates]
+                if not len(candidates):
+                    break
+            for internal in candidates[::-1].tolist():
+                doc = self.docs[internal]
+                if doc is None:
+                    continue
+                verified += 1
+                score = match_score(tokens, doc[3])
+                if score:
+                    hits.append((score, internal, doc))
+                if verified >= MAX_VERIFY:
+                    break
+        hits.sort(key=lambda hit: (-hit[0], -hit[1]))
+        return hits[:limit]
+
+    # ==================== FILE FORMAT ====================
+
+    def compact(self):
+        """Rebuild the postings as one array without retired ids, renumbering the live records"""
+        alive = np.array([doc is not None for doc in self.docs], dtype=bool)
+        remap = np.cumsum(alive, dtype=np.int64) - 1
+        grams, chunks, offsets = [], [], [0]
+        for gram in sorted(set(self.base) | set(self.added)):
+            postings = self.postings(gram)
+            postings = remap[postings[alive[postings]]]
+            if len(postings):
+                grams.append(gram)
+                chunks.append(postings.astype(np.uint32))
+                offsets.append(offsets[-1] + len(postings))
+        flat = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.uint32)
+        self._load(grams, np.array(offsets, dtype=np.int64), flat, [doc for doc in self.docs if doc is not None])
+
+    def _load(self, grams, offsets, flat, docs):
+        self.docs = list(docs)
+        self.by_doc = {doc[0]: i for i, doc in enumerate(self.docs) if doc is not None}
+        self.base = {gram: flat[offsets[i]:offsets[i + 1]] for i, gram in enumerate(grams)}
+        self.added = {}
+        self.dead = sum(1 for doc in self.docs if doc is None)
+
+    def arrays(self):
+        """(grams, offsets, postings) as saved; call compact() first to drop retired ids"""
+        grams = sorted(set(self.base) | set(self.added))
+        chunks = [self.postings(gram) for gram in grams]
+        offsets = np.zeros(len(grams) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(c) for c in chunks])
+        flat = np.concatenate(chunks).astype(np.uint32) if chunks else np.empty(0, dtype=np.uint32)
+        return np.array(grams, dtype=str), offsets, flat
+
+
+class SearchIndex:
+    """One IndexShard per record kind behind a lock, so listener threads can update it while it serves"""
+
+    def __init__(self):
+        self.shards = {kind: IndexShard(kind) for kind in KINDS}
+        self.watermarks = {}
+        self._lock = threading.Lock()
+        self.dirty = False
+        self.counts = defaultdict(int)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards.values())
+
+    def put(self, kind, doc_id, record):
+        with self._lock:
+            changed = self.shards[kind].put(doc_id, record) if record else self.shards[kind].remove(doc_id)
+            self.dirty = self.dirty or changed
+        self.counts[f'{kind} indexed' if record else f'{kind} removed'] += changed
+        return changed
+
+    def advance(self, collection, ts):
+        with self._lock:
+            if ts is not None and (self.watermarks.get(collection) is None or ts > self.watermarks[collection]):
+                self.watermarks[collection] = ts
+                self.dirty = True
+
+    def doc_ids(self, kind):
+        with self._lock:
+            return set(self.shards[kind].by_doc)
+
+    def search(self, query, kinds=None, limit=DEFAULT_LIMIT):
+        """Ranked hits for every word of query (AND), across the given kinds (default all)"""
+        tokens = list(dict.fromkeys(normalize(query).split()))
+        if not tokens:
+            return []
+        hits = []
+        with self._lock:
+            for kind in kinds or KINDS:
+                for score, internal, (doc_id, title, subtitle, _) in self.shards[kind].search(tokens, limit):
+                    hits.append((score, internal, {'kind': kind, 'id': doc_id, 'title': title,
+                                                   'subtitle': subtitle, 'score': score}))
+        hits.sort(key=lambda hit: (-hit[0], -hit[1]))
+        return [hit for _, _, hit in hits[:limit]]
+
+    def save(self, path):
+        """Write every shard to one .npz file (atomically), compacting shards with many retired records"""
+        with self._lock:
+            arrays = {}
+            meta = {'watermarks': to_json_value(self.watermarks), 'docs': {}}
+            for kind, shard in self.shards.items():
+                if shard.dead > COMPACT_RATIO * max(len(shard.docs), 1):
+                    shard.compact()
+                grams, offsets, flat = shard.arrays()
+                arrays.update({f'{kind}_grams': grams, f'{kind}_offsets': offsets, f'{kind}_postings': flat})
+                meta['docs'][kind] = [None if doc is None else [doc[0], doc[1], doc[2], doc[3]] for doc in shard.docs]
+            self.dirty = False
+        arrays['meta'] = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as fh:
+            np.savez(fh, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+            index.watermarks = from_json_value(meta.get('watermarks') or {})
+            for kind, shard in index.shards.items():
+                if f'{kind}_grams' not in data:
+                    continue
+                docs = [None if doc is None else (doc[0], doc[1], doc[2], [tuple(f) for f in doc[3]])
+                        for doc in meta['docs'].get(kind, [])]
+                shard._load(data[f'{kind}_grams'].tolist(), data[f'{kind}_offsets'], data[f'{kind}_postings'], docs)
+        return index
+
+
+# ============================================================
+# INDEXER
+# ============================================================
+
+class SearchIndexer:
+    """Feeds SearchIndex from Firestore: a full read to build, then one listener per source"""
+
+    def __init__(self, db, index):
+        self.db = db
+        self.index = index
+        self.watches = []
+
+    def query(self, source):
+        query = self.db.collection(source.collection)
+        since = self.index.watermarks.get(source.collection) if source.since_field else None
+        if since is not None:
+            # >= rather than >: documents sharing the watermark are re-read, and are no-ops
+            query = query.where(filter=FieldFilter(source.since_field, '>=', since))
+        return query
+
+    def apply(self, source, doc_id, data):
+        self.index.put(source.kind, doc_id, source.record(data) if data is not None else None)
+        if data is not None and source.since_field:
+            self.index.advance(source.collection, data.get(source.since_field))
+
+    def build(self):
+        """Read every source (append-only ones from their watermark) and drop records whose document is gone"""
+        for source in SOURCES:
+            started = time.perf_counter()
+            # Taken before the read, so records a live listener adds meanwhile are never pruned
+            known = self.index.doc_ids(source.kind)
+            seen = set()
+            for doc in self.query(source).stream():
+                seen.add(doc.id)
+                self.apply(source, doc.id, doc.to_dict())
+            if not source.since_field:
+                for doc_id in known - seen:
+                    self.index.put(source.kind, doc_id, None)
+            print(f"   ✓ {source.collection}: {len(seen):,} read in {time.perf_counter() - started:.1f}s, "
+                  f"{len(self.index.shards[source.kind]):,} indexed")
+
+    def on_snapshot(self, source):
+        def callback(docs, changes, read_time):
+            for change in changes:
+                removed = change.type.name == 'REMOVED'
+                self.apply(source, change.document.id, None if removed else change.document.to_dict())
+        return callback
+
+    def listen(self):
+        """Start one listener per source; the initial snapshots re-apply known documents as no-ops"""
+        self.watches = [self.query(source).on_snapshot(self.on_snapshot(source)) for source in SOURCES]
+        return self.watches
+
+    def check_listeners(self):
+        for i, source in enumerate(SOURCES):
+            if not self.watches[i].is_active:
+                self.watches[i] = self.query(source).on_snapshot(self.on_snapshot(source))
+                print(f"⚠️  Listener on {source.collection} closed, re-opened")
+
+    def close(self):
+        for watch in self.watches:
+            watch.unsubscribe()
+        self.watches = []
+
+    def run(self, path, duration=None, stop=None):
+        """Keep the index file current until interrupted, stop is set, or duration seconds have passed
+
+        Every SAVE_INTERVAL: re-open closed listeners, rebuild once RECONCILE_INTERVAL has
+        passed, and save if anything changed. api_middleware.py runs this on a thread.
+        """
+        stop = stop or threading.Event()
+        self.listen()
+        started = reconciled = time.time()
+        print(f"👂 Listening to {', '.join(s.collection for s in SOURCES)} (save every {SAVE_INTERVAL:g}s)...")
+        try:
+            while duration is None or time.time() - started < duration:
+                if stop.wait(min(SAVE_INTERVAL, duration or SAVE_INTERVAL)):
+                    break
+                self.check_listeners()
+                if time.time() - reconciled >= RECONCILE_INTERVAL:
+                    self.build()
+                    reconciled = time.time()
+                if self.index.dirty:
+                    self.index.save(path)
+                    print(f"   ✓ Saved {len(self.index):,} records to {path}")
+        except KeyboardInterrupt:
+            print("\n🛑 Stopping search indexer")
+        finally:
+            self.close()
+            if self.index.dirty:
+                self.index.save(path)
+
+
+def open_index(path):
+    if os.path.exists(path):
+        return SearchIndex.load(path)
+    return SearchIndex()
+
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+
+def benchmark(records, queries=500, seed=7):
+    """Index synthetic records shaped like the seeded data and time ranked queries; returns a stats dict"""
+    rng = np.random.default_rng(seed)
+    vocab = ['restaurant', 'hotel', 'chain', 'cafe', 'bistro', 'kitchen', 'golden', 'river', 'palace', 'siam',
+             'garden', 'royal', 'street', 'food', 'premium', 'standard', 'bulk', 'cooking', 'palm', 'soybean',
+             'refined', 'bottle', 'oil', 'bangkok', 'central', 'north', 'grand', 'market', 'noodle', 'seafood']
+    actions = ['created', 'approved', 'rejected', 'status_changed', 'assigned', 'cancelled', 'completed']
+    words = rng.integers(0, len(vocab), (records, 3))
+    index = SearchIndex()
+    started = time.perf_counter()
+    for i in range(records):
+        name = ' '.join(vocab[w] for w in words[i])
+        if i % 10 == 0:
+            index.put('customer', f'wf_{i}', (name, f'order_{i:07d}', [(3, normalize(name)), (2, f'order_{i:07d}')]))
+        elif i % 10 == 1:
+            text = normalize(f'Order order_{i:07d} for {name}: payment TXN{i:09d} declined')
+            index.put('exception', f'ex_{i}', ('payment_failed', text, [(2, f'order_{i:07d}'), (1, text)]))
+        elif i % 1000 == 2:
+            index.put('product', f'p_{i}', (name, f'OIL-{i:07d}', [(3, normalize(name)), (3, f'oil_{i:07d}')]))
+        else:
+            action = actions[i % len(actions)]
+            index.put('audit', f'a_{i}', (action, f'order_{i // 3:07d}',
+                                          [(2, f'order_{i // 3:07d}'), (1, action), (1, normalize(name))]))
+    built = time.perf_counter() - started
+
+    terms = vocab + [w[:2] for w in vocab] + [w[1:5] for w in vocab]
+    samples = []
+    for q in range(queries):
+        kind = q % 4
+        if kind == 0:
+            text = f'{terms[rng.integers(len(terms))]} {vocab[rng.integers(len(vocab))]}'
+        elif kind == 1:
+            text = f'order_{rng.integers(records // 3):07d}'
+        elif kind == 2:
+            text = f'TXN{rng.integers(records):09d}'[:9]
+        else:
+            text = terms[rng.integers(len(terms))]
+        samples.append(text)
+    latencies = []
+    for text in samples:
+        t0 = time.perf_counter()
+        index.search(text)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    return {'records': len(index), 'build': built, 'queries': len(latencies),
+            'p50': latencies[len(latencies) // 2], 'p99': latencies[int(len(latencies) * 0.99)],
+            'max': latencies[-1], 'grams': sum(len(s.added) for s in index.shards.values())}
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help=f'index file (default {DEFAULT_INDEX_PATH})')
+    parser.add_argument('--once', action='store_true', help='build or refresh the index file and exit')
+    parser.add_argument('--rebuild', action='store_true', help='ignore the existing index file')
+    parser.add_argument('--duration', type=float, metavar='SECONDS', help='stop listening after SECONDS')
+    parser.add_argument('--query', metavar='TEXT', help='search the index file and exit')
+    parser.add_argument('--kind', choices=KINDS, action='append', help='restrict --query to a record kind')
+    parser.add_argument('--benchmark', type=int, metavar='RECORDS',
+                        help='index RECORDS synthetic records in memory and time queries, then exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(f"⏱️  Indexing {args.benchmark:,} synthetic records...")
+        stats = benchmark(args.benchmark)
+        print(f"   • {stats['records']:,} records, {stats['grams']:,} grams in {stats['build']:.1f}s")
+        print(f"   • {stats['queries']} queries: p50 {stats['p50'] * 1000:.2f} ms, "
+              f"p99 {stats['p99'] * 1000:.2f} ms, max {stats['max'] * 1000:.2f} ms")
+        return
+
+    if args.query:
+        index = SearchIndex.load(args.index)
+        started = time.perf_counter()
+        hits = index.search(args.query, kinds=args.kind)
+        print(f"🔎 {len(hits)} hit(s) for '{args.query}' in {(time.perf_counter() - started) * 1000:.1f} ms")
+        for hit in hits:
+            print(f"   {hit['score']:>3} {hit['kind']:<10} {hit['id']:<24} {hit['title']} — {hit['subtitle'][:60]}")
+        return
+
+    print("🔎 Oil Manager search indexer")
+    index = SearchIndex() if args.rebuild else open_index(args.index)
+    indexer = SearchIndexer(sync_client(job='search_index', args=args), index)
+    started = time.perf_counter()
+    indexer.build()
+    index.save(args.index)
+    print(f"✅ {len(index):,} records indexed to {args.index} in {time.perf_counter() - started:.1f}s")
+    if not args.once:
+        indexer.run(args.index, duration=args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,18 @@
 #!/usr/bin/env python3
 """
 Firestore Setup Script for Oil Manager
-Creates collections, indexes, and sample data
+Creates collections and sample data
+Composite indexes are planned by firestore_index_planner.py into firestore.indexes.json
 """
 
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from firebase_admin import firestore, auth
 from datetime import datetime, timedelta
 import sys
 
-print("🔥 Starting Firestore setup for Oil Manager...")
+from firestore_metrics import parse_metrics_args
+from maintenance_runtime import initialize_firebase, sync_client
 
-# Initialize Firebase Admin SDK
-try:
-    cred = credentials.Certificate('/opt/flutter/firebase-admin-sdk.json')
-    firebase_admin.initialize_app(cred)
-    print("✅ Firebase Admin SDK initialized")
-except Exception as e:
-    print(f"❌ Failed to initialize Firebase: {e}")
-    sys.exit(1)
-
-db = firestore.client()
-
-# Create test users
-print("\n📝 Creating test users...")
+db = None
 
 test_users = [
     {
@@ -63,43 +52,49 @@ test_users = [
     }
 ]
 
-for user_data in test_users:
+def create_auth_user(user_data):
+    """Create the Firebase Auth account for a test user, if missing"""
+    # Try to create user in Firebase Auth
     try:
-        # Try to create user in Firebase Auth
-        try:
-            user = auth.create_user(
-                uid=user_data['uid'],
-                email=user_data['email'],
-                password=user_data['password'],
-                display_name=user_data['displayName']
-            )
-            print(f"✅ Created auth user: {user_data['email']}")
-        except auth.EmailAlreadyExistsError:
-            print(f"⚠️  Auth user already exists: {user_data['email']}")
-        except Exception as e:
-            print(f"⚠️  Auth user creation skipped: {user_data['email']} - {e}")
-        
-        # Create user document in Firestore
-        user_doc = {
-            'uid': user_data['uid'],
-            'role': user_data['role'],
-            'displayName': user_data['displayName'],
-            'phone': f'+123456789{test_users.index(user_data)}',
-            'email': user_data['email'],
-            'customerAccountId': f"CUST{test_users.index(user_data):03d}" if 'customer' in user_data['role'] else None,
-            'branchIds': [],
-            'isActive': True,
-            'createdAt': firestore.SERVER_TIMESTAMP
-        }
-        
-        db.collection('users').document(user_data['uid']).set(user_doc)
-        print(f"✅ Created Firestore user: {user_data['displayName']} ({user_data['role']})")
-        
+        user = auth.create_user(
+            uid=user_data['uid'],
+            email=user_data['email'],
+            password=user_data['password'],
+            display_name=user_data['displayName']
+        )
+        print(f"✅ Created auth user: {user_data['email']}")
+    except auth.EmailAlreadyExistsError:
+        print(f"⚠️  Auth user already exists: {user_data['email']}")
     except Exception as e:
-        print(f"❌ Error creating user {user_data['email']}: {e}")
+        print(f"⚠️  Auth user creation skipped: {user_data['email']} - {e}")
+
+def user_doc(index, user_data):
+    """Firestore profile for the test user at position index"""
+    return {
+        'uid': user_data['uid'],
+        'role': user_data['role'],
+        'displayName': user_data['displayName'],
+        'phone': f'+123456789{index}',
+        'email': user_data['email'],
+        'customerAccountId': f"CUST{index:03d}" if 'customer' in user_data['role'] else None,
+        'branchIds': [],
+        'isActive': True,
+        'createdAt': firestore.SERVER_TIMESTAMP
+    }
+
+def create_test_users():
+    """Create test users in Firebase Auth and Firestore"""
+    print("\n📝 Creating test users...")
+
+    for index, user_data in enumerate(test_users):
+        try:
+            create_auth_user(user_data)
+
+            db.collection('users').document(user_data['uid']).set(user_doc(index, user_data))
+            print(f"✅ Created Firestore user: {user_data['displayName']} ({user_data['role']})")
 
-# Create sample products
-print("\n📦 Creating sample products...")
+        except Exception as e:
+            print(f"❌ Error creating user {user_data['email']}: {e}")
 
 products = [
     {
@@ -134,18 +129,20 @@ products = [
     }
 ]
 
-for product in products:
-    try:
-        db.collection('products_cache').document(product['sku']).set(product)
-        print(f"✅ Created product: {product['name']}")
-    except Exception as e:
-        print(f"❌ Error creating product {product['sku']}: {e}")
+def create_products():
+    """Create sample products in products_cache"""
+    print("\n📦 Creating sample products...")
 
-# Create sample order
-print("\n📋 Creating sample order...")
+    for product in products:
+        try:
+            db.collection('products_cache').document(product['sku']).set(product)
+            print(f"✅ Created product: {product['name']}")
+        except Exception as e:
+            print(f"❌ Error creating product {product['sku']}: {e}")
 
-try:
-    order_data = {
+def sample_order_doc():
+    """Sample B2C sales order"""
+    return {
         'orderNumber': 'SO-2024-001',
         'customerType': 'B2C',
         'customerAccountId': 'CUST000',
@@ -166,33 +163,38 @@ try:
         'createdAt': firestore.SERVER_TIMESTAMP,
         'lastStatusAt': firestore.SERVER_TIMESTAMP
     }
-    
-    order_ref = db.collection('sales_orders').add(order_data)
-    print(f"✅ Created sample order: SO-2024-001")
-    
-    # Create order lines
-    order_lines = [
+
+def sample_order_line_docs(order_id):
+    """Order lines for the sample order"""
+    return [
         {
-            'orderId': order_ref[1].id,
+            'orderId': order_id,
             'sku': 'OIL-001',
             'qty': 10,
             'unitPrice': 23.50,
             'lineTotal': 235.00
         }
     ]
-    
-    for line in order_lines:
-        db.collection('sales_order_lines').add(line)
-    print(f"✅ Created order lines")
-    
-except Exception as e:
-    print(f"❌ Error creating order: {e}")
-
-# Create sample pickup request
-print("\n♻️  Creating sample pickup request...")
-
-try:
-    pickup_data = {
+
+def create_sample_order():
+    """Create the sample order and its lines"""
+    print("\n📋 Creating sample order...")
+
+    try:
+        order_ref = db.collection('sales_orders').add(sample_order_doc())
+        print(f"✅ Created sample order: SO-2024-001")
+
+        # Create order lines
+        for line in sample_order_line_docs(order_ref[1].id):
+            db.collection('sales_order_lines').add(line)
+        print(f"✅ Created order lines")
+
+    except Exception as e:
+        print(f"❌ Error creating order: {e}")
+
+def sample_pickup_doc():
+    """Sample B2C UCO pickup request"""
+    return {
         'customerType': 'B2C',
         'customerAccountId': 'CUST000',
         'branchId': None,
@@ -215,17 +217,47 @@ try:
         'createdAt': firestore.SERVER_TIMESTAMP,
         'lastStatusAt': firestore.SERVER_TIMESTAMP
     }
-    
-    db.collection('pickup_requests').add(pickup_data)
-    print(f"✅ Created sample pickup request")
-    
-except Exception as e:
-    print(f"❌ Error creating pickup request: {e}")
-
-print("\n✅ Firestore setup complete!")
-print("\n📧 Test User Credentials:")
-print("=" * 50)
-for user in test_users:
-    print(f"{user['displayName']:20} | {user['email']:25} | {user['password']}")
-print("=" * 50)
-print("\n🌐 You can now login with these credentials in the app!")
+
+def create_sample_pickup():
+    """Create the sample pickup request"""
+    print("\n♻️  Creating sample pickup request...")
+
+    try:
+        db.collection('pickup_requests').add(sample_pickup_doc())
+        print(f"✅ Created sample pickup request")
+
+    except Exception as e:
+        print(f"❌ Error creating pickup request: {e}")
+
+def main():
+    """Main execution function"""
+    global db
+    args = parse_metrics_args(__doc__)
+
+    print("🔥 Starting Firestore setup for Oil Manager...")
+
+    # Initialize Firebase Admin SDK
+    try:
+        initialize_firebase()
+        print("✅ Firebase Admin SDK initialized")
+    except Exception as e:
+        print(f"❌ Failed to initialize Firebase: {e}")
+        sys.exit(1)
+
+    db = sync_client(args=args)
+
+    create_test_users()
+    create_products()
+    create_sample_order()
+    create_sample_pickup()
+
+    print("\n✅ Firestore setup complete!")
+    print("\n📧 Test User Credentials:")
+    print("=" * 50)
+    for user in test_users:
+        print(f"{user['displayName']:20} | {user['email']:25} | {user['password']}")
+    print("=" * 50)
+    print("\n🌐 You can now login with these credentials in the app!")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Delivery-slot demand forecasting for Oil Manager
+Builds per-zone, per-window daily demand series from sales_orders and pickup_requests,
+fits a weekly seasonal baseline with exponential smoothing across all series at once,
+and writes recommended capacities with confidence bands to slot_forecasts/{slotId}
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+from statistics import NormalDist
+from zoneinfo import ZoneInfo
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ numpy not installed. Run: pip install numpy")
+    sys.exit(1)
+
+try:
+    from firebase_admin import firestore
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from daily_rollups import DEFAULT_TIMEZONE, UNASSIGNED, zone_of
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import MAX_BATCH_WRITES, chunked, sync_client
+
+FORECAST_COLLECTION = 'slot_forecasts'
+DEFAULT_HISTORY_DAYS = 730
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+# Smoothing constants tried for every series; each series keeps the one with the lowest one-step error
+ALPHAS = (0.02, 0.05, 0.1, 0.2, 0.3, 0.5)
+# Weeks of history the weekday profile is estimated from, and days of residuals behind the band
+SEASON_WEEKS = 26
+RESIDUAL_DAYS = 56
+# Pseudo-count that keeps weekday factors finite for sparse series
+SEASONAL_PRIOR = 0.5
+DEFAULT_CONFIDENCE = 0.9
+
+# (collection, address field) demand sources; both are booked against a preferred window
+SOURCES = (('sales_orders', 'deliveryAddress'), ('pickup_requests', 'pickupAddress'))
+EXCLUDED_STATUSES = {'Cancelled', 'Rejected'}
+
+
+# ============================================================
+# SERIES
+# ============================================================
+
+class SlotTable:
+    """Active config_delivery_slots grouped by zone, for mapping a booking time to a slot"""
+
+    def __init__(self, slots):
+        self.slots = [s for s in slots if s.get('isActive', True)]
+        self.by_zone = {}
+        for i, slot in enumerate(self.slots):
+            self.by_zone.setdefault(slot['zone'], []).append((slot['timeWindowStart'], slot['timeWindowEnd'], i))
+
+    def locate(self, zone, local):
+        """Index of the zone's slot whose window contains the local time, or None"""
+        hhmm = local.strftime('%H:%M')
+        for start, end, i in self.by_zone.get(zone, ()):
+            if start <= hhmm < end:
+                return i
+        return None
+
+
+def demand_matrix(bookings, table, first_day, days, tz):
+    """(slots × days) booking counts from (zone, window start) pairs; returns (matrix, unslotted)"""
+    rows, cols = [], []
+    unslotted = 0
+    for zone, when in bookings:
+        local = when.astimezone(tz)
+        day = (local.date() - first_day).days
+        slot = table.locate(zone, local)
+        if slot is None or not 0 <= day < days:
+            unslotted += 1
+            continue
+        rows.append(slot)
+        cols.append(day)
+    matrix = np.zeros((len(table.slots), days))
+    np.add.at(matrix, (np.asarray(rows, dtype=int), np.asarray(cols, dtype=int)), 1)
+    return matrix, unslotted
+
+
+# ============================================================
+# MODEL
+# ============================================================
+
+class Forecast:
+    """Per-series fit: weekday factors, smoothed level, chosen alpha and residual spread"""
+
+    def __init__(self, seasonal, level, alpha, sigma):
+        self.seasonal = seasonal
+        self.level = level
+        self.alpha = alpha
+        self.sigma = sigma
+
+    def weekday_forecast(self, confidence=DEFAULT_CONFIDENCE):
+        """(mean, lower, upper) arrays of shape (series × 7), Monday first"""
+        mean = self.level[:, None] * self.seasonal
+        # Counts are at least Poisson-noisy, however well the smoother tracked them
+        spread = np.sqrt(np.maximum(self.sigma[:, None] ** 2 * self.seasonal ** 2, mean))
+        z = NormalDist().inv_cdf(confidence)
+        return mean, np.maximum(mean - z * spread, 0), mean + z * spread
+
+
+def fit(matrix, first_weekday, alphas=ALPHAS):
+    """Fit every row of a (series × days) matrix at once; the time loop is the only Python loop
+
+    Demand is deseasonalized by weekday factors from the last SEASON_WEEKS weeks, then a
+    simple exponential smoother runs for all alphas × series in one array. Each series
+    keeps the alpha with the lowest one-step-ahead squared error after a two-week warm-up.
+    """
+    series, days = matrix.shape
+    weekday = (first_weekday + np.arange(days)) % 7
+    recent = np.arange(max(0, days - SEASON_WEEKS * 7), days)
+    overall = matrix[:, recent].mean(axis=1)
+    by_weekday = np.stack([matrix[:, recent[weekday[recent] == w]].mean(axis=1) if (weekday[recent] == w).any()
+                           else overall for w in range(7)], axis=1)
+    seasonal = (by_weekday + SEASONAL_PRIOR) / (overall[:, None] + SEASONAL_PRIOR)
+    deseasonalized = matrix / seasonal[:, weekday]
+
+    a = np.asarray(alphas)[:, None]
+    level = np.repeat(deseasonalized[:, :14].mean(axis=1)[None, :], len(alphas), axis=0)
+    sse = np.zeros((len(alphas), series))
+    tail = min(RESIDUAL_DAYS, days)
+    residuals = np.zeros((len(alphas), series, tail))
+    warmup = min(14, days - 1)
+    for t in range(days):
+        error = matrix[:, t] - level * seasonal[:, weekday[t]]
+        if t >= warmup:
+            sse += error ** 2
+        if t >= days - tail:
+            residuals[:, :, t - (days - tail)] = error / seasonal[:, weekday[t]]
+        level = a * deseasonalized[:, t] + (1 - a) * level
+
+    best = sse.argmin(axis=0)
+    columns = np.arange(series)
+    return Forecast(seasonal, level[best, columns], np.asarray(alphas)[best],
+                    residuals[best, columns].std(axis=1))
+
+
+# ============================================================
+# JOB
+# ============================================================
+
+class SlotForecastJob:
+    def __init__(self, db, tz, history_days=DEFAULT_HISTORY_DAYS, confidence=DEFAULT_CONFIDENCE):
+        self.db = db
+        self.tz = tz
+        self.history_days = history_days
+        self.confidence = confidence
+        self.counts = {}
+
+    def load_slots(self):
+        snaps = list(self.db.collection('config_delivery_slots').stream())
+        slots = [dict(s.to_dict(), id=s.id) for s in snaps]
+        return SlotTable(slots)
+
+    def load_bookings(self, since):
+        """(zone, preferredWindowStart) for every non-cancelled order and pickup since a date"""
+        bookings = []
+        for collection, address_field in SOURCES:
+            query = (self.db.collection(collection)
+                     .where(filter=FieldFilter('preferredWindowStart', '>=', since))
+                     .select(['preferredWindowStart', 'status', 'zone', address_field]))
+            count = unzoned = 0
+            for snap in query.stream():
+                doc = snap.to_dict()
+                if doc.get('status') in EXCLUDED_STATUSES or doc.get('preferredWindowStart') is None:
+                    continue
+                zone = zone_of(doc, address_field)
+                unzoned += zone == UNASSIGNED
+                bookings.append((zone, doc['preferredWindowStart']))
+                count += 1
+            self.counts[collection] = count
+            self.counts[f'{collection} without a zone'] = unzoned
+        return bookings
+
+    def run(self):
+        today = datetime.now(self.tz).date()
+        first_day = today - timedelta(days=self.history_days)
+        since = datetime.combine(first_day, datetime.min.time(), self.tz)
+
+        table = self.load_slots()
+        print(f"\n📦 Reading {self.history_days} days of bookings for {len(table.slots)} slot(s)...")
+        started = time.perf_counter()
+        bookings = self.load_bookings(since)
+        matrix, unslotted = demand_matrix(bookings, table, first_day, self.history_days, self.tz)
+        self.counts['outside any slot'] = unslotted
+        read_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        model = fit(matrix, first_day.weekday())
+        mean, lower, upper = model.weekday_forecast(self.confidence)
+        fit_seconds = time.perf_counter() - started
+        print(f"   ✓ Read {len(bookings)} bookings in {read_seconds:.1f}s, fitted {matrix.shape[0]} series "
+              f"in {fit_seconds * 1000:.0f} ms")
+        return table, matrix, model, (mean, lower, upper)
+
+    def documents(self, table, matrix, model, bands):
+        mean, lower, upper = bands
+        docs = []
+        for i, slot in enumerate(table.slots):
+            # A slot nothing was ever booked into has no demand to size it by, only a zero forecast
+            history = int(matrix[i].sum())
+            recommended = np.ceil(upper[i]).astype(int)
+            docs.append((slot['id'], {
+                'slotId': slot['id'],
+                'zone': slot['zone'],
+                'timeWindowStart': slot['timeWindowStart'],
+                'timeWindowEnd': slot['timeWindowEnd'],
+                'currentCapacity': slot.get('maxCapacity'),
+                'recommendedCapacity': max(1, int(recommended.max())) if history else None,
+                'confidence': self.confidence,
+                'byWeekday': {
+                    name: {
+                        'forecast': round(float(mean[i, w]), 2),
+                        'lower': round(float(lower[i, w]), 2),
+                        'upper': round(float(upper[i, w]), 2),
+                        'recommended': max(1, int(recommended[w])) if history else None,
+                    } for w, name in enumerate(WEEKDAYS)
+                },
+                'alpha': float(model.alpha[i]),
+                'residualStd': round(float(model.sigma[i]), 3),
+                'historyDays': self.history_days,
+                'historyBookings': history,
+                'generatedAt': firestore.SERVER_TIMESTAMP,
+            }))
+        return docs
+
+    def write(self, docs, apply=False):
+        for chunk in chunked(docs, MAX_BATCH_WRITES // 2):
+            batch = self.db.batch()
+            for slot_id, doc in chunk:
+                batch.set(self.db.collection(FORECAST_COLLECTION).document(slot_id), doc)
+                if apply and doc['recommendedCapacity'] not in (None, doc['currentCapacity']):
+                    batch.update(self.db.collection('config_delivery_slots').document(slot_id), {
+                        'maxCapacity': doc['recommendedCapacity'],
+                        'updatedAt': firestore.SERVER_TIMESTAMP,
+                    })
+            batch.commit()
+
+
+def benchmark(series, days):
+    """Fit synthetic Poisson demand with weekly seasonality; returns fit seconds"""
+    rng = np.random.default_rng(7)
+    base = rng.uniform(2, 30, size=(series, 1))
+    weekly = rng.uniform(0.6, 1.4, size=(series, 7))
+    trend = np.linspace(0.8, 1.2, days)[None, :]
+    rate = base * weekly[:, np.arange(days) % 7] * trend
+    matrix = rng.poisson(rate).astype(float)
+    started = time.perf_counter()
+    model = fit(matrix, 0)
+    model.weekday_forecast()
+    return time.perf_counter() - started
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--days', type=int, default=DEFAULT_HISTORY_DAYS,
+                        help=f'days of history to fit (default {DEFAULT_HISTORY_DAYS})')
+    parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE,
+                        help=f'upper band the capacity is sized to (default {DEFAULT_CONFIDENCE})')
+    parser.add_argument('--tz', default=DEFAULT_TIMEZONE, help=f'timezone of slot windows (default {DEFAULT_TIMEZONE})')
+    parser.add_argument('--apply', action='store_true', help='also set maxCapacity on config_delivery_slots')
+    parser.add_argument('--dry-run', action='store_true', help='print the recommendations without writing')
+    parser.add_argument('--benchmark', type=int, metavar='SERIES',
+                        help='time the fit on SERIES synthetic series of --days days, then exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        seconds = benchmark(args.benchmark, args.days)
+        print(f"⏱️  Fitted {args.benchmark} series × {args.days} days in {seconds * 1000:.0f} ms")
+        return
+
+    print("📈 Oil Manager delivery-slot forecast")
+    job = SlotForecastJob(sync_client(args=args), ZoneInfo(args.tz), args.days, args.confidence)
+    table, matrix, model, bands = job.run()
+    docs = job.documents(table, matrix, model, bands)
+
+    print(f"\n🚚 Recommended capacity (p{args.confidence * 100:g} of daily demand):")
+    for _, doc in docs:
+        if doc['recommendedCapacity'] is None:
+            print(f"   {doc['zone']:<18} {doc['timeWindowStart']}-{doc['timeWindowEnd']}  "
+                  f"{doc['currentCapacity']!s:>4} → kept (no booking history)")
+            continue
+        peak = max(doc['byWeekday'].items(), key=lambda kv: kv[1]['forecast'])[0]
+        print(f"   {doc['zone']:<18} {doc['timeWindowStart']}-{doc['timeWindowEnd']}  "
+              f"{doc['currentCapacity']!s:>4} → {doc['recommendedCapacity']:<4} (peak {peak}, "
+              f"{doc['historyBookings']} bookings)")
+    for name, count in job.counts.items():
+        print(f"   • {name}: {count}")
+
+    if not args.dry_run:
+        job.write(docs, apply=args.apply)
+        print(f"\n✅ {len(docs)} forecast(s) written to {FORECAST_COLLECTION}"
+              f"{' and applied to config_delivery_slots' if args.apply else ''}")
+
+
+if __name__ == '__main__':
+    main()
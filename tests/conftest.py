@@ -0,0 +1,9 @@
+"""
+Shared setup for the Oil Manager Python job tests
+The jobs are top-level scripts, so the repository root goes on sys.path
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
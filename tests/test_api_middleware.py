@@ -0,0 +1,52 @@
+"""
+Tests for api_middleware.py request parsing
+"""
+
+import asyncio
+
+import pytest
+
+from api_middleware import MAX_BODY_BYTES, HttpError, Principal, read_request
+
+
+def parse(raw):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await read_request(reader)
+    return asyncio.run(run())
+
+
+def request_with_length(length, body=b''):
+    return b'POST /v1/orders HTTP/1.1\r\nHost: x\r\nContent-Length: ' + length + b'\r\n\r\n' + body
+
+
+def test_body_is_read_to_content_length():
+    request = parse(request_with_length(b'7', b'{"a":1}'))
+    assert request.method == 'POST'
+    assert request.body == b'{"a":1}'
+
+
+def test_missing_content_length_means_empty_body():
+    request = parse(b'GET /v1/health HTTP/1.1\r\nHost: x\r\n\r\n')
+    assert request.body == b''
+
+
+@pytest.mark.parametrize('length', [b'abc', b'-5', b'1.5'])
+def test_malformed_content_length_is_a_400(length):
+    with pytest.raises(HttpError) as e:
+        parse(request_with_length(length))
+    assert e.value.status == 400
+
+
+def test_oversized_body_is_a_413():
+    with pytest.raises(HttpError) as e:
+        parse(request_with_length(str(MAX_BODY_BYTES + 1).encode()))
+    assert e.value.status == 413
+
+
+def test_customer_type_follows_role():
+    assert Principal('u1', {'role': 'customer_b2b_admin'}).customer_type == 'B2B'
+    assert Principal('u2', {'role': 'customer_b2c'}).customer_type == 'B2C'
+    assert Principal('u3', {}).customer_type == 'B2C'
@@ -0,0 +1,111 @@
+"""
+Tests for approval_inbox_fanout.py inbox rendering and listener resync
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from approval_inbox_fanout import UNASSIGNED_INBOX, InboxFanout, inbox_ids, render_inbox
+
+NOW = datetime(2026, 3, 1, 12, tzinfo=timezone.utc)
+
+
+class Snap:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = {}
+
+    def set(self, ref, data):
+        self.writes[ref] = data
+
+    def commit(self):
+        if self.db.failures:
+            self.db.failures -= 1
+            raise RuntimeError('unavailable')
+        self.db.docs.update(self.writes)
+
+
+class Db:
+    def __init__(self, failures=0):
+        self.docs = {}
+        self.failures = failures
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return doc_id
+
+    def batch(self):
+        return Batch(self)
+
+
+def request(assigned_to=None, role=None, **fields):
+    doc = {'status': 'pending', 'assignedTo': assigned_to, 'assignedToRole': role, 'priority': 'medium',
+           'requestedAt': NOW - timedelta(hours=1)}
+    doc.update(fields)
+    return doc
+
+
+def test_inbox_ids():
+    assert inbox_ids(request('u1', 'finance_manager')) == ['u1', 'finance_manager']
+    assert inbox_ids(request()) == [UNASSIGNED_INBOX]
+
+
+def test_render_orders_by_priority_then_sla_and_counts_overdue():
+    items = [dict(request(priority='low'), id='a'),
+             dict(request(priority='urgent', slaDeadline=NOW + timedelta(hours=5)), id='b'),
+             dict(request(priority='urgent', slaDeadline=NOW - timedelta(hours=1)), id='c')]
+    doc, next_deadline = render_inbox('u1', items, NOW, max_items=2)
+    assert [item['id'] for item in doc['items']] == ['c', 'b']
+    assert doc['pendingCount'] == 3 and doc['truncated'] and doc['overdueCount'] == 1
+    assert next_deadline == NOW + timedelta(hours=5)
+
+
+def test_decided_request_leaves_its_inboxes():
+    fanout = InboxFanout(Db())
+    fanout.apply('r1', request('u1', 'ops'))
+    fanout.apply('r1', request('u1', 'ops', status='approved'))
+    fanout.flush(NOW)
+    assert fanout.db.docs['u1']['pendingCount'] == 0
+    assert fanout.db.docs['ops']['pendingCount'] == 0
+
+
+def test_restart_drops_requests_decided_during_the_outage():
+    db = Db()
+    fanout = InboxFanout(db)
+    fanout._resync = True
+    fanout.on_snapshot([Snap('r1', request('u1')), Snap('r2', request('u2'))], [], NOW)
+    fanout.flush(NOW)
+    assert db.docs['u1']['pendingCount'] == 1 and db.docs['u2']['pendingCount'] == 1
+
+    # r1 was approved while the listener was down; the new listener's first snapshot no longer has it
+    fanout._resync = True
+    fanout.on_snapshot([Snap('r2', request('u2')), Snap('r3', request('u2'))], [], NOW)
+    assert set(fanout.requests) == {'r2', 'r3'}
+    fanout.flush(NOW)
+    assert db.docs['u1']['pendingCount'] == 0
+    assert db.docs['u2']['pendingCount'] == 2
+    assert 'u1' not in fanout.members
+
+
+def test_failed_commit_leaves_the_inboxes_dirty():
+    db = Db(failures=1)
+    fanout = InboxFanout(db)
+    fanout.apply('r1', request('u1', 'ops'))
+    with pytest.raises(RuntimeError):
+        fanout.flush(NOW)
+    assert fanout.dirty == {'u1', 'ops'} and db.docs == {}
+    assert fanout.flush(NOW) == 2
+    assert db.docs['u1']['pendingCount'] == 1 and db.docs['ops']['pendingCount'] == 1
+    assert fanout.flush(NOW) == 0
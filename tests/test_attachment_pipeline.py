@@ -0,0 +1,85 @@
+"""
+Tests for attachment_pipeline.py near-duplicate index, hashing and object naming
+"""
+
+import io
+import random
+
+import numpy as np
+from PIL import Image
+
+from attachment_pipeline import HashIndex, attachment_key, parse_name, perceptual_hash, render
+
+
+def flip(value, *bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_match_finds_hashes_within_distance():
+    index = HashIndex(distance=6)
+    base = 0x9F3A_5C71_0E2B_D846
+    index.add(base, ('a1', 'jobs/j1'))
+    assert index.match(base) == (0, 'a1')
+    assert index.match(flip(base, 0, 9, 18, 27, 36, 45)) == (6, 'a1')
+    assert index.match(flip(base, 0, 9, 18, 27, 36, 45, 54)) is None
+
+
+def test_match_prefers_the_closest_hash():
+    index = HashIndex(distance=6)
+    base = 0x0123_4567_89AB_CDEF
+    index.add(flip(base, 1, 2, 3), ('far', 'jobs/j1'))
+    index.add(flip(base, 4), ('near', 'jobs/j2'))
+    assert index.match(base) == (1, 'near')
+
+
+def test_match_ignores_photos_of_the_same_owner():
+    index = HashIndex()
+    index.add(42, ('a1', 'jobs/j1'))
+    assert index.match(42, owner='jobs/j1') is None
+    assert index.match(42, owner='jobs/j2') == (0, 'a1')
+
+
+def test_banding_never_misses_a_match_within_distance():
+    rng = random.Random(3)
+    index = HashIndex(distance=6)
+    stored = [rng.getrandbits(64) for _ in range(200)]
+    for n, value in enumerate(stored):
+        index.add(value, (f'a{n}', f'owner{n}'))
+    for n, value in enumerate(stored):
+        probe = flip(value, *rng.sample(range(64), rng.randint(0, 6)))
+        found = index.match(probe)
+        assert found is not None and found[0] <= 6
+
+
+def photo(size=(640, 480), seed=0):
+    """Smooth colour blocks, like a scene rather than noise"""
+    blocks = np.random.default_rng(seed).integers(0, 256, (6, 8, 3)).astype(np.uint8)
+    return Image.fromarray(blocks).resize(size, Image.Resampling.BICUBIC)
+
+
+def test_perceptual_hash_survives_resizing_but_not_a_different_picture():
+    image = photo()
+    resized = image.resize((320, 240))
+    other = photo(seed=1)
+    assert bin(perceptual_hash(image) ^ perceptual_hash(resized)).count('1') <= 6
+    assert bin(perceptual_hash(image) ^ perceptual_hash(other)).count('1') > 6
+
+
+def test_render_makes_bounded_variants_and_reports_bad_input():
+    out = io.BytesIO()
+    photo((2000, 1500)).save(out, 'JPEG')
+    result = render(out.getvalue())
+    assert (result['width'], result['height']) == (2000, 1500)
+    assert result['variants']['thumb'][1:] == (256, 192)
+    assert result['variants']['web'][1:] == (1280, 960)
+    assert 'error' in render(b'not an image')
+
+
+def test_parse_name_accepts_only_known_layouts():
+    assert parse_name('attachments/jobs/j1/POD_PHOTO/a.jpg') == ('jobs', 'j1', 'POD_PHOTO')
+    assert parse_name('attachments/jobs/j1/POD_PHOTO/a.txt') is None
+    assert parse_name('attachments/jobs/j1/OTHER/a.jpg') is None
+    assert parse_name('variants/jobs/j1/POD_PHOTO/a.jpg') is None
+    assert attachment_key('attachments/jobs/j1/POD_PHOTO/a.jpg') != attachment_key('attachments/jobs/j1/POD_PHOTO/b.jpg')
@@ -0,0 +1,117 @@
+"""
+Tests for audit_writer.py WAL recovery and compaction
+"""
+
+import os
+import time
+
+import pytest
+
+import audit_writer
+from audit_writer import AUDIT_COLLECTION, AuditWriter, audit_entry, read_wal
+
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref, data))
+
+    def commit(self):
+        if self.db.failing:
+            raise RuntimeError('unavailable')
+        self.db.docs.update(self.writes)
+
+
+class Db:
+    """Records committed audit_log documents by ID; commits fail while failing is set"""
+
+    def __init__(self, failing=False):
+        self.failing = failing
+        self.docs = {}
+
+    def batch(self):
+        return Batch(self)
+
+    def collection(self, name):
+        assert name == AUDIT_COLLECTION
+
+        class Collection:
+            def document(self, doc_id):
+                return doc_id
+        return Collection()
+
+
+@pytest.fixture(autouse=True)
+def quick_retries(monkeypatch):
+    monkeypatch.setattr(audit_writer, 'RETRY_DELAY', 0.01)
+
+
+def entries(n):
+    return [audit_entry(f'wf{i}', 'sales_order', f'o{i}', 'status_changed', 'tester') for i in range(n)]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_uncommitted_entries_are_recovered_with_their_ids(tmp_path):
+    path = str(tmp_path / 'audit.wal')
+    writer = AuditWriter(Db(failing=True), wal_path=path, max_delay=60)
+    ids = writer.extend(entries(3))
+    assert writer.close(timeout=0.1) is False
+    with open(path, 'a', encoding='utf-8') as fh:
+        fh.write('{"id": "torn')
+    db = Db()
+    with AuditWriter(db, wal_path=path) as recovered:
+        assert recovered.depth == 3
+    assert sorted(db.docs) == sorted(ids)
+    assert db.docs[ids[0]]['workflowInstanceId'] == 'wf0'
+    assert read_wal(path) == []
+
+
+def test_second_writer_on_the_same_wal_is_refused(tmp_path):
+    path = str(tmp_path / 'audit.wal')
+    with AuditWriter(Db(), wal_path=path):
+        with pytest.raises(RuntimeError):
+            AuditWriter(Db(), wal_path=path)
+
+
+def test_compaction_replaces_the_wal_with_the_uncommitted_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(audit_writer, 'MAX_WAL_BYTES', 0)
+    path = str(tmp_path / 'audit.wal')
+    db = Db()
+    writer = AuditWriter(db, wal_path=path, max_batch=2, max_delay=60)
+    before = os.stat(path).st_ino
+    ids = writer.extend(entries(3))
+    wait_for(lambda: writer.stats()['flushed'] == 2)
+    assert [doc_id for doc_id, _ in read_wal(path)] == ids[2:]
+    assert os.stat(path).st_ino != before
+    assert not os.path.exists(path + '.compact')
+    # The replacement is locked too, and later entries are appended to it
+    with pytest.raises(RuntimeError):
+        AuditWriter(Db(), wal_path=path)
+    writer.append(entries(1)[0])
+    assert len(read_wal(path)) == 2
+    assert writer.close() is True
+    assert len(db.docs) == 4 and read_wal(path) == []
+
+
+def test_failed_compaction_keeps_the_old_wal(tmp_path, monkeypatch):
+    monkeypatch.setattr(audit_writer, 'MAX_WAL_BYTES', 0)
+
+    def fail(*args):
+        raise OSError('disk full')
+    monkeypatch.setattr(audit_writer.os, 'replace', fail)
+    path = str(tmp_path / 'audit.wal')
+    writer = AuditWriter(Db(), wal_path=path, max_batch=2, max_delay=60)
+    ids = writer.extend(entries(3))
+    wait_for(lambda: writer.stats()['flushed'] == 2)
+    assert [doc_id for doc_id, _ in read_wal(path)] == ids
+    assert not os.path.exists(path + '.compact')
+    writer.close()
@@ -0,0 +1,118 @@
+"""
+Tests for change_bus.py snapshot handling, durable watermarks and socket acknowledgements
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from change_bus import BusClient, ChangeBus, serve_socket
+
+T0 = datetime(2026, 3, 1, 8, tzinfo=timezone.utc)
+
+
+class Kind:
+    def __init__(self, name):
+        self.name = name
+
+
+class Snap:
+    def __init__(self, doc_id, minutes, **data):
+        self.id = doc_id
+        self.update_time = T0 + timedelta(minutes=minutes)
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class Change:
+    def __init__(self, kind, snap):
+        self.type = Kind(kind)
+        self.document = snap
+
+
+def snapshot(bus, *snaps, collection='sales_orders'):
+    bus._on_snapshot(collection, list(snaps), [Change('ADDED', s) for s in snaps], T0 + timedelta(hours=1))
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_events_are_published_in_update_order_and_saved(tmp_path):
+    state = str(tmp_path / 'state.json')
+    bus = ChangeBus(db=None, collections=['sales_orders'], state_path=state)
+    sub = bus.subscribe('reader')
+    snapshot(bus, Snap('o2', 5), Snap('o1', 1))
+    events = sub.poll(timeout=0)
+    assert [(e.seq, e.doc_id, e.initial) for e in events] == [(0, 'o1', True), (1, 'o2', True)]
+    bus.save()
+    restarted = ChangeBus(db=None, collections=['sales_orders'], state_path=state)
+    assert restarted.known['sales_orders'] == {'o1', 'o2'}
+
+
+def test_documents_deleted_while_offline_are_removed_on_reconnect(tmp_path):
+    state = str(tmp_path / 'state.json')
+    bus = ChangeBus(db=None, collections=['sales_orders'], state_path=state)
+    snapshot(bus, Snap('o1', 1), Snap('o2', 2))
+    bus.save()
+    bus = ChangeBus(db=None, collections=['sales_orders'], state_path=state)
+    sub = bus.subscribe('reader')
+    snapshot(bus, Snap('o1', 1))
+    assert [(e.type, e.doc_id) for e in sub.poll(timeout=0)] == [('ADDED', 'o1'), ('REMOVED', 'o2')]
+
+
+def test_durable_consumers_skip_what_they_committed(tmp_path):
+    state = str(tmp_path / 'state.json')
+    bus = ChangeBus(db=None, collections=['sales_orders'], state_path=state)
+    sub = bus.subscribe('worker', durable=True)
+    snapshot(bus, Snap('o1', 1), Snap('o2', 2))
+    sub.commit(sub.poll(timeout=0)[:1])
+    bus.save()
+    bus = ChangeBus(db=None, collections=['sales_orders'], state_path=state)
+    sub = bus.subscribe('worker', durable=True)
+    snapshot(bus, Snap('o1', 1), Snap('o2', 2))
+    assert [e.doc_id for e in sub.poll(timeout=0)] == ['o2']
+
+
+def test_save_is_safe_while_listeners_publish(tmp_path):
+    bus = ChangeBus(db=None, collections=['sales_orders'], state_path=str(tmp_path / 'state.json'), capacity=10 ** 6)
+    done = threading.Event()
+
+    def listener():
+        for i in range(300):
+            snapshot(bus, *(Snap(f'o{j}', j) for j in range(i % 50)))
+        done.set()
+    thread = threading.Thread(target=listener)
+    thread.start()
+    while not done.is_set():
+        bus.save()
+    thread.join()
+    bus.save()
+    assert not bus._dirty
+
+
+def test_socket_consumers_commit_only_what_they_acknowledge(tmp_path):
+    bus = ChangeBus(db=None, collections=['sales_orders'], state_path=None)
+    server = serve_socket(bus, str(tmp_path / 'bus.sock'))
+    try:
+        snapshot(bus, Snap('o1', 1), Snap('o2', 2), Snap('o3', 3))
+        stop = threading.Event()
+        with BusClient(str(tmp_path / 'bus.sock'), 'worker', durable=True) as client:
+            events = client.events(stop)
+            received = [next(events) for _ in range(3)]
+            assert [e.doc_id for e in received] == ['o1', 'o2', 'o3']
+            time.sleep(0.1)
+            assert bus.watermark('worker', 'sales_orders') is None
+            client.ack(received[:2])
+            wait_for(lambda: bus.watermark('worker', 'sales_orders') == T0 + timedelta(minutes=2))
+            stop.set()
+        wait_for(lambda: not bus.subscriptions)
+        assert bus.watermark('worker', 'sales_orders') == T0 + timedelta(minutes=2)
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,162 @@
+"""
+Tests for config_cache.py invalidation: listener snapshots, TTL re-reads and forced refreshes
+"""
+
+import pytest
+
+import config_cache
+from config_cache import ConfigCache
+
+SETTINGS = 'config_system_settings'
+INCENTIVES = 'config_uco_incentives'
+
+
+class Snap:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class Watch:
+    def __init__(self):
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+
+
+class Collection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def stream(self):
+        self.db.queries.append(self.name)
+        if self.db.unavailable:
+            raise RuntimeError('unavailable')
+        return [Snap(doc_id, data) for doc_id, data in self.db.data[self.name].items()]
+
+    def on_snapshot(self, callback):
+        watch = Watch()
+        self.db.listeners[self.name] = (callback, watch)
+        callback(self.stream(), [], None)
+        return watch
+
+
+class Db:
+    """Config collections in memory; push() delivers a snapshot to the collection's listener"""
+
+    def __init__(self, data):
+        self.data = data
+        self.unavailable = False
+        self.listeners = {}
+        self.queries = []
+
+    def collection(self, name):
+        return Collection(self, name)
+
+    def push(self, name, docs):
+        self.data[name] = docs
+        callback, _ = self.listeners[name]
+        callback(self.collection(name).stream(), [], None)
+
+
+def setting(key, value):
+    return {'key': key, 'valueNumber': value}
+
+
+def config():
+    return {
+        SETTINGS: {'s1': setting('SLA_DEFAULT_HOURS', 24)},
+        INCENTIVES: {'i1': {'zone': 'north', 'customerType': 'restaurant', 'minQty': 0, 'rate': 1.0}},
+    }
+
+
+def cache(db, **kwargs):
+    changed = []
+    return ConfigCache(db, collections=(SETTINGS, INCENTIVES), on_change=changed.append, **kwargs).load(), changed
+
+
+def expire(entry, ttl):
+    entry.synced_at -= ttl + 1
+
+
+def test_listener_snapshots_replace_documents_and_indexes():
+    db = Db(config())
+    cached, changed = cache(db)
+    assert cached.get_setting('SLA_DEFAULT_HOURS') == 24
+    db.push(SETTINGS, {'s1': setting('SLA_DEFAULT_HOURS', 48), 's2': setting('MAX_DRIVERS', 9)})
+    db.push(INCENTIVES, {})
+    assert cached.get_setting('SLA_DEFAULT_HOURS') == 48 and cached.get_setting('MAX_DRIVERS') == 9
+    assert cached.incentive_for('north', 'restaurant') is None
+    assert changed == [SETTINGS, INCENTIVES, SETTINGS, INCENTIVES]
+
+
+def test_live_listeners_never_expire():
+    db = Db(config())
+    cached, _ = cache(db, ttl=0)
+    queries = len(db.queries)
+    expire(cached._entries[SETTINGS], 0)
+    assert cached.get_setting('SLA_DEFAULT_HOURS') == 24
+    assert len(db.queries) == queries
+    assert cached.stats()[SETTINGS]['lookups'] == {'hit': 1, 'miss': 0, 'stale': 0}
+
+
+def test_without_listeners_a_lookup_past_the_ttl_rereads():
+    db = Db(config())
+    cached, changed = cache(db, ttl=60, listen=False)
+    db.data[SETTINGS] = {'s1': setting('SLA_DEFAULT_HOURS', 36)}
+    assert cached.get_setting('SLA_DEFAULT_HOURS') == 24
+    expire(cached._entries[SETTINGS], 60)
+    assert cached.get_setting('SLA_DEFAULT_HOURS') == 36
+    stats = cached.stats()[SETTINGS]
+    assert stats['refreshes'] == {'load': 1, 'listener': 0, 'ttl': 1}
+    assert stats['lookups'] == {'hit': 1, 'miss': 1, 'stale': 0}
+    assert changed.count(SETTINGS) == 2
+
+
+def test_a_dropped_listener_is_restarted_by_the_ttl_reread():
+    db = Db(config())
+    cached, _ = cache(db, ttl=60)
+    entry = cached._entries[SETTINGS]
+    db.listeners[SETTINGS][1].is_active = False
+    expire(entry, 60)
+    db.data[SETTINGS] = {'s1': setting('SLA_DEFAULT_HOURS', 12)}
+    assert cached.get_setting('SLA_DEFAULT_HOURS') == 12
+    assert entry.listening and entry.refreshes['ttl'] == 1
+
+
+def test_failed_reread_serves_the_cached_copy():
+    db = Db(config())
+    cached, _ = cache(db, ttl=60, listen=False)
+    expire(cached._entries[SETTINGS], 60)
+    db.unavailable = True
+    assert cached.get_setting('SLA_DEFAULT_HOURS') == 24
+    assert cached.stats()[SETTINGS]['lookups']['stale'] == 1
+    assert cached.stats()[SETTINGS]['staleness'] > 60
+
+
+def test_refresh_forces_a_reread():
+    db = Db(config())
+    cached, changed = cache(db)
+    db.data[INCENTIVES]['i2'] = {'zone': 'north', 'customerType': 'restaurant', 'minQty': 50, 'rate': 1.5}
+    assert cached.incentive_for('north', 'restaurant', quantity=80)['rate'] == 1.0
+    cached.refresh(INCENTIVES)
+    assert cached.incentive_for('north', 'restaurant', quantity=80)['rate'] == 1.5
+    assert changed[-1] == INCENTIVES
+    with pytest.raises(KeyError):
+        cached.documents('config_products')
+
+
+def test_init_cache_closes_the_previous_cache(monkeypatch):
+    monkeypatch.setattr(config_cache, '_cache', None)
+    first = Db(config())
+    config_cache.init_cache(first, collections=(SETTINGS,))
+    second = Db(config())
+    second.data[SETTINGS] = {'s1': setting('SLA_DEFAULT_HOURS', 72)}
+    config_cache.init_cache(second, collections=(SETTINGS,))
+    assert not first.listeners[SETTINGS][1].is_active
+    assert config_cache.get_setting('SLA_DEFAULT_HOURS') == 72
@@ -0,0 +1,66 @@
+"""
+Tests for credit_exposure.py order facts, ledger deltas and the credit check
+"""
+
+from credit_exposure import credit_check, fact_delta, ledger_entry, ledger_facts, order_facts
+
+
+def credit_order(status, amount=1000.0, account='acct1', method='Credit', customer_type='B2B'):
+    return {'customerAccountId': account, 'customerType': customer_type, 'paymentMethod': method,
+            'status': status, 'totalAmount': amount}
+
+
+def test_open_and_receivable_orders_are_exposure():
+    assert order_facts(credit_order('Confirmed')) == (
+        'acct1', {'openOrders': 1000.0, 'openOrderCount': 1, 'exposure': 1000.0})
+    assert order_facts(credit_order('Invoiced')) == (
+        'acct1', {'receivable': 1000.0, 'receivableCount': 1, 'exposure': 1000.0})
+
+
+def test_paid_cash_and_b2c_orders_are_not_exposure():
+    assert order_facts(credit_order('Completed')) == (None, {})
+    assert order_facts(credit_order('Confirmed', method='COD')) == (None, {})
+    assert order_facts(credit_order('Confirmed', method=None)) == (None, {})
+    assert order_facts(credit_order('Confirmed', customer_type='B2C')) == (None, {})
+
+
+def test_delivery_moves_the_amount_from_open_to_receivable():
+    old_account, old = order_facts(credit_order('OutForDelivery'))
+    new_account, new = order_facts(credit_order('Delivered'))
+    assert fact_delta(old_account, old, new_account, new) == {'acct1': {
+        'openOrders': -1000.0, 'openOrderCount': -1, 'receivable': 1000.0, 'receivableCount': 1}}
+
+
+def test_reassigned_order_moves_between_accounts():
+    old_account, old = order_facts(credit_order('Confirmed', account='acct1'))
+    new_account, new = order_facts(credit_order('Confirmed', account='acct2'))
+    delta = fact_delta(old_account, old, new_account, new)
+    assert delta['acct1'] == {'openOrders': -1000.0, 'openOrderCount': -1, 'exposure': -1000.0}
+    assert delta['acct2'] == {'openOrders': 1000.0, 'openOrderCount': 1, 'exposure': 1000.0}
+
+
+def test_unchanged_facts_produce_no_delta():
+    account, facts = order_facts(credit_order('Confirmed'))
+    assert fact_delta(account, facts, account, dict(facts)) == {}
+    assert fact_delta(None, {}, None, {}) == {}
+
+
+def test_credit_check_against_the_limit():
+    exposure = {'customerAccountId': 'acct1', 'creditLimit': 5000, 'exposure': 4000}
+    assert credit_check(exposure, 1000)['exceeds'] is False
+    check = credit_check(exposure, 1000.02)
+    assert check['exceeds'] is True and check['available'] == 1000.0
+
+
+def test_account_without_a_limit_has_no_credit():
+    assert credit_check(None, 1)['exceeds'] is True
+    assert credit_check({'exposure': 0}, 0)['exceeds'] is False
+
+
+def test_ledger_round_trip_keyed_by_account():
+    account, facts = order_facts(credit_order('Invoiced'))
+    entry = ledger_entry('sales_orders', 'o1', account, facts)
+    assert entry['customerAccountId'] == 'acct1' and 'day' not in entry
+    assert ledger_facts(entry) == ('acct1', facts)
+    assert ledger_facts(None) == (None, {})
+    assert ledger_facts({'customerAccountId': 'acct1', 'facts': facts}) == ('acct1', facts)
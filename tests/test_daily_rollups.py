@@ -0,0 +1,83 @@
+"""
+Tests for daily_rollups.py order facts and the ledger deltas that keep rollups incremental
+"""
+
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from daily_rollups import fact_delta, ledger_entry, ledger_facts, nest, order_facts, pack_litres
+
+BANGKOK = ZoneInfo('Asia/Bangkok')
+LITRES = {'OIL-PREM-5L': 5.0}
+
+
+def delivered(created_at, total=500.0, qty=2, status='Delivered'):
+    order = {'status': status, 'createdAt': created_at, 'totalAmount': total,
+             'deliveryAddress': {'lat': 13.7563, 'lng': 100.5018}}
+    return order, [{'sku': 'OIL-PREM-5L', 'qty': qty, 'lineTotal': total}]
+
+
+def test_order_facts_count_on_the_local_day():
+    order, lines = delivered(datetime(2026, 3, 1, 18, tzinfo=timezone.utc))
+    day, facts = order_facts(order, lines, LITRES, BANGKOK)
+    assert day == '2026-03-02'
+    assert facts[('totals', 'orders')] == 1
+    assert facts[('totals', 'litresSold')] == 10.0
+    assert facts[('byZone', 'Bangkok Central', 'revenue')] == 500.0
+    assert facts[('bySku', 'OIL-PREM-5L', 'qty')] == 2
+
+
+def test_undelivered_orders_contribute_nothing():
+    order, lines = delivered(datetime(2026, 3, 1, tzinfo=timezone.utc), status='Confirmed')
+    assert order_facts(order, lines, LITRES, BANGKOK) == (None, {})
+
+
+def test_delta_of_a_changed_order_on_the_same_day():
+    old = {('totals', 'revenue'): 500.0, ('totals', 'orders'): 1}
+    new = {('totals', 'revenue'): 650.0, ('totals', 'orders'): 1}
+    assert fact_delta('2026-03-01', old, '2026-03-01', new) == {'2026-03-01': {('totals', 'revenue'): 150.0}}
+
+
+def test_delta_moves_the_contribution_between_days():
+    facts = {('totals', 'orders'): 1, ('totals', 'revenue'): 500.0}
+    assert fact_delta('2026-03-01', facts, '2026-03-02', facts) == {
+        '2026-03-01': {('totals', 'orders'): -1, ('totals', 'revenue'): -500.0},
+        '2026-03-02': {('totals', 'orders'): 1, ('totals', 'revenue'): 500.0},
+    }
+
+
+def test_delta_retracts_and_first_contributes():
+    facts = {('totals', 'orders'): 1}
+    assert fact_delta('2026-03-01', facts, None, {}) == {'2026-03-01': {('totals', 'orders'): -1}}
+    assert fact_delta(None, {}, '2026-03-01', facts) == {'2026-03-01': {('totals', 'orders'): 1}}
+
+
+def test_delta_drops_float_noise_and_unchanged_documents():
+    old = {('totals', 'revenue'): 0.1 + 0.2}
+    new = {('totals', 'revenue'): 0.3}
+    assert fact_delta('2026-03-01', old, '2026-03-01', new) == {}
+
+
+def test_replaying_deltas_reproduces_the_final_facts():
+    versions = [(None, {}),
+                ('2026-03-01', {('totals', 'revenue'): 100.0, ('byZone', 'A', 'revenue'): 100.0}),
+                ('2026-03-01', {('totals', 'revenue'): 120.0, ('byZone', 'B', 'revenue'): 120.0}),
+                ('2026-03-02', {('totals', 'revenue'): 120.0, ('byZone', 'B', 'revenue'): 120.0})]
+    totals = {}
+    for (old_day, old), (new_day, new) in zip(versions, versions[1:]):
+        for day, changes in fact_delta(old_day, old, new_day, new).items():
+            for path, change in changes.items():
+                totals[(day, path)] = round(totals.get((day, path), 0) + change, 6)
+    assert {k: v for k, v in totals.items() if v} == {
+        ('2026-03-02', ('totals', 'revenue')): 120.0, ('2026-03-02', ('byZone', 'B', 'revenue')): 120.0}
+
+
+def test_ledger_round_trip_and_nesting():
+    facts = {('byZone', 'North', 'revenue'): 5.0, ('totals', 'orders'): 1}
+    assert ledger_facts(ledger_entry('sales_orders', 'o1', '2026-03-01', facts)) == ('2026-03-01', facts)
+    assert nest(facts) == {'byZone': {'North': {'revenue': 5.0}}, 'totals': {'orders': 1}}
+
+
+def test_pack_litres_from_sku_or_name():
+    assert pack_litres({'sku': 'OIL-PREM-5L'}) == 5.0
+    assert pack_litres({'sku': 'X', 'name': '18L Tin'}) == 18.0
@@ -0,0 +1,125 @@
+"""
+Tests for driver_assignment.py solver capacity and slot limits, and the conflict path of write()
+"""
+
+import pytest
+from google.api_core.exceptions import FailedPrecondition, NotFound, ServiceUnavailable
+
+from driver_assignment import AssignmentJob, AssignmentSolver, Fleet, Pickups
+
+LAT, LNG = 13.75, 100.50
+# About 1.1 km per 0.01 degree at Bangkok's latitude
+KM = 0.009
+
+
+def fleet(offsets, capacity, load=None, max_jobs=12):
+    n = len(offsets)
+    return Fleet([f'd{i}' for i in range(n)], [f'v{i}' for i in range(n)], [LAT] * n,
+                 [LNG + km * KM for km in offsets], capacity, load or [0] * n, max_jobs)
+
+
+def pickups(qty, offset=0.0):
+    n = len(qty)
+    return Pickups([f'p{i}' for i in range(n)], [LAT] * n, [LNG + offset * KM] * n, qty,
+                   [0.0] * n, [3600.0] * n)
+
+
+def test_overflowing_picks_are_bumped_to_the_next_driver():
+    # Both 60 L pickups fit d0 one at a time but not together; the second moves to d1
+    solver = AssignmentSolver(fleet([0, 6], [100, 100]), pickups([60, 60]))
+    assigned = solver.solve()
+    assert sorted(driver for driver, _ in assigned.values()) == [0, 1]
+    assert solver.stats['bumped'] == 1 and solver.stats['rounds'] == 2
+
+
+def test_capacity_is_cumulative_per_vehicle():
+    solver = AssignmentSolver(fleet([0], [100]), pickups([40, 40, 40]))
+    assigned = solver.solve()
+    assert len(assigned) == 2
+    assert sum(solver.pickups.qty[row] for row in assigned) <= 100
+
+
+def test_slot_cap_counts_jobs_already_on_the_route():
+    assert len(AssignmentSolver(fleet([0], [1000], max_jobs=2), pickups([10] * 5)).solve()) == 2
+    assert len(AssignmentSolver(fleet([0], [1000], load=[1], max_jobs=2), pickups([10] * 5)).solve()) == 1
+    assert AssignmentSolver(fleet([0], [1000], load=[2], max_jobs=2), pickups([10] * 5)).solve() == {}
+
+
+def test_pickups_beyond_reach_or_capacity_stay_unassigned():
+    assert AssignmentSolver(fleet([0], [1000]), pickups([10], offset=50), max_km=40).solve() == {}
+    assert AssignmentSolver(fleet([0], [50]), pickups([60])).solve() == {}
+
+
+# ==================== WRITE ====================
+
+class Ref:
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+
+class Snap:
+    def __init__(self, doc_id):
+        self.reference = Ref(doc_id)
+        self.update_time = 1
+
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+        self.pickups = []
+
+    def set(self, ref, data):
+        pass
+
+    def update(self, ref, data, option=None):
+        self.pickups.append(ref.id)
+
+    def commit(self):
+        self.db.commits += 1
+        for pickup_id in self.pickups:
+            if pickup_id in self.db.failures:
+                raise self.db.failures[pickup_id]
+        self.db.written.extend(self.pickups)
+
+
+class Db:
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.written = []
+        self.commits = 0
+
+    def batch(self):
+        return Batch(self)
+
+    def collection(self, name):
+        class Collection:
+            def document(self, doc_id=None):
+                return Ref(doc_id or 'job')
+        return Collection()
+
+    def write_option(self, **kwargs):
+        return kwargs
+
+
+class Cache:
+    def get_setting(self, key, default=None):
+        return default
+
+
+def write(failures):
+    db = Db(failures)
+    docs = [(row, {'refId': f'p{row}'}) for row in range(3)]
+    result = AssignmentJob(db, Cache()).write(docs, [Snap(f'p{row}') for row in range(3)])
+    return result, db
+
+
+def test_conflicting_pickups_are_skipped_and_the_rest_written():
+    (written, conflicts), db = write({'p1': FailedPrecondition('stale'), 'p2': NotFound('deleted')})
+    assert (written, conflicts) == (1, 2)
+    assert db.written == ['p0']
+    assert db.commits == 4
+
+
+def test_other_commit_errors_propagate():
+    with pytest.raises(ServiceUnavailable):
+        write({'p1': ServiceUnavailable('down')})
@@ -0,0 +1,176 @@
+"""
+Tests for emulator_fixtures.py snapshots, restores and the pytest plugin wiring
+No emulator is needed: the session talks to stub clients
+"""
+
+import json
+
+import pytest
+
+import emulator_fixtures
+from emulator_fixtures import EmulatorSession
+
+pytest_plugins = ['pytester']
+
+DOCUMENTS = {
+    'sales_orders/o1': {'status': 'Open'},
+    'sales_orders/o1/lines/l1': {'qty': 2},
+    'sales_orders/o1/lines/l1/notes/n1': {'text': 'fragile'},
+    'users/u1': {'role': 'admin'},
+}
+
+
+class Ref:
+    def __init__(self, path):
+        self.path = path
+
+
+class Snap:
+    def __init__(self, path, data):
+        self.reference = Ref(path)
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class Collection:
+    """Top-level collection whose recursive query yields every document below it"""
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.is_recursive = False
+
+    def recursive(self):
+        query = Collection(self.db, self.name)
+        query.is_recursive = True
+        return query
+
+    def stream(self):
+        for path, data in sorted(self.db.docs.items()):
+            depth = path.count('/')
+            if path.startswith(self.name + '/') and (self.is_recursive or depth == 1):
+                yield Snap(path, data)
+
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = {}
+
+    def set(self, ref, data):
+        self.writes[ref] = data
+
+    def commit(self):
+        self.db.docs.update(self.writes)
+        self.db.written += len(self.writes)
+
+
+class Db:
+    def __init__(self, docs):
+        self.docs = dict(docs)
+        self.written = 0
+
+    def collections(self):
+        return [Collection(self, name) for name in sorted({p.split('/')[0] for p in self.docs})]
+
+    def document(self, path):
+        return path
+
+    def batch(self):
+        return Batch(self)
+
+
+class User:
+    def __init__(self, uid):
+        self.uid = uid
+
+
+class Auth:
+    def __init__(self, uids):
+        self.uids = set(uids)
+
+    def list_users(self):
+        auth = self
+
+        class Page:
+            def iterate_all(self):
+                return [User(uid) for uid in sorted(auth.uids)]
+        return Page()
+
+    def create_user(self, uid, **kwargs):
+        self.uids.add(uid)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    from setup_firestore import test_users
+    session = EmulatorSession()
+    session.db = Db(DOCUMENTS)
+    stub = Auth([test_users[0]['uid']])
+
+    def clear():
+        session.db.docs.clear()
+        stub.uids.clear()
+    monkeypatch.setattr(session, 'clear', lambda: None)
+    monkeypatch.setattr(emulator_fixtures, 'auth', stub)
+    session.load('empty')
+    monkeypatch.setattr(session, 'clear', clear)
+    return session
+
+
+def test_snapshots_include_subcollections(session):
+    from setup_firestore import test_users
+    snapshot = session.load('empty')
+    assert snapshot['documents'] == DOCUMENTS
+    assert snapshot['users'] == test_users[:1]
+
+
+def test_every_restore_rewrites_the_snapshot(session):
+    assert session.restore('empty') == len(DOCUMENTS)
+    # A write the process never saw (another client, the app, the REST API) is still undone
+    session.db.docs['sales_orders/o1/lines/l1'] = {'qty': 99}
+    session.db.docs['sales_orders/o2'] = {'status': 'Open'}
+    assert session.restore('empty') == len(DOCUMENTS)
+    assert session.db.docs == DOCUMENTS
+    assert session.db.written == 2 * len(DOCUMENTS)
+
+
+TEST_FILE = """
+def test_one(firestore_db):
+    assert firestore_db == 'db'
+
+def test_two(firestore_db):
+    assert firestore_db == 'db'
+"""
+
+
+def test_plugin_skips_without_an_emulator(pytester, monkeypatch):
+    monkeypatch.setattr(emulator_fixtures, '_port_open', lambda host: False)
+    monkeypatch.setattr(emulator_fixtures.shutil, 'which', lambda name: None)
+    pytester.makepyfile(TEST_FILE)
+    result = pytester.runpytest('-p', 'emulator_fixtures', '-rs')
+    result.assert_outcomes(skipped=2)
+    result.stdout.fnmatch_lines(['*firebase CLI is not installed*'])
+
+
+def test_plugin_restores_before_every_test_and_reports_it(pytester, monkeypatch, tmp_path):
+    restored = []
+
+    def start(self):
+        self.db = 'db'
+        return self
+    monkeypatch.setattr(EmulatorSession, 'start', start)
+    monkeypatch.setattr(EmulatorSession, 'stop', lambda self: None)
+    monkeypatch.setattr(EmulatorSession, 'load', lambda self, name: {'seconds': 0.5})
+    monkeypatch.setattr(EmulatorSession, 'restore', lambda self, name: restored.append(name) or 3)
+    pytester.makepyfile(TEST_FILE)
+    timings = str(tmp_path / 'timings.json')
+    result = pytester.runpytest('-p', 'emulator_fixtures', '--emulator-dataset', 'config',
+                                '--emulator-timings', timings)
+    result.assert_outcomes(passed=2)
+    assert restored == ['config', 'config']
+    result.stdout.fnmatch_lines(['*2 test(s) on the emulator, 6 document(s) restored*', 'seeded once: config 0.50s'])
+    with open(timings) as fh:
+        assert [entry['documents'] for entry in json.load(fh).values()] == [3, 3]
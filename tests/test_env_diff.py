@@ -0,0 +1,95 @@
+"""
+Tests for env_diff.py Merkle comparison and cross-environment document keys
+"""
+
+import random
+
+from env_diff import LEAF_SIZE, EnvIndex, Snapshot, content_hash, diff_collection, merkle, tree_depth
+
+
+def leaves(n, seed=0, prefix='k'):
+    rng = random.Random(seed)
+    return {f'{prefix}{i}': (f'{rng.getrandbits(64):016x}', f'doc{i}') for i in range(n)}
+
+
+def brute_force(source, target):
+    created = sorted(k for k in source if k not in target)
+    updated = sorted(k for k in source if k in target and source[k] != target[k])
+    deleted = sorted(k for k in target if k not in source)
+    return created, updated, deleted
+
+
+def test_identical_collections_compare_at_the_root():
+    source = leaves(5000)
+    created, updated, deleted, visited, total = diff_collection(source, dict(source))
+    assert (created, updated, deleted) == ([], [], [])
+    assert visited == 1 and total > 1
+
+
+def test_diff_matches_brute_force_and_visits_only_differing_subtrees():
+    source = leaves(5000)
+    target = dict(source)
+    target['k7'] = ('changed', 'doc7')
+    del target['k11']
+    target['extra'] = ('new', 'docx')
+    created, updated, deleted, visited, total = diff_collection(source, target)
+    assert (created, updated, deleted) == brute_force(source, target) == (['k11'], ['k7'], ['extra'])
+    assert visited < total / 10
+
+
+def test_random_edits_agree_with_brute_force():
+    rng = random.Random(5)
+    for size in (0, 3, LEAF_SIZE + 1, 700):
+        source = leaves(size, seed=size)
+        target = dict(source)
+        for key in rng.sample(sorted(source), min(len(source), 12)):
+            if rng.random() < 0.5:
+                del target[key]
+            else:
+                target[key] = ('edited', key)
+        target.update(leaves(rng.randint(0, 5), seed=size + 1, prefix='new'))
+        assert diff_collection(source, target)[:3] == brute_force(source, target)
+
+
+def test_tree_shape_depends_only_on_keys():
+    assert tree_depth(LEAF_SIZE) == 0
+    assert tree_depth(LEAF_SIZE + 1) == 1
+    assert tree_depth(LEAF_SIZE * 16 + 1) == 2
+    a, _ = merkle(leaves(300), 2)
+    b, _ = merkle(dict(reversed(list(leaves(300).items()))), 2)
+    assert a == b
+
+
+def snapshot(label, collections):
+    snap = Snapshot(label, cache_dir='unused')
+    snap.collections = {name: {doc_id: {'t': None, 'h': content_hash(data, name, snap.ignored), 'data': data}
+                               for doc_id, data in docs.items()}
+                        for name, docs in collections.items()}
+    return snap
+
+
+def test_documents_match_on_natural_keys_and_references_by_target_key():
+    dev = snapshot('dev', {
+        'config_uco_grades': {'g1': {'gradeCode': 'A', 'name': 'Premium A'}},
+        'config_uco_buyback_rates': {'r1': {'gradeId': 'g1', 'ratePerKg': 12}},
+    })
+    prod = snapshot('prod', {
+        'config_uco_grades': {'x9': {'gradeCode': 'A', 'name': 'Premium A', 'updatedAt': 'later'}},
+        'config_uco_buyback_rates': {'y3': {'gradeId': 'x9', 'ratePerKg': 12}},
+    })
+    for name in ('config_uco_grades', 'config_uco_buyback_rates'):
+        src, dst = EnvIndex(dev).leaves(name), EnvIndex(prod).leaves(name)
+        assert diff_collection(src, dst)[:3] == ([], [], []), name
+    rate = prod.collections['config_uco_buyback_rates']['y3']
+    rate['data']['ratePerKg'] = 11
+    rate['h'] = content_hash(rate['data'], 'config_uco_buyback_rates', prod.ignored)
+    src = EnvIndex(dev).leaves('config_uco_buyback_rates')
+    dst = EnvIndex(prod).leaves('config_uco_buyback_rates')
+    assert diff_collection(src, dst)[:3] == ([], [EnvIndex(dev).keys('config_uco_buyback_rates')['r1']], [])
+
+
+def test_duplicate_natural_keys_fall_back_to_document_ids():
+    dev = snapshot('dev', {'config_uco_grades': {'g1': {'gradeCode': 'A'}, 'g2': {'gradeCode': 'A'}}})
+    index = EnvIndex(dev)
+    assert index.keys('config_uco_grades') == {'g1': 'id:g1', 'g2': 'id:g2'}
+    assert index.duplicates['config_uco_grades'] == ['["A"]']
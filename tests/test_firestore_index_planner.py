@@ -0,0 +1,103 @@
+"""
+Tests for firestore_index_planner.py query extraction and index planning
+"""
+
+import os
+import textwrap
+
+from firestore_index_planner import (REPO_ROOT, CompositeIndex, QueryShape, extract_all_shapes, extract_dart_shapes,
+                                     extract_python_shapes, load_index_file, plan_indexes, serves)
+
+
+def python_shapes(tmp_path, source):
+    path = tmp_path / 'job.py'
+    path.write_text(textwrap.dedent(source))
+    return {(s.collection, s.equality, s.ranges, s.order) for s in extract_python_shapes([str(path)])}
+
+
+def test_straight_python_chain(tmp_path):
+    assert python_shapes(tmp_path, '''
+        def run(db):
+            return db.collection('audit_log').where(filter=FieldFilter('workflowInstanceId', '==', 'x')) \\
+                .order_by('performedAt', direction=firestore.Query.DESCENDING).stream()
+    ''') == {('audit_log', ('workflowInstanceId',), (), (('performedAt', 'DESCENDING'),))}
+
+
+def test_collection_names_from_call_sites_and_loops(tmp_path):
+    shapes = python_shapes(tmp_path, '''
+        SOURCES = ('sales_orders', 'pickup_requests')
+
+        class Api:
+            async def list_records(self, db, status, collection):
+                query = (db.collection(collection).where(filter=FieldFilter('status', '==', status))
+                         .order_by('createdAt', direction='DESCENDING').limit(20))
+                return await self.reads.run(collection, lambda: fetch(query))
+
+            async def orders(self, db):
+                return await self.list_records(db, 'Open', 'sales_orders')
+
+        def sync(db, since):
+            for source in SOURCES:
+                query = db.collection(source).where(filter=FieldFilter('lastStatusAt', '>=', since))
+                docs = list(query.stream())
+    ''')
+    assert shapes == {
+        ('sales_orders', ('status',), (), (('createdAt', 'DESCENDING'),)),
+        ('sales_orders', (), ('lastStatusAt',), ()),
+        ('pickup_requests', (), ('lastStatusAt',), ()),
+    }
+
+
+def test_builder_chains_follow_each_branch(tmp_path):
+    shapes = python_shapes(tmp_path, '''
+        async def list_jobs(db, driver_uid, status, date):
+            query = db.collection('jobs')
+            if driver_uid:
+                query = query.where(filter=FieldFilter('assignedDriverUid', '==', driver_uid))
+            elif status and not date:
+                query = query.where(filter=FieldFilter('status', '==', status))
+            elif not date:
+                raise HttpError(400, 'driverUid, status or date is required')
+            if date:
+                query = query.where(filter=FieldFilter('scheduledDate', '>=', date))
+            return await query.get()
+    ''')
+    assert shapes == {
+        ('jobs', ('assignedDriverUid',), (), ()),
+        ('jobs', ('assignedDriverUid',), ('scheduledDate',), ()),
+        ('jobs', ('status',), (), ()),
+        ('jobs', (), ('scheduledDate',), ()),
+    }
+
+
+def test_dart_conditional_builder(tmp_path):
+    path = tmp_path / 'service.dart'
+    path.write_text(textwrap.dedent('''
+        Stream<List<Order>> getOrders({String? status}) {
+          Query query = _firestore.collection('sales_orders').orderBy('createdAt', descending: true);
+          if (status != null) {
+            query = query.where('status', isEqualTo: status);
+          }
+          return query.snapshots();
+        }
+    '''))
+    shapes = {(s.equality, s.order) for s in extract_dart_shapes([str(path)])}
+    assert shapes == {((), (('createdAt', 'DESCENDING'),)), (('status',), (('createdAt', 'DESCENDING'),))}
+
+
+def test_plan_drops_indexes_that_merging_covers():
+    order = (('createdAt', 'DESCENDING'),)
+    shapes = [QueryShape('jobs', 't', ('a',), (), order), QueryShape('jobs', 't', ('b',), (), order),
+              QueryShape('jobs', 't', ('a', 'b'), (), order)]
+    indexes = plan_indexes(shapes)
+    assert {ix.fields for ix in indexes} == {(('a', 'ASCENDING'), ('createdAt', 'DESCENDING')),
+                                              (('b', 'ASCENDING'), ('createdAt', 'DESCENDING'))}
+    assert len(serves(indexes, shapes[2])) == 2
+    assert len(plan_indexes(shapes, allow_merge=False)) == 3
+
+
+def test_committed_index_file_is_what_the_planner_generates():
+    indexes = load_index_file(os.path.join(REPO_ROOT, 'firestore.indexes.json'))
+    assert plan_indexes(extract_all_shapes()) == indexes
+    listing = CompositeIndex('sales_orders', (('status', 'ASCENDING'), ('createdAt', 'DESCENDING')))
+    assert listing in indexes
@@ -0,0 +1,142 @@
+"""
+Tests for firestore_metrics.py retries and the idempotence rules that decide them
+"""
+
+import asyncio
+
+import pytest
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+from google.cloud import firestore
+
+import firestore_metrics
+from firestore_metrics import (MAX_ATTEMPTS, AsyncInstrumentedBatch, FirestoreMetrics, InstrumentedBatch,
+                               is_idempotent)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(firestore_metrics, 'RETRY_BASE_DELAY', 0)
+
+
+class Flaky:
+    """Fails with the given errors, then returns 'ok'"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class Parent:
+    id = 'jobs'
+
+
+class Ref:
+    parent = Parent()
+    path = 'jobs/j1'
+
+
+class Batch:
+    def __init__(self, commit):
+        self.commit = commit
+
+    def set(self, *args, **kwargs):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def create(self, *args, **kwargs):
+        pass
+
+    def delete(self, *args, **kwargs):
+        pass
+
+
+def test_transient_errors_are_retried_and_counted():
+    metrics = FirestoreMetrics()
+    fn = Flaky(ServiceUnavailable('down'), ServiceUnavailable('down'))
+    result, _, retries, _ = metrics.timed('jobs', 'get', fn)
+    assert (result, retries, fn.calls) == ('ok', 2, 3)
+
+
+def test_retries_stop_at_max_attempts_and_other_errors_are_not_retried():
+    metrics = FirestoreMetrics()
+    fn = Flaky(*[ServiceUnavailable('down')] * MAX_ATTEMPTS)
+    with pytest.raises(ServiceUnavailable):
+        metrics.timed('jobs', 'get', fn)
+    assert fn.calls == MAX_ATTEMPTS
+    fn = Flaky(NotFound('gone'))
+    with pytest.raises(NotFound):
+        metrics.timed('jobs', 'get', fn)
+    assert fn.calls == 1
+    assert (metrics.totals().calls, metrics.totals().retries) == (2, MAX_ATTEMPTS - 1)
+
+
+def test_non_idempotent_calls_are_not_retried():
+    fn = Flaky(ServiceUnavailable('down'))
+    with pytest.raises(ServiceUnavailable):
+        FirestoreMetrics().timed('jobs', 'add', fn, idempotent=False)
+    assert fn.calls == 1
+
+
+def test_increments_and_preconditions_are_not_idempotent():
+    assert is_idempotent({'status': 'Done', 'updatedAt': firestore.SERVER_TIMESTAMP})
+    assert is_idempotent({'tags': firestore.ArrayUnion(['x'])})
+    assert not is_idempotent({'count': firestore.Increment(1)})
+    assert not is_idempotent({'totals': {'orders': firestore.Increment(1)}})
+    assert not is_idempotent({'status': 'Done'}, option=object())
+    assert not is_idempotent(option=object())
+
+
+@pytest.mark.parametrize('write, retried', [
+    (lambda b: b.set(Ref(), {'status': 'Done'}), True),
+    (lambda b: b.delete(Ref()), True),
+    (lambda b: b.create(Ref(), {'status': 'Done'}), False),
+    (lambda b: b.update(Ref(), {'count': firestore.Increment(1)}), False),
+    (lambda b: b.update(Ref(), {'status': 'Done'}, option=object()), False),
+    (lambda b: b.delete(Ref(), option=object()), False),
+])
+def test_batch_commit_retries_only_idempotent_writes(write, retried):
+    commit = Flaky(ServiceUnavailable('down'))
+    batch = InstrumentedBatch(Batch(commit), FirestoreMetrics())
+    batch.set(Ref(), {'status': 'Open'})
+    write(batch)
+    if retried:
+        assert batch.commit() == 'ok'
+    else:
+        with pytest.raises(ServiceUnavailable):
+            batch.commit()
+    assert commit.calls == (2 if retried else 1)
+
+
+def test_batch_idempotence_resets_after_each_commit():
+    commit = Flaky()
+    batch = InstrumentedBatch(Batch(commit), FirestoreMetrics())
+    batch.create(Ref(), {'status': 'Open'})
+    batch.commit()
+    commit.errors.append(ServiceUnavailable('down'))
+    batch.set(Ref(), {'status': 'Done'})
+    assert batch.commit() == 'ok' and commit.calls == 3
+
+
+def test_async_batch_follows_the_same_rules():
+    async def run(write):
+        commit = Flaky(ServiceUnavailable('down'))
+
+        async def commit_async():
+            return commit()
+        batch = AsyncInstrumentedBatch(Batch(commit_async), FirestoreMetrics())
+        write(batch)
+        try:
+            await batch.commit()
+        except ServiceUnavailable:
+            pass
+        return commit.calls
+    assert asyncio.run(run(lambda b: b.set(Ref(), {'status': 'Done'}))) == 2
+    assert asyncio.run(run(lambda b: b.update(Ref(), {'n': firestore.Increment(1)}))) == 1
@@ -0,0 +1,187 @@
+"""
+Tests for geofence.py fence states and the service's stop cache
+"""
+
+import math
+
+from geofence import (ENTERING, INSIDE, METERS_PER_DEGREE, OUTSIDE, Fence, GeofenceEngine, GeofenceService,
+                      project)
+
+LAT, LNG = 13.75, 100.55
+
+
+def north(meters):
+    """Latitude meters north of the test stop"""
+    return LAT + meters / METERS_PER_DEGREE
+
+
+def engine_with_fence(driver='drv1'):
+    engine = GeofenceEngine(radius=100, dwell=60, depart=120)
+    engine.add(Fence('job1', driver, LAT, LNG))
+    return engine
+
+
+def kinds(transitions):
+    return [t.kind for t in transitions]
+
+
+def test_arrival_needs_the_full_dwell_inside_the_radius():
+    engine = engine_with_fence()
+    assert engine.update('drv1', north(50), LNG, 0) == []
+    assert engine.fences['job1'].state == ENTERING
+    assert engine.update('drv1', north(50), LNG, 59) == []
+    arrived = engine.update('drv1', north(40), LNG, 60)
+    assert kinds(arrived) == ['arrived']
+    assert arrived[0].dwell == 60
+    assert engine.fences['job1'].state == INSIDE
+
+
+def test_leaving_before_the_dwell_resets_the_clock():
+    engine = engine_with_fence()
+    engine.update('drv1', north(50), LNG, 0)
+    engine.update('drv1', north(120), LNG, 30)
+    assert engine.fences['job1'].state == OUTSIDE
+    engine.update('drv1', north(50), LNG, 40)
+    assert engine.update('drv1', north(50), LNG, 70) == []
+    assert kinds(engine.update('drv1', north(50), LNG, 100)) == ['arrived']
+
+
+def test_jitter_between_radius_and_exit_radius_does_not_depart():
+    engine = engine_with_fence()
+    engine.update('drv1', north(10), LNG, 0)
+    engine.update('drv1', north(10), LNG, 60)
+    assert engine.update('drv1', north(140), LNG, 100) == []
+    assert engine.update('drv1', north(140), LNG, 1000) == []
+    assert engine.fences['job1'].state == INSIDE
+
+
+def test_north_south_moves_measure_true_distance():
+    engine = engine_with_fence()
+    fence = engine.fences['job1']
+    x, y = project(north(140), LNG)
+    assert abs(math.hypot(x - fence.x, y - fence.y) - 140) < 0.5
+
+
+def test_departure_after_depart_seconds_beyond_the_exit_radius():
+    engine = engine_with_fence()
+    engine.update('drv1', north(10), LNG, 0)
+    engine.update('drv1', north(10), LNG, 60)
+    assert engine.update('drv1', north(500), LNG, 100) == []
+    assert engine.tick(219) == []
+    departed = engine.tick(220)
+    assert kinds(departed) == ['departed']
+    assert departed[0].dwell == 100
+    assert engine.fences['job1'].state == OUTSIDE
+
+
+def test_other_drivers_and_far_away_positions_are_ignored():
+    engine = engine_with_fence()
+    assert engine.update('drv2', LAT, LNG, 0) == []
+    assert engine.update('drv2', LAT, LNG, 100) == []
+    assert engine.checks == 0
+    engine.update('drv1', north(5000), LNG, 200)
+    assert engine.checks == 0
+
+
+def test_tick_completes_arrivals_for_drivers_that_stop_reporting():
+    engine = engine_with_fence()
+    engine.update('drv1', north(10), LNG, 0)
+    assert engine.tick(30) == []
+    assert kinds(engine.tick(60)) == ['arrived']
+
+
+def test_moving_a_fence_regrids_it_and_resets_its_state():
+    engine = engine_with_fence()
+    engine.update('drv1', north(10), LNG, 0)
+    engine.add(Fence('job1', 'drv1', north(2000), LNG))
+    assert engine.fences['job1'].state == OUTSIDE
+    assert len(engine.grid) == 1
+    engine.remove('job1')
+    assert len(engine) == 0 and not engine.grid and not engine.by_driver
+
+
+# ==================== SERVICE ====================
+
+class Snap:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+        self.update_time = 1
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class Ref:
+    def __init__(self, db, collection, doc_id):
+        self.db = db
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self):
+        self.db.reads += 1
+        return Snap(self.id, self.db.data.get(self.collection, {}).get(self.id))
+
+
+class Collection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def document(self, doc_id):
+        return Ref(self.db, self.name, doc_id)
+
+
+class Db:
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+
+    def collection(self, name):
+        return Collection(self, name)
+
+    def get_all(self, refs):
+        return [ref.get() for ref in refs]
+
+
+def pickup_at(lat, lng):
+    return {'status': 'DriverAssigned', 'pickupAddress': {'lat': lat, 'lng': lng}}
+
+
+def job_snap(job_id, status='Assigned', ref_id='p1'):
+    return Snap(job_id, {'jobType': 'Pickup', 'refId': ref_id, 'status': status, 'assignedDriverUid': 'drv1'})
+
+
+def test_address_edit_moves_the_fence_of_every_job_using_it():
+    db = Db({'pickup_requests': {'p1': pickup_at(LAT, LNG)}})
+    service = GeofenceService(db, GeofenceEngine())
+    service.apply_job('job1', job_snap('job1'))
+    service.apply_job('job2', job_snap('job2'))
+    assert db.reads == 1
+    service.apply_stop('Pickup', 'p1', pickup_at(north(800), LNG))
+    assert {service.engine.fences[j].lat for j in ('job1', 'job2')} == {north(800)}
+    assert service.counts['stops moved'] == 1
+    service.apply_stop('Pickup', 'p1', {**pickup_at(north(800), LNG), 'notes': 'gate 2'})
+    assert service.counts['stops moved'] == 1
+
+
+def test_address_gaining_coordinates_places_the_missing_fence():
+    db = Db({'pickup_requests': {'p1': {'status': 'DriverAssigned', 'pickupAddress': {}}}})
+    service = GeofenceService(db, GeofenceEngine())
+    service.apply_job('job1', job_snap('job1'))
+    assert len(service.engine) == 0
+    service.apply_stop('Pickup', 'p1', pickup_at(LAT, LNG))
+    assert service.engine.fences['job1'].lat == LAT
+
+
+def test_stops_are_forgotten_once_no_active_job_uses_them():
+    db = Db({'pickup_requests': {'p1': pickup_at(LAT, LNG), 'p2': pickup_at(north(900), LNG)}})
+    service = GeofenceService(db, GeofenceEngine())
+    service.apply_job('job1', job_snap('job1'))
+    service.apply_job('job1', job_snap('job1', ref_id='p2'))
+    assert set(service.stops) == {('Pickup', 'p2')}
+    service.apply_job('job1', job_snap('job1', status='Completed'))
+    assert service.stops == {} and len(service.engine) == 0
+    service.apply_stop('Pickup', 'p2', pickup_at(LAT, LNG))
+    assert len(service.engine) == 0
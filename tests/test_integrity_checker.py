@@ -0,0 +1,87 @@
+"""
+Tests for integrity_checker.py reference, orphan and duplicate checks over in-memory scans
+"""
+
+import numpy as np
+
+from integrity_checker import ID, CollectionScan, IntegrityChecker, Reference, plan, present
+
+
+def checker(collections, references, unique_keys=()):
+    """An IntegrityChecker whose scans are filled from {collection: {doc_id: data}}"""
+    check = IntegrityChecker(None, references=references, unique_keys=unique_keys)
+    for name, fields in plan(references, unique_keys).items():
+        scan = CollectionScan(name, fields)
+        for doc_id, data in collections.get(name, {}).items():
+            scan.add(doc_id, data)
+        check.scans[name] = scan
+    check.check()
+    return check
+
+
+def findings(check):
+    return sorted((f['kind'], f['collection'], f.get('docId') or tuple(f['docIds'])) for f in check.findings)
+
+
+def test_present_mask():
+    keys = np.array([1, 5, 9], dtype=np.int64)
+    assert present(keys, np.array([5, 2, 9, 10], dtype=np.int64)).tolist() == [True, False, True, False]
+    assert present(np.array([], dtype=np.int64), np.array([1], dtype=np.int64)).tolist() == [False]
+
+
+def test_unassigned_job_is_not_a_dangling_driver_reference():
+    refs = (Reference('jobs', 'assignedDriverUid', 'users'),)
+    check = checker({
+        'users': {'u1': {}},
+        'jobs': {'j1': {'assignedDriverUid': ''}, 'j2': {'assignedDriverUid': None}, 'j3': {},
+                 'j4': {'assignedDriverUid': 'u1'}, 'j5': {'assignedDriverUid': 'u9'}},
+    }, refs)
+    assert findings(check) == [('dangling', 'jobs', 'j5')]
+    assert check.counts['references checked'] == 2
+
+
+def test_empty_value_is_dangling_when_not_nullable():
+    refs = (Reference('config_uco_buyback_rates', 'gradeId', 'config_uco_grades', nullable=False),)
+    check = checker({'config_uco_grades': {'g1': {}},
+                     'config_uco_buyback_rates': {'r1': {'gradeId': 'g1'}, 'r2': {'gradeId': ''}}}, refs)
+    assert findings(check) == [('dangling', 'config_uco_buyback_rates', 'r2')]
+
+
+def test_owned_children_of_missing_parents_are_orphans():
+    refs = (Reference('sales_order_lines', 'orderId', 'sales_orders', owned=True),
+            Reference('sales_order_lines', 'sku', 'config_products.sku', nullable=False))
+    check = checker({
+        'sales_orders': {'o1': {}},
+        'config_products': {'p1': {'sku': 'OIL-5L'}},
+        'sales_order_lines': {'l1': {'orderId': 'o1', 'sku': 'OIL-5L'}, 'l2': {'orderId': 'gone', 'sku': 'OIL-1L'}},
+    }, refs)
+    assert findings(check) == [('dangling', 'sales_order_lines', 'l2'), ('orphan', 'sales_order_lines', 'l2')]
+
+
+def test_when_restricts_a_rule_to_matching_documents():
+    refs = (Reference('jobs', 'refId', 'sales_orders', owned=True, when={'jobType': ('Delivery', None)}),
+            Reference('jobs', 'refId', 'pickup_requests', owned=True, when={'jobType': ('Pickup',)}))
+    check = checker({
+        'sales_orders': {'o1': {}},
+        'pickup_requests': {'p1': {}},
+        'jobs': {'j1': {'refId': 'o1'}, 'j2': {'jobType': 'Pickup', 'refId': 'p1'},
+                 'j3': {'jobType': 'Pickup', 'refId': 'o1'}},
+    }, refs)
+    assert findings(check) == [('orphan', 'jobs', 'j3')]
+
+
+def test_duplicate_keys_single_and_compound():
+    check = checker({
+        'config_products': {'p1': {'sku': 'A'}, 'p2': {'sku': 'A'}, 'p3': {'sku': 'B'}, 'p4': {'sku': ''}},
+        'config_price_list_items': {'i1': {'priceListId': 'l1', 'productId': 'p1'},
+                                    'i2': {'priceListId': 'l1', 'productId': 'p1'},
+                                    'i3': {'priceListId': 'l2', 'productId': 'p1'}},
+    }, (), (('config_products', ('sku',)), ('config_price_list_items', ('priceListId', 'productId'))))
+    assert findings(check) == [('duplicate', 'config_price_list_items', ('i1', 'i2')),
+                               ('duplicate', 'config_products', ('p1', 'p2'))]
+
+
+def test_plan_reads_only_rule_fields():
+    fields = plan((Reference('sales_order_lines', 'sku', 'config_products.sku'),), ())
+    assert fields == {'sales_order_lines': {'sku'}, 'config_products': {'sku'}}
+    assert ID == '__name__'
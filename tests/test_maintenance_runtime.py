@@ -0,0 +1,79 @@
+"""
+Tests for maintenance_runtime.py TaskGraph validation, job selection and critical path
+"""
+
+import asyncio
+
+import pytest
+
+from maintenance_runtime import GraphError, TaskGraph
+
+
+def graph(edges):
+    """TaskGraph whose jobs return their name and record the order they ran in"""
+    tasks = TaskGraph()
+    tasks.ran = []
+    for name, deps in edges.items():
+        async def fn(ctx, name=name):
+            tasks.ran.append((name, sorted(ctx.results)))
+            return name
+        tasks.add(name, fn, deps)
+    return tasks
+
+
+# users ← products ← orders ← invoices, and users ← audit; config stands alone
+EDGES = {
+    'users': (),
+    'products': ('users',),
+    'orders': ('users', 'products'),
+    'invoices': ('orders',),
+    'audit': ('users',),
+    'config': (),
+}
+
+
+@pytest.mark.parametrize('edges, cycle', [
+    ({'a': ('a',)}, 'a → a'),
+    ({'a': ('b',), 'b': ('c',), 'c': ('a',)}, 'a → b → c → a'),
+    ({'root': (), 'a': ('root', 'b'), 'b': ('a',)}, 'a → b → a'),
+])
+def test_cycles_are_reported_with_their_path(edges, cycle):
+    with pytest.raises(GraphError, match=f'dependency cycle: {cycle}$'):
+        graph(edges).validate()
+
+
+def test_unknown_dependencies_and_duplicates_are_rejected():
+    with pytest.raises(GraphError, match='orders depends on unknown job'):
+        graph({'orders': ('users',)}).validate()
+    tasks = graph({'users': ()})
+    with pytest.raises(GraphError, match='duplicate job: users'):
+        tasks.add('users', None)
+
+
+def test_closure_pulls_in_transitive_dependencies_only():
+    tasks = graph(EDGES)
+    assert tasks._closure(['invoices']) == {'users', 'products', 'orders', 'invoices'}
+    assert tasks._closure(['audit', 'config']) == {'users', 'audit', 'config'}
+    with pytest.raises(GraphError, match='unknown job: payments'):
+        tasks._closure(['payments'])
+
+
+def test_only_runs_the_closure_after_its_dependencies():
+    tasks = graph(EDGES)
+    results = asyncio.run(tasks.run(db=None, only=['invoices']))
+    assert results == {name: name for name in ('users', 'products', 'orders', 'invoices')}
+    order = [name for name, _ in tasks.ran]
+    assert order.index('users') < order.index('products') < order.index('orders') < order.index('invoices')
+    assert dict(tasks.ran)['orders'] == ['products', 'users']
+
+
+def test_critical_path_is_the_longest_dependent_chain():
+    tasks = graph(EDGES)
+    tasks.selected = set(tasks.jobs)
+    durations = {'users': 1.0, 'products': 2.0, 'orders': 0.5, 'invoices': 0.25, 'audit': 3.5, 'config': 4.0}
+    for name, seconds in durations.items():
+        tasks.jobs[name].started, tasks.jobs[name].finished = 10.0, 10.0 + seconds
+    # users → audit (4.5) beats users → products → orders → invoices (3.75) and config (4.0)
+    assert tasks.critical_path() == 4.5
+    tasks.selected = tasks._closure(['invoices'])
+    assert tasks.critical_path() == 3.75
@@ -0,0 +1,153 @@
+"""
+Tests for order_auto_cancel.py timing wheel and pending-order rules
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from google.api_core.exceptions import FailedPrecondition, PermissionDenied
+
+from order_auto_cancel import HOUR, AutoCancelScheduler, TimingWheel, hour_of
+
+NOW = datetime(2026, 3, 1, 12, tzinfo=timezone.utc)
+
+
+def test_keys_fire_at_their_hour_in_order():
+    wheel = TimingWheel(0)
+    wheel.schedule('late', 5)
+    wheel.schedule('early', 2)
+    assert wheel.advance(1) == []
+    assert wheel.advance(2) == ['early']
+    assert wheel.advance(10) == ['late']
+    assert len(wheel) == 0
+
+
+def test_far_expiries_cascade_down_and_fire_exactly_once():
+    wheel = TimingWheel(0, sizes=(4, 4, 2))
+    hours = {f'k{h}': h for h in (3, 7, 17, 40, 100)}
+    for key, hour in hours.items():
+        wheel.schedule(key, hour)
+    fired = {}
+    for hour in range(1, 120):
+        for key in wheel.advance(hour):
+            fired[key] = hour
+    assert fired == hours
+    assert wheel.cascaded > 0
+
+
+def test_remove_and_reschedule_are_lazy():
+    wheel = TimingWheel(0)
+    wheel.schedule('paid', 3)
+    wheel.schedule('moved', 3)
+    assert wheel.remove('paid')
+    assert not wheel.remove('paid')
+    wheel.schedule('moved', 30)
+    assert wheel.advance(10) == []
+    assert 'moved' in wheel
+    assert wheel.advance(30) == ['moved']
+
+
+def test_past_hours_fire_on_next_advance():
+    wheel = TimingWheel(10)
+    wheel.schedule('overdue', 4)
+    assert wheel.advance(10) == ['overdue']
+
+
+class StubCache:
+    def get_setting(self, key, default=None):
+        return {'ORDER_AUTO_CANCEL_HOURS': 72}.get(key, default)
+
+    def documents(self, name):
+        return {}
+
+
+def order(**fields):
+    doc = {'status': 'Submitted', 'paymentMethod': 'Transfer', 'createdAt': NOW - timedelta(hours=80)}
+    doc.update(fields)
+    return doc
+
+
+def test_only_unpaid_prepaid_orders_are_pending():
+    scheduler = AutoCancelScheduler(None, StubCache(), now=NOW)
+    assert scheduler.is_pending(order())
+    assert not scheduler.is_pending(order(paymentMethod='COD'))
+    assert not scheduler.is_pending(order(paymentMethod='Credit'))
+    # SalesOrder.fromFirestore() reads a missing paymentMethod as COD
+    assert not scheduler.is_pending({k: v for k, v in order().items() if k != 'paymentMethod'})
+    assert not scheduler.is_pending(order(paidAt=NOW))
+    assert not scheduler.is_pending(order(status='Confirmed'))
+
+
+def test_cod_orders_are_never_scheduled():
+    scheduler = AutoCancelScheduler(None, StubCache(), now=NOW - timedelta(hours=100))
+    scheduler.apply('cod', order(paymentMethod='COD'))
+    scheduler.apply('transfer', order())
+    assert 'cod' not in scheduler.wheel
+    assert scheduler.wheel.index['transfer'] == hour_of(order()['createdAt'].timestamp() + 72 * HOUR)
+
+
+class Snap:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.data = data
+        self.exists = True
+        self.reference = doc_id
+        self.update_time = NOW
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+        self.refs = []
+
+    def update(self, ref, data, option=None):
+        self.refs.append(ref)
+
+    def set(self, ref, data):
+        pass
+
+    def commit(self):
+        self.db.commits.append(list(self.refs))
+        for ref in self.refs:
+            if ref in self.db.fail:
+                raise self.db.fail[ref]
+
+
+class Db:
+    def __init__(self, orders, fail=None):
+        self.orders = orders
+        self.fail = fail or {}
+        self.commits = []
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id=None):
+        return doc_id
+
+    def get_all(self, refs):
+        return [Snap(ref, self.orders[ref]) for ref in refs]
+
+    def batch(self):
+        return Batch(self)
+
+    def write_option(self, **kwargs):
+        return None
+
+
+def test_conflicting_order_is_skipped():
+    db = Db({'o1': order(), 'o2': order()}, fail={'o2': FailedPrecondition('changed')})
+    scheduler = AutoCancelScheduler(db, StubCache(), now=NOW)
+    assert scheduler.cancel(['o1', 'o2'], NOW) == 1
+    assert scheduler.counts['conflicts'] == 1
+
+
+def test_other_errors_are_not_swallowed_as_conflicts():
+    db = Db({'o1': order()}, fail={'o1': PermissionDenied('denied')})
+    scheduler = AutoCancelScheduler(db, StubCache(), now=NOW)
+    with pytest.raises(PermissionDenied):
+        scheduler.cancel(['o1'], NOW)
+    assert scheduler.counts['conflicts'] == 0
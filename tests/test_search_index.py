@@ -0,0 +1,119 @@
+"""
+Tests for search_index.py ranking and the indexer's reconcile and maintenance loop
+"""
+
+import threading
+import time
+
+import search_index
+from search_index import SOURCES, SearchIndex, SearchIndexer
+
+PRODUCTS = next(source for source in SOURCES if source.kind == 'product')
+
+
+class Doc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class Watch:
+    def __init__(self):
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+
+
+class Query:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def where(self, filter=None):
+        return self
+
+    def stream(self):
+        docs = [Doc(doc_id, data) for doc_id, data in self.db.data.get(self.name, {}).items()]
+        self.db.on_stream(self.name)
+        return iter(docs)
+
+    def on_snapshot(self, callback):
+        watch = Watch()
+        self.db.watches.append(watch)
+        return watch
+
+
+class Db:
+    def __init__(self, data):
+        self.data = data
+        self.watches = []
+        self.on_stream = lambda name: None
+
+    def collection(self, name):
+        return Query(self, name)
+
+
+def product(name, sku):
+    return {'name': name, 'sku': sku}
+
+
+def test_search_ranks_title_matches_and_requires_every_word():
+    index = SearchIndex()
+    SearchIndexer(Db({'config_products': {
+        'p1': product('Palm Oil 18L', 'PALM-18'),
+        'p2': product('Soybean Oil 1L', 'SOY-1'),
+    }}), index).build()
+    assert [hit['id'] for hit in index.search('palm')] == ['p1']
+    assert {hit['id'] for hit in index.search('oil')} == {'p1', 'p2'}
+    assert index.search('palm soybean') == []
+
+
+def test_build_prunes_documents_deleted_while_down():
+    db = Db({'config_products': {'p1': product('Palm Oil', 'PALM'), 'p2': product('Rice Bran Oil', 'RICE')}})
+    index = SearchIndex()
+    SearchIndexer(db, index).build()
+    del db.data['config_products']['p2']
+    SearchIndexer(db, index).build()
+    assert index.doc_ids('product') == {'p1'}
+    assert index.search('rice') == []
+
+
+def test_build_keeps_records_a_listener_added_during_the_read():
+    db = Db({'config_products': {'p1': product('Palm Oil', 'PALM')}})
+    index = SearchIndex()
+    indexer = SearchIndexer(db, index)
+
+    def listener_adds(name):
+        if name == 'config_products':
+            indexer.apply(PRODUCTS, 'p9', product('Canola Oil', 'CAN'))
+    db.on_stream = listener_adds
+    indexer.build()
+    assert index.doc_ids('product') == {'p1', 'p9'}
+
+
+def test_run_reopens_closed_listeners_and_saves_on_stop(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_index, 'SAVE_INTERVAL', 0.01)
+    db = Db({'config_products': {'p1': product('Palm Oil', 'PALM')}})
+    index = SearchIndex()
+    indexer = SearchIndexer(db, index)
+    indexer.build()
+    stop = threading.Event()
+    path = str(tmp_path / 'index.npz')
+    thread = threading.Thread(target=indexer.run, args=(path,), kwargs={'stop': stop})
+    thread.start()
+    while not indexer.watches:
+        time.sleep(0.001)
+    first = indexer.watches[0]
+    first.is_active = False
+    while indexer.watches[0] is first:
+        time.sleep(0.001)
+    stop.set()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert indexer.watches == []
+    assert SearchIndex.load(path).doc_ids('product') == {'p1'}
+
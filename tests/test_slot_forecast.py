@@ -0,0 +1,104 @@
+"""
+Tests for slot_forecast.py demand series, fit and capacity recommendations
+"""
+
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from daily_rollups import OUTER_ZONE, UNASSIGNED, zone_for_location, zone_of
+from slot_forecast import SlotForecastJob, SlotTable, demand_matrix, fit
+
+TZ = ZoneInfo('Asia/Bangkok')
+SLOTS = [
+    {'id': 's1', 'zone': 'Bangkok Central', 'timeWindowStart': '08:00', 'timeWindowEnd': '12:00', 'maxCapacity': 20},
+    {'id': 's2', 'zone': 'Bangkok Central', 'timeWindowStart': '13:00', 'timeWindowEnd': '17:00', 'maxCapacity': 25},
+    {'id': 's3', 'zone': 'Provinces', 'timeWindowStart': '09:00', 'timeWindowEnd': '13:00', 'maxCapacity': 10},
+]
+
+
+def test_zone_from_address_coordinates():
+    assert zone_of({'deliveryAddress': {'lat': 13.7466, 'lng': 100.5393}}, 'deliveryAddress') == 'Bangkok Central'
+    assert zone_of({'pickupAddress': {'lat': 13.9, 'lng': 100.6}}, 'pickupAddress') == 'Bangkok Suburbs'
+    assert zone_of({'deliveryAddress': {'lat': 18.79, 'lng': 98.98}}, 'deliveryAddress') == OUTER_ZONE
+
+
+def test_zone_prefers_explicit_zone_and_ignores_missing_coordinates():
+    assert zone_of({'zone': 'Provinces', 'deliveryAddress': {'lat': 13.75, 'lng': 100.5}}, 'deliveryAddress') == 'Provinces'
+    assert zone_of({'deliveryAddress': {'lat': 0.0, 'lng': 0.0}}, 'deliveryAddress') == UNASSIGNED
+    assert zone_of({'deliveryAddress': '123 Main St, Bangkok'}, 'deliveryAddress') == UNASSIGNED
+    assert zone_for_location(None, 100.5) is None
+
+
+def test_demand_matrix_counts_bookings_into_their_slot_and_day():
+    table = SlotTable(SLOTS)
+    first = date(2026, 1, 5)
+    at = lambda day, hour: datetime(2026, 1, 5 + day, hour, 30, tzinfo=TZ)
+    bookings = [('Bangkok Central', at(0, 9)), ('Bangkok Central', at(0, 10)), ('Bangkok Central', at(1, 14)),
+                ('Provinces', at(2, 9)), ('Bangkok Central', at(0, 12)), (UNASSIGNED, at(0, 9))]
+    matrix, unslotted = demand_matrix(bookings, table, first, 7, TZ)
+    assert unslotted == 2
+    assert matrix[0, 0] == 2 and matrix[1, 1] == 1 and matrix[2, 2] == 1
+    assert matrix.sum() == 4
+
+
+def test_fit_recovers_weekday_profile():
+    rng = np.random.default_rng(1)
+    weekly = np.array([10, 10, 10, 10, 30, 40, 5], dtype=float)
+    matrix = rng.poisson(weekly[np.arange(364) % 7])[None, :].astype(float)
+    mean, lower, upper = fit(matrix, 0).weekday_forecast(0.9)
+    assert np.allclose(mean[0], weekly, rtol=0.25)
+    assert (lower[0] <= mean[0]).all() and (mean[0] <= upper[0]).all()
+
+
+def test_slot_without_history_gets_no_capacity():
+    table = SlotTable(SLOTS)
+    first = date(2026, 1, 5)
+    days = 28
+    bookings = [('Bangkok Central', datetime.combine(first + timedelta(days=d), datetime.min.time(), TZ)
+                 + timedelta(hours=9)) for d in range(days) for _ in range(6)]
+    matrix, _ = demand_matrix(bookings, table, first, days, TZ)
+    job = SlotForecastJob(None, TZ, history_days=days)
+    model = fit(matrix, first.weekday())
+    docs = dict(job.documents(table, matrix, model, model.weekday_forecast()))
+    assert docs['s1']['recommendedCapacity'] >= 6
+    assert docs['s2']['recommendedCapacity'] is None
+    assert docs['s3']['recommendedCapacity'] is None
+    assert docs['s3']['byWeekday']['Mon']['recommended'] is None
+
+
+class _Batch:
+    def __init__(self, writes):
+        self.writes = writes
+
+    def set(self, ref, data):
+        self.writes.append(('set', ref, data))
+
+    def update(self, ref, data):
+        self.writes.append(('update', ref, data))
+
+    def commit(self):
+        pass
+
+
+class _Db:
+    def __init__(self):
+        self.writes = []
+
+    def batch(self):
+        return _Batch(self.writes)
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return doc_id
+
+
+def test_apply_skips_slots_without_recommendation():
+    db = _Db()
+    docs = [('s1', {'recommendedCapacity': 8, 'currentCapacity': 20}),
+            ('s2', {'recommendedCapacity': None, 'currentCapacity': 25})]
+    SlotForecastJob(db, TZ).write(docs, apply=True)
+    assert [(op, ref) for op, ref, _ in db.writes if op == 'update'] == [('update', 's1')]
@@ -0,0 +1,211 @@
+"""
+Tests for uco_grading.py grade lookup, penalties and payouts
+"""
+
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from daily_rollups import pickup_facts
+from uco_grading import ADJUSTMENT_COLLECTION, GradeIndex, GradingEngine, GradingJob, flag_penalties, grade_code
+
+GRADES = [
+    {'gradeCode': 'A', 'minQualityScore': 80, 'maxQualityScore': 100},
+    {'gradeCode': 'B', 'minQualityScore': 60, 'maxQualityScore': 79},
+    {'gradeCode': 'C', 'minQualityScore': 40, 'maxQualityScore': 59},
+]
+INCENTIVE = {'cashRatePerKg': 45.0, 'minQty': 0,
+             'qualityMultipliers': {'Premium A': 1.2, 'Standard B': 1.0, 'Basic C': 0.8}}
+
+
+class StubCache:
+    """The slice of ConfigCache the grading engine reads"""
+
+    def __init__(self, settings=None):
+        self.settings = settings or {}
+
+    def grades(self):
+        return sorted(GRADES, key=lambda g: g['minQualityScore'])
+
+    def get_setting(self, key, default=None):
+        return self.settings.get(key, default)
+
+    def incentive_for(self, zone, customer_type, quantity=None):
+        return INCENTIVE
+
+    def grade_for_score(self, score):
+        return GradeIndex(GRADES).lookup(score)
+
+
+def pickup(score, **fields):
+    doc = {'qualityScore': score, 'actualQty': 100, 'actualUom': 'kg', 'incentiveType': 'Cash',
+           'customerType': 'B2C', 'zone': 'Bangkok Central', 'status': 'Collected'}
+    doc.update(fields)
+    return doc
+
+
+def grade_one(score, settings=None, **fields):
+    return GradingEngine(StubCache(settings)).grade_batch([('p1', pickup(score, **fields))])[0]
+
+
+def test_grade_code_accepts_codes_labels_and_names():
+    assert grade_code('b') == 'B'
+    assert grade_code('Premium A') == 'A'
+    assert grade_code('Grade C - Basic') == 'C'
+    assert grade_code('Gold') is None
+
+
+def test_grade_index_gaps_go_to_the_lower_band():
+    index = GradeIndex(GRADES)
+    assert index.lookup(79.5)['gradeCode'] == 'B'
+    assert index.lookup(80)['gradeCode'] == 'A'
+    assert index.lookup(39.9) is None
+    assert index.overlaps() == []
+
+
+def test_flag_penalties_only_for_set_flags():
+    assert flag_penalties({'water': True, 'odor': False}) == {'water': 15.0}
+    assert flag_penalties(None) == {}
+
+
+def test_graded_pickup_is_paid_at_grade_multiplier():
+    result = grade_one(85)
+    assert result.code == 'A' and not result.withheld
+    assert result.payout == pytest.approx(5400.0)
+
+
+def test_penalties_lower_the_grade():
+    result = grade_one(85, qualityFlags={'water': True, 'solid': True})
+    assert result.score == 60 and result.code == 'B'
+    assert result.payout == pytest.approx(4500.0)
+
+
+def test_rejected_pickup_pays_nothing_and_records_the_base_rate():
+    result = grade_one(30)
+    assert result.code is None and result.withheld
+    assert result.payout == 0.0
+    # Not the 4500 a 1.0 multiplier would pay, which is more than grade C earns
+    assert result.previous_payout == pytest.approx(4500.0)
+    assert result.delta == pytest.approx(-4500.0)
+
+
+def test_below_threshold_pays_nothing_even_with_a_grade():
+    result = grade_one(50)
+    assert result.code == 'C' and result.below_threshold and result.withheld
+    assert result.payout == 0.0
+    assert grade_one(50, settings={'UCO_QUALITY_THRESHOLD': 40}).payout == pytest.approx(3600.0)
+
+
+def test_downgrade_below_threshold_adjusts_from_the_previous_grade():
+    result = grade_one(45, gradeCode='A')
+    assert result.changed and result.withheld
+    assert result.previous_payout == pytest.approx(5400.0)
+    assert result.delta == pytest.approx(-5400.0)
+
+
+def test_rejected_again_after_a_rejection_owes_nothing():
+    result = grade_one(20, gradedAt=datetime(2026, 1, 1, tzinfo=timezone.utc))
+    assert result.payout == 0.0 and result.delta == 0.0
+
+
+def test_recorded_payout_is_the_previous_payout():
+    result = grade_one(30, payoutAmount=1000.0)
+    assert result.previous_payout == 1000.0 and result.delta == -1000.0
+
+
+def test_adjustment_reason():
+    engine = GradingEngine(StubCache())
+    rejected, low = engine.grade_batch([('p1', pickup(30)), ('p2', pickup(50))])
+    assert engine.payout_adjustment(rejected)['reason'] == 'rejected'
+    assert engine.payout_adjustment(low)['reason'] == 'below_threshold'
+
+
+# ==================== JOB ====================
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def update(self, ref, data):
+        self.ops.append(('update', ref, data))
+
+    def set(self, ref, data):
+        self.ops.append(('set', ref, data))
+
+    def commit(self):
+        for op, (collection, doc_id), data in self.ops:
+            docs = self.db.data.setdefault(collection, {})
+            docs[doc_id] = {**docs.get(doc_id, {}), **data} if op == 'update' else data
+
+    def __len__(self):
+        return len(self.ops)
+
+
+class Db:
+    """Applies batches to an in-memory {collection: {id: doc}} map"""
+
+    def __init__(self, pickups):
+        self.data = {'pickup_requests': dict(pickups)}
+        self.ids = iter(range(10 ** 6))
+
+    def collection(self, name):
+        db = self
+
+        class Collection:
+            def document(self, doc_id=None):
+                return name, doc_id if doc_id is not None else f'auto{next(db.ids)}'
+        return Collection()
+
+    def batch(self):
+        return Batch(self)
+
+
+def regrade(db, pickup_id, score, settings=None):
+    """Record a new inspection and grade it the way the job does"""
+    pickup = {**db.data['pickup_requests'][pickup_id], 'qualityScore': score}
+    db.data['pickup_requests'][pickup_id] = pickup
+    job = GradingJob(db, GradingEngine(StubCache(settings)))
+    engine_results = job.engine.grade_batch([(pickup_id, pickup)])
+    job.pending = lambda ids=None: [(pickup_id, pickup)]
+    job.run()
+    return engine_results[0], job
+
+
+def test_grade_update_records_the_payout():
+    db = Db({'p1': pickup(30)})
+    regrade(db, 'p1', 30)
+    stored = db.data['pickup_requests']['p1']
+    assert stored['payoutAmount'] == 0.0 and stored['payoutWithheld'] is True
+    regrade(db, 'p1', 85)
+    stored = db.data['pickup_requests']['p1']
+    assert stored['payoutAmount'] == pytest.approx(5400.0) and stored['payoutWithheld'] is False
+
+
+def test_chained_regrades_adjust_from_the_latest_payout():
+    db = Db({'p1': pickup(85, gradeCode='A', payoutAmount=5400.0)})
+    first, job = regrade(db, 'p1', 70)
+    assert (first.code, first.delta) == ('B', pytest.approx(-900.0))
+    second, job = regrade(db, 'p1', 45, settings={'UCO_QUALITY_THRESHOLD': 40})
+    assert (second.code, second.delta) == ('C', pytest.approx(-900.0))
+    adjustments = db.data[ADJUSTMENT_COLLECTION].values()
+    assert sum(a['delta'] for a in adjustments) == pytest.approx(3600.0 - 5400.0)
+
+
+def test_graded_before_payouts_were_recorded_adjusts_from_the_last_grade():
+    stale = pickup(70, gradeCode='B', payoutAmount=5400.0, gradedAt=datetime(2026, 1, 1, tzinfo=timezone.utc))
+    result = GradingEngine(StubCache()).grade_batch([('p1', stale)])[0]
+    assert result.previous_payout == pytest.approx(4500.0)
+
+
+def test_rollups_pay_nothing_for_withheld_pickups():
+    created = datetime(2026, 3, 1, 3, tzinfo=timezone.utc)
+    db = Db({'rejected': pickup(30, createdAt=created, payoutAmount=4500.0),
+             'watery': pickup(65, createdAt=created, payoutAmount=4500.0, qualityFlags={'water': True}),
+             'good': pickup(85, createdAt=created, payoutAmount=4500.0)})
+    for pickup_id, score in (('rejected', 30), ('watery', 65), ('good', 85)):
+        regrade(db, pickup_id, score)
+    payouts = {pickup_id: pickup_facts(doc, StubCache(), ZoneInfo('Asia/Bangkok'))[1].get(('totals', 'payouts'), 0.0)
+               for pickup_id, doc in db.data['pickup_requests'].items()}
+    assert payouts == {'rejected': 0.0, 'watery': 0.0, 'good': pytest.approx(5400.0)}
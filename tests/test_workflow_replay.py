@@ -0,0 +1,91 @@
+"""
+Tests for workflow_replay.py reducer, stream replay, drift detection and checkpoints
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from workflow_replay import OPEN_EXCEPTIONS, Checkpoint, diff_state, fold, reduce_event, replay
+
+T0 = datetime(2026, 3, 1, 8, tzinfo=timezone.utc)
+
+
+def event(action, minutes=0, instance='wf1', **fields):
+    return {'workflowInstanceId': instance, 'action': action, 'performedAt': T0 + timedelta(minutes=minutes),
+            **fields}
+
+
+def test_created_then_completed():
+    state = fold([event('created'), event('status_changed', 5, toStatus='in_progress'),
+                  event('approved', 9, toStatus='completed')])
+    assert state['currentStatus'] == 'completed'
+    assert state['isCompleted'] is True
+    assert state['completedAt'] == T0 + timedelta(minutes=9)
+    assert state['hasException'] is False
+
+
+def test_cancelled_is_completed_without_a_completion_time():
+    state = fold([event('created'), event('rejected', 3, toStatus='cancelled')])
+    assert state['isCompleted'] is True and state['completedAt'] is None
+
+
+def test_exception_flag_clears_only_when_every_exception_is_resolved():
+    state = fold([event('created'), event('exception_raised', 1, notes='late'),
+                  event('exception_raised', 2, notes='short'), event('exception_resolved', 3)])
+    assert state['hasException'] is True and state['exceptionReason'] == 'short'
+    state = reduce_event(state, event('exception_resolved', 4))
+    assert state['hasException'] is False and state['exceptionReason'] is None
+    state = reduce_event(state, event('exception_resolved', 5))
+    assert state[OPEN_EXCEPTIONS] == 0
+
+
+def test_reducer_never_mutates_its_input():
+    state = fold([event('created')])
+    before = dict(state)
+    reduce_event(state, event('status_changed', toStatus='completed'))
+    reduce_event(state, event('exception_raised', notes='x'))
+    assert state == before
+
+
+def test_events_without_state_are_ignored():
+    state = fold([event('created')])
+    assert reduce_event(state, event('assigned')) is state
+    assert reduce_event(state, event('status_changed')) is state
+
+
+def test_partial_history_only_sets_the_fields_it_touches():
+    state = fold([event('status_changed', toStatus='in_progress')])
+    assert state == {'currentStatus': 'in_progress', 'isCompleted': False, 'completedAt': None}
+    assert diff_state(state, {'currentStatus': 'in_progress', 'isCompleted': False, 'hasException': True}) == {}
+
+
+def test_replay_folds_each_instance_of_a_newest_first_stream():
+    stream = [event('approved', 9, 'a', toStatus='completed'), event('created', 0, 'a'),
+              event('exception_raised', 4, 'b', notes='x'), event('created', 0, 'b')]
+    results = {instance: (count, state, newest) for instance, count, state, newest in replay(stream)}
+    assert results['a'][0] == 2 and results['a'][1]['isCompleted'] is True
+    assert results['a'][2]['action'] == 'approved'
+    assert results['b'][1]['hasException'] is True
+    assert list(replay([])) == []
+
+
+def test_drift_compares_completed_at_by_presence_only():
+    state = fold([event('created'), event('approved', 9, toStatus='completed')])
+    live = {'currentStatus': 'completed', 'isCompleted': True, 'completedAt': T0 + timedelta(minutes=8, seconds=59),
+            'hasException': False, 'exceptionReason': None}
+    assert diff_state(state, live) == {}
+    assert diff_state(state, {**live, 'completedAt': None}) == {'completedAt': (None, state['completedAt'])}
+    assert diff_state(state, {**live, 'currentStatus': 'pending'}) == {'currentStatus': ('pending', 'completed')}
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / 'replay.json')
+    checkpoint = Checkpoint(path)
+    checkpoint.counts['instances'] = 3
+    checkpoint.findings.append({'id': 'wf1', 'at': T0})
+    checkpoint.save('wf9')
+    restored = Checkpoint(path)
+    assert restored.load() is True
+    assert restored.after == 'wf9' and restored.counts['instances'] == 3
+    assert restored.findings == [{'id': 'wf1', 'at': T0}]
+    restored.clear()
+    assert Checkpoint(path).load() is False
@@ -0,0 +1,113 @@
+"""
+Tests for workflow_tiering.py archiving, its conflict path and the cold bundle format
+"""
+
+import os
+from datetime import datetime, timezone
+
+import pytest
+from google.api_core.exceptions import FailedPrecondition, NotFound, ServiceUnavailable
+
+from workflow_tiering import ARCHIVE_COLLECTION, DirectoryColdStore, WorkflowTiering, pack, unpack
+
+COMPLETED = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+class Ref:
+    def __init__(self, path):
+        self.path = path
+
+
+class Snap:
+    def __init__(self, doc_id, **data):
+        self.id = doc_id
+        self.data = {'isCompleted': True, 'completedAt': COMPLETED, 'workflowType': 'order_approval', **data}
+        self.reference = Ref(f'workflow_instances/{doc_id}')
+        self.update_time = 1
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def set(self, ref, data):
+        self.ops.append(('set', ref.path, data))
+
+    def delete(self, ref, option=None):
+        self.ops.append(('delete', ref.path, option))
+
+    def commit(self):
+        for op, path, _ in self.ops:
+            if path in self.db.failures:
+                raise self.db.failures[path]
+        self.db.committed.extend(self.ops)
+
+
+class Db:
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.committed = []
+
+    def batch(self):
+        return Batch(self)
+
+    def collection(self, name):
+        class Collection:
+            def document(self, doc_id):
+                return Ref(f'{name}/{doc_id}')
+        return Collection()
+
+    def write_option(self, **kwargs):
+        return kwargs
+
+
+def cold_files(root):
+    return [name for _, _, files in os.walk(root) for name in files]
+
+
+def test_archive_uploads_and_swaps_in_a_tombstone(tmp_path):
+    db = Db()
+    tiering = WorkflowTiering(db, DirectoryColdStore(str(tmp_path)))
+    tiering.archive_one(Snap('wf1'), [], [])
+    assert cold_files(tmp_path) == ['wf1.json.gz']
+    tombstone = next(data for op, path, data in db.committed if path == f'{ARCHIVE_COLLECTION}/wf1')
+    assert tombstone['isArchived'] is True and tombstone['workflowType'] == 'order_approval'
+    assert ('delete', 'workflow_instances/wf1', {'last_update_time': 1}) in db.committed
+    assert tiering.stats['archived'] == 1 and tiering.stats['hot_docs_removed'] == 1
+
+
+@pytest.mark.parametrize('error', [FailedPrecondition('changed'), NotFound('deleted')])
+def test_changed_workflow_stays_hot_and_its_cold_object_is_removed(tmp_path, error):
+    db = Db({'workflow_instances/wf1': error})
+    tiering = WorkflowTiering(db, DirectoryColdStore(str(tmp_path)))
+    tiering.archive_one(Snap('wf1'), [], [])
+    assert cold_files(tmp_path) == []
+    assert db.committed == []
+    assert tiering.stats['skipped'] == 1 and tiering.stats['archived'] == 0
+
+
+def test_other_commit_errors_propagate(tmp_path):
+    db = Db({'workflow_instances/wf1': ServiceUnavailable('down')})
+    tiering = WorkflowTiering(db, DirectoryColdStore(str(tmp_path)))
+    with pytest.raises(ServiceUnavailable):
+        tiering.archive_one(Snap('wf1'), [], [])
+
+
+def test_stats_add_up_across_worker_threads(tmp_path):
+    snaps = [Snap(f'wf{i}') for i in range(200)]
+    db = Db({f'workflow_instances/wf{i}': FailedPrecondition('changed') for i in range(0, 200, 4)})
+    tiering = WorkflowTiering(db, DirectoryColdStore(str(tmp_path)))
+    tiering.related = lambda collection, ids: {i: [] for i in ids}
+    tiering.archive_page(snaps, workers=8)
+    assert (tiering.stats['archived'], tiering.stats['skipped']) == (150, 50)
+    assert len(cold_files(tmp_path)) == 150
+
+
+def test_bundle_round_trip():
+    bundle = {'instance': {'id': 'wf1', 'data': {'completedAt': COMPLETED, 'steps': [1, 2]}}}
+    assert unpack(pack(bundle)) == bundle
+    assert pack(bundle) == pack(bundle)
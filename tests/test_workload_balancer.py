@@ -0,0 +1,82 @@
+"""
+Tests for workload_balancer.py queue order, load spreading and redistribution
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from workload_balancer import EXCEPTION_ROLE, WorkloadBalancer, work_item
+
+NOW = datetime(2026, 3, 1, 9, tzinfo=timezone.utc)
+ROLE = 'dispatcher'
+
+
+def balancer_with(*uids, capacity=20):
+    balancer = WorkloadBalancer(capacity=capacity)
+    for uid in uids:
+        balancer.set_user(uid, [ROLE])
+    return balancer
+
+
+def test_least_slack_goes_first_to_the_least_loaded_user():
+    balancer = balancer_with('alice', capacity=1)
+    balancer.upsert('late', ROLE, 300)
+    balancer.upsert('soon', ROLE, 100)
+    assert balancer.assign() == [('soon', 'alice')]
+    assert balancer.queued() == {ROLE: 1}
+
+
+def test_items_spread_evenly_and_stop_at_capacity():
+    balancer = balancer_with('alice', 'bob', capacity=2)
+    for n in range(5):
+        balancer.upsert(f'item{n}', ROLE, n)
+    decisions = balancer.assign()
+    assert len(decisions) == 4
+    assert balancer.load('alice') == balancer.load('bob') == 2
+    assert balancer.queued() == {ROLE: 1}
+
+
+def test_users_only_get_items_of_roles_they_serve():
+    balancer = balancer_with('alice')
+    balancer.upsert('exc1', EXCEPTION_ROLE, 0)
+    assert balancer.assign() == []
+    balancer.set_user('olga', [EXCEPTION_ROLE])
+    assert balancer.assign() == [('exc1', 'olga')]
+
+
+def test_offline_users_items_are_redistributed():
+    balancer = balancer_with('alice', 'bob')
+    balancer.upsert('a1', ROLE, 0, assignee='alice')
+    balancer.upsert('a2', ROLE, 1, assignee='alice')
+    assert sorted(balancer.set_user('alice', [ROLE], available=False)) == ['a1', 'a2']
+    assert sorted(balancer.assign()) == [('a1', 'bob'), ('a2', 'bob')]
+    assert balancer.load('alice') == 0
+
+
+def test_items_held_by_an_unavailable_user_are_requeued():
+    balancer = balancer_with('bob')
+    balancer.set_user('alice', [ROLE], available=False)
+    assert balancer.upsert('a1', ROLE, 0, assignee='alice') is True
+    assert balancer.assign() == [('a1', 'bob')]
+
+
+def test_finished_items_free_capacity():
+    balancer = balancer_with('alice', capacity=1)
+    balancer.upsert('a1', ROLE, 0)
+    balancer.upsert('a2', ROLE, 1)
+    assert balancer.assign() == [('a1', 'alice')]
+    balancer.remove('a1')
+    assert balancer.assign() == [('a2', 'alice')]
+
+
+def test_priority_brings_the_effective_deadline_forward():
+    deadline = NOW + timedelta(hours=10)
+    _, urgent, _ = work_item('approval', {'assignedToRole': ROLE, 'slaDeadline': deadline, 'priority': 'urgent'})
+    _, low, _ = work_item('approval', {'assignedToRole': ROLE, 'slaDeadline': deadline, 'priority': 'low'})
+    assert urgent == (deadline - timedelta(hours=8)).timestamp()
+    assert low == (deadline + timedelta(hours=4)).timestamp()
+
+
+def test_exceptions_default_to_operations_and_a_severity_sla():
+    role, due, assignee = work_item('exception', {'severity': 'critical', 'occurredAt': NOW})
+    assert role == EXCEPTION_ROLE and assignee is None
+    assert due == (NOW + timedelta(hours=2) - timedelta(hours=8)).timestamp()
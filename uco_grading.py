@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+UCO grading engine for Oil Manager pickups
+Grades inspected pickup_requests in bulk against the config_uco_grades bands,
+after QualityFlags penalties, and writes the grade back together with regrade
+exceptions and payout adjustments for pickups whose grade changed
+"""
+
+import argparse
+import bisect
+import re
+import sys
+from datetime import datetime, timezone
+
+try:
+    from firebase_admin import firestore
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from config_cache import ConfigCache
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import chunked, sync_client
+
+# config_uco_grades uses gradeCode; workflow metadata and config_uco_incentives.qualityMultipliers use these labels
+GRADE_LABELS = {'A': 'Premium A', 'B': 'Standard B', 'C': 'Basic C'}
+_LABEL_CODES = {label.lower(): code for code, label in GRADE_LABELS.items()}
+_GRADE_NAME = re.compile(r'^grade\s+([a-z])\b', re.IGNORECASE)
+
+# Points off the inspection score per QualityFlags flag; config_system_settings can override
+# each with UCO_PENALTY_WATER / UCO_PENALTY_SOLID / UCO_PENALTY_ODOR
+QUALITY_FLAG_PENALTIES = {'water': 15.0, 'solid': 10.0, 'odor': 5.0}
+DEFAULT_QUALITY_THRESHOLD = 60.0
+
+GRADED_STATUSES = ['Collected', 'Settled']
+ADJUSTMENT_COLLECTION = 'uco_payout_adjustments'
+# Each pickup costs up to three writes (pickup, exception, adjustment)
+PICKUPS_PER_BATCH = 150
+# Written with every grade; the rollups and credit notes price the pickup from these
+PAYOUT_FIELDS = ('payoutAmount', 'payoutWithheld')
+
+
+def grade_code(name):
+    """'A', 'Premium A' or 'Grade A - Premium' → 'A'; None for anything unrecognised"""
+    if not name:
+        return None
+    text = str(name).strip()
+    if text.upper() in GRADE_LABELS:
+        return text.upper()
+    if text.lower() in _LABEL_CODES:
+        return _LABEL_CODES[text.lower()]
+    match = _GRADE_NAME.match(text)
+    return match.group(1).upper() if match else None
+
+
+def grade_label(code):
+    return GRADE_LABELS.get(code, code)
+
+
+class GradeIndex:
+    """Grade bands sorted by minQualityScore, looked up by bisection
+
+    A score belongs to the band with the highest minQualityScore it reaches, so the
+    gaps between whole-number ranges (79 → 80) go to the lower band, the same rule
+    as ConfigCache.grade_for_score(). Scores below the lowest band have no grade.
+    """
+
+    def __init__(self, grades):
+        active = [g for g in grades if g.get('isActive', True) and g.get('gradeCode')]
+        self.grades = sorted(active, key=lambda g: g.get('minQualityScore') or 0)
+        self.bounds = [g.get('minQualityScore') or 0 for g in self.grades]
+        self.ranks = {grade_code(g['gradeCode']): i for i, g in enumerate(self.grades)}
+
+    def lookup(self, score):
+        i = bisect.bisect_right(self.bounds, score)
+        return self.grades[i - 1] if i else None
+
+    def lookup_many(self, scores):
+        return [self.lookup(score) for score in scores]
+
+    def rank(self, code):
+        """Position of a grade from the bottom (0 = lowest); None for unknown grades"""
+        return self.ranks.get(grade_code(code))
+
+    def band(self, code):
+        rank = self.rank(code)
+        return self.grades[rank] if rank is not None else None
+
+    def overlaps(self):
+        """Pairs of adjacent bands whose score ranges overlap (a config error)"""
+        return [(low['gradeCode'], high['gradeCode']) for low, high in zip(self.grades, self.grades[1:])
+                if (low.get('maxQualityScore') or 0) >= (high.get('minQualityScore') or 0)]
+
+
+def flag_penalties(flags, penalties=QUALITY_FLAG_PENALTIES):
+    """{flag: points} for the QualityFlags set on an inspection"""
+    flags = flags or {}
+    return {flag: points for flag, points in penalties.items() if flags.get(flag)}
+
+
+# ============================================================
+# BATCH GRADING
+# ============================================================
+
+class Grading:
+    """The outcome of grading one pickup"""
+
+    def __init__(self, pickup_id, pickup, score, penalties, grade, previous_code, threshold):
+        self.pickup_id = pickup_id
+        self.pickup = pickup
+        self.raw_score = pickup['qualityScore']
+        self.penalties = penalties
+        self.score = score
+        self.grade = grade
+        self.code = grade['gradeCode'] if grade else None
+        self.previous_code = previous_code
+        self.below_threshold = self.score < threshold
+        self.threshold = threshold
+        # Rejected and below-threshold oil is not paid for; what it would have earned becomes an adjustment
+        self.withheld = self.code is None or self.below_threshold
+        self.payout = None
+        self.previous_payout = None
+
+    @property
+    def changed(self):
+        return self.previous_code is not None and self.code != self.previous_code
+
+    @property
+    def delta(self):
+        if self.payout is None or self.previous_payout is None:
+            return None
+        return round(self.payout - self.previous_payout, 2)
+
+
+class GradingEngine:
+    def __init__(self, cache):
+        self.cache = cache
+        self.index = GradeIndex(cache.grades())
+        self.threshold = cache.get_setting('UCO_QUALITY_THRESHOLD', DEFAULT_QUALITY_THRESHOLD)
+        self.penalties = {flag: cache.get_setting(f'UCO_PENALTY_{flag.upper()}', points)
+                          for flag, points in QUALITY_FLAG_PENALTIES.items()}
+
+    def grade_batch(self, pickups):
+        """Grade [(pickup_id, pickup)] inspection results; pickups without a qualityScore are skipped"""
+        from daily_rollups import pickup_kg, pickup_payout
+
+        inspected = [(pid, p) for pid, p in pickups if p.get('qualityScore') is not None]
+        penalties = [flag_penalties(p.get('qualityFlags'), self.penalties) for _, p in inspected]
+        scores = [max(0.0, p['qualityScore'] - sum(pen.values())) for (_, p), pen in zip(inspected, penalties)]
+        results = []
+        for (pickup_id, pickup), pen, score, grade in zip(inspected, penalties, scores, self.index.lookup_many(scores)):
+            previous = grade_code(pickup.get('gradeCode') or pickup.get('ucoGrade') or pickup.get('expectedGrade'))
+            result = Grading(pickup_id, pickup, score, pen, grade, previous, self.threshold)
+            kg = pickup_kg(pickup)
+            unpaid = {k: v for k, v in pickup.items() if k not in PAYOUT_FIELDS}
+            result.payout = 0.0 if result.withheld else round(pickup_payout(unpaid, kg, result.code, self.cache)[0], 2)
+            if pickup.get('gradedAt') is not None and 'payoutWithheld' in pickup:
+                # What the last grading recorded, so chained regrades adjust from the latest payout
+                result.previous_payout = pickup.get('payoutAmount') or 0.0
+            elif pickup.get('gradedAt') is not None and previous is not None:
+                # Graded before payouts were recorded: the last grade's price
+                result.previous_payout = round(pickup_payout(unpaid, kg, previous, self.cache)[0], 2)
+            elif pickup.get('payoutAmount') is not None:
+                # Never graded: the amount quoted when the pickup was booked
+                result.previous_payout = pickup['payoutAmount']
+            elif previous is not None:
+                result.previous_payout = round(pickup_payout(unpaid, kg, previous, self.cache)[0], 2)
+            elif pickup.get('gradedAt') is not None:
+                # Rejected by an earlier run, so nothing is owed
+                result.previous_payout = 0.0
+            elif result.withheld:
+                # Never graded: the pickup was quoted at the zone base rate (grade multiplier 1.0)
+                result.previous_payout = round(pickup_payout(unpaid, kg, None, self.cache)[0], 2)
+            results.append(result)
+        return results
+
+    def regrade_exception(self, result):
+        """exceptions document in the shape of the quality_issue sample in create_exceptions()"""
+        expected = grade_label(result.previous_code)
+        suggested = grade_label(result.code) if result.code else 'Rejected'
+        new_rank = -1 if result.code is None else self.index.rank(result.code)
+        downgrade = (self.index.rank(result.previous_code) or 0) - new_rank
+        band = self.index.band(result.previous_code) or {}
+        if result.below_threshold:
+            reason = f"below minimum threshold ({self.threshold:g}) for {expected} grade"
+        else:
+            reason = f"outside the {expected} band ({band.get('minQualityScore', 0):g}-{band.get('maxQualityScore', 100):g})"
+        return {
+            'workflowInstanceId': result.pickup.get('workflowInstanceId'),
+            'entityType': 'uco_pickup',
+            'entityId': result.pickup_id,
+            'exceptionType': 'quality_issue',
+            'severity': 'high' if result.below_threshold or downgrade >= 2 else 'medium',
+            'description': f"UCO quality score ({result.score:g}) {reason}. Regraded to {suggested}.",
+            'occurredAt': datetime.now(timezone.utc),
+            'assignedTo': None,
+            'status': 'open',
+            'resolution': None,
+            'resolvedAt': None,
+            'resolvedBy': None,
+            'metadata': {
+                'pickupId': result.pickup_id,
+                'expectedGrade': expected,
+                'actualQualityScore': result.score,
+                'inspectionScore': result.raw_score,
+                'qualityPenalties': result.penalties,
+                'minQualityScore': band.get('minQualityScore', self.threshold),
+                'suggestedGrade': suggested,
+                'payoutDelta': result.delta,
+            },
+        }
+
+    def payout_adjustment(self, result):
+        return {
+            'pickupId': result.pickup_id,
+            'customerAccountId': result.pickup.get('customerAccountId'),
+            'incentiveType': result.pickup.get('incentiveType'),
+            'fromGrade': result.previous_code,
+            'toGrade': result.code,
+            'previousPayout': result.previous_payout,
+            'newPayout': result.payout,
+            'delta': result.delta,
+            'reason': 'rejected' if result.code is None else 'below_threshold' if result.below_threshold else 'regraded',
+            # Settled pickups were already paid; the delta has to go through as a credit or debit
+            'settled': result.pickup.get('status') == 'Settled',
+            'status': 'pending',
+            'createdAt': firestore.SERVER_TIMESTAMP,
+        }
+
+
+class GradingJob:
+    def __init__(self, db, engine, dry_run=False):
+        self.db = db
+        self.engine = engine
+        self.dry_run = dry_run
+        self.counts = {'graded': 0, 'regraded': 0, 'below threshold': 0, 'rejected': 0}
+        self.payout_delta = 0.0
+
+    def pending(self, pickup_ids=None):
+        """Collected pickups with an inspection newer than their grade (or the given pickups)"""
+        if pickup_ids:
+            snaps = self.db.get_all([self.db.collection('pickup_requests').document(i) for i in pickup_ids])
+            return [(s.id, s.to_dict()) for s in snaps if s.exists]
+        query = self.db.collection('pickup_requests').where(filter=FieldFilter('status', 'in', GRADED_STATUSES))
+        pending = []
+        for snap in query.stream():
+            pickup = snap.to_dict()
+            if pickup.get('qualityScore') is None:
+                continue
+            graded, inspected = pickup.get('gradedAt'), pickup.get('inspectedAt')
+            if graded is None or (inspected is not None and inspected > graded):
+                pending.append((snap.id, pickup))
+        return pending
+
+    def run(self, pickup_ids=None):
+        pickups = self.pending(pickup_ids)
+        print(f"\n🔬 Grading {len(pickups)} inspected pickup(s)...")
+        for chunk in chunked(pickups, PICKUPS_PER_BATCH):
+            results = self.engine.grade_batch(chunk)
+            batch = self.db.batch()
+            for result in results:
+                self.counts['graded'] += 1
+                self.counts['below threshold'] += result.below_threshold
+                self.counts['rejected'] += result.code is None
+                batch.update(self.db.collection('pickup_requests').document(result.pickup_id), {
+                    'gradeCode': result.code,
+                    'gradeLabel': grade_label(result.code) if result.code else None,
+                    'gradedScore': result.score,
+                    'qualityPenalties': result.penalties,
+                    'payoutAmount': result.payout,
+                    'payoutWithheld': result.withheld,
+                    'gradedAt': firestore.SERVER_TIMESTAMP,
+                    # Bumped so the incremental rollups re-price the pickup under its new grade
+                    'lastStatusAt': firestore.SERVER_TIMESTAMP,
+                })
+                if result.changed or (result.below_threshold and result.previous_code):
+                    self.counts['regraded'] += result.changed
+                    batch.set(self.db.collection('exceptions').document(), self.engine.regrade_exception(result))
+                if (result.changed or result.withheld) and result.delta:
+                    self.payout_delta += result.delta
+                    batch.set(self.db.collection(ADJUSTMENT_COLLECTION).document(),
+                              self.engine.payout_adjustment(result))
+                if result.changed or (result.withheld and result.delta):
+                    print(f"   ↘ {result.pickup_id}: {grade_label(result.previous_code)} → "
+                          f"{grade_label(result.code) if result.code else 'Rejected'} "
+                          f"(score {result.score:g}, payout {result.delta or 0:+.2f})")
+            if not self.dry_run and len(batch):
+                batch.commit()
+        return self.counts
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pickup', nargs='+', metavar='PICKUP_ID', help='(re)grade these pickups regardless of gradedAt')
+    parser.add_argument('--dry-run', action='store_true', help='grade and report without writing')
+    parser.add_argument('--bands', action='store_true', help='print the grade bands and settings, then exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    db = sync_client(args=args)
+    cache = ConfigCache(db, collections=('config_system_settings', 'config_uco_grades', 'config_uco_incentives'),
+                        listen=False).load()
+    engine = GradingEngine(cache)
+    for low, high in engine.index.overlaps():
+        print(f"⚠️  Grade bands {low} and {high} overlap; scores in both go to {high}")
+
+    if args.bands:
+        print(f"♻️  UCO grade bands (threshold {engine.threshold:g}):")
+        for grade in reversed(engine.index.grades):
+            print(f"   {grade['gradeCode']}  {grade_label(grade['gradeCode']):<11} "
+                  f"{grade.get('minQualityScore'):>5g} – {grade.get('maxQualityScore'):g}")
+        print("   Penalties: " + ', '.join(f'{flag} −{points:g}' for flag, points in engine.penalties.items()))
+        return
+
+    job = GradingJob(db, engine, dry_run=args.dry_run)
+    counts = job.run(args.pickup)
+    print(f"\n✅ Grading finished{' (dry run)' if args.dry_run else ''}")
+    for name, count in counts.items():
+        print(f"   • {name}: {count}")
+    print(f"   • payout delta: {job.payout_delta:+.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Event-sourced rebuild of Oil Manager workflow_instances from audit_log
+Streams audit_log ordered by workflow instance and time, folds each instance's events
+into its state with a pure reducer, diffs the result against the live workflow_instances
+documents and optionally repairs drifted fields in batches. Progress is checkpointed to a
+local file after every reconciled chunk, so an interrupted run resumes where it stopped
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+try:
+    from firebase_admin import firestore
+    from google.api_core.exceptions import FailedPrecondition, NotFound
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from audit_writer import AUDIT_COLLECTION, audit_entry
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import MAX_BATCH_WRITES, chunked, from_json_value, sync_client, to_json_value
+from workflow_tiering import ARCHIVE_COLLECTION
+
+SYSTEM_ACTOR = 'system_workflow_replay'
+INSTANCES_COLLECTION = 'workflow_instances'
+DEFAULT_CHECKPOINT = 'workflow_replay.checkpoint.json'
+PAGE_SIZE = 2000
+# Instances whose live documents are fetched, diffed and repaired together; one checkpoint each
+RECONCILE_CHUNK = 250
+MAX_PRINTED = 10
+
+# Only the fields the workflow service derives from audited actions are rebuilt
+STATE_FIELDS = ('currentStatus', 'isCompleted', 'completedAt', 'hasException', 'exceptionReason')
+COMPLETED_STATUSES = ('completed', 'cancelled')
+STATUS_ACTIONS = ('status_changed', 'approved', 'rejected')
+# Reducer bookkeeping, never written to an instance
+OPEN_EXCEPTIONS = '_openExceptions'
+FROM_CREATION = '_fromCreation'
+EVENT_FIELDS = ['workflowInstanceId', 'entityType', 'entityId', 'action', 'performedAt', 'toStatus', 'notes']
+
+
+# ============================================================
+# REDUCER
+# ============================================================
+
+def reduce_event(state, event):
+    """Instance state after one audit_log event, mirroring WorkflowService; state is never mutated
+
+    A history that starts at 'created' rebuilds every field. A partial one (the trail was
+    pruned, or the instance predates audit logging) only sets the fields its events touch.
+    """
+    action = event.get('action')
+    if action == 'created':
+        return {
+            'currentStatus': event.get('toStatus') or 'pending',
+            'isCompleted': False,
+            'completedAt': None,
+            'hasException': False,
+            'exceptionReason': None,
+            OPEN_EXCEPTIONS: 0,
+            FROM_CREATION: True,
+        }
+    if action in STATUS_ACTIONS:
+        status = event.get('toStatus')
+        if not status:
+            return state
+        state = dict(state)
+        state['currentStatus'] = status
+        state['isCompleted'] = status in COMPLETED_STATUSES
+        state['completedAt'] = event.get('performedAt') if status == 'completed' else None
+        return state
+    if action == 'exception_raised':
+        state = dict(state)
+        state['hasException'] = True
+        state['exceptionReason'] = event.get('notes')
+        state[OPEN_EXCEPTIONS] = state.get(OPEN_EXCEPTIONS, 0) + 1
+        return state
+    if action == 'exception_resolved':
+        state = dict(state)
+        remaining = max(state.get(OPEN_EXCEPTIONS, 0) - 1, 0)
+        state[OPEN_EXCEPTIONS] = remaining
+        # resolveException() only clears the flag once no open exception is left
+        if remaining == 0:
+            state['hasException'] = False
+            state['exceptionReason'] = None
+        return state
+    # Assignment, approval-request and repair entries do not change instance state
+    return state
+
+
+def fold(events, state=None):
+    """State after the given events of one instance, oldest first"""
+    state = state if state is not None else {}
+    for event in events:
+        state = reduce_event(state, event)
+    return state
+
+
+def replay(events):
+    """(instanceId, event count, state, newest event) per instance of a newest-first event stream
+
+    The stream holds each instance's events contiguously and newest first, the order the
+    (workflowInstanceId asc, performedAt desc) index serves; they are folded oldest first.
+    """
+    current, pending = None, []
+    for event in events:
+        instance_id = event['workflowInstanceId']
+        if instance_id != current:
+            if pending:
+                yield current, len(pending), fold(reversed(pending)), pending[0]
+            current, pending = instance_id, []
+        pending.append(event)
+    if pending:
+        yield current, len(pending), fold(reversed(pending)), pending[0]
+
+
+def diff_state(state, live):
+    """{field: (live, replayed)} for the rebuilt fields that disagree with a live instance"""
+    drift = {}
+    for field in STATE_FIELDS:
+        if field not in state:
+            continue
+        replayed, current = state[field], live.get(field)
+        # completedAt is stamped by the client just before the audit entry, so only its presence is compared
+        if field == 'completedAt':
+            if (replayed is None) != (current is None):
+                drift[field] = (current, replayed)
+        elif replayed != current:
+            drift[field] = (current, replayed)
+    return drift
+
+
+# ============================================================
+# CHECKPOINT
+# ============================================================
+
+class Checkpoint:
+    """Last fully reconciled instance ID, running counts and findings, persisted atomically"""
+
+    def __init__(self, path):
+        self.path = path
+        self.after = None
+        self.counts = defaultdict(int)
+        self.findings = []
+        self.started_at = datetime.now(timezone.utc)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding='utf-8') as fh:
+            state = from_json_value(json.load(fh))
+        self.after = state.get('after')
+        self.counts.update(state.get('counts', {}))
+        self.findings = state.get('findings', [])
+        self.started_at = state.get('startedAt') or self.started_at
+        return True
+
+    def save(self, after):
+        self.after = after
+        if not self.path:
+            return
+        state = {
+            'after': after,
+            'counts': dict(self.counts),
+            'findings': self.findings,
+            'startedAt': self.started_at,
+            'savedAt': datetime.now(timezone.utc),
+        }
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(to_json_value(state), fh, separators=(',', ':'))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# ============================================================
+# REPLAY
+# ============================================================
+
+class WorkflowReplay:
+    """Replays audit_log into workflow instance states and reconciles them with the live documents"""
+
+    def __init__(self, db, checkpoint, repair=False, instance_id=None):
+        self.db = db
+        self.checkpoint = checkpoint
+        self.repair = repair
+        self.instance_id = instance_id
+        self.counts = checkpoint.counts
+        self.findings = checkpoint.findings
+
+    def stream(self):
+        """audit_log events with a workflow instance, per instance and newest first, after the checkpoint"""
+        if self.instance_id:
+            query = (self.db.collection('audit_log')
+                     .where(filter=FieldFilter('workflowInstanceId', '==', self.instance_id))
+                     .order_by('performedAt', direction=firestore.Query.DESCENDING))
+        else:
+            # > '' also skips entity-level entries, whose workflowInstanceId is null
+            query = (self.db.collection('audit_log')
+                     .where(filter=FieldFilter('workflowInstanceId', '>', self.checkpoint.after or ''))
+                     .order_by('workflowInstanceId')
+                     .order_by('performedAt', direction=firestore.Query.DESCENDING))
+        query = query.select(EVENT_FIELDS).limit(PAGE_SIZE)
+        last = None
+        while True:
+            page = (query.start_after(last) if last else query).get()
+            for snap in page:
+                yield snap.to_dict()
+            self.counts['events replayed'] += len(page)
+            if len(page) < PAGE_SIZE:
+                return
+            last = page[-1]
+
+    def run(self):
+        pending = []
+        for replayed in replay(self.stream()):
+            pending.append(replayed)
+            if len(pending) >= RECONCILE_CHUNK:
+                self.reconcile(pending)
+                pending = []
+        if pending:
+            self.reconcile(pending)
+
+    def reconcile(self, replayed):
+        """Diff one chunk of replayed instances against workflow_instances, repair, then checkpoint"""
+        refs = [self.db.collection(INSTANCES_COLLECTION).document(instance_id) for instance_id, _, _, _ in replayed]
+        live = {snap.id: snap for snap in self.db.get_all(refs)}
+        gone = [ref.id for ref in refs if not live[ref.id].exists]
+        archived = set()
+        if gone:
+            archive_refs = [self.db.collection(ARCHIVE_COLLECTION).document(instance_id) for instance_id in gone]
+            archived = {snap.id for snap in self.db.get_all(archive_refs) if snap.exists}
+        repairs = []
+        for instance_id, events, state, newest in replayed:
+            self.counts['instances replayed'] += 1
+            snap = live[instance_id]
+            if not snap.exists:
+                self.counts['archived' if instance_id in archived else 'missing instances'] += 1
+                continue
+            drift = diff_state(state, snap.to_dict())
+            if not drift:
+                continue
+            complete = state.get(FROM_CREATION, False)
+            self.counts['drifted instances'] += 1
+            for field in drift:
+                self.counts[f'drift: {field}'] += 1
+            self.findings.append({
+                'instanceId': instance_id,
+                'events': events,
+                'fullHistory': complete,
+                'fields': {field: {'live': old, 'replayed': new} for field, (old, new) in drift.items()},
+            })
+            if not complete:
+                # Without the 'created' event the replayed state is incomplete; report, never repair
+                self.counts['partial history (not repaired)'] += 1
+            elif self.repair:
+                repairs.append((snap, drift, newest))
+        if repairs:
+            self.commit_repairs(repairs)
+        self.checkpoint.save(replayed[-1][0])
+
+    def commit_repairs(self, repairs):
+        """Rewrite drifted fields, each instance with an audit entry, under update-time preconditions"""
+        def stage(batch, snap, drift, newest):
+            updates = {field: new for field, (_, new) in drift.items()}
+            batch.update(snap.reference, updates, option=self.db.write_option(last_update_time=snap.update_time))
+            batch.set(self.db.collection(AUDIT_COLLECTION).document(), audit_entry(
+                snap.id, newest.get('entityType'), newest.get('entityId'), 'state_repaired', SYSTEM_ACTOR,
+                notes=f"Rebuilt from audit_log replay: {', '.join(sorted(updates))}", changes=updates))
+
+        def commit(chunk):
+            batch = self.db.batch()
+            for repair in chunk:
+                stage(batch, *repair)
+            batch.commit()
+
+        # Two writes per instance
+        for chunk in chunked(repairs, MAX_BATCH_WRITES // 2):
+            try:
+                commit(chunk)
+                self.counts['repaired'] += len(chunk)
+                continue
+            except (FailedPrecondition, NotFound):
+                pass
+            # Someone changed an instance since it was read: retry one by one and leave the changed ones
+            for repair in chunk:
+                try:
+                    commit([repair])
+                    self.counts['repaired'] += 1
+                except (FailedPrecondition, NotFound):
+                    self.counts['changed during repair (skipped)'] += 1
+
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+
+def synthetic_events(count, seed=7):
+    """Newest-first audit_log events for synthetic instances, about eight events each"""
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    events = []
+    instance = 0
+    while len(events) < count:
+        instance_id = f'wf_bench_{instance:08d}'
+        at = start + timedelta(minutes=instance)
+        history = [('created', 'pending', None)]
+        for _ in range(rng.randint(0, 2)):
+            history.append(('exception_raised', None, 'Product out of stock'))
+            history.append(('assigned', None, None))
+            history.append(('exception_resolved', None, 'Restocked'))
+        history.append(('status_changed', 'approved', None))
+        history.append(('approved', 'approved', None))
+        history.append(('status_changed', rng.choice(COMPLETED_STATUSES + ('in_progress',)), None))
+        trail = []
+        for step, (action, to_status, notes) in enumerate(history):
+            trail.append({'workflowInstanceId': instance_id, 'entityType': 'sales_order',
+                          'entityId': f'order_bench_{instance}', 'action': action,
+                          'performedAt': at + timedelta(seconds=step), 'toStatus': to_status, 'notes': notes})
+        events.extend(reversed(trail))
+        instance += 1
+    return events[:count]
+
+
+def benchmark(count):
+    events = synthetic_events(count)
+    print(f"⏱️  Replaying {len(events):,} synthetic audit_log events...")
+    started = time.perf_counter()
+    instances = sum(1 for _ in replay(events))
+    elapsed = time.perf_counter() - started
+    print(f"   • {instances:,} instances rebuilt in {elapsed:.3f}s ({len(events) / elapsed:,.0f} events/s)")
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def print_report(findings):
+    for finding in findings[:MAX_PRINTED]:
+        marker = '' if finding['fullHistory'] else ' (partial history)'
+        fields = ', '.join(f"{field} {change['live']!r} → {change['replayed']!r}"
+                           for field, change in finding['fields'].items())
+        print(f"   • {finding['instanceId']}{marker}: {fields}")
+    if len(findings) > MAX_PRINTED:
+        print(f"   … {len(findings) - MAX_PRINTED} more")
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repair', action='store_true',
+                        help='rewrite drifted fields of instances whose history starts at "created"')
+    parser.add_argument('--instance', metavar='INSTANCE_ID', help='replay a single workflow instance')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                        help=f'progress file used to resume an interrupted run (default {DEFAULT_CHECKPOINT})')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint and start over')
+    parser.add_argument('--report', metavar='PATH', help='write every drift finding to a JSON file')
+    parser.add_argument('--benchmark', type=int, metavar='EVENTS',
+                        help='time the reducer over synthetic events and exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+
+    # A single-instance replay is quick and never touches the full-run checkpoint
+    checkpoint = Checkpoint(None if args.instance else args.checkpoint)
+    if args.restart:
+        checkpoint.clear()
+    elif checkpoint.load():
+        print(f"↩️  Resuming after {checkpoint.after} ({checkpoint.counts['instances replayed']:,} instances done)")
+
+    print(f"🔁 Replaying audit_log into workflow_instances{' (repair)' if args.repair else ''}...")
+    started = time.perf_counter()
+    replayer = WorkflowReplay(sync_client(job='workflow_replay', args=args), checkpoint,
+                              repair=args.repair, instance_id=args.instance)
+    try:
+        replayer.run()
+    except KeyboardInterrupt:
+        print(f"\n🛑 Stopped; rerun to resume after {checkpoint.after}")
+        sys.exit(130)
+    elapsed = time.perf_counter() - started
+
+    findings = replayer.findings
+    print(f"\n{'⚠️ ' if findings else '✅'} {len(findings)} drifted instance(s) in {elapsed:.1f}s")
+    print_report(findings)
+    for name, count in sorted(replayer.counts.items()):
+        print(f"   • {name}: {count:,}")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as fh:
+            json.dump(to_json_value(findings), fh, indent=2, default=str)
+        print(f"   • report written to {args.report}")
+    checkpoint.clear()
+    if findings and not args.repair:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Hot/cold tiering for completed Oil Manager workflows
+Moves workflow_instances completed more than N days ago, with their approval_requests
+and resolved exceptions, into gzip-compressed objects in a cold store (Cloud Storage
+or a local directory), leaving a small summary in workflow_archive/{instanceId}.
+rehydrate() puts an archived workflow back into the hot collections on demand
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+try:
+    from firebase_admin import firestore
+    from google.api_core.exceptions import FailedPrecondition, NotFound
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import MAX_BATCH_WRITES, chunked, from_json_value, sync_client, to_json_value
+
+ARCHIVE_COLLECTION = 'workflow_archive'
+DEFAULT_AGE_DAYS = 90
+DEFAULT_STORE = 'gs://fleets-x9tytb.firebasestorage.app/cold'
+PAGE_SIZE = 200
+IN_QUERY_LIMIT = 30
+DEFAULT_WORKERS = 8
+
+# An instance stays hot while any of its exceptions is still being worked on
+RESOLVED_EXCEPTION_STATUSES = {'resolved', 'closed'}
+
+# Instance fields kept on the tombstone, enough for WorkflowInstance.fromFirestore() to render a row
+SUMMARY_FIELDS = (
+    'workflowType', 'entityId', 'entityType', 'currentStatus', 'currentStepId', 'initiatedBy',
+    'initiatedAt', 'completedAt', 'isCompleted', 'hasException', 'exceptionReason', 'slaDeadline', 'isOverdue',
+)
+
+
+# ============================================================
+# COLD STORES
+# ============================================================
+
+class DirectoryColdStore:
+    """Cold objects as files under a local directory (development and emulator runs)"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def uri(self, key):
+        return os.path.abspath(os.path.join(self.root, key))
+
+    def put(self, key, data):
+        path = self.uri(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+        return path
+
+    def get(self, uri):
+        with open(uri, 'rb') as fh:
+            return fh.read()
+
+    def delete(self, uri):
+        if os.path.exists(uri):
+            os.remove(uri)
+
+
+class BucketColdStore:
+    """Cold objects in a Cloud Storage bucket, e.g. gs://fleets-x9tytb.firebasestorage.app/cold"""
+
+    def __init__(self, bucket_name, prefix=''):
+        from firebase_admin import storage
+        self.bucket = storage.bucket(bucket_name)
+        self.prefix = prefix.strip('/')
+
+    def _name(self, key):
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def uri(self, key):
+        return f'gs://{self.bucket.name}/{self._name(key)}'
+
+    def put(self, key, data):
+        blob = self.bucket.blob(self._name(key))
+        blob.upload_from_string(data, content_type='application/gzip')
+        return self.uri(key)
+
+    def get(self, uri):
+        return self.bucket.blob(self._blob_name(uri)).download_as_bytes()
+
+    def delete(self, uri):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(self._blob_name(uri)).delete()
+        except NotFound:
+            pass
+
+    def _blob_name(self, uri):
+        return uri.split(f'gs://{self.bucket.name}/', 1)[1]
+
+
+def open_store(spec):
+    """Cold store for a gs://bucket/prefix URI or a local directory path"""
+    if spec.startswith('gs://'):
+        bucket, _, prefix = spec[len('gs://'):].partition('/')
+        return BucketColdStore(bucket, prefix)
+    return DirectoryColdStore(spec)
+
+
+def store_for_uri(uri):
+    if uri.startswith('gs://'):
+        return BucketColdStore(uri[len('gs://'):].split('/', 1)[0])
+    return DirectoryColdStore(os.path.dirname(uri))
+
+
+def pack(bundle):
+    return gzip.compress(json.dumps(to_json_value(bundle), separators=(',', ':')).encode('utf-8'), mtime=0)
+
+
+def unpack(data, db=None):
+    return from_json_value(json.loads(gzip.decompress(data).decode('utf-8')), db)
+
+
+# ============================================================
+# TIERING
+# ============================================================
+
+class WorkflowTiering:
+    def __init__(self, db, store, age_days=DEFAULT_AGE_DAYS, dry_run=False):
+        self.db = db
+        self.store = store
+        self.cutoff = datetime.now(timezone.utc) - timedelta(days=age_days)
+        self.dry_run = dry_run
+        # archive_one() runs on a thread pool
+        self._lock = threading.Lock()
+        self.stats = {'archived': 0, 'skipped': 0, 'hot_docs_removed': 0, 'raw_bytes': 0, 'cold_bytes': 0}
+
+    def candidates(self):
+        """Pages of completed instances older than the cutoff, oldest first"""
+        query = (self.db.collection('workflow_instances')
+                 .where(filter=FieldFilter('completedAt', '<', self.cutoff))
+                 .order_by('completedAt')
+                 .limit(PAGE_SIZE))
+        last = None
+        while True:
+            page = (query.start_after(last) if last else query).get()
+            if not page:
+                return
+            yield [snap for snap in page if self._eligible(snap.to_dict())]
+            if len(page) < PAGE_SIZE:
+                return
+            last = page[-1]
+
+    def _eligible(self, data):
+        if not data.get('isCompleted'):
+            return False
+        # Rehydrated on demand recently: leave it hot until it ages out again
+        rehydrated = data.get('rehydratedAt')
+        return rehydrated is None or rehydrated < self.cutoff
+
+    def related(self, collection, instance_ids):
+        """{instanceId: [snapshots]} for approval_requests or exceptions of the given instances"""
+        found = {i: [] for i in instance_ids}
+        for ids in chunked(list(instance_ids), IN_QUERY_LIMIT):
+            query = self.db.collection(collection).where(filter=FieldFilter('workflowInstanceId', 'in', ids))
+            for snap in query.stream():
+                found[snap.get('workflowInstanceId')].append(snap)
+        return found
+
+    def archive_page(self, snaps, workers=DEFAULT_WORKERS):
+        ids = [snap.id for snap in snaps]
+        approvals = self.related('approval_requests', ids)
+        exceptions = self.related('exceptions', ids)
+        jobs = []
+        for snap in snaps:
+            open_exceptions = [e for e in exceptions[snap.id] if e.get('status') not in RESOLVED_EXCEPTION_STATUSES]
+            if open_exceptions:
+                self.stats['skipped'] += 1
+                continue
+            children = approvals[snap.id] + exceptions[snap.id]
+            if len(children) + 2 > MAX_BATCH_WRITES:
+                print(f"⚠️  {snap.id}: {len(children)} related documents, too many for one atomic batch; left hot")
+                self.stats['skipped'] += 1
+                continue
+            jobs.append((snap, approvals[snap.id], exceptions[snap.id]))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda job: self.archive_one(*job), jobs))
+
+    def archive_one(self, snap, approvals, exceptions):
+        """Upload one workflow bundle, then swap the hot documents for a tombstone in one batch"""
+        data = snap.to_dict()
+        bundle = {
+            'instance': {'id': snap.id, 'data': data},
+            'approval_requests': [{'id': a.id, 'data': a.to_dict()} for a in approvals],
+            'exceptions': [{'id': e.id, 'data': e.to_dict()} for e in exceptions],
+            'archivedAt': datetime.now(timezone.utc),
+        }
+        blob = pack(bundle)
+        raw = len(json.dumps(to_json_value(bundle)))
+        completed = data.get('completedAt') or self.cutoff
+        key = f"workflow_instances/{completed:%Y/%m}/{snap.id}.json.gz"
+        if self.dry_run:
+            uri = self.store.uri(key)
+        else:
+            uri = self.store.put(key, blob)
+
+            tombstone = {field: data.get(field) for field in SUMMARY_FIELDS}
+            tombstone.update({
+                'isArchived': True,
+                'archiveUri': uri,
+                'archivedAt': firestore.SERVER_TIMESTAMP,
+                'approvalCount': len(approvals),
+                'exceptionCount': len(exceptions),
+                'archiveBytes': len(blob),
+            })
+            batch = self.db.batch()
+            batch.set(self.db.collection(ARCHIVE_COLLECTION).document(snap.id), tombstone)
+            # Preconditions: if anything changed since it was read, the batch fails and the workflow stays hot
+            for doc in [snap] + approvals + exceptions:
+                batch.delete(doc.reference, option=self.db.write_option(last_update_time=doc.update_time))
+            try:
+                batch.commit()
+            except (FailedPrecondition, NotFound) as e:
+                # No tombstone points at the uploaded object, so it would only be an orphan
+                self.store.delete(uri)
+                print(f"⚠️  {snap.id} changed while archiving, left hot: {e}")
+                with self._lock:
+                    self.stats['skipped'] += 1
+                return
+
+        with self._lock:
+            self.stats['archived'] += 1
+            self.stats['hot_docs_removed'] += 1 + len(approvals) + len(exceptions)
+            self.stats['raw_bytes'] += raw
+            self.stats['cold_bytes'] += len(blob)
+
+    def run(self, limit=None, workers=DEFAULT_WORKERS):
+        print(f"\n🧊 Archiving workflows completed before {self.cutoff:%Y-%m-%d}"
+              f"{' (dry run)' if self.dry_run else ''}...")
+        for page in self.candidates():
+            if limit is not None:
+                page = page[:max(0, limit - self.stats['archived'])]
+            if page:
+                self.archive_page(page, workers)
+                print(f"   ✓ {self.stats['archived']} archived so far")
+            if limit is not None and self.stats['archived'] >= limit:
+                break
+        return self.stats
+
+
+def rehydrate(db, instance_id):
+    """Restore an archived workflow to workflow_instances, approval_requests and exceptions
+
+    Returns the restored instance data, or None if instance_id has no tombstone. The
+    instance gets rehydratedAt so the next tiering run leaves it hot for another age window.
+    """
+    tombstone_ref = db.collection(ARCHIVE_COLLECTION).document(instance_id)
+    tombstone = tombstone_ref.get()
+    if not tombstone.exists:
+        return None
+    uri = tombstone.get('archiveUri')
+    bundle = unpack(store_for_uri(uri).get(uri), db)
+
+    instance = dict(bundle['instance']['data'], rehydratedAt=datetime.now(timezone.utc))
+    batch = db.batch()
+    batch.set(db.collection('workflow_instances').document(instance_id), instance)
+    for collection in ('approval_requests', 'exceptions'):
+        for doc in bundle[collection]:
+            batch.set(db.collection(collection).document(doc['id']), doc['data'])
+    batch.delete(tombstone_ref)
+    batch.commit()
+    return instance
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--days', type=int, default=DEFAULT_AGE_DAYS,
+                        help=f'archive workflows completed more than DAYS ago (default {DEFAULT_AGE_DAYS})')
+    parser.add_argument('--store', default=DEFAULT_STORE,
+                        help=f'gs://bucket/prefix or a local directory (default {DEFAULT_STORE})')
+    parser.add_argument('--limit', type=int, help='archive at most this many workflows')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='parallel uploads (default 8)')
+    parser.add_argument('--dry-run', action='store_true', help='report what would be archived without writing')
+    parser.add_argument('--rehydrate', nargs='+', metavar='INSTANCE_ID', help='restore archived workflows and exit')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    db = sync_client(args=args)
+
+    if args.rehydrate:
+        for instance_id in args.rehydrate:
+            instance = rehydrate(db, instance_id)
+            if instance is None:
+                print(f"⚠️  {instance_id} is not archived")
+            else:
+                print(f"♨️  Rehydrated {instance_id} ({instance.get('workflowType')} {instance.get('entityId')})")
+        return
+
+    started = time.perf_counter()
+    stats = WorkflowTiering(db, open_store(args.store), args.days, args.dry_run).run(args.limit, args.workers)
+    ratio = stats['raw_bytes'] / stats['cold_bytes'] if stats['cold_bytes'] else 0
+    print(f"\n✅ Tiering finished in {time.perf_counter() - started:.1f}s")
+    print(f"   • Workflows archived: {stats['archived']} (skipped {stats['skipped']})")
+    print(f"   • Hot documents removed: {stats['hot_docs_removed']}")
+    print(f"   • Cold bytes: {stats['cold_bytes']:,} ({ratio:.1f}x smaller than JSON)")
+
+
+if __name__ == '__main__':
+    main()
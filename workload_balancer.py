@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+"""
+SLA-aware workload balancer for Oil Manager approvals and exceptions
+Assigns pending approval_requests and open exceptions that only carry a role to
+individual staff in that role: the item with the least SLA slack goes to the least
+loaded available user, and a user going offline has their items redistributed
+"""
+
+import argparse
+import heapq
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+try:
+    from google.api_core.exceptions import FailedPrecondition, NotFound
+    from google.cloud.firestore_v1.base_query import FieldFilter
+except ImportError:
+    print("❌ firebase-admin not installed. Run: pip install firebase-admin")
+    sys.exit(1)
+
+from audit_writer import AUDIT_COLLECTION, audit_entry
+from config_cache import ConfigCache
+from firestore_metrics import add_metrics_args
+from maintenance_runtime import MAX_BATCH_WRITES, chunked, sync_client
+
+SYSTEM_ACTOR = 'system_workload_balancer'
+
+# Staff who work the Approval Inbox; a user's optional workRoles list names the queues they serve
+# (e.g. operations_manager), otherwise they serve the queue named after their own role
+STAFF_ROLES = ['dispatcher', 'admin']
+EXCEPTION_ROLE = 'operations_manager'
+OPEN_EXCEPTION_STATUSES = ['open', 'in_progress']
+
+# Priority and severity move the effective deadline forward rather than scaling the slack, so an
+# item's place in the queue does not change as time passes and the heaps stay valid
+PRIORITY_LEAD_HOURS = {'urgent': 8, 'critical': 8, 'high': 4, 'medium': 0, 'low': -4}
+# Exceptions have no slaDeadline; they are due this long after occurredAt
+EXCEPTION_SLA_HOURS = {'critical': 2, 'high': 8, 'medium': 24, 'low': 72}
+DEFAULT_SLA_HOURS = 24
+
+# Open items per user before the rest wait in the role queue; WORKLOAD_MAX_PER_USER overrides
+DEFAULT_CAPACITY = 20
+FLUSH_INTERVAL = 1.0
+# Each assignment is two writes (item, audit entry)
+DECISIONS_PER_BATCH = MAX_BATCH_WRITES // 2
+
+COLLECTIONS = {'approval': 'approval_requests', 'exception': 'exceptions'}
+
+
+def _aware(ts):
+    if ts is None:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def work_item(kind, doc):
+    """(role, effective due epoch seconds, assignee) of an approval request or exception"""
+    if kind == 'approval':
+        rank = doc.get('priority')
+        deadline = _aware(doc.get('slaDeadline'))
+        if deadline is None:
+            deadline = (_aware(doc.get('requestedAt')) or datetime.now(timezone.utc)) + timedelta(hours=DEFAULT_SLA_HOURS)
+        role = doc.get('assignedToRole')
+    else:
+        rank = doc.get('severity')
+        deadline = _aware(doc.get('slaDeadline'))
+        if deadline is None:
+            deadline = ((_aware(doc.get('occurredAt')) or datetime.now(timezone.utc))
+                        + timedelta(hours=EXCEPTION_SLA_HOURS.get(rank, DEFAULT_SLA_HOURS)))
+        role = doc.get('assignedToRole') or EXCEPTION_ROLE
+    due = deadline.timestamp() - PRIORITY_LEAD_HOURS.get(rank, 0) * 3600
+    return role, due, doc.get('assignedTo')
+
+
+def user_roles(user):
+    """Queues a staff user serves"""
+    return tuple(user.get('workRoles') or [user.get('role')])
+
+
+def user_available(user):
+    """Active and not marked away; isAvailable is flipped by the app on sign-out or shift end"""
+    return user.get('isActive', True) and user.get('isAvailable', True)
+
+
+# ============================================================
+# BALANCER
+# ============================================================
+
+class WorkItem:
+    __slots__ = ('key', 'role', 'due', 'assignee', 'seq')
+
+    def __init__(self, key):
+        self.key = key
+        self.role = None
+        self.due = None
+        self.assignee = None
+        self.seq = None
+
+
+class WorkUser:
+    __slots__ = ('uid', 'roles', 'available')
+
+    def __init__(self, uid):
+        self.uid = uid
+        self.roles = ()
+        self.available = True
+
+
+class WorkloadBalancer:
+    """Per-role queues of unassigned items and per-role pools of users, both binary heaps
+
+    Queues are ordered by effective due time (SLA deadline minus the priority lead), pools
+    by current load. Entries are never updated in place: a change pushes a fresh entry and
+    stale ones are skipped when they reach the top, so every decision is a few heap
+    operations regardless of how many items are open.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.items = {}
+        self.users = {}
+        self.held = defaultdict(set)
+        self.queues = defaultdict(list)
+        self.pools = defaultdict(list)
+        self._seq = itertools.count()
+        self.decisions = 0
+
+    def load(self, uid):
+        held = self.held.get(uid)
+        return len(held) if held else 0
+
+    def _offer(self, uid):
+        user = self.users.get(uid)
+        if user is None or not user.available:
+            return
+        load = self.load(uid)
+        for role in user.roles:
+            pool = self.pools[role]
+            heapq.heappush(pool, (load, next(self._seq), uid))
+            if len(pool) > 64 and len(pool) > 8 * len(self.users):
+                self._compact_pool(role)
+
+    def _compact_pool(self, role):
+        self.pools[role] = [entry for entry in self.pools[role] if self._current(role, entry)]
+        heapq.heapify(self.pools[role])
+
+    def _current(self, role, entry):
+        load, _, uid = entry
+        user = self.users.get(uid)
+        return user is not None and user.available and role in user.roles and load == self.load(uid)
+
+    def _enqueue(self, item):
+        item.assignee = None
+        item.seq = next(self._seq)
+        heapq.heappush(self.queues[item.role], (item.due, item.seq, item.key))
+
+    def _unhold(self, item):
+        if item.assignee is None:
+            return
+        held = self.held.get(item.assignee)
+        if held is not None:
+            held.discard(item.key)
+            if not held:
+                del self.held[item.assignee]
+        self._offer(item.assignee)
+        item.assignee = None
+
+    def set_user(self, uid, roles, available=True):
+        """Add or update a user; returns the keys of items released because they are now unavailable"""
+        user = self.users.get(uid)
+        if user is None:
+            user = self.users[uid] = WorkUser(uid)
+        user.roles = tuple(roles)
+        user.available = available
+        if not available:
+            return self.release(uid)
+        self._offer(uid)
+        return []
+
+    def remove_user(self, uid):
+        released = self.release(uid)
+        self.users.pop(uid, None)
+        return released
+
+    def release(self, uid):
+        """Put every item held by uid back in its role queue"""
+        keys = list(self.held.pop(uid, ()))
+        for key in keys:
+            self._enqueue(self.items[key])
+        return keys
+
+    def upsert(self, key, role, due, assignee=None):
+        """Add or update an open item; returns True when it was held by an unavailable user and is queued again"""
+        item = self.items.get(key)
+        if item is None:
+            item = self.items[key] = WorkItem(key)
+        elif item.assignee == assignee and item.role == role and item.due == due:
+            return False
+        else:
+            self._unhold(item)
+        item.role, item.due = role, due
+        user = self.users.get(assignee) if assignee else None
+        if assignee and (user is None or user.available):
+            item.assignee = assignee
+            self.held[assignee].add(key)
+            self._offer(assignee)
+            return False
+        self._enqueue(item)
+        return bool(assignee)
+
+    def remove(self, key):
+        """Drop an item that was decided, resolved or deleted"""
+        item = self.items.pop(key, None)
+        if item is not None:
+            self._unhold(item)
+
+    def _least_loaded(self, role):
+        pool = self.pools.get(role)
+        while pool:
+            if not self._current(role, pool[0]):
+                heapq.heappop(pool)
+                continue
+            load, _, uid = pool[0]
+            return uid if load < self.capacity else None
+        return None
+
+    def assign(self):
+        """Hand out queued items while some user in the role has capacity; returns [(key, uid)]"""
+        decisions = []
+        for role, queue in self.queues.items():
+            while queue:
+                _, seq, key = queue[0]
+                item = self.items.get(key)
+                if item is None or item.seq != seq or item.assignee is not None:
+                    heapq.heappop(queue)
+                    continue
+                uid = self._least_loaded(role)
+                if uid is None:
+                    break
+                heapq.heappop(queue)
+                item.assignee = uid
+                self.held[uid].add(key)
+                self._offer(uid)
+                decisions.append((key, uid))
+        self.decisions += len(decisions)
+        return decisions
+
+    def queued(self):
+        """Open items waiting for a user, per role"""
+        counts = defaultdict(int)
+        for item in self.items.values():
+            if item.assignee is None:
+                counts[item.role] += 1
+        return dict(counts)
+
+
+# ============================================================
+# SERVICE
+# ============================================================
+
+class AssignmentService:
+    """Feeds the balancer from listeners on users, approval_requests and exceptions
+
+    dispatch() runs the balancer and writes its decisions as assignedTo updates with an
+    audit_log entry each. Writes carry a last_update_time precondition, so an item a user
+    claimed by hand in the meantime keeps its assignee and the listener corrects the
+    balancer. Items released by an offline user that nobody can take are unassigned.
+    """
+
+    def __init__(self, db, balancer, dry_run=False):
+        self.db = db
+        self.balancer = balancer
+        self.dry_run = dry_run
+        self._lock = threading.Lock()
+        self.docs = {}
+        self.released = set()
+        self.counts = defaultdict(int)
+
+    def queries(self):
+        return {
+            'users': self.db.collection('users').where(filter=FieldFilter('role', 'in', STAFF_ROLES)),
+            'approval': self.db.collection('approval_requests').where(filter=FieldFilter('status', '==', 'pending')),
+            'exception': self.db.collection('exceptions').where(
+                filter=FieldFilter('status', 'in', OPEN_EXCEPTION_STATUSES)),
+        }
+
+    def apply_user(self, uid, user):
+        with self._lock:
+            if user is None:
+                released = self.balancer.remove_user(uid)
+            else:
+                released = self.balancer.set_user(uid, user_roles(user), user_available(user))
+            self.released.update(released)
+            self.counts['released'] += len(released)
+
+    def apply_item(self, kind, doc_id, snap):
+        key = (kind, doc_id)
+        doc = snap.to_dict() if snap is not None else None
+        open_statuses = ['pending'] if kind == 'approval' else OPEN_EXCEPTION_STATUSES
+        with self._lock:
+            if doc is None or doc.get('status') not in open_statuses:
+                self.balancer.remove(key)
+                self.docs.pop(key, None)
+                self.released.discard(key)
+                return
+            self.docs[key] = (doc, snap.update_time)
+            if self.balancer.upsert(key, *work_item(kind, doc)):
+                self.released.add(key)
+
+    def listener(self, kind):
+        def on_snapshot(docs, changes, read_time):
+            for change in changes:
+                snap = None if change.type.name == 'REMOVED' else change.document
+                if kind == 'users':
+                    self.apply_user(change.document.id, snap.to_dict() if snap is not None else None)
+                else:
+                    self.apply_item(kind, change.document.id, snap)
+        return on_snapshot
+
+    def load(self):
+        for kind, query in self.queries().items():
+            for snap in query.stream():
+                if kind == 'users':
+                    self.apply_user(snap.id, snap.to_dict())
+                else:
+                    self.apply_item(kind, snap.id, snap)
+
+    def listen(self):
+        return [query.on_snapshot(self.listener(kind)) for kind, query in self.queries().items()]
+
+    def dispatch(self):
+        """Assign what can be assigned and write it; returns (assigned, unassigned) write counts"""
+        started = time.perf_counter()
+        with self._lock:
+            decisions = self.balancer.assign()
+            decided = {key for key, _ in decisions}
+            # Released items nobody could take go back to the role inbox
+            writes = [(key, uid, key in self.released, self.docs[key]) for key, uid in decisions]
+            writes += [(key, None, True, self.docs[key]) for key in self.released
+                       if key not in decided and key in self.docs]
+            self.released = set()
+        self.counts['decision ms'] = max(self.counts['decision ms'], (time.perf_counter() - started) * 1000)
+        if self.dry_run or not writes:
+            return len(decisions), len(writes) - len(decisions)
+        for chunk in chunked(writes, DECISIONS_PER_BATCH):
+            batch = self.db.batch()
+            for write in chunk:
+                self._stage(batch, *write)
+            try:
+                batch.commit()
+                continue
+            except (FailedPrecondition, NotFound):
+                pass
+            # Someone changed an item in the chunk: retry one by one, the listener fixes up the rest
+            for write in chunk:
+                batch = self.db.batch()
+                self._stage(batch, *write)
+                try:
+                    batch.commit()
+                except (FailedPrecondition, NotFound):
+                    self.counts['conflicts'] += 1
+        return len(decisions), len(writes) - len(decisions)
+
+    def _stage(self, batch, key, uid, released, doc_and_time):
+        kind, doc_id = key
+        doc, update_time = doc_and_time
+        now = datetime.now(timezone.utc)
+        batch.update(self.db.collection(COLLECTIONS[kind]).document(doc_id),
+                     {'assignedTo': uid, 'assignedAt': now if uid else None, 'assignedBy': SYSTEM_ACTOR},
+                     option=self.db.write_option(last_update_time=update_time))
+        action = 'unassigned' if uid is None else 'reassigned' if released else 'assigned'
+        self.counts[action] += 1
+        batch.set(self.db.collection(AUDIT_COLLECTION).document(), audit_entry(
+            doc.get('workflowInstanceId'), doc.get('workflowType') or doc.get('entityType'), doc.get('entityId'),
+            action, SYSTEM_ACTOR, notes=f"{COLLECTIONS[kind]}/{doc_id} -> {uid or doc.get('assignedToRole')}",
+            changes={'assignedTo': uid, 'previousAssignee': doc.get('assignedTo')}, performed_at=now))
+
+    def run(self, duration=None):
+        """Balance until interrupted (or duration seconds)"""
+        self.load()
+        assigned, unassigned = self.dispatch()
+        watches = self.listen()
+        started = time.time()
+        print(f"👂 {len(self.balancer.items)} open item(s), {len(self.balancer.users)} staff; "
+              f"{assigned} assigned on start")
+        try:
+            while duration is None or time.time() - started < duration:
+                time.sleep(FLUSH_INTERVAL)
+                assigned, unassigned = self.dispatch()
+                if assigned or unassigned:
+                    print(f"   ✓ {assigned} assigned, {unassigned} returned to role inboxes")
+                if not all(w.is_active for w in watches):
+                    print("⚠️  Listener closed, restarting from a fresh snapshot")
+                    for watch in watches:
+                        watch.unsubscribe()
+                    watches = self.listen()
+        except KeyboardInterrupt:
+            print("\n🛑 Stopping workload balancer")
+        finally:
+            for watch in watches:
+                watch.unsubscribe()
+
+
+# ============================================================
+# SIMULATION
+# ============================================================
+
+SIM_ROLES = {'operations_manager': 12, 'finance_manager': 8}
+SIM_PRIORITIES = (('urgent', 0.05, 2), ('high', 0.25, 8), ('medium', 0.5, 24), ('low', 0.2, 48))
+# Staggered shifts (start, end hour) so people go offline while holding work
+SIM_SHIFTS = ((6, 15), (8, 17), (10, 19), (13, 22))
+SIM_HANDLE_MINUTES = 6.0
+
+
+def simulate(arrivals=2000, backlog=0, policy='balanced', capacity=DEFAULT_CAPACITY, seed=7):
+    """Replay a day of arrivals against staff on shifts; returns a stats dict
+
+    'balanced' uses the balancer, 'grab' has each free user take a random item from
+    their role's queue, which is how the inbox is worked today.
+    """
+    rng = random.Random(seed)
+    day = 24 * 3600
+    events = []
+    seq = itertools.count()
+
+    def push(at, kind, payload):
+        heapq.heappush(events, (at, next(seq), kind, payload))
+
+    items = {}
+    roles = list(SIM_ROLES)
+    role_weights = [SIM_ROLES[r] for r in roles]
+
+    def new_item(at):
+        p = rng.random()
+        for name, share, sla in SIM_PRIORITIES:
+            p -= share
+            if p <= 0:
+                break
+        role = rng.choices(roles, role_weights)[0]
+        deadline = at + sla * 3600
+        return {'role': role, 'deadline': deadline, 'due': deadline - PRIORITY_LEAD_HOURS[name] * 3600,
+                'work': rng.expovariate(1 / (SIM_HANDLE_MINUTES * 60))}
+
+    for n in range(backlog):
+        items[f'b{n}'] = new_item(-rng.uniform(0, day))
+    for n in range(arrivals):
+        # Office-hours arrival curve peaking late morning
+        at = min(max(rng.gauss(11.5, 3.5), 0), 23.99) * 3600
+        push(at, 'arrive', f'a{n}')
+        items[f'a{n}'] = new_item(at)
+    users = {}
+    for role, count in SIM_ROLES.items():
+        for n in range(count):
+            uid = f'{role}_{n:02d}'
+            start, end = SIM_SHIFTS[n % len(SIM_SHIFTS)]
+            users[uid] = {'role': role, 'busy': None, 'online': False, 'queue': [], 'done': 0, 'leaving': False}
+            push(start * 3600, 'online', uid)
+            push(end * 3600, 'offline', uid)
+
+    balancer = WorkloadBalancer(capacity)
+    pending = {role: [] for role in roles}
+    for key, item in items.items():
+        if key.startswith('b'):
+            if policy == 'balanced':
+                balancer.upsert(key, item['role'], item['due'])
+            else:
+                pending[item['role']].append(key)
+    timings = []
+    stats = defaultdict(int)
+
+    def start_work(uid, now):
+        user = users[uid]
+        if user['busy'] or not user['online']:
+            return
+        if policy == 'balanced':
+            while user['queue']:
+                _, key = heapq.heappop(user['queue'])
+                if key in balancer.items and balancer.items[key].assignee == uid:
+                    break
+            else:
+                return
+        else:
+            queue = pending[user['role']]
+            if not queue:
+                return
+            i = rng.randrange(len(queue))
+            queue[i], queue[-1] = queue[-1], queue[i]
+            key = queue.pop()
+        user['busy'] = key
+        push(now + items[key]['work'], 'done', uid)
+
+    def rebalance(now):
+        started = time.perf_counter()
+        decisions = balancer.assign()
+        if decisions:
+            timings.append(((time.perf_counter() - started) * 1000, len(decisions)))
+        for key, uid in decisions:
+            heapq.heappush(users[uid]['queue'], (items[key]['due'], key))
+            start_work(uid, now)
+
+    if policy == 'balanced':
+        for uid, user in users.items():
+            balancer.set_user(uid, [user['role']], available=False)
+
+    while events:
+        now, _, kind, payload = heapq.heappop(events)
+        if now > day:
+            break
+        if kind == 'arrive':
+            item = items[payload]
+            if policy == 'balanced':
+                balancer.upsert(payload, item['role'], item['due'])
+                rebalance(now)
+            else:
+                pending[item['role']].append(payload)
+                for uid, user in users.items():
+                    if user['role'] == item['role'] and user['online'] and not user['busy']:
+                        start_work(uid, now)
+                        break
+        elif kind == 'online':
+            users[payload]['online'] = True
+            if policy == 'balanced':
+                balancer.set_user(payload, [users[payload]['role']])
+                rebalance(now)
+            start_work(payload, now)
+        elif kind == 'offline':
+            user = users[payload]
+            if user['busy']:
+                user['leaving'] = True
+                continue
+            user['online'] = False
+            if policy == 'balanced':
+                stats['reassigned'] += len(balancer.set_user(payload, [user['role']], available=False))
+                user['queue'] = []
+                rebalance(now)
+        elif kind == 'done':
+            user = users[payload]
+            key, user['busy'] = user['busy'], None
+            user['done'] += 1
+            stats['completed'] += 1
+            if now > items[key]['deadline']:
+                stats['late'] += 1
+            del items[key]
+            if policy == 'balanced':
+                balancer.remove(key)
+            if user['leaving']:
+                user['leaving'] = False
+                push(now, 'offline', payload)
+                continue
+            start_work(payload, now)
+            if policy == 'balanced':
+                rebalance(now)
+    # Anything still open past its deadline at the end of the day missed its SLA too
+    stats['open'] = len(items)
+    stats['overdue open'] = sum(1 for item in items.values() if item['deadline'] < day)
+    done = sorted(user['done'] for user in users.values())
+    per_decision = sorted(ms / n for ms, n in timings)
+    return {
+        'policy': policy, 'stats': dict(stats), 'done_min': done[0], 'done_max': done[-1],
+        'decision_p50': per_decision[len(per_decision) // 2] if per_decision else 0.0,
+        'decision_p99': per_decision[int(len(per_decision) * 0.99)] if per_decision else 0.0,
+        'call_max': max((ms for ms, _ in timings), default=0.0),
+        'decisions': balancer.decisions,
+    }
+
+
+def print_simulation(result):
+    stats = result['stats']
+    missed = stats.get('late', 0) + stats.get('overdue open', 0)
+    print(f"\n📊 {result['policy']}: {stats.get('completed', 0):,} handled, {stats.get('late', 0):,} after SLA, "
+          f"{stats.get('open', 0):,} still open ({stats.get('overdue open', 0):,} overdue) → {missed:,} SLA misses")
+    print(f"   • per-user items handled: {result['done_min']}–{result['done_max']}")
+    if result['policy'] == 'balanced':
+        print(f"   • {result['decisions']:,} assignments, {stats.get('reassigned', 0):,} reassigned at shift end")
+        print(f"   • decision time p50 {result['decision_p50']:.3f} ms, p99 {result['decision_p99']:.3f} ms, "
+              f"slowest batch {result['call_max']:.1f} ms")
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--once', action='store_true', help='assign the current backlog and exit')
+    parser.add_argument('--duration', type=float, metavar='SECONDS', help='stop listening after SECONDS')
+    parser.add_argument('--dry-run', action='store_true', help='report decisions without writing')
+    parser.add_argument('--capacity', type=int, help=f'open items per user (default {DEFAULT_CAPACITY})')
+    parser.add_argument('--simulate', type=int, metavar='ARRIVALS',
+                        help='replay a simulated day with ARRIVALS new items, then exit')
+    parser.add_argument('--backlog', type=int, default=0, help='open items already waiting when the simulated day starts')
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.simulate is not None:
+        print(f"⏱️  Simulating a day: {args.simulate:,} arrivals, {args.backlog:,} backlog, "
+              f"{sum(SIM_ROLES.values())} staff on shifts")
+        for policy in ('grab', 'balanced'):
+            print_simulation(simulate(args.simulate, args.backlog, policy, args.capacity or DEFAULT_CAPACITY))
+        return
+
+    print("⚖️  Oil Manager workload balancer")
+    db = sync_client(job='workload_balancer', args=args)
+    cache = ConfigCache(db, collections=('config_system_settings',), listen=False).load()
+    capacity = args.capacity or int(cache.get_setting('WORKLOAD_MAX_PER_USER', DEFAULT_CAPACITY))
+    service = AssignmentService(db, WorkloadBalancer(capacity), dry_run=args.dry_run)
+    if args.once:
+        service.load()
+        assigned, unassigned = service.dispatch()
+        print(f"✅ {assigned} assigned, {unassigned} returned to role inboxes "
+              f"({len(service.balancer.items)} open, {len(service.balancer.users)} staff)")
+        queued = service.balancer.queued()
+        if queued:
+            print(f"   • still queued by role: {queued}")
+    else:
+        service.run(duration=args.duration)
+    for name, count in sorted(service.counts.items()):
+        print(f"   • {name}: {count:.1f}" if isinstance(count, float) else f"   • {name}: {count}")
+
+
+if __name__ == '__main__':
+    main()